@@ -0,0 +1,412 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Module for generating and deploying the Airflow DAG of MarkUp workflows.
+
+The DAG is an alternative to the daily scheduled queries. The main workflow is
+split in stages (see the "-- STAGE:" markers in scripts/main_workflow.sql)
+which run as separate BigQuery jobs, so each stage is retried and timed on its
+own. Each tenant (a dataset with its Merchant Center and Google Ads accounts)
+gets its own task group, which waits for the partitions of the Merchant Center
+and Google Ads transfers for the run date. The tenants run in parallel, up to
+the limit of the Airflow pool or of `max_active_tasks`.
+
+The DAG file reads the rendered SQL of each tenant from a directory next to it,
+so the output directory is uploaded to the DAGs folder as a whole.
+
+Typical usage example:
+  >>> tenants = [Tenant('project_id', 'markup', '1234', '5678', False)]
+  >>> dag_file = render_dag(tenants, '/tmp/markup_dag')
+  >>> validate_dag(dag_file)
+  >>> deploy_dag('project_id', 'composer-env', '/tmp/markup_dag')
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import re
+import string
+from typing import List, Optional
+
+import cloud_bigquery
+import config_parser
+from plugins.cloud_utils import cloud_composer
+from plugins.cloud_utils import cloud_storage
+
+_DAG_ID = 'markup_workflows'
+_SCHEDULE = '@daily'
+_MAX_ACTIVE_TASKS = 8
+_RETRIES = 2
+_RETRY_DELAY_MINUTES = 5
+# How often and for how long the transfer partitions are waited for.
+_SENSOR_POKE_INTERVAL_SECONDS = 10 * 60
+_SENSOR_TIMEOUT_SECONDS = 12 * 60 * 60
+_BEST_SELLERS_STAGE = 'best_sellers'
+_TENANTS_FILE = 'tenants.json'
+_COMPOSER_LOCATION = 'us-central1'
+
+# Set logging level.
+logging.getLogger().setLevel(logging.INFO)
+
+# A MarkUp installation: the dataset and the accounts transferred into it.
+Tenant = collections.namedtuple('Tenant', [
+    'project_id', 'dataset_id', 'merchant_id', 'ads_customer_id',
+    'market_insights'
+])
+
+_DAG_TEMPLATE = string.Template('''# Generated by airflow_dag.py. Do not edit, re-generate it instead.
+"""MarkUp workflows, one task group per tenant."""
+
+import datetime
+import json
+import os
+
+from airflow import models
+from airflow.providers.google.cloud.operators import bigquery
+from airflow.providers.google.cloud.sensors import bigquery as bigquery_sensors
+from airflow.utils import task_group
+
+_SQL_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), $sql_dir)
+# The Merchant Center transfer of a day lands in the partition of that day,
+# the Google Ads transfer in the partition of the previous day.
+_RUN_DATE = '{{ data_interval_end | ds }}'
+_PRODUCTS_PARTITION = '{{ data_interval_end | ds_nodash }}'
+_ADS_PARTITION = '{{ data_interval_start | ds_nodash }}'
+
+with open(os.path.join(_SQL_DIR, $tenants_file)) as tenants_file:
+  _TENANTS = json.load(tenants_file)
+
+
+def _read_sql(tenant_id, stage):
+  with open(os.path.join(_SQL_DIR, tenant_id, stage + '.sql')) as sql_file:
+    # The SQL is not an Airflow template.
+    return '{% raw %}' + sql_file.read() + '{% endraw %}'
+
+
+def _query_task(tenant, stage):
+  # Priority, labels, timeout and bytes cap of the job policy of the stage.
+  job_configuration = tenant['job_configurations'][stage]
+  return bigquery.BigQueryInsertJobOperator(
+      task_id=stage,
+      project_id=tenant['project_id'],
+      location=$location,
+      pool=$pool,
+      configuration={
+          **job_configuration,
+          'query': {
+              **job_configuration['query'],
+              'query': _read_sql(tenant['tenant_id'], stage),
+              'useLegacySql': False,
+              'queryParameters': [{
+                  'name': 'run_date',
+                  'parameterType': {'type': 'DATE'},
+                  'parameterValue': {'value': _RUN_DATE},
+              }],
+          }
+      })
+
+
+def _partition_sensor(tenant, task_id, table_id, partition_id):
+  return bigquery_sensors.BigQueryTablePartitionExistenceSensor(
+      task_id=task_id,
+      project_id=tenant['project_id'],
+      dataset_id=tenant['dataset_id'],
+      table_id=table_id,
+      partition_id=partition_id,
+      mode='reschedule',
+      poke_interval=$poke_interval,
+      timeout=$sensor_timeout)
+
+
+with models.DAG(
+    dag_id=$dag_id,
+    schedule_interval=$schedule,
+    start_date=datetime.datetime(2021, 1, 1),
+    catchup=False,
+    max_active_runs=1,
+    max_active_tasks=$max_active_tasks,
+    default_args={
+        'retries': $retries,
+        'retry_delay': datetime.timedelta(minutes=$retry_delay_minutes),
+    }) as dag:
+  for tenant in _TENANTS:
+    with task_group.TaskGroup(group_id=tenant['tenant_id']):
+      products_landed = _partition_sensor(
+          tenant, 'wait_for_products', 'Products_' + tenant['merchant_id'],
+          _PRODUCTS_PARTITION)
+      ads_landed = _partition_sensor(
+          tenant, 'wait_for_shopping_product_stats',
+          'p_ShoppingProductStats_' + tenant['ads_customer_id'],
+          _ADS_PARTITION)
+      upstream = [products_landed, ads_landed]
+      for stage in tenant['stages']:
+        task = _query_task(tenant, stage)
+        upstream >> task
+        upstream = task
+      if tenant['market_insights']:
+        products_landed >> _query_task(tenant, $best_sellers_stage)
+''')
+
+
+class Error(Exception):
+  """Base error for this module."""
+
+
+def get_tenant_id(tenant: Tenant) -> str:
+  """Returns the id of the task group and SQL directory of a tenant."""
+  return re.sub(r'\W', '_', f'{tenant.dataset_id}_{tenant.ads_customer_id}')
+
+
+def render_dag(tenants: List[Tenant],
+               output_dir: str,
+               dag_id: str = _DAG_ID,
+               schedule: str = _SCHEDULE,
+               pool: Optional[str] = None,
+               max_active_tasks: int = _MAX_ACTIVE_TASKS,
+               retries: int = _RETRIES) -> str:
+  """Renders the DAG file and the SQL of the stages of each tenant.
+
+  Args:
+    tenants: The MarkUp installations to be run by the DAG.
+    output_dir: Directory where the DAG file and SQL directory are written.
+    dag_id: Optional. Id of the DAG, also used to name the DAG file and SQL
+      directory.
+    schedule: Optional. Schedule interval of the DAG.
+    pool: Optional. Airflow pool limiting the number of concurrent BigQuery
+      jobs across tenants. The pool has to be created in the environment.
+    max_active_tasks: Optional. Maximum number of tasks of a DAG run running at
+      the same time.
+    retries: Optional. Number of retries of each task.
+
+  Returns:
+    Path of the DAG file.
+
+  Raises:
+    Error: If two tenants have the same id.
+  """
+  sql_dir = os.path.join(output_dir, dag_id)
+  tenant_configs = []
+  for tenant in tenants:
+    tenant_id = get_tenant_id(tenant)
+    if any(config['tenant_id'] == tenant_id for config in tenant_configs):
+      raise Error(f'The tenant "{tenant_id}" is declared more than once.')
+    ads_customer_id = tenant.ads_customer_id.replace('-', '')
+    stages = cloud_bigquery.split_workflow_stages(
+        cloud_bigquery.get_main_workflow_sql(tenant.project_id,
+                                             tenant.dataset_id,
+                                             tenant.merchant_id,
+                                             ads_customer_id))
+    job_configurations = {
+        stage: cloud_bigquery.get_job_configuration(stage, ads_customer_id)
+        for stage in stages
+    }
+    if tenant.market_insights:
+      stages[_BEST_SELLERS_STAGE] = (
+          cloud_bigquery.get_best_sellers_workflow_sql(tenant.project_id,
+                                                       tenant.dataset_id,
+                                                       tenant.merchant_id))
+      job_configurations[_BEST_SELLERS_STAGE] = (
+          cloud_bigquery.get_job_configuration('best_sellers_workflow',
+                                               tenant.merchant_id))
+    tenant_dir = os.path.join(sql_dir, tenant_id)
+    os.makedirs(tenant_dir, exist_ok=True)
+    for stage, query in stages.items():
+      with open(os.path.join(tenant_dir, f'{stage}.sql'), 'w') as sql_file:
+        sql_file.write(query)
+    tenant_configs.append({
+        'tenant_id': tenant_id,
+        'project_id': tenant.project_id,
+        'dataset_id': tenant.dataset_id,
+        'merchant_id': tenant.merchant_id,
+        'ads_customer_id': ads_customer_id,
+        'market_insights': bool(tenant.market_insights),
+        'stages': [
+            stage for stage in stages if stage != _BEST_SELLERS_STAGE
+        ],
+        'job_configurations': job_configurations,
+    })
+  os.makedirs(sql_dir, exist_ok=True)
+  with open(os.path.join(sql_dir, _TENANTS_FILE), 'w') as tenants_file:
+    json.dump(tenant_configs, tenants_file, indent=2)
+  dag_file_path = os.path.join(output_dir, f'{dag_id}.py')
+  with open(dag_file_path, 'w') as dag_file:
+    dag_file.write(
+        _DAG_TEMPLATE.substitute(
+            sql_dir=repr(dag_id),
+            tenants_file=repr(_TENANTS_FILE),
+            location=repr(config_parser.get_dataset_location()),
+            pool=repr(pool),
+            poke_interval=_SENSOR_POKE_INTERVAL_SECONDS,
+            sensor_timeout=_SENSOR_TIMEOUT_SECONDS,
+            dag_id=repr(dag_id),
+            schedule=repr(schedule),
+            max_active_tasks=max_active_tasks,
+            retries=retries,
+            retry_delay_minutes=_RETRY_DELAY_MINUTES,
+            best_sellers_stage=repr(_BEST_SELLERS_STAGE)))
+  logging.info('Rendered "%s" DAG with %d tenants to "%s".', dag_id,
+               len(tenant_configs), dag_file_path)
+  return dag_file_path
+
+
+def validate_dag(dag_file_path: str) -> None:
+  """Validates a rendered DAG offline.
+
+  The DAG file is compiled and the SQL file of every task is checked. If
+  Airflow is installed, the DAG is also loaded with a DagBag, which builds the
+  tasks and checks the dependencies.
+
+  Args:
+    dag_file_path: Path of the DAG file returned by render_dag.
+
+  Raises:
+    Error: If the DAG is invalid.
+  """
+  with open(dag_file_path) as dag_file:
+    source = dag_file.read()
+  try:
+    compile(source, dag_file_path, 'exec')
+  except SyntaxError as error:
+    raise Error(f'The DAG file "{dag_file_path}" is invalid: {error}')
+  dag_id = os.path.splitext(os.path.basename(dag_file_path))[0]
+  sql_dir = os.path.join(os.path.dirname(dag_file_path), dag_id)
+  with open(os.path.join(sql_dir, _TENANTS_FILE)) as tenants_file:
+    tenant_configs = json.load(tenants_file)
+  for tenant in tenant_configs:
+    stages = list(tenant['stages'])
+    if tenant['market_insights']:
+      stages.append(_BEST_SELLERS_STAGE)
+    for stage in stages:
+      sql_path = os.path.join(sql_dir, tenant['tenant_id'], f'{stage}.sql')
+      if not os.path.isfile(sql_path):
+        raise Error(f'The SQL file "{sql_path}" is missing.')
+  try:
+    from airflow.models import dagbag  # pylint: disable=g-import-not-at-top
+  except ImportError:
+    logging.info('Airflow is not installed, the DAG was not loaded.')
+    return
+  dag_bag = dagbag.DagBag(dag_folder=dag_file_path, include_examples=False)
+  if dag_bag.import_errors:
+    raise Error(f'The DAG could not be loaded: {dag_bag.import_errors}')
+  if dag_id not in dag_bag.dags:
+    raise Error(f'The DAG file does not define the "{dag_id}" DAG.')
+  logging.info('The "%s" DAG has %d tasks.', dag_id,
+               len(dag_bag.dags[dag_id].tasks))
+
+
+def deploy_dag(project_id: str,
+               environment_name: str,
+               output_dir: str,
+               location: str = _COMPOSER_LOCATION
+              ) -> cloud_storage.SyncReport:
+  """Uploads a rendered DAG to the DAGs folder of a Composer environment.
+
+  Only the files which changed since the previous deployment are uploaded.
+
+  Args:
+    project_id: A cloud project id.
+    environment_name: Name of the Composer environment.
+    output_dir: Directory passed to render_dag.
+    location: Optional. Region of the Composer environment.
+
+  Returns:
+    Summary of the uploaded files.
+  """
+  composer = cloud_composer.CloudComposerUtils(project_id, location)
+  dags_folder = composer.get_dags_folder(environment_name)
+  storage_utils = cloud_storage.CloudStorageUtils(project_id)
+  return storage_utils.upload_directory_to_url(output_dir, dags_folder,
+                                               sync=True)
+
+
+def parse_arguments() -> argparse.Namespace:
+  """Initialize command line parser using argparse.
+
+  Returns:
+    An argparse.ArgumentParser.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--project_id', help='GCP project id.', required=True)
+  parser.add_argument(
+      '--tenants_file',
+      help=('JSON file with the list of tenants, each with "dataset_id", '
+            '"merchant_id", "ads_customer_id" and "market_insights" keys.'))
+  parser.add_argument(
+      '--dataset_id', help='BigQuery dataset id.', default='markup')
+  parser.add_argument(
+      '--merchant_id', help='Google Merchant Center Account Id.')
+  parser.add_argument(
+      '--ads_customer_id', help='Google Ads External Customer Id.')
+  parser.add_argument(
+      '--market_insights',
+      help='Run the Market Insights workflow.',
+      action='store_true')
+  parser.add_argument(
+      '--output_dir', help='Directory of the rendered DAG.', required=True)
+  parser.add_argument('--dag_id', help='Id of the DAG.', default=_DAG_ID)
+  parser.add_argument(
+      '--pool', help='Airflow pool of the BigQuery tasks.', default=None)
+  parser.add_argument(
+      '--max_active_tasks',
+      help='Maximum number of concurrent tasks per DAG run.',
+      type=int,
+      default=_MAX_ACTIVE_TASKS)
+  parser.add_argument(
+      '--composer_environment',
+      help='Composer environment to deploy the DAG to.',
+      default=None)
+  parser.add_argument(
+      '--composer_location',
+      help='Region of the Composer environment.',
+      default=_COMPOSER_LOCATION)
+  return parser.parse_args()
+
+
+def main():
+  args = parse_arguments()
+  if args.tenants_file:
+    with open(args.tenants_file) as tenants_file:
+      tenants = [
+          Tenant(args.project_id, tenant['dataset_id'],
+                 str(tenant['merchant_id']), str(tenant['ads_customer_id']),
+                 tenant.get('market_insights', False))
+          for tenant in json.load(tenants_file)
+      ]
+  elif args.merchant_id and args.ads_customer_id:
+    tenants = [
+        Tenant(args.project_id, args.dataset_id, args.merchant_id,
+               args.ads_customer_id, args.market_insights)
+    ]
+  else:
+    raise Error('Either --tenants_file or --merchant_id and --ads_customer_id '
+                'are required.')
+  dag_file_path = render_dag(
+      tenants,
+      args.output_dir,
+      dag_id=args.dag_id,
+      pool=args.pool,
+      max_active_tasks=args.max_active_tasks)
+  validate_dag(dag_file_path)
+  if args.composer_environment:
+    deploy_dag(args.project_id, args.composer_environment, args.output_dir,
+               args.composer_location)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,262 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Tests for airflow_dag and the stages of the main workflow.
+
+Airflow is not needed: the rendered DAG file is run against stand-ins of the
+Airflow modules it imports, which record the tasks and their dependencies.
+"""
+
+import os
+import re
+import runpy
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import airflow_dag
+import cloud_bigquery
+
+_STAGE_MARKER_PATTERN = re.compile(r'^-- STAGE: (\w+)$', re.MULTILINE)
+_MAIN_WORKFLOW_STAGES = [
+    'parse_criteria', 'targeting', 'product_detailed', 'product_historical',
+    'dashboard_cubes'
+]
+_TENANTS = [
+    airflow_dag.Tenant('project', 'markup', '1234', '567-890-1234', False),
+    airflow_dag.Tenant('project', 'markup_eu', '4321', '098-765-4321', True),
+]
+
+
+class _Task(object):
+  """Stand-in of an Airflow operator recording its arguments and upstreams."""
+
+  tasks = []
+  group_ids = []
+
+  def __init__(self, task_id, **kwargs):
+    self.task_id = '.'.join(self.group_ids + [task_id])
+    self.kwargs = kwargs
+    self.upstream_task_ids = set()
+    self.tasks.append(self)
+
+  def __rshift__(self, other):
+    other.upstream_task_ids.add(self.task_id)
+    return other
+
+  def __rrshift__(self, others):
+    for other in others:
+      self.upstream_task_ids.add(other.task_id)
+    return self
+
+
+class _TaskGroup(object):
+
+  def __init__(self, group_id):
+    self.group_id = group_id
+
+  def __enter__(self):
+    _Task.group_ids.append(self.group_id)
+    return self
+
+  def __exit__(self, *args):
+    _Task.group_ids.pop()
+
+
+class _Dag(object):
+
+  def __init__(self, **kwargs):
+    self.kwargs = kwargs
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    pass
+
+
+def _get_airflow_modules():
+  """Returns stand-ins of the Airflow modules imported by the DAG file."""
+  attributes = {
+      'airflow.models': {
+          'DAG': _Dag
+      },
+      'airflow.providers.google.cloud.operators.bigquery': {
+          'BigQueryInsertJobOperator':
+              type('BigQueryInsertJobOperator', (_Task,), {})
+      },
+      'airflow.providers.google.cloud.sensors.bigquery': {
+          'BigQueryTablePartitionExistenceSensor':
+              type('BigQueryTablePartitionExistenceSensor', (_Task,), {})
+      },
+      'airflow.utils.task_group': {
+          'TaskGroup': _TaskGroup
+      },
+  }
+  modules = {}
+  for module_name, module_attributes in attributes.items():
+    parts = module_name.split('.')
+    for index in range(len(parts)):
+      name = '.'.join(parts[:index + 1])
+      if name not in modules:
+        modules[name] = types.ModuleType(name)
+        if index:
+          setattr(modules['.'.join(parts[:index])], parts[index],
+                  modules[name])
+    for attribute_name, value in module_attributes.items():
+      setattr(modules[module_name], attribute_name, value)
+  return modules
+
+
+class SplitWorkflowStagesTest(unittest.TestCase):
+
+  def test_split_main_workflow(self):
+    query = cloud_bigquery.get_main_workflow_sql('project', 'markup', '1234',
+                                                 '5678')
+
+    stages = cloud_bigquery.split_workflow_stages(query)
+
+    self.assertEqual(list(stages), _MAIN_WORKFLOW_STAGES)
+    preamble = query[:_STAGE_MARKER_PATTERN.search(query).start()].rstrip()
+    for name, stage in stages.items():
+      with self.subTest(stage=name):
+        self.assertTrue(stage.startswith(preamble))
+        self.assertEqual(
+            _STAGE_MARKER_PATTERN.findall(stage[len(preamble):]), [name])
+    # The stages hold the statements after the preamble once, in order.
+    self.assertEqual(
+        ''.join(stage[len(preamble):] for stage in stages.values()).split(),
+        query[len(preamble):].split())
+
+  def test_split_fails_without_stage(self):
+    with self.assertRaises(ValueError):
+      cloud_bigquery.split_workflow_stages('SELECT 1;')
+
+  def test_split_fails_on_duplicate_stage(self):
+    with self.assertRaises(ValueError):
+      cloud_bigquery.split_workflow_stages(
+          '-- STAGE: a\nSELECT 1;\n-- STAGE: a\nSELECT 2;\n')
+
+
+class RenderDagTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    output_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(output_dir.cleanup)
+    self.dag_file_path = airflow_dag.render_dag(
+        _TENANTS, output_dir.name, pool='markup_bigquery')
+    self.sql_dir = os.path.join(output_dir.name, 'markup_workflows')
+    _Task.tasks = []
+
+  def _load_dag(self):
+    with mock.patch.dict(sys.modules, _get_airflow_modules()):
+      dag = runpy.run_path(self.dag_file_path)['dag']
+    return dag, {task.task_id: task for task in _Task.tasks}
+
+  def test_validate_dag(self):
+    airflow_dag.validate_dag(self.dag_file_path)
+
+  def test_validate_dag_fails_on_missing_sql(self):
+    os.remove(
+        os.path.join(self.sql_dir, 'markup_eu_098_765_4321',
+                     'best_sellers.sql'))
+
+    with self.assertRaises(airflow_dag.Error):
+      airflow_dag.validate_dag(self.dag_file_path)
+
+  def test_validate_dag_fails_on_invalid_dag_file(self):
+    with open(self.dag_file_path, 'a') as dag_file:
+      dag_file.write('\n  invalid indentation\n')
+
+    with self.assertRaises(airflow_dag.Error):
+      airflow_dag.validate_dag(self.dag_file_path)
+
+  def test_rendered_stages_are_the_workflow_stages(self):
+    expected_stages = cloud_bigquery.split_workflow_stages(
+        cloud_bigquery.get_main_workflow_sql('project', 'markup', '1234',
+                                             '5678901234'))
+
+    for stage, query in expected_stages.items():
+      with open(os.path.join(self.sql_dir, 'markup_567_890_1234',
+                             f'{stage}.sql')) as sql_file:
+        self.assertEqual(sql_file.read(), query)
+
+  def test_dag_settings(self):
+    dag, _ = self._load_dag()
+
+    self.assertEqual(dag.kwargs['dag_id'], 'markup_workflows')
+    self.assertEqual(dag.kwargs['schedule_interval'], '@daily')
+    self.assertEqual(dag.kwargs['max_active_runs'], 1)
+
+  def test_stages_run_in_order_after_the_sensors(self):
+    _, tasks = self._load_dag()
+
+    for tenant_id in ('markup_567_890_1234', 'markup_eu_098_765_4321'):
+      with self.subTest(tenant_id=tenant_id):
+        sensors = {
+            f'{tenant_id}.wait_for_products',
+            f'{tenant_id}.wait_for_shopping_product_stats'
+        }
+        upstream_task_ids = sensors
+        for stage in _MAIN_WORKFLOW_STAGES:
+          task = tasks[f'{tenant_id}.{stage}']
+          self.assertEqual(task.upstream_task_ids, upstream_task_ids)
+          upstream_task_ids = {task.task_id}
+
+  def test_sensors_wait_for_the_transfer_partitions(self):
+    _, tasks = self._load_dag()
+
+    products_sensor = tasks['markup_567_890_1234.wait_for_products']
+    ads_sensor = tasks['markup_567_890_1234.wait_for_shopping_product_stats']
+    self.assertEqual(products_sensor.kwargs['table_id'], 'Products_1234')
+    self.assertEqual(products_sensor.kwargs['partition_id'],
+                     '{{ data_interval_end | ds_nodash }}')
+    self.assertEqual(ads_sensor.kwargs['table_id'],
+                     'p_ShoppingProductStats_5678901234')
+    self.assertEqual(ads_sensor.kwargs['partition_id'],
+                     '{{ data_interval_start | ds_nodash }}')
+    self.assertEqual(ads_sensor.kwargs['mode'], 'reschedule')
+
+  def test_best_sellers_only_for_market_insights(self):
+    _, tasks = self._load_dag()
+
+    self.assertNotIn('markup_567_890_1234.best_sellers', tasks)
+    self.assertEqual(
+        tasks['markup_eu_098_765_4321.best_sellers'].upstream_task_ids,
+        {'markup_eu_098_765_4321.wait_for_products'})
+
+  def test_query_tasks_apply_the_job_policy(self):
+    _, tasks = self._load_dag()
+
+    task = tasks['markup_567_890_1234.product_detailed']
+    configuration = task.kwargs['configuration']
+    expected_configuration = cloud_bigquery.get_job_configuration(
+        'product_detailed', '5678901234')
+    self.assertEqual(task.kwargs['pool'], 'markup_bigquery')
+    self.assertEqual(configuration['labels'],
+                     expected_configuration['labels'])
+    self.assertEqual(configuration['query']['priority'],
+                     expected_configuration['query']['priority'])
+    self.assertTrue(configuration['query']['query'].startswith('{% raw %}'))
+    self.assertEqual(configuration['query']['queryParameters'][0]['name'],
+                     'run_date')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,216 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Benchmarks the wall-clock time of the installer against fake clients.
+
+Each run installs MarkUp with cloud_env_setup.install against new fake_cloud
+clients, whose API calls, jobs and transfer runs take durations and fail
+with probabilities drawn from the service profile set by the flags. The runs
+are seeded by their number, so that the same flags give the same draws and
+two versions of the installer can be compared.
+
+The wall-clock time of a run is simulated on a virtual clock, unless
+--time_scale is set: it includes the polling of the transfers and the
+concurrency of the installer, e.g. of the reference data loads. The APIs are not enabled, and the trigger mode isn't benchmarked.
+With --upgrade, each run installs once untimed and times a second install
+over the first one.
+
+Run from the root of the repository:
+  python -m benchmarks.installer --runs=20 --transfer_failure_rate=0.05
+"""
+
+import argparse
+import collections
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import cloud_bigquery
+import cloud_env_setup
+import fake_cloud
+import synthetic_data
+from pyarrow import parquet
+
+_DEFAULT_RUNS = 10
+_PROJECT_ID = 'markup-benchmark'
+_DATASET_ID = 'markup'
+_MERCHANT_ID = '1234'
+_CUSTOMER_ID = '5678'
+_LANGUAGE_CODES_FILE = os.path.join('data', 'language_codes.csv')
+
+# Outcome of an installer run: its simulated seconds, the type of the error
+# which failed it if any, and the number of calls of each client method.
+InstallerRun = collections.namedtuple('InstallerRun',
+                                      ['seconds', 'error', 'calls'])
+
+
+def _write_reference_data(data_dir: str) -> None:
+  """Writes the language codes and synthetic geo targets to a directory."""
+  shutil.copy(_LANGUAGE_CODES_FILE, data_dir)
+  tables = synthetic_data.generate_tables(
+      _MERCHANT_ID, _CUSTOMER_ID, synthetic_data.Scale(products=1))
+  parquet.write_table(tables['geo_targets'],
+                      os.path.join(data_dir, 'geo_targets.parquet'))
+
+
+def run_installer(profile: fake_cloud.ServiceProfile,
+                  seed: int,
+                  reference_data_dir: str,
+                  time_scale: Optional[float] = None,
+                  market_insights: bool = False,
+                  upgrade: bool = False) -> InstallerRun:
+  """Runs the installer against fake clients.
+
+  Args:
+    profile: Durations and failure rates of the fake services.
+    seed: Seed of the durations and failures.
+    reference_data_dir: Directory of the reference data files.
+    time_scale: Optional. Real seconds slept per simulated second. The time
+      is virtual if not set.
+    market_insights: Whether Market Insights is installed.
+    upgrade: Whether an installation is run before the one timed.
+
+  Returns:
+    The outcome of the timed installation.
+  """
+  args = argparse.Namespace(
+      project_id=_PROJECT_ID,
+      dataset_id=_DATASET_ID,
+      merchant_id=_MERCHANT_ID,
+      ads_customer_id=_CUSTOMER_ID,
+      market_insights=market_insights,
+      trigger_mode=False,
+      job_stats_table=False)
+  clock = fake_cloud.FakeClock(time_scale)
+  bigquery_client = fake_cloud.FakeBigQueryClient(_PROJECT_ID, clock, profile,
+                                                  seed)
+  data_transfer_client = fake_cloud.FakeDataTransferServiceClient(
+      clock, profile, seed)
+  if upgrade:
+    # The existing installation is installed without failures.
+    for client in (bigquery_client, data_transfer_client):
+      client.profile = profile._replace(
+          call_failure_rate=0, job_failure_rate=0, transfer_failure_rate=0)
+    cloud_env_setup.install(args, bigquery_client, data_transfer_client,
+                            clock.sleep, reference_data_dir)
+    for client in (bigquery_client, data_transfer_client):
+      client.profile = profile
+      client.calls.clear()
+  cloud_bigquery.reset_job_stats()
+  error = None
+  start_seconds = clock.now()
+  try:
+    cloud_env_setup.install(args, bigquery_client, data_transfer_client,
+                            clock.sleep, reference_data_dir)
+  except Exception as install_error:  # pylint: disable=broad-except
+    error = type(install_error).__name__
+  seconds = clock.now() - start_seconds
+  return InstallerRun(seconds, error,
+                      bigquery_client.calls + data_transfer_client.calls)
+
+
+def summarize_runs(runs: List[InstallerRun]) -> Dict[str, Any]:
+  """Returns the distribution of the wall-clock times, failures and calls."""
+  seconds = sorted(run.seconds for run in runs)
+  calls = sum((run.calls for run in runs), collections.Counter())
+  return {
+      'runs': len(runs),
+      'median_seconds': statistics.median(seconds),
+      'p90_seconds': seconds[min(len(seconds) - 1, int(len(seconds) * 0.9))],
+      'max_seconds': seconds[-1],
+      'failures': collections.Counter(run.error for run in runs if run.error),
+      'calls_per_run': {
+          method: count / len(runs) for method, count in sorted(calls.items())
+      },
+  }
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+  """Formats a summary of runs as returned by summarize_runs."""
+  lines = [
+      f'{summary["runs"]} runs: median {summary["median_seconds"]:.0f}s, '
+      f'p90 {summary["p90_seconds"]:.0f}s, max {summary["max_seconds"]:.0f}s',
+      'failures: ' + (', '.join(
+          f'{error} {count}'
+          for error, count in summary['failures'].most_common()) or 'none'),
+      f'{"calls per run":<30} {"mean":>6}',
+  ]
+  for method, count in summary['calls_per_run'].items():
+    lines.append(f'{method:<30} {count:>6.1f}')
+  return '\n'.join(lines)
+
+
+def parse_arguments() -> argparse.Namespace:
+  """Initialize command line parser using argparse.
+
+  Returns:
+    An argparse.ArgumentParser.
+  """
+  default_profile = fake_cloud.ServiceProfile()
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--runs',
+      help='Number of installer runs.',
+      type=int,
+      default=_DEFAULT_RUNS)
+  parser.add_argument(
+      '--time_scale',
+      help='Real seconds slept per simulated second. The simulated time is '
+      'virtual and nothing is slept if not set.',
+      type=float,
+      default=None)
+  parser.add_argument(
+      '--market_insights',
+      help='Install Market Insights.',
+      action='store_true')
+  parser.add_argument(
+      '--upgrade',
+      help='Time the install over an existing installation.',
+      action='store_true')
+  for field in fake_cloud.ServiceProfile._fields:
+    parser.add_argument(
+        f'--{field}',
+        help=f'{field} of the fake services, see fake_cloud.ServiceProfile.',
+        type=float,
+        default=getattr(default_profile, field))
+  return parser.parse_args()
+
+
+def main():
+  args = parse_arguments()
+  profile = fake_cloud.ServiceProfile(
+      **{field: getattr(args, field)
+         for field in fake_cloud.ServiceProfile._fields})
+  # The installer logs each step and error of each run, which are summarized.
+  logging.getLogger().setLevel(logging.CRITICAL)
+  start = time.monotonic()
+  with tempfile.TemporaryDirectory() as reference_data_dir:
+    _write_reference_data(reference_data_dir)
+    runs = [
+        run_installer(profile, seed, reference_data_dir, args.time_scale,
+                      args.market_insights, args.upgrade)
+        for seed in range(args.runs)
+    ]
+  print(format_summary(summarize_runs(runs)))
+  print(f'Benchmarked in {time.monotonic() - start:.1f} real seconds.')
+
+
+if __name__ == '__main__':
+  main()
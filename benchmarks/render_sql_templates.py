@@ -0,0 +1,118 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Benchmarks rendering all the MarkUp SQL scripts for many tenants.
+
+Run from the root of the repository:
+  python -m benchmarks.render_sql_templates --tenants=1000
+"""
+
+import argparse
+import glob
+import logging
+import time
+from typing import Dict, List
+
+import sql_template
+
+_SCRIPTS_GLOB = 'scripts/**/*.sql'
+_DEFAULT_TENANTS = 1000
+
+# Set logging level.
+logging.getLogger().setLevel(logging.INFO)
+
+
+def _get_tenant_params(index: int) -> Dict[str, sql_template.Identifier]:
+  return {
+      'project_id': sql_template.Identifier(f'project-{index % 10}'),
+      'dataset': sql_template.Identifier(f'markup_{index}'),
+      'merchant_id': sql_template.Identifier(str(100000000 + index)),
+      'external_customer_id': sql_template.Identifier(str(2000000000 + index)),
+  }
+
+
+def _render_all(sql_files: List[str], tenant_count: int) -> Dict[str, str]:
+  """Renders all the scripts for all the tenants, returns their fingerprints."""
+  fingerprints = {}
+  for index in range(tenant_count):
+    params = _get_tenant_params(index)
+    for sql_file in sql_files:
+      fingerprints[(index, sql_file)] = sql_template.load_template(
+          sql_file).fingerprint(params)
+  return fingerprints
+
+
+def run_benchmark(tenant_count: int = _DEFAULT_TENANTS) -> Dict[str, float]:
+  """Compiles the scripts then renders them for a number of tenants.
+
+  Args:
+    tenant_count: Number of tenants the scripts are rendered for.
+
+  Returns:
+    The compile time, the render time and the render time per script in
+    seconds.
+
+  Raises:
+    AssertionError: If rendering the same parameters twice gives different
+      SQL.
+  """
+  sql_files = sorted(glob.glob(_SCRIPTS_GLOB, recursive=True))
+  sql_template.load_template.cache_clear()
+  start = time.perf_counter()
+  for sql_file in sql_files:
+    sql_template.load_template(sql_file)
+  compile_seconds = time.perf_counter() - start
+  start = time.perf_counter()
+  fingerprints = _render_all(sql_files, tenant_count)
+  render_seconds = time.perf_counter() - start
+  assert fingerprints == _render_all(sql_files, tenant_count), (
+      'Rendering is not deterministic.')
+  return {
+      'scripts': len(sql_files),
+      'tenants': tenant_count,
+      'compile_seconds': compile_seconds,
+      'render_seconds': render_seconds,
+      'render_seconds_per_script': render_seconds / len(fingerprints),
+  }
+
+
+def parse_arguments() -> argparse.Namespace:
+  """Initialize command line parser using argparse.
+
+  Returns:
+    An argparse.ArgumentParser.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--tenants',
+      help='Number of tenants the scripts are rendered for.',
+      type=int,
+      default=_DEFAULT_TENANTS)
+  return parser.parse_args()
+
+
+def main():
+  args = parse_arguments()
+  results = run_benchmark(args.tenants)
+  logging.info(
+      'Compiled %d scripts in %.1f ms, rendered them for %d tenants in %.2f s '
+      '(%.1f us per script).', results['scripts'],
+      results['compile_seconds'] * 1000, results['tenants'],
+      results['render_seconds'], results['render_seconds_per_script'] * 1e6)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,315 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Benchmarks the stages of the MarkUp scripts against checked-in baselines.
+
+Each scale is a fixed synthetic dataset, see synthetic_data. The installer,
+the main workflow and the best sellers workflow are run on it with
+local_harness, and each stage is measured: the views created by the
+installer, the stages of the main workflow and the best sellers workflow.
+The measures of a stage are its wall time, the rows it wrote, the rows it
+scanned and the bytes BigQuery would scan, estimated from the columns read.
+
+Measures above their baseline by more than their threshold are regressions,
+and rows written which differ from their baseline by more than the threshold
+are changes of the results. The rows and bytes only depend on the scripts and
+the data, while the wall times are noisy and depend on the machine: they have
+their own, larger threshold and their baselines are refreshed with
+--update_baselines on the machine comparing them.
+
+Run from the root of the repository:
+  python -m benchmarks.sql_stages --scales=small,medium
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+from typing import Any, Dict, List, Sequence
+
+import duckdb
+import local_harness
+import synthetic_data
+
+_DEFAULT_BASELINES_PATH = os.path.join('benchmarks',
+                                       'sql_stages_baselines.json')
+_DEFAULT_SCALES = ('small', 'medium')
+_DEFAULT_REPEATS = 3
+_DEFAULT_THRESHOLD = 0.1
+_DEFAULT_SECONDS_THRESHOLD = 0.5
+# Wall time differences below this are noise, whatever the threshold.
+_MIN_SECONDS_DELTA = 0.05
+_MERCHANT_ID = '1234'
+_CUSTOMER_ID = '5678'
+_END_DATE = datetime.date(2021, 10, 1)
+# The best sellers workflow reads the best sellers of two days before the run.
+_CURRENT_DATE = _END_DATE + datetime.timedelta(days=2)
+SCALES = {
+    'small':
+        synthetic_data.Scale(
+            products=1000,
+            days=7,
+            countries=2,
+            criteria=100,
+            targeting_depth=3,
+            seed=1,
+            end_date=_END_DATE),
+    'medium':
+        synthetic_data.Scale(
+            products=10000,
+            days=14,
+            countries=3,
+            criteria=500,
+            targeting_depth=4,
+            seed=1,
+            end_date=_END_DATE),
+    'large':
+        synthetic_data.Scale(
+            products=50000,
+            days=14,
+            countries=3,
+            criteria=2000,
+            targeting_depth=5,
+            seed=1,
+            end_date=_END_DATE),
+}
+_VIEW_SCRIPTS = ('1_product_view.sql', '2_product_metrics_view.sql',
+                 '3_customer_view.sql', '4_product_detailed_view.sql',
+                 'market_insights/snapshot_view.sql',
+                 'market_insights/historical_view.sql')
+_VIEWS_STAGE = 'views'
+_BEST_SELLERS_STAGE = 'best_sellers'
+STAGES = (_VIEWS_STAGE, 'parse_criteria', 'targeting', 'product_detailed',
+          'product_historical', 'dashboard_cubes', _BEST_SELLERS_STAGE)
+_WRITE_STATEMENTS = ('INSERT', 'DELETE', 'UPDATE', 'MERGE', 'CREATE')
+_SECONDS_MEASURE = 'seconds'
+# Measures which are regressions when they grow.
+_COST_MEASURES = (_SECONDS_MEASURE, 'rows_scanned', 'bytes_scanned')
+
+# Set logging level.
+logging.getLogger().setLevel(logging.INFO)
+
+
+def _get_stage_measures(
+    timings: Sequence[local_harness.StatementTiming]) -> Dict[str, Any]:
+  """Sums the measures of the statements of a stage."""
+  return {
+      'seconds':
+          sum(timing.seconds for timing in timings),
+      'rows':
+          sum(timing.row_count or 0
+              for timing in timings
+              if timing.statement.split(' ')[0] in _WRITE_STATEMENTS),
+      'rows_scanned':
+          sum(timing.rows_scanned or 0 for timing in timings),
+      'bytes_scanned':
+          sum(timing.bytes_scanned or 0 for timing in timings),
+  }
+
+
+def _run_once(fixture_dir: str) -> Dict[str, Dict[str, Any]]:
+  """Runs the scripts on the fixtures and measures each stage."""
+  harness = local_harness.LocalHarness(
+      _MERCHANT_ID, _CUSTOMER_ID, current_date=_CURRENT_DATE, profile=True)
+  try:
+    harness.load_fixtures(fixture_dir)
+    harness.run_installer(enable_market_insights=True)
+    installer_timings = list(harness.timings)
+    harness.run_main_workflow()
+    workflow_timings = harness.timings[len(installer_timings):]
+    harness.run_best_sellers_workflow()
+    best_sellers_timings = harness.timings[len(installer_timings) +
+                                           len(workflow_timings):]
+  finally:
+    harness.close()
+  stage_timings = {stage: [] for stage in STAGES}
+  stage_timings[_VIEWS_STAGE] = [
+      timing for timing in installer_timings if timing.script in _VIEW_SCRIPTS
+  ]
+  for timing in workflow_timings:
+    if timing.stage in stage_timings:
+      stage_timings[timing.stage].append(timing)
+  stage_timings[_BEST_SELLERS_STAGE] = best_sellers_timings
+  return {
+      stage: _get_stage_measures(timings)
+      for stage, timings in stage_timings.items()
+  }
+
+
+def run_benchmark(scale_name: str,
+                  repeats: int = _DEFAULT_REPEATS) -> Dict[str, Any]:
+  """Measures the stages of the scripts on the dataset of a scale.
+
+  Args:
+    scale_name: One of SCALES.
+    repeats: Number of runs, the wall time of a stage is its median.
+
+  Returns:
+    The measures keyed by stage.
+  """
+  scale = SCALES[scale_name]
+  tables = synthetic_data.generate_tables(_MERCHANT_ID, _CUSTOMER_ID, scale)
+  with tempfile.TemporaryDirectory() as fixture_dir:
+    synthetic_data.write_tables(tables, fixture_dir)
+    runs = [_run_once(fixture_dir) for _ in range(repeats)]
+  measures = runs[0]
+  for stage in measures:
+    measures[stage]['seconds'] = round(
+        statistics.median(run[stage]['seconds'] for run in runs), 4)
+  return measures
+
+
+def compare_measures(
+    results: Dict[str, Any],
+    baselines: Dict[str, Any],
+    threshold: float = _DEFAULT_THRESHOLD,
+    seconds_threshold: float = _DEFAULT_SECONDS_THRESHOLD) -> List[str]:
+  """Compares measures with their baselines.
+
+  Args:
+    results: Measures keyed by scale and stage.
+    baselines: Baseline measures keyed by scale and stage.
+    threshold: Relative difference above which the rows and bytes are
+      flagged.
+    seconds_threshold: Relative difference above which a wall time is
+      flagged.
+
+  Returns:
+    The regressions and changes found, one line each.
+  """
+  findings = []
+  for scale_name, stages in results.items():
+    for stage, measures in stages.items():
+      baseline = baselines.get(scale_name, {}).get(stage)
+      if not baseline:
+        findings.append(f'{scale_name} {stage}: no baseline')
+        continue
+      for measure, value in measures.items():
+        baseline_value = baseline.get(measure)
+        if baseline_value is None:
+          continue
+        delta = value - baseline_value
+        if measure == _SECONDS_MEASURE:
+          if delta < _MIN_SECONDS_DELTA:
+            continue
+          limit = seconds_threshold * baseline_value
+        else:
+          limit = threshold * baseline_value
+        if measure in _COST_MEASURES and delta > limit:
+          findings.append(f'{scale_name} {stage}: {measure} regressed from '
+                          f'{baseline_value} to {value}')
+        elif measure not in _COST_MEASURES and abs(delta) > limit:
+          findings.append(f'{scale_name} {stage}: {measure} changed from '
+                          f'{baseline_value} to {value}')
+  return findings
+
+
+def _format_baseline(value: Any, scale: float = 1) -> str:
+  return '-' if value is None else f'{value / scale:.3f}'
+
+
+def format_measures(results: Dict[str, Any], baselines: Dict[str, Any]) -> str:
+  """Formats the measures of each stage next to their baselines."""
+  lines = [
+      f'{"scale":<8} {"stage":<20} {"seconds":>9} {"baseline":>9} '
+      f'{"rows":>10} {"rows scanned":>13} {"MB scanned":>11} {"baseline":>9}'
+  ]
+  for scale_name, stages in results.items():
+    for stage, measures in stages.items():
+      baseline = baselines.get(scale_name, {}).get(stage, {})
+      baseline_seconds = _format_baseline(baseline.get(_SECONDS_MEASURE))
+      baseline_mb = _format_baseline(baseline.get('bytes_scanned'), 1e6)
+      lines.append(f'{scale_name:<8} {stage:<20} {measures["seconds"]:>9.3f} '
+                   f'{baseline_seconds:>9} {measures["rows"]:>10} '
+                   f'{measures["rows_scanned"]:>13} '
+                   f'{measures["bytes_scanned"] / 1e6:>11.3f} '
+                   f'{baseline_mb:>9}')
+  return '\n'.join(lines)
+
+
+def parse_arguments() -> argparse.Namespace:
+  """Initialize command line parser using argparse.
+
+  Returns:
+    An argparse.ArgumentParser.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--scales',
+      help=f'Comma separated scales among {", ".join(SCALES)}.',
+      default=','.join(_DEFAULT_SCALES))
+  parser.add_argument(
+      '--repeats',
+      help='Number of runs per scale.',
+      type=int,
+      default=_DEFAULT_REPEATS)
+  parser.add_argument(
+      '--threshold',
+      help=('Relative difference of the rows and bytes to their baselines '
+            'flagged, e.g. 0.1 for 10%%.'),
+      type=float,
+      default=_DEFAULT_THRESHOLD)
+  parser.add_argument(
+      '--seconds_threshold',
+      help='Relative difference of the wall times to their baselines flagged.',
+      type=float,
+      default=_DEFAULT_SECONDS_THRESHOLD)
+  parser.add_argument(
+      '--baselines',
+      help='JSON file of the baselines.',
+      default=_DEFAULT_BASELINES_PATH)
+  parser.add_argument(
+      '--update_baselines',
+      help='Write the measures of the scales run as their baselines.',
+      action='store_true')
+  return parser.parse_args()
+
+
+def main():
+  args = parse_arguments()
+  baselines = {}
+  if os.path.exists(args.baselines):
+    with open(args.baselines) as baselines_file:
+      baselines = json.load(baselines_file)
+  results = {
+      scale_name: run_benchmark(scale_name, args.repeats)
+      for scale_name in args.scales.split(',')
+  }
+  print(format_measures(results, baselines.get('scales', {})))
+  if args.update_baselines:
+    baselines['duckdb_version'] = duckdb.__version__
+    baselines.setdefault('scales', {}).update(results)
+    with open(args.baselines, 'w') as baselines_file:
+      json.dump(baselines, baselines_file, indent=2, sort_keys=True)
+      baselines_file.write('\n')
+    logging.info('Updated the baselines of %s in %s.', args.scales,
+                 args.baselines)
+    return
+  findings = compare_measures(results, baselines.get('scales', {}),
+                              args.threshold, args.seconds_threshold)
+  for finding in findings:
+    logging.warning('%s', finding)
+  if findings:
+    sys.exit(1)
+  logging.info('No regression beyond the thresholds of the baselines.')
+
+
+if __name__ == '__main__':
+  main()
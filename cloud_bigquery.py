@@ -16,32 +16,322 @@
 # python3
 """Cloud BigQuery module."""
 
+import collections
+import datetime
+import json
 import logging
 import os
-from typing import Any, Dict
+import re
+import threading
+from typing import Any, Dict, List, Optional, Union
 
 import config_parser
+import sql_template
 from google.cloud import bigquery
 from google.cloud import exceptions
 
 # Main workflow sql.
 _MAIN_WORKFLOW_SQL = 'scripts/main_workflow.sql'
 _BEST_SELLERS_WORKFLOW_SQL = 'scripts/market_insights/best_sellers_workflow.sql'
+# Marks the beginning of a stage of a workflow script: "-- STAGE: <name>".
+_STAGE_MARKER_PATTERN = re.compile(r'^-- STAGE: (\w+)[ \t]*$', re.MULTILINE)
+# Table of the job statistics in the MarkUp dataset.
+JOB_STATS_TABLE = 'markup_job_stats'
+_JOB_STATS_SCHEMA = [
+    bigquery.SchemaField('script', 'STRING'),
+    bigquery.SchemaField('tenant', 'STRING'),
+    bigquery.SchemaField('job_id', 'STRING'),
+    bigquery.SchemaField('job_type', 'STRING'),
+    bigquery.SchemaField('location', 'STRING'),
+    bigquery.SchemaField('succeeded', 'BOOLEAN'),
+    bigquery.SchemaField('started_at', 'TIMESTAMP'),
+    bigquery.SchemaField('duration_seconds', 'FLOAT'),
+    bigquery.SchemaField('bytes_processed', 'INTEGER'),
+    bigquery.SchemaField('bytes_billed', 'INTEGER'),
+    bigquery.SchemaField('slot_ms', 'INTEGER'),
+    bigquery.SchemaField('cache_hit', 'BOOLEAN'),
+    bigquery.SchemaField('output_rows', 'INTEGER'),
+    bigquery.SchemaField('error', 'STRING'),
+]
+_BYTES_PER_GB = 1024**3
+_INTERACTIVE_PRIORITY = 'INTERACTIVE'
+# Label keys and values are lowercase letters, digits, "_" and "-".
+_INVALID_LABEL_CHARS_PATTERN = re.compile(r'[^a-z0-9_-]')
+_MAX_LABEL_LENGTH = 63
+# Declarations, comments and blank lines at the beginning of a script, which
+# have to stay before any other statement.
+_SCRIPT_DECLARATIONS_PATTERN = re.compile(
+    r'\A(?:\s+|--[^\n]*|#[^\n]*|DECLARE\b[^;]*;)*')
 
 # Set logging level.
 logging.getLogger().setLevel(logging.INFO)
 logging.getLogger('googleapiclient.discovery').setLevel(logging.WARNING)
 
+# Statistics of the jobs run by this module, see wait_for_job.
+_job_stats = []
+_job_stats_lock = threading.Lock()
+_job_stats_file = None
 
-def create_dataset_if_not_exists(project_id: str, dataset_id: str) -> None:
+
+def _format_label(value: str) -> str:
+  return _INVALID_LABEL_CHARS_PATTERN.sub(
+      '_', str(value).lower())[:_MAX_LABEL_LENGTH]
+
+
+def get_job_labels(stage: str, tenant: Optional[str] = None) -> Dict[str, str]:
+  """Returns the labels of the jobs of a stage.
+
+  Args:
+    stage: Name of the installation script, workflow or workflow stage.
+    tenant: Google Ads customer id the jobs run for, if any.
+
+  Returns:
+    The labels of the job policy of the stage, with the stage and tenant.
+  """
+  labels = dict(config_parser.get_job_policy(stage).labels)
+  labels['markup_stage'] = stage
+  if tenant:
+    labels['markup_tenant'] = tenant
+  return {
+      _format_label(key): _format_label(value)
+      for key, value in labels.items()
+  }
+
+
+def get_job_configuration(stage: str,
+                          tenant: Optional[str] = None) -> Dict[str, Any]:
+  """Returns the REST configuration of the query jobs of a stage.
+
+  Args:
+    stage: Name of the installation script, workflow or workflow stage.
+    tenant: Google Ads customer id the jobs run for, if any.
+
+  Returns:
+    The job configuration applying the job policy of the stage, without the
+    query itself.
+  """
+  policy = config_parser.get_job_policy(stage)
+  query_configuration = {'priority': policy.priority}
+  if policy.maximum_bytes_billed:
+    query_configuration['maximumBytesBilled'] = str(
+        policy.maximum_bytes_billed)
+  configuration = {
+      'query': query_configuration,
+      'labels': get_job_labels(stage, tenant),
+  }
+  if policy.timeout_seconds:
+    configuration['jobTimeoutMs'] = str(int(policy.timeout_seconds * 1000))
+  return configuration
+
+
+def get_query_job_config(stage: str,
+                         tenant: Optional[str] = None
+                        ) -> bigquery.QueryJobConfig:
+  """Returns the config of the query jobs of a stage run by the installer.
+
+  The installer waits for each of its jobs, so they run with the INTERACTIVE
+  priority whatever the priority of the stage: BATCH jobs may stay queued.
+  """
+  configuration = get_job_configuration(stage, tenant)
+  configuration['query']['priority'] = _INTERACTIVE_PRIORITY
+  return bigquery.QueryJobConfig.from_api_repr(configuration)
+
+
+def add_job_policy_header(query: str,
+                          stage: str,
+                          tenant: Optional[str] = None) -> str:
+  """Adds the labels and reservation of a stage to a script.
+
+  Scheduled queries have no job configuration, so the policy is set by system
+  variables after the declarations of the script. The stages of a workflow,
+  marked by "-- STAGE: <name>" lines, get their own labels; the reservation
+  is the one of the script.
+
+  Args:
+    query: The script.
+    stage: Name of the script, e.g. the workflow.
+    tenant: Google Ads customer id the script runs for, if any.
+
+  Returns:
+    The script with the policy header.
+  """
+
+  def get_label_header(stage: str) -> str:
+    labels = ','.join(
+        f'{key}:{value}'
+        for key, value in get_job_labels(stage, tenant).items())
+    return f"SET @@query_label = '{labels}';"
+
+  query = _STAGE_MARKER_PATTERN.sub(
+      lambda marker: f'{marker.group(0)}\n{get_label_header(marker.group(1))}',
+      query)
+  header = get_label_header(stage)
+  reservation = config_parser.get_job_policy(stage).reservation
+  if reservation:
+    header = f"SET @@reservation = '{reservation}';\n{header}"
+  # Comments after the last declaration document the next statement.
+  declarations = _SCRIPT_DECLARATIONS_PATTERN.match(query).group(0)
+  last_declaration_end = declarations.rfind(';') + 1
+  declarations_end = last_declaration_end or len(declarations)
+  declarations = query[:declarations_end].rstrip()
+  if declarations:
+    header = f'{declarations}\n\n{header}'
+  return f'{header}\n\n{query[declarations_end:].lstrip()}'
+
+
+def set_job_stats_file(file_path: Optional[str]) -> None:
+  """Sets the JSONL file the job statistics are appended to.
+
+  Args:
+    file_path: Path of the file, or None to only keep the statistics in memory.
+  """
+  global _job_stats_file
+  _job_stats_file = file_path
+
+
+def get_job_stats() -> List[Dict[str, Any]]:
+  """Returns the statistics of the jobs waited for since the last reset."""
+  with _job_stats_lock:
+    return list(_job_stats)
+
+
+def reset_job_stats() -> None:
+  """Clears the statistics of the jobs."""
+  with _job_stats_lock:
+    _job_stats.clear()
+
+
+def _get_job_stats(job: Union[bigquery.QueryJob, bigquery.LoadJob],
+                   script: str, tenant: Optional[str]) -> Dict[str, Any]:
+  """Returns the statistics of a finished query or load job."""
+  duration_seconds = None
+  if job.started and job.ended:
+    duration_seconds = (job.ended - job.started).total_seconds()
+  if isinstance(job, bigquery.LoadJob):
+    output_rows = job.output_rows
+  else:
+    output_rows = getattr(job, 'num_dml_affected_rows', None)
+  return {
+      'script': script,
+      'tenant': tenant,
+      'job_id': job.job_id,
+      'job_type': job.job_type,
+      'location': job.location,
+      'succeeded': job.error_result is None,
+      'started_at': job.started.isoformat() if job.started else None,
+      'duration_seconds': duration_seconds,
+      'bytes_processed': getattr(job, 'total_bytes_processed', None),
+      'bytes_billed': getattr(job, 'total_bytes_billed', None),
+      'slot_ms': getattr(job, 'slot_millis', None),
+      'cache_hit': getattr(job, 'cache_hit', None),
+      'output_rows': output_rows,
+      'error': (job.error_result or {}).get('message'),
+  }
+
+
+def wait_for_job(job: Union[bigquery.QueryJob, bigquery.LoadJob],
+                 script: str,
+                 tenant: Optional[str] = None) -> Any:
+  """Waits for a query or load job and records its statistics.
+
+  The statistics are recorded whether the job succeeds or fails, and appended
+  to the job statistics file if one is set.
+
+  Args:
+    job: The job to wait for.
+    script: Name of the script or data file run by the job.
+    tenant: Google Ads customer id the job runs for, if any.
+
+  Returns:
+    The result of the job.
+  """
+  try:
+    return job.result()
+  finally:
+    stats = _get_job_stats(job, script, tenant)
+    with _job_stats_lock:
+      _job_stats.append(stats)
+      if _job_stats_file:
+        with open(_job_stats_file, 'a') as stats_file:
+          stats_file.write(json.dumps(stats) + '\n')
+
+
+def write_job_stats_table(project_id: str,
+                          dataset_id: str,
+                          job_stats: List[Dict[str, Any]],
+                          client: Optional[bigquery.Client] = None) -> None:
+  """Appends job statistics to the "markup_job_stats" table of the dataset.
+
+  Args:
+    project_id: A cloud project id.
+    dataset_id: BigQuery dataset id.
+    job_stats: Job statistics as returned by get_job_stats.
+    client: BigQuery client, one for the project is created if not set.
+  """
+  if not job_stats:
+    return
+  client = client or bigquery.Client(project=project_id)
+  job_config = bigquery.LoadJobConfig(
+      schema=_JOB_STATS_SCHEMA,
+      write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+  client.load_table_from_json(
+      job_stats,
+      f'{project_id}.{dataset_id}.{JOB_STATS_TABLE}',
+      job_config=job_config).result()
+
+
+def format_job_stats(job_stats: List[Dict[str, Any]]) -> str:
+  """Formats job statistics as a summary table, costliest scripts first.
+
+  Args:
+    job_stats: Job statistics as returned by get_job_stats.
+
+  Returns:
+    The summary table with a line per script and tenant and a total line.
+  """
+  summaries = collections.OrderedDict()
+  for stats in job_stats:
+    summary = summaries.setdefault(
+        (stats['script'], stats['tenant'] or '-'), collections.Counter())
+    summary['jobs'] += 1
+    summary['failed'] += 0 if stats['succeeded'] else 1
+    summary['cache_hits'] += 1 if stats['cache_hit'] else 0
+    for key in ('duration_seconds', 'bytes_processed', 'bytes_billed',
+                'slot_ms'):
+      summary[key] += stats[key] or 0
+  summaries[('total', '')] = sum(summaries.values(), collections.Counter())
+  lines = [
+      f'{"script":<48} {"tenant":<12} {"jobs":>5} {"failed":>6} '
+      f'{"cached":>6} {"seconds":>9} {"GB processed":>13} {"GB billed":>10} '
+      f'{"slot seconds":>13}'
+  ]
+  ordered_keys = sorted(
+      list(summaries)[:-1], key=lambda key: -summaries[key]['bytes_billed'])
+  for script, tenant in ordered_keys + [('total', '')]:
+    summary = summaries[(script, tenant)]
+    lines.append(
+        f'{script:<48} {tenant:<12} {summary["jobs"]:>5} '
+        f'{summary["failed"]:>6} {summary["cache_hits"]:>6} '
+        f'{summary["duration_seconds"]:>9.1f} '
+        f'{summary["bytes_processed"] / _BYTES_PER_GB:>13.3f} '
+        f'{summary["bytes_billed"] / _BYTES_PER_GB:>10.3f} '
+        f'{summary["slot_ms"] / 1000:>13.1f}')
+  return '\n'.join(lines)
+
+
+def create_dataset_if_not_exists(
+    project_id: str,
+    dataset_id: str,
+    client: Optional[bigquery.Client] = None) -> None:
   """Creates BigQuery dataset if it doesn't exists.
 
   Args:
     project_id: A cloud project id.
     dataset_id: BigQuery dataset id.
+    client: BigQuery client, one for the project is created if not set.
   """
   # Construct a BigQuery client object.
-  client = bigquery.Client(project=project_id)
+  client = client or bigquery.Client(project=project_id)
   fully_qualified_dataset_id = f'{project_id}.{dataset_id}'
   try:
     client.get_dataset(fully_qualified_dataset_id)
@@ -54,40 +344,6 @@ def create_dataset_if_not_exists(project_id: str, dataset_id: str) -> None:
     logging.info('Dataset %s created.', fully_qualified_dataset_id)
 
 
-def load_language_codes(project_id: str, dataset_id: str) -> None:
-  """Loads language codes."""
-  client = bigquery.Client(project=project_id)
-  fully_qualified_table_id = f'{project_id}.{dataset_id}.language_codes'
-  job_config = bigquery.LoadJobConfig(
-      source_format=bigquery.SourceFormat.CSV,
-      skip_leading_rows=1,
-      autodetect=True,
-  )
-  file_name = 'data/language_codes.csv'
-  with open(file_name, 'rb') as source_file:
-    job = client.load_table_from_file(
-        source_file, fully_qualified_table_id, job_config=job_config)
-
-  job.result()
-
-
-def load_geo_targets(project_id: str, dataset_id: str) -> None:
-  """Loads geo targets."""
-  client = bigquery.Client(project=project_id)
-  fully_qualified_table_id = f'{project_id}.{dataset_id}.geo_targets'
-  job_config = bigquery.LoadJobConfig(
-      source_format=bigquery.SourceFormat.CSV,
-      skip_leading_rows=1,
-      autodetect=True,
-  )
-  file_name = 'data/geo_targets.csv'
-  with open(file_name, 'rb') as source_file:
-    job = client.load_table_from_file(
-        source_file, fully_qualified_table_id, job_config=job_config)
-
-  job.result()
-
-
 def read_file(file_path: str) -> str:
   """Reads and returns contents of the file.
 
@@ -113,48 +369,75 @@ def read_file(file_path: str) -> str:
 def configure_sql(sql_path: str, query_params: Dict[str, Any]) -> str:
   """Configures parameters of SQL script with variables supplied.
 
+  The script is compiled once and rendered by sql_template, see the module
+  for the syntax and the types of values.
+
   Args:
     sql_path: Path to SQL script.
     query_params: Configuration containing query parameter values.
 
   Returns:
     sql_script: String representation of SQL script with parameters assigned.
-  """
-  sql_script = read_file(sql_path)
-
-  params = {}
-  for param_key, param_value in query_params.items():
-    # If given value is list of strings (ex. 'a,b,c'), create tuple of
-    # strings (ex. ('a', 'b', 'c')) to pass to SQL IN operator.
-    if isinstance(param_value, str) and ',' in param_value:
-      params[param_key] = tuple(param_value.split(','))
-    else:
-      params[param_key] = param_value
 
-  return sql_script.format(**params)
+  Raises:
+    sql_template.MissingParameterError: If a parameter used by the script is
+      missing.
+  """
+  return sql_template.render_file(sql_path, query_params)
 
 
-def execute_queries(project_id: str, dataset_id: str, merchant_id: str,
-                    customer_id: str, enable_market_insights: bool) -> None:
-  """Executes list of queries."""
+def get_sql_files(enable_market_insights: bool) -> List[str]:
+  """Returns the sql files run by the installation, in order."""
   # Sql files to be executed in a specific order.
   # The prefix "scripts" should be omitted.
   sql_files = [
       '1_product_view.sql',
       'targeted_products/targeted_product_ddl.sql',
       'targeted_products/construct_parsed_criteria.sql',
+      'workflow_run_state.sql',
+      'workflow_run_log.sql',
       '2_product_metrics_view.sql',
       '3_customer_view.sql',
       '4_product_detailed_view.sql',
       'materialize_product_detailed.sql',
       'materialize_product_historical.sql',
+      'materialize_dashboard_cubes.sql',
   ]
   if enable_market_insights:
     market_insights_sql_files = [
         'market_insights/snapshot_view.sql',
+        'market_insights/price_history.sql',
         'market_insights/historical_view.sql'
     ]
     sql_files.extend(market_insights_sql_files)
+  return sql_files
+
+
+def _get_stage_name(sql_file: str) -> str:
+  """Returns the job policy stage of a sql file, i.e. its base name."""
+  return os.path.splitext(os.path.basename(sql_file))[0]
+
+
+def execute_queries(project_id: str,
+                    dataset_id: str,
+                    merchant_id: str,
+                    customer_id: str,
+                    enable_market_insights: bool,
+                    client: Optional[bigquery.Client] = None) -> None:
+  """Executes list of queries.
+
+  The queries run with the job policy of their script (see JOB_POLICY in
+  config.yaml), e.g. they fail without being billed if they would bill more
+  than the maximum bytes billed, but always with the INTERACTIVE priority.
+
+  Args:
+    project_id: A cloud project id.
+    dataset_id: BigQuery dataset id.
+    merchant_id: Merchant center id.
+    customer_id: Google Ads customer id.
+    enable_market_insights: Whether market insights queries are run.
+    client: BigQuery client, one for the project is created if not set.
+  """
   prefix = 'scripts'
   query_params = {
       'project_id': project_id,
@@ -163,17 +446,120 @@ def execute_queries(project_id: str, dataset_id: str, merchant_id: str,
       'external_customer_id': customer_id
   }
   location = config_parser.get_dataset_location()
-  client = bigquery.Client(project=project_id)
-  for sql_file in sql_files:
+  client = client or bigquery.Client(project=project_id)
+  for sql_file in get_sql_files(enable_market_insights):
     try:
       query = configure_sql(os.path.join(prefix, sql_file), query_params)
-      query_job = client.query(query, location=location)
-      query_job.result()
+      stage = _get_stage_name(sql_file)
+      if config_parser.get_job_policy(stage).reservation:
+        # Jobs have no reservation setting, the script sets it.
+        query = add_job_policy_header(query, stage, customer_id)
+      query_job = client.query(
+          query,
+          job_config=get_query_job_config(stage, customer_id),
+          location=location)
+      wait_for_job(query_job, sql_file, customer_id)
     except:
       logging.exception('Error in %s', sql_file)
       raise
 
 
+def estimate_queries(
+    project_id: str,
+    dataset_id: str,
+    merchant_id: str,
+    customer_id: str,
+    enable_market_insights: bool,
+    client: Optional[bigquery.Client] = None) -> List[Dict[str, Any]]:
+  """Estimates the bytes processed by the queries of an installation.
+
+  The queries run by execute_queries and the workflows are submitted as dry
+  run jobs, which are free. A query reading tables or views created by a
+  previous query can only be estimated once they exist, i.e. when upgrading an
+  installation; its estimate then holds the error instead.
+
+  Args:
+    project_id: A cloud project id.
+    dataset_id: BigQuery dataset id.
+    merchant_id: Merchant center id.
+    customer_id: Google Ads customer id.
+    enable_market_insights: Whether market insights queries are estimated.
+    client: BigQuery client, one for the project is created if not set.
+
+  Returns:
+    One dict per query with its script name, tenant, estimated bytes processed
+    and error, in the order of execution.
+  """
+  prefix = 'scripts'
+  query_params = {
+      'project_id': project_id,
+      'dataset': dataset_id,
+      'merchant_id': merchant_id,
+      'external_customer_id': customer_id
+  }
+  queries = [(sql_file,
+              configure_sql(os.path.join(prefix, sql_file), query_params))
+             for sql_file in get_sql_files(enable_market_insights)]
+  queries.append((os.path.relpath(_MAIN_WORKFLOW_SQL, prefix),
+                  get_main_workflow_sql(project_id, dataset_id, merchant_id,
+                                        customer_id)))
+  if enable_market_insights:
+    queries.append((os.path.relpath(_BEST_SELLERS_WORKFLOW_SQL, prefix),
+                    get_best_sellers_workflow_sql(project_id, dataset_id,
+                                                  merchant_id)))
+  location = config_parser.get_dataset_location()
+  job_config = bigquery.QueryJobConfig(
+      dry_run=True,
+      use_query_cache=False,
+      query_parameters=[
+          bigquery.ScalarQueryParameter('run_date', 'DATE',
+                                        datetime.date.today())
+      ])
+  client = client or bigquery.Client(project=project_id)
+  estimates = []
+  for sql_file, query in queries:
+    estimate = {
+        'script': sql_file,
+        'tenant': customer_id,
+        'bytes_processed': None,
+        'error': None
+    }
+    try:
+      query_job = client.query(query, job_config=job_config, location=location)
+      estimate['bytes_processed'] = query_job.total_bytes_processed
+    except exceptions.GoogleCloudError as error:
+      logging.warning('Could not estimate %s: %s', sql_file, error)
+      estimate['error'] = str(error)
+    estimates.append(estimate)
+  return estimates
+
+
+def format_estimates(estimates: List[Dict[str, Any]]) -> str:
+  """Formats query estimates as a table with a total line per tenant.
+
+  Args:
+    estimates: Query estimates as returned by estimate_queries.
+
+  Returns:
+    The table with a line per script and tenant.
+  """
+  lines = [f'{"script":<48} {"tenant":<12} {"GB processed":>13}']
+  totals = collections.OrderedDict()
+  for estimate in estimates:
+    tenant = estimate['tenant'] or '-'
+    totals.setdefault(tenant, 0)
+    if estimate['error']:
+      estimated_gb = 'error'
+    else:
+      totals[tenant] += estimate['bytes_processed'] or 0
+      estimated_gb = f'{(estimate["bytes_processed"] or 0) / _BYTES_PER_GB:.3f}'
+    lines.append(f'{estimate["script"]:<48} {tenant:<12} {estimated_gb:>13}')
+  for tenant, total in totals.items():
+    lines.append(
+        f'{"total":<48} {tenant:<12} {total / _BYTES_PER_GB:>13.3f}')
+  return '\n'.join(lines)
+
+
 def get_main_workflow_sql(project_id: str, dataset_id: str, merchant_id: str,
                           customer_id: str) -> str:
   """Returns main workflow sql.
@@ -190,7 +576,9 @@ def get_main_workflow_sql(project_id: str, dataset_id: str, merchant_id: str,
       'merchant_id': merchant_id,
       'external_customer_id': customer_id
   }
-  return configure_sql(_MAIN_WORKFLOW_SQL, query_params)
+  return add_job_policy_header(
+      configure_sql(_MAIN_WORKFLOW_SQL, query_params), 'main_workflow',
+      customer_id)
 
 
 def get_best_sellers_workflow_sql(project_id: str, dataset_id: str,
@@ -207,4 +595,36 @@ def get_best_sellers_workflow_sql(project_id: str, dataset_id: str,
       'dataset': dataset_id,
       'merchant_id': merchant_id
   }
-  return configure_sql(_BEST_SELLERS_WORKFLOW_SQL, query_params)
+  return add_job_policy_header(
+      configure_sql(_BEST_SELLERS_WORKFLOW_SQL, query_params),
+      'best_sellers_workflow', merchant_id)
+
+
+def split_workflow_stages(query: str) -> Dict[str, str]:
+  """Splits a workflow script in stages.
+
+  Stages start with a "-- STAGE: <name>" line. The statements before the first
+  stage (i.e. the declarations) are prepended to every stage, so that each
+  stage can run as a script on its own.
+
+  Args:
+    query: Workflow script.
+
+  Returns:
+    The scripts of the stages keyed by stage name, in order.
+
+  Raises:
+    ValueError: If the script has no stage or a stage is declared twice.
+  """
+  markers = list(_STAGE_MARKER_PATTERN.finditer(query))
+  if not markers:
+    raise ValueError('The workflow script has no "-- STAGE:" marker.')
+  preamble = query[:markers[0].start()].rstrip()
+  stages = collections.OrderedDict()
+  for index, marker in enumerate(markers):
+    name = marker.group(1)
+    if name in stages:
+      raise ValueError(f'The stage "{name}" is declared more than once.')
+    end = markers[index + 1].start() if index + 1 < len(markers) else None
+    stages[name] = f'{preamble}\n\n{query[marker.start():end].strip()}\n'
+  return stages
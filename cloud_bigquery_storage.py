@@ -0,0 +1,491 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Module for streaming MarkUp tables through the BigQuery Storage Read API.
+
+The materialized MarkUp tables are read as Arrow record batches over parallel
+read streams instead of paging `SELECT *` results through the REST API.
+
+Typical usage example:
+  >>> for batch in read_table_batches(
+  ...     'project_id.markup.product_detailed_materialized',
+  ...     columns=['unique_product_id', 'target_country', 'is_approved'],
+  ...     row_filter="target_country = 'US'"):
+  ...   process(batch)
+  >>> export_table('project_id.markup.product_historical_materialized',
+  ...              '/tmp/product_historical.parquet')
+"""
+
+import abc
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import logging
+import queue
+import re
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from google.cloud import bigquery_storage
+import pyarrow
+from pyarrow import compute
+from pyarrow import ipc
+from pyarrow import parquet
+
+_DEFAULT_MAX_STREAMS = 4
+# Number of record batches buffered per stream before readers are paused.
+_BATCHES_PER_STREAM_BUFFER = 2
+_FAKE_BATCH_SIZE = 1024
+PARQUET_FORMAT = 'parquet'
+ARROW_FORMAT = 'arrow'
+_FILE_FORMATS = (PARQUET_FORMAT, ARROW_FORMAT)
+# Matches a single comparison of a row filter e.g. "target_country = 'US'".
+_COMPARISON_REGEX = re.compile(
+    r'^\s*(?P<column>\w+)\s*(?P<operator>=|!=|<>|<=|>=|<|>)\s*'
+    r'(?P<value>\'[^\']*\'|"[^"]*"|-?\d+(\.\d+)?|TRUE|FALSE)\s*$',
+    re.IGNORECASE)
+
+# Set logging level.
+logging.getLogger().setLevel(logging.INFO)
+
+# A read session is the Arrow schema of the projected columns and the list of
+# stream names that together return all the rows of the table.
+ReadSession = collections.namedtuple('ReadSession', ['schema', 'streams'])
+
+
+class Error(Exception):
+  """Base error for this module."""
+
+
+class ReadSessionBackend(abc.ABC):
+  """Interface of the backends that serve read sessions."""
+
+  @abc.abstractmethod
+  def create_read_session(self, table_id: str, columns: Optional[List[str]],
+                          row_filter: Optional[str],
+                          max_streams: int) -> ReadSession:
+    """Creates a read session over a table.
+
+    Args:
+      table_id: Fully qualified table id, e.g. 'project.dataset.table'.
+      columns: Optional. Columns to read. All columns are read if not set.
+      row_filter: Optional. SQL predicate that the returned rows satisfy.
+      max_streams: Maximum number of streams in the session.
+
+    Returns:
+      The read session.
+    """
+
+  @abc.abstractmethod
+  def read_stream(self, session: ReadSession,
+                  stream: str) -> Iterator[pyarrow.RecordBatch]:
+    """Yields record batches of one stream of the read session.
+
+    Args:
+      session: The read session returned by `create_read_session`.
+      stream: Name of one of the streams of the session.
+    """
+
+
+class BigQueryReadSessionBackend(ReadSessionBackend):
+  """Serves read sessions from the BigQuery Storage Read API."""
+
+  def __init__(self,
+               project_id: str,
+               client: Optional[bigquery_storage.BigQueryReadClient] = None):
+    """Initialise new instance of BigQueryReadSessionBackend.
+
+    Args:
+      project_id: GCP project id billed for the read sessions.
+      client: Optional. Storage Read API client.
+    """
+    self.project_id = project_id
+    self.client = client or bigquery_storage.BigQueryReadClient()
+
+  def create_read_session(self, table_id: str, columns: Optional[List[str]],
+                          row_filter: Optional[str],
+                          max_streams: int) -> ReadSession:
+    project_id, dataset_id, table_name = _split_table_id(table_id)
+    read_options = bigquery_storage.types.ReadSession.TableReadOptions(
+        selected_fields=columns or [], row_restriction=row_filter or '')
+    requested_session = bigquery_storage.types.ReadSession(
+        table=(f'projects/{project_id}/datasets/{dataset_id}/'
+               f'tables/{table_name}'),
+        data_format=bigquery_storage.types.DataFormat.ARROW,
+        read_options=read_options)
+    session = self.client.create_read_session(
+        parent=f'projects/{self.project_id}',
+        read_session=requested_session,
+        max_stream_count=max_streams)
+    schema = ipc.read_schema(
+        pyarrow.py_buffer(session.arrow_schema.serialized_schema))
+    return ReadSession(schema, [stream.name for stream in session.streams])
+
+  def read_stream(self, session: ReadSession,
+                  stream: str) -> Iterator[pyarrow.RecordBatch]:
+    for response in self.client.read_rows(stream):
+      yield ipc.read_record_batch(
+          pyarrow.py_buffer(
+              response.arrow_record_batch.serialized_record_batch),
+          session.schema)
+
+
+class FakeReadSessionBackend(ReadSessionBackend):
+  """Serves read sessions from in-memory Arrow tables.
+
+  The fake backend is used to exercise the export functions offline. Row
+  filters are limited to comparisons of a column with a literal joined with
+  AND, e.g. "target_country = 'US' AND data_date >= '2021-01-01'".
+
+  Typical usage example:
+    >>> backend = FakeReadSessionBackend(
+    ...     {'project.markup.product_detailed_materialized': arrow_table})
+    >>> read_table('project.markup.product_detailed_materialized',
+    ...            backend=backend)
+  """
+
+  def __init__(self,
+               tables: Dict[str, pyarrow.Table],
+               batch_size: int = _FAKE_BATCH_SIZE):
+    """Initialise new instance of FakeReadSessionBackend.
+
+    Args:
+      tables: Arrow tables keyed by fully qualified table id.
+      batch_size: Maximum number of rows in the returned record batches.
+    """
+    self.tables = tables
+    self.batch_size = batch_size
+    self._streams = {}
+    self._stream_numbers = itertools.count()
+    self._lock = threading.Lock()
+
+  def create_read_session(self, table_id: str, columns: Optional[List[str]],
+                          row_filter: Optional[str],
+                          max_streams: int) -> ReadSession:
+    if table_id not in self.tables:
+      raise Error(f'Table {table_id} not found.')
+    table = self.tables[table_id]
+    if row_filter:
+      table = table.filter(_parse_row_filter(row_filter, table.schema))
+    if columns:
+      table = table.select(columns)
+    stream_count = max(1, min(max_streams, table.num_rows))
+    rows_per_stream = -(-table.num_rows // stream_count)
+    stream_names = []
+    with self._lock:
+      for index in range(stream_count):
+        stream_name = f'{table_id}/streams/{next(self._stream_numbers)}'
+        self._streams[stream_name] = table.slice(index * rows_per_stream,
+                                                 rows_per_stream)
+        stream_names.append(stream_name)
+    return ReadSession(table.schema, stream_names)
+
+  def read_stream(self, session: ReadSession,
+                  stream: str) -> Iterator[pyarrow.RecordBatch]:
+    with self._lock:
+      table = self._streams.pop(stream)
+    for batch in table.to_batches(max_chunksize=self.batch_size):
+      yield batch
+
+
+def _split_table_id(table_id: str) -> Sequence[str]:
+  """Splits a 'project.dataset.table' id into its three parts.
+
+  Args:
+    table_id: Fully qualified table id.
+
+  Returns:
+    The project id, dataset id and table name.
+
+  Raises:
+    Error: If the table id is not fully qualified.
+  """
+  parts = table_id.split('.')
+  if len(parts) != 3:
+    raise Error(f'Invalid table id "{table_id}". The table id should be in '
+                'the form of "project.dataset.table".')
+  return parts
+
+
+def _parse_row_filter(row_filter: str,
+                      schema: pyarrow.Schema) -> compute.Expression:
+  """Converts a row filter into an Arrow expression for the fake backend.
+
+  Args:
+    row_filter: Comparisons of a column with a literal joined with AND.
+    schema: Schema of the filtered table, used to cast the literals.
+
+  Returns:
+    The Arrow filter expression.
+
+  Raises:
+    Error: If the row filter is not supported.
+  """
+  operators = {
+      '=': lambda field, value: field == value,
+      '!=': lambda field, value: field != value,
+      '<>': lambda field, value: field != value,
+      '<': lambda field, value: field < value,
+      '<=': lambda field, value: field <= value,
+      '>': lambda field, value: field > value,
+      '>=': lambda field, value: field >= value,
+  }
+  expression = None
+  for comparison in re.split(r'\s+AND\s+', row_filter, flags=re.IGNORECASE):
+    match = _COMPARISON_REGEX.match(comparison)
+    if not match:
+      raise Error(f'Unsupported row filter "{comparison}".')
+    column = match.group('column')
+    if column not in schema.names:
+      raise Error(f'Unknown column "{column}" in row filter.')
+    raw_value = match.group('value')
+    if raw_value[0] in ('\'', '"'):
+      value = raw_value[1:-1]
+    elif raw_value.upper() in ('TRUE', 'FALSE'):
+      value = raw_value.upper() == 'TRUE'
+    else:
+      value = float(raw_value) if '.' in raw_value else int(raw_value)
+    scalar = pyarrow.scalar(value).cast(schema.field(column).type)
+    condition = operators[match.group('operator')](compute.field(column),
+                                                   scalar)
+    expression = condition if expression is None else expression & condition
+  return expression
+
+
+def _read_session_batches(
+    backend: ReadSessionBackend, session: ReadSession,
+    table_id: str) -> Iterator[pyarrow.RecordBatch]:
+  """Streams the record batches of all the streams of a read session.
+
+  The streams are read in parallel. At most `_BATCHES_PER_STREAM_BUFFER`
+  batches per stream are buffered, hence the memory used is bounded by the
+  batch size rather than by the table size. The order of the batches is not
+  deterministic.
+
+  Args:
+    backend: Backend serving the read session.
+    session: The read session.
+    table_id: Fully qualified table id, used in the logs and errors.
+
+  Yields:
+    Record batches of the table.
+
+  Raises:
+    Error: If reading one of the streams failed.
+  """
+  logging.info('Reading %s with %d streams.', table_id, len(session.streams))
+  if not session.streams:
+    return
+  batches = queue.Queue(maxsize=_BATCHES_PER_STREAM_BUFFER *
+                        len(session.streams))
+  cancelled = threading.Event()
+  end_of_stream = object()
+
+  def read_stream(stream: str) -> None:
+    try:
+      for batch in backend.read_stream(session, stream):
+        if cancelled.is_set():
+          return
+        batches.put(batch)
+    finally:
+      batches.put(end_of_stream)
+
+  executor = concurrent.futures.ThreadPoolExecutor(
+      max_workers=len(session.streams))
+  futures = [
+      executor.submit(read_stream, stream) for stream in session.streams
+  ]
+  try:
+    remaining_streams = len(session.streams)
+    while remaining_streams:
+      batch = batches.get()
+      if batch is end_of_stream:
+        remaining_streams -= 1
+        continue
+      yield batch
+    for future in futures:
+      if future.exception():
+        raise Error(f'Error while reading {table_id}.') from future.exception()
+  finally:
+    cancelled.set()
+    # Unblock readers waiting on a full queue when the consumer stops early.
+    while not all(future.done() for future in futures):
+      try:
+        batches.get(timeout=0.1)
+      except queue.Empty:
+        pass
+    executor.shutdown()
+
+
+def read_table_batches(
+    table_id: str,
+    columns: Optional[List[str]] = None,
+    row_filter: Optional[str] = None,
+    max_streams: int = _DEFAULT_MAX_STREAMS,
+    backend: Optional[ReadSessionBackend] = None
+) -> Iterator[pyarrow.RecordBatch]:
+  """Streams a table as Arrow record batches.
+
+  The streams of the read session are read in parallel with a bounded buffer,
+  and the order of the batches is not deterministic.
+
+  Args:
+    table_id: Fully qualified table id, e.g. 'project.dataset.table'.
+    columns: Optional. Columns to read. All columns are read if not set.
+    row_filter: Optional. SQL predicate that the returned rows satisfy, e.g.
+      "target_country = 'US'".
+    max_streams: Maximum number of streams read in parallel.
+    backend: Optional. Backend serving the read session. The Storage Read API
+      billed to the project of `table_id` is used if not set.
+
+  Yields:
+    Record batches of the table.
+
+  Raises:
+    Error: If reading one of the streams failed.
+  """
+  if backend is None:
+    backend = BigQueryReadSessionBackend(_split_table_id(table_id)[0])
+  session = backend.create_read_session(table_id, columns, row_filter,
+                                        max_streams)
+  yield from _read_session_batches(backend, session, table_id)
+
+
+def read_table(table_id: str,
+               columns: Optional[List[str]] = None,
+               row_filter: Optional[str] = None,
+               max_streams: int = _DEFAULT_MAX_STREAMS,
+               backend: Optional[ReadSessionBackend] = None) -> pyarrow.Table:
+  """Reads a table into memory as an Arrow table.
+
+  Args:
+    table_id: Fully qualified table id, e.g. 'project.dataset.table'.
+    columns: Optional. Columns to read. All columns are read if not set.
+    row_filter: Optional. SQL predicate that the returned rows satisfy.
+    max_streams: Maximum number of streams read in parallel.
+    backend: Optional. Backend serving the read session.
+
+  Returns:
+    The Arrow table, empty with the schema of the read columns if no row is
+    read.
+  """
+  if backend is None:
+    backend = BigQueryReadSessionBackend(_split_table_id(table_id)[0])
+  session = backend.create_read_session(table_id, columns, row_filter,
+                                        max_streams)
+  return pyarrow.Table.from_batches(
+      list(_read_session_batches(backend, session, table_id)),
+      schema=session.schema)
+
+
+def export_table(table_id: str,
+                 destination_path: str,
+                 file_format: str = PARQUET_FORMAT,
+                 columns: Optional[List[str]] = None,
+                 row_filter: Optional[str] = None,
+                 max_streams: int = _DEFAULT_MAX_STREAMS,
+                 backend: Optional[ReadSessionBackend] = None) -> int:
+  """Streams a table into a local Parquet or Arrow IPC file.
+
+  The record batches are written as they arrive, hence the table is never
+  fully loaded in memory. An empty table is exported as an empty file with
+  the schema of the exported columns.
+
+  Args:
+    table_id: Fully qualified table id, e.g. 'project.dataset.table'.
+    destination_path: Path of the file to be written.
+    file_format: Either 'parquet' or 'arrow' (Arrow IPC file format).
+    columns: Optional. Columns to export. All columns are exported if not set.
+    row_filter: Optional. SQL predicate that the exported rows satisfy.
+    max_streams: Maximum number of streams read in parallel.
+    backend: Optional. Backend serving the read session.
+
+  Returns:
+    Number of rows written.
+
+  Raises:
+    Error: If the file format is not supported.
+  """
+  if file_format not in _FILE_FORMATS:
+    raise Error(f'Unsupported file format "{file_format}". Allowed values - '
+                f'{", ".join(_FILE_FORMATS)}.')
+  if backend is None:
+    backend = BigQueryReadSessionBackend(_split_table_id(table_id)[0])
+  session = backend.create_read_session(table_id, columns, row_filter,
+                                        max_streams)
+  if file_format == PARQUET_FORMAT:
+    writer = parquet.ParquetWriter(destination_path, session.schema)
+    write_batch = writer.write_batch
+  else:
+    writer = ipc.new_file(destination_path, session.schema)
+    write_batch = writer.write
+  row_count = 0
+  try:
+    for batch in _read_session_batches(backend, session, table_id):
+      write_batch(batch)
+      row_count += batch.num_rows
+  finally:
+    writer.close()
+  logging.info('Exported %d rows of %s to %s.', row_count, table_id,
+               destination_path)
+  return row_count
+
+
+def parse_arguments() -> argparse.Namespace:
+  """Initialize command line parser using argparse.
+
+  Returns:
+    An argparse.ArgumentParser.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--table_id',
+      help='Fully qualified table id, e.g. project.markup.'
+      'product_detailed_materialized.',
+      required=True)
+  parser.add_argument(
+      '--output', help='Path of the exported file.', required=True)
+  parser.add_argument(
+      '--format',
+      help='Exported file format.',
+      choices=_FILE_FORMATS,
+      default=PARQUET_FORMAT)
+  parser.add_argument(
+      '--columns',
+      help='Comma separated list of columns to export.',
+      default=None)
+  parser.add_argument(
+      '--row_filter',
+      help='SQL predicate that the exported rows satisfy.',
+      default=None)
+  parser.add_argument(
+      '--max_streams',
+      help='Maximum number of streams read in parallel.',
+      type=int,
+      default=_DEFAULT_MAX_STREAMS)
+  return parser.parse_args()
+
+
+def main():
+  args = parse_arguments()
+  columns = args.columns.split(',') if args.columns else None
+  export_table(args.table_id, args.output, args.format, columns,
+               args.row_filter, args.max_streams)
+
+
+if __name__ == '__main__':
+  main()
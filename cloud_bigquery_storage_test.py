@@ -0,0 +1,161 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Tests for cloud_bigquery_storage."""
+
+import os
+import tempfile
+import unittest
+
+import cloud_bigquery_storage
+import pyarrow
+from pyarrow import ipc
+from pyarrow import parquet
+
+_TABLE_ID = 'project.markup.product_detailed_materialized'
+
+
+def _new_table(row_count: int) -> pyarrow.Table:
+  return pyarrow.table({
+      'unique_product_id': [f'product_{index}' for index in range(row_count)],
+      'target_country': [
+          'US' if index % 2 else 'FR' for index in range(row_count)
+      ],
+      'impressions': list(range(row_count)),
+  })
+
+
+class ReadSessionBackendTest(unittest.TestCase):
+
+  def test_incomplete_backend_cannot_be_instantiated(self):
+
+    class IncompleteBackend(cloud_bigquery_storage.ReadSessionBackend):
+
+      def create_read_session(self, table_id, columns, row_filter,
+                              max_streams):
+        return cloud_bigquery_storage.ReadSession(None, [])
+
+    with self.assertRaises(TypeError):
+      IncompleteBackend()
+
+
+class FakeReadSessionBackendTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.table = _new_table(10)
+    self.backend = cloud_bigquery_storage.FakeReadSessionBackend(
+        {_TABLE_ID: self.table}, batch_size=3)
+
+  def test_create_read_session_splits_rows_across_streams(self):
+    session = self.backend.create_read_session(_TABLE_ID, None, None, 4)
+
+    self.assertEqual(len(session.streams), 4)
+    row_count = sum(
+        batch.num_rows
+        for stream in session.streams
+        for batch in self.backend.read_stream(session, stream))
+    self.assertEqual(row_count, 10)
+
+  def test_stream_names_are_unique_after_streams_are_read(self):
+    first_session = self.backend.create_read_session(_TABLE_ID, None, None, 3)
+    list(self.backend.read_stream(first_session, first_session.streams[0]))
+    second_session = self.backend.create_read_session(_TABLE_ID, None, None, 3)
+
+    self.assertFalse(
+        set(first_session.streams).intersection(second_session.streams))
+    for session in (first_session, second_session):
+      for stream in session.streams[1:]:
+        self.assertTrue(list(self.backend.read_stream(session, stream)))
+
+  def test_create_read_session_fails_for_unknown_table(self):
+    with self.assertRaises(cloud_bigquery_storage.Error):
+      self.backend.create_read_session('project.markup.unknown', None, None, 1)
+
+  def test_create_read_session_fails_for_unsupported_row_filter(self):
+    with self.assertRaises(cloud_bigquery_storage.Error):
+      self.backend.create_read_session(_TABLE_ID, None,
+                                       "target_country LIKE 'U%'", 1)
+
+  def test_read_table_applies_columns_and_row_filter(self):
+    table = cloud_bigquery_storage.read_table(
+        _TABLE_ID,
+        columns=['unique_product_id', 'impressions'],
+        row_filter="target_country = 'US' AND impressions >= 5",
+        backend=self.backend)
+
+    self.assertEqual(table.column_names, ['unique_product_id', 'impressions'])
+    self.assertCountEqual(table['impressions'].to_pylist(), [5, 7, 9])
+
+  def test_read_table_returns_empty_table_with_schema(self):
+    table = cloud_bigquery_storage.read_table(
+        _TABLE_ID,
+        columns=['unique_product_id'],
+        row_filter="target_country = 'DE'",
+        backend=self.backend)
+
+    self.assertEqual(table.num_rows, 0)
+    self.assertEqual(table.column_names, ['unique_product_id'])
+    self.assertFalse(self.backend._streams)
+
+  def test_read_table_batches_stops_early(self):
+    batches = cloud_bigquery_storage.read_table_batches(
+        _TABLE_ID, max_streams=2, backend=self.backend)
+
+    self.assertEqual(next(batches).num_rows, 3)
+    batches.close()
+    self.assertFalse(self.backend._streams)
+
+  def test_export_table(self):
+    with tempfile.TemporaryDirectory() as directory:
+      parquet_path = os.path.join(directory, 'table.parquet')
+      arrow_path = os.path.join(directory, 'table.arrow')
+
+      parquet_rows = cloud_bigquery_storage.export_table(
+          _TABLE_ID, parquet_path, backend=self.backend)
+      arrow_rows = cloud_bigquery_storage.export_table(
+          _TABLE_ID,
+          arrow_path,
+          cloud_bigquery_storage.ARROW_FORMAT,
+          backend=self.backend)
+
+      self.assertEqual(parquet_rows, 10)
+      self.assertEqual(arrow_rows, 10)
+      self.assertCountEqual(
+          parquet.read_table(parquet_path)['unique_product_id'].to_pylist(),
+          self.table['unique_product_id'].to_pylist())
+      with ipc.open_file(arrow_path) as reader:
+        self.assertEqual(reader.read_all().num_rows, 10)
+
+  def test_export_table_writes_empty_file_with_schema(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, 'table.parquet')
+
+      row_count = cloud_bigquery_storage.export_table(
+          _TABLE_ID,
+          path,
+          columns=['target_country'],
+          row_filter="target_country = 'DE'",
+          backend=self.backend)
+
+      self.assertEqual(row_count, 0)
+      self.assertEqual(parquet.read_table(path).column_names,
+                       ['target_country'])
+      self.assertFalse(self.backend._streams)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,85 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Tests for cloud_bigquery."""
+
+import unittest
+from unittest import mock
+
+import cloud_bigquery
+import config_parser
+
+_RESERVATION = 'projects/admin/locations/US/reservations/markup'
+_DECLARE_SCRIPT = """-- Copyright notice.
+DECLARE run_date DATE DEFAULT CURRENT_DATE();
+DECLARE days INT64 DEFAULT 7;
+
+-- Deletes the old rows.
+DELETE FROM `project.markup.table` WHERE data_date < run_date - days;
+"""
+
+
+def _get_job_policy(stage: str) -> config_parser.JobPolicy:
+  del stage  # Unused.
+  return config_parser.JobPolicy(
+      priority='BATCH',
+      labels={'solution': 'markup'},
+      reservation=_RESERVATION,
+      timeout_seconds=None,
+      maximum_bytes_billed=None)
+
+
+@mock.patch.object(config_parser, 'get_job_policy', _get_job_policy)
+@mock.patch.object(config_parser, 'get_dataset_location', lambda: 'US')
+class ExecuteQueriesTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.client = mock.Mock()
+    wait_for_job = mock.patch.object(cloud_bigquery, 'wait_for_job')
+    wait_for_job.start()
+    self.addCleanup(wait_for_job.stop)
+    configure_sql = mock.patch.object(
+        cloud_bigquery, 'configure_sql', return_value=_DECLARE_SCRIPT)
+    configure_sql.start()
+    self.addCleanup(configure_sql.stop)
+
+  def _execute_queries(self):
+    cloud_bigquery.execute_queries('project', 'markup', '1234', '5678', False,
+                                   client=self.client)
+    return self.client.query.call_args_list
+
+  def test_reservation_is_set_after_the_declarations(self):
+    for query_call in self._execute_queries():
+      query = query_call.args[0]
+      reservation_index = query.index(f"SET @@reservation = '{_RESERVATION}';")
+      self.assertTrue(query.startswith('-- Copyright notice.\nDECLARE'))
+      self.assertGreater(reservation_index,
+                         query.index('DECLARE days INT64 DEFAULT 7;'))
+      self.assertLess(reservation_index, query.index('DELETE FROM'))
+
+  def test_installer_jobs_run_with_interactive_priority(self):
+    for query_call in self._execute_queries():
+      self.assertEqual(query_call.kwargs['job_config'].priority, 'INTERACTIVE')
+
+  def test_workflow_stages_keep_their_priority(self):
+    configuration = cloud_bigquery.get_job_configuration('product_detailed')
+
+    self.assertEqual(configuration['query']['priority'], 'BATCH')
+
+
+if __name__ == '__main__':
+  unittest.main()
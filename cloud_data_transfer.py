@@ -19,7 +19,7 @@
 import datetime
 import logging
 import time
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Optional
 
 import auth
 import config_parser
@@ -55,14 +55,23 @@ class CloudDataTransferUtils(object):
     >>> data_transfer.create_merchant_center_transfer(12345, 'dataset_id')
   """
 
-  def __init__(self, project_id: str):
+  def __init__(
+      self,
+      project_id: str,
+      client: Optional[bigquery_datatransfer.DataTransferServiceClient] = None,
+      sleep: Callable[[float], None] = time.sleep):
     """Initialise new instance of CloudDataTransferUtils.
 
     Args:
       project_id: GCP project id.
+      client: Optional. Data transfer client, e.g. a fake_cloud client. A
+        client is created if not set.
+      sleep: Optional. Function sleeping between two checks of a transfer
+        run, e.g. the sleep of the fake_cloud clock.
     """
     self.project_id = project_id
-    self.client = bigquery_datatransfer.DataTransferServiceClient()
+    self.client = client or bigquery_datatransfer.DataTransferServiceClient()
+    self._sleep = sleep
 
   def wait_for_transfer_completion(self, transfer_config: Dict[str,
                                                                Any]) -> None:
@@ -105,7 +114,7 @@ class CloudDataTransferUtils(object):
       logging.info(
           'Transfer %s still in progress. Sleeping for %s seconds before '
           'checking again.', transfer_config_name, _SLEEP_SECONDS)
-      time.sleep(_SLEEP_SECONDS)
+      self._sleep(_SLEEP_SECONDS)
       poll_counter += 1
       if poll_counter >= _MAX_POLL_COUNTER:
         error_message = (f'Transfer {transfer_config_name} is taking too long'
@@ -189,11 +198,10 @@ class CloudDataTransferUtils(object):
           'skipping update.', transfer_config.display_name)
       return transfer_config
     new_transfer_config = bigquery_datatransfer.TransferConfig()
-    new_transfer_config.CopyFrom(transfer_config)
-    # Clear existing parameter values.
-    new_transfer_config.params.Clear()
-    for key, value in params.items():
-      new_transfer_config.params[key] = value
+    bigquery_datatransfer.TransferConfig.copy_from(new_transfer_config,
+                                                   transfer_config)
+    # Replace existing parameter values.
+    new_transfer_config.params = params
     # Only params field is updated.
     update_mask = {'paths': ['params']}
     new_transfer_config = self.client.update_transfer_config(
@@ -202,9 +210,46 @@ class CloudDataTransferUtils(object):
                  new_transfer_config.display_name)
     return new_transfer_config
 
+  def _update_transfer_settings(
+      self, transfer_config: bigquery_datatransfer.TransferConfig,
+      **settings: Any) -> bigquery_datatransfer.TransferConfig:
+    """Updates fields of an existing data transfer if they changed.
+
+    Args:
+      transfer_config: Data transfer configuration to update.
+      **settings: New values of the transfer config fields, e.g.
+        notification_pubsub_topic.
+
+    Returns:
+      Updated data transfer config.
+    """
+    changed_settings = {
+        field: value
+        for field, value in settings.items()
+        if getattr(transfer_config, field) != value
+    }
+    if not changed_settings:
+      return transfer_config
+    new_transfer_config = bigquery_datatransfer.TransferConfig()
+    bigquery_datatransfer.TransferConfig.copy_from(new_transfer_config,
+                                                   transfer_config)
+    for field, value in changed_settings.items():
+      setattr(new_transfer_config, field, value)
+    update_mask = {'paths': list(changed_settings)}
+    new_transfer_config = self.client.update_transfer_config(
+        new_transfer_config, update_mask)
+    logging.info('The data transfer config "%s" %s updated.',
+                 new_transfer_config.display_name,
+                 ', '.join(changed_settings))
+    return new_transfer_config
+
   def create_merchant_center_transfer(
-      self, merchant_id: str, destination_dataset: str,
-      enable_market_insights: bool) -> bigquery_datatransfer.TransferConfig:
+      self,
+      merchant_id: str,
+      destination_dataset: str,
+      enable_market_insights: bool,
+      notification_pubsub_topic: Optional[str] = None
+  ) -> bigquery_datatransfer.TransferConfig:
     """Creates a new merchant center transfer.
 
     Merchant center allows retailers to store product info into Google. This
@@ -214,6 +259,9 @@ class CloudDataTransferUtils(object):
       merchant_id: Google Merchant Center(GMC) account id.
       destination_dataset: BigQuery dataset id.
       enable_market_insights: Whether to deploy market insights solution.
+      notification_pubsub_topic: Optional. Pub/Sub topic, in the form of
+        'projects/{project_id}/topics/{topic_id}', to which a message is
+        published when a transfer run finishes.
 
     Returns:
       Transfer config.
@@ -232,7 +280,13 @@ class CloudDataTransferUtils(object):
       logging.info(
           'Data transfer for merchant id %s to destination dataset %s '
           'already exists.', merchant_id, destination_dataset)
-      return self._update_existing_transfer(data_transfer_config, parameters)
+      data_transfer_config = self._update_existing_transfer(
+          data_transfer_config, parameters)
+      if notification_pubsub_topic:
+        data_transfer_config = self._update_transfer_settings(
+            data_transfer_config,
+            notification_pubsub_topic=notification_pubsub_topic)
+      return data_transfer_config
     logging.info(
         'Creating data transfer for merchant id %s to destination dataset %s',
         merchant_id, destination_dataset)
@@ -249,6 +303,8 @@ class CloudDataTransferUtils(object):
         'params': parameters,
         'data_refresh_window_days': 0,
     }
+    if notification_pubsub_topic:
+      input_config['notification_pubsub_topic'] = notification_pubsub_topic
     request = bigquery_datatransfer.CreateTransferConfigRequest(
         parent=parent,
         transfer_config=input_config,
@@ -264,7 +320,9 @@ class CloudDataTransferUtils(object):
       self,
       customer_id: str,
       destination_dataset: str,
-      backfill_days: int = 30) -> bigquery_datatransfer.TransferConfig:
+      backfill_days: int = 30,
+      notification_pubsub_topic: Optional[str] = None
+  ) -> bigquery_datatransfer.TransferConfig:
     """Creates a new Google Ads transfer.
 
     This method creates a data transfer config to copy Google Ads data to
@@ -274,6 +332,9 @@ class CloudDataTransferUtils(object):
       customer_id: Google Ads customer id.
       destination_dataset: BigQuery dataset id.
       backfill_days: Number of days to backfill.
+      notification_pubsub_topic: Optional. Pub/Sub topic, in the form of
+        'projects/{project_id}/topics/{topic_id}', to which a message is
+        published when a transfer run finishes.
 
     Returns:
       Transfer config.
@@ -289,6 +350,10 @@ class CloudDataTransferUtils(object):
       logging.info(
           'Data transfer for Google Ads customer id %s to destination dataset '
           '%s already exists.', customer_id, destination_dataset)
+      if notification_pubsub_topic:
+        data_transfer_config = self._update_transfer_settings(
+            data_transfer_config,
+            notification_pubsub_topic=notification_pubsub_topic)
       return data_transfer_config
     logging.info(
         'Creating data transfer for Google Ads customer id %s to destination '
@@ -306,6 +371,8 @@ class CloudDataTransferUtils(object):
         'params': parameters,
         'data_refresh_window_days': 1,
     }
+    if notification_pubsub_topic:
+      input_config['notification_pubsub_topic'] = notification_pubsub_topic
     request = bigquery_datatransfer.CreateTransferConfigRequest(
         parent=parent,
         transfer_config=input_config,
@@ -334,17 +401,25 @@ class CloudDataTransferUtils(object):
           end_time=end_time_pb)
     return transfer_config
 
-  def schedule_query(self, name: str,
-                     query_string: str) -> bigquery_datatransfer.TransferConfig:
+  def schedule_query(
+      self,
+      name: str,
+      query_string: str,
+      trigger_mode: bool = False) -> bigquery_datatransfer.TransferConfig:
     """Schedules query to run every day.
 
     Args:
       name: Name of the scheduled query.
       query_string: The query to be run.
+      trigger_mode: Optional. Whether the automatic daily runs are disabled, so
+        that the query only runs when it is started by `start_run`, e.g. by
+        the transfer_trigger module once its upstream transfers succeeded.
 
     Returns:
       Transfer config.
     """
+    schedule_options = bigquery_datatransfer.ScheduleOptions(
+        disable_auto_scheduling=trigger_mode)
     data_transfer_config = self._get_existing_transfer(
         'scheduled_query', name=name)
     parameters = struct_pb2.Struct()
@@ -354,6 +429,8 @@ class CloudDataTransferUtils(object):
                    name)
       updated_transfer_config = self._update_existing_transfer(
           data_transfer_config, parameters)
+      updated_transfer_config = self._update_transfer_settings(
+          updated_transfer_config, schedule_options=schedule_options)
       logging.info('Data transfer for scheduling query "%s" updated.', name)
       start_time_pb = timestamp_pb2.Timestamp()
       start_time = datetime.datetime.now(tz=pytz.utc)
@@ -374,6 +451,7 @@ class CloudDataTransferUtils(object):
         data_source_id='scheduled_query',
         params={'query': query_string},
         schedule='every 24 hours',
+        schedule_options=schedule_options,
     )
     request = bigquery_datatransfer.CreateTransferConfigRequest(
         parent=parent,
@@ -383,6 +461,23 @@ class CloudDataTransferUtils(object):
     transfer_config = self.client.create_transfer_config(request=request)
     return transfer_config
 
+  def start_run(self, transfer_config_name: str,
+                run_time: datetime.datetime) -> None:
+    """Starts a manual run of a data transfer.
+
+    Args:
+      transfer_config_name: Name of the transfer config, in the form of
+        'projects/{project_id}/locations/{location}/transferConfigs/{id}'.
+      run_time: Run time of the transfer. The @run_date parameter of scheduled
+        queries is the date of the run time.
+    """
+    run_time_pb = timestamp_pb2.Timestamp()
+    run_time_pb.FromDatetime(run_time)
+    self.client.start_manual_transfer_runs(
+        parent=transfer_config_name, requested_run_time=run_time_pb)
+    logging.info('Manual run of %s started for %s.', transfer_config_name,
+                 run_time.isoformat())
+
   def _get_data_source(self,
                        data_source_id: str) -> bigquery_datatransfer.DataSource:
     """Returns data source.
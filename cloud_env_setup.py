@@ -25,11 +25,16 @@ This module automates the following 4 steps:
 import argparse
 import logging
 import os
-from typing import Dict, Union
+import time
+from typing import Callable, Dict, Optional, Union
 
 import cloud_bigquery
 import cloud_data_transfer
 import config_parser
+import reference_data
+import transfer_trigger
+from google.cloud import bigquery
+from google.cloud import bigquery_datatransfer
 from google.cloud import exceptions
 from plugins.cloud_utils import cloud_api
 
@@ -41,20 +46,28 @@ logging.getLogger('googleapiclient.discovery').setLevel(logging.WARNING)
 _APIS_TO_BE_ENABLED = [
     'bigquery.googleapis.com', 'bigquerydatatransfer.googleapis.com'
 ]
+_TRIGGER_MODE_APIS = ['pubsub.googleapis.com']
 _DATASET_ID = 'markup'
+_TRIGGER_RULES_FILE = 'trigger_rules.json'
+_JOB_STATS_FILE = 'job_stats.jsonl'
 _MATERIALIZE_PRODUCT_DETAILED_SQL = 'scripts/materialize_product_detailed.sql'
 _MATERIALIZE_PRODUCT_HISTORICAL_SQL = (
     'scripts/materialize_product_historical.sql')
+_REFERENCE_DATA_DIR = 'data'
 
 
-def enable_apis(project_id: str) -> None:
+def enable_apis(project_id: str, trigger_mode: bool = False) -> None:
   """Enables list of cloud APIs for given cloud project.
 
   Args:
     project_id: A cloud project id.
+    trigger_mode: Whether the APIs required by the trigger mode are enabled.
   """
   cloud_api_utils = cloud_api.CloudApiUtils(project_id=project_id)
-  cloud_api_utils.enable_apis(_APIS_TO_BE_ENABLED)
+  apis = list(_APIS_TO_BE_ENABLED)
+  if trigger_mode:
+    apis.extend(_TRIGGER_MODE_APIS)
+  cloud_api_utils.enable_apis(apis)
 
 
 def parse_boolean(arg: str):
@@ -89,22 +102,61 @@ def parse_arguments() -> argparse.Namespace:
       help='Deploy Market Insights solution.',
       type=parse_boolean,
       required=True)
+  parser.add_argument(
+      '--trigger_mode',
+      help=('Start the workflows when the transfers of the day have succeeded '
+            'instead of every 24 hours.'),
+      type=parse_boolean,
+      default=False)
+  parser.add_argument(
+      '--dry_run',
+      help=('Only report the bytes the MarkUp queries of an existing '
+            'installation would process, without changing it.'),
+      type=parse_boolean,
+      default=False)
+  parser.add_argument(
+      '--job_stats_table',
+      help=('Append the statistics of the BigQuery jobs run by the install to '
+            f'the {cloud_bigquery.JOB_STATS_TABLE} table of the dataset.'),
+      type=parse_boolean,
+      default=False)
   return parser.parse_args()
 
 
-def main():
-  args = parse_arguments()
+def install(
+    args: argparse.Namespace,
+    bigquery_client: Optional[bigquery.Client] = None,
+    data_transfer_client: Optional[
+        bigquery_datatransfer.DataTransferServiceClient] = None,
+    sleep: Callable[[float], None] = time.sleep,
+    reference_data_dir: str = _REFERENCE_DATA_DIR) -> None:
+  """Creates the dataset, the transfers, the tables and views and workflows.
+
+  Args:
+    args: The parsed command line arguments.
+    bigquery_client: Optional. BigQuery client, e.g. a fake_cloud client. One
+      is created for the project if not set.
+    data_transfer_client: Optional. Data transfer client, e.g. a fake_cloud
+      client. One is created if not set.
+    sleep: Optional. Function sleeping between two checks of a transfer run.
+    reference_data_dir: Optional. Directory of the reference data files.
+  """
   ads_customer_id = args.ads_customer_id.replace('-', '')
-  data_transfer = cloud_data_transfer.CloudDataTransferUtils(args.project_id)
-  logging.info('Enabling APIs.')
-  enable_apis(args.project_id)
-  logging.info('Enabled APIs.')
+  data_transfer = cloud_data_transfer.CloudDataTransferUtils(
+      args.project_id, client=data_transfer_client, sleep=sleep)
   logging.info('Creating %s dataset.', args.dataset_id)
-  cloud_bigquery.create_dataset_if_not_exists(args.project_id, args.dataset_id)
+  cloud_bigquery.create_dataset_if_not_exists(
+      args.project_id, args.dataset_id, client=bigquery_client)
+  notification_topic = None
+  if args.trigger_mode:
+    notification_topic = transfer_trigger.setup_notifications(args.project_id)
   merchant_center_config = data_transfer.create_merchant_center_transfer(
-      args.merchant_id, args.dataset_id, args.market_insights)
-  ads_config = data_transfer.create_google_ads_transfer(ads_customer_id,
-                                                        args.dataset_id)
+      args.merchant_id, args.dataset_id, args.market_insights,
+      notification_pubsub_topic=notification_topic)
+  ads_config = data_transfer.create_google_ads_transfer(
+      ads_customer_id,
+      args.dataset_id,
+      notification_pubsub_topic=notification_topic)
   try:
     logging.info('Checking the GMC data transfer status.')
     data_transfer.wait_for_transfer_completion(merchant_center_config)
@@ -117,30 +169,77 @@ def main():
   logging.info('Checking the Google Ads data transfer status.')
   data_transfer.wait_for_transfer_completion(ads_config)
   logging.info('The Google Ads data have been successfully transferred.')
-  cloud_bigquery.load_language_codes(args.project_id, args.dataset_id)
-  cloud_bigquery.load_geo_targets(args.project_id, args.dataset_id)
+  reference_data.load_reference_data(
+      args.project_id,
+      args.dataset_id,
+      reference_data_dir,
+      client=bigquery_client)
   logging.info('Creating MarkUp specific views.')
-  cloud_bigquery.execute_queries(args.project_id, args.dataset_id,
-                                 args.merchant_id, ads_customer_id,
-                                 args.market_insights)
+  cloud_bigquery.execute_queries(
+      args.project_id,
+      args.dataset_id,
+      args.merchant_id,
+      ads_customer_id,
+      args.market_insights,
+      client=bigquery_client)
   logging.info('Created MarkUp specific views.')
   logging.info('Updating targeted products')
   query = cloud_bigquery.get_main_workflow_sql(args.project_id, args.dataset_id,
                                                args.merchant_id,
                                                ads_customer_id)
-  data_transfer.schedule_query(
-      f'Main workflow - {args.dataset_id} - {ads_customer_id}', query)
+  main_workflow_config = data_transfer.schedule_query(
+      f'Main workflow - {args.dataset_id} - {ads_customer_id}', query,
+      args.trigger_mode)
   logging.info('Job created to run markup main workflow.')
+  trigger_rules = [
+      transfer_trigger.TriggerRule(
+          main_workflow_config.name,
+          [merchant_center_config.name, ads_config.name])
+  ]
   if args.market_insights:
     logging.info('Market insights requested, creating scheduled query')
     best_sellers_query = cloud_bigquery.get_best_sellers_workflow_sql(
         args.project_id, args.dataset_id, args.merchant_id)
-    data_transfer.schedule_query(
+    best_sellers_config = data_transfer.schedule_query(
         f'Best sellers workflow - {args.dataset_id} - {args.merchant_id}',
-        best_sellers_query)
+        best_sellers_query, args.trigger_mode)
     logging.info('Job created to run best sellers workflow.')
+    trigger_rules.append(
+        transfer_trigger.TriggerRule(best_sellers_config.name,
+                                     [merchant_center_config.name]))
+  if args.trigger_mode:
+    transfer_trigger.save_rules(trigger_rules, _TRIGGER_RULES_FILE)
+    logging.info(
+        'Trigger rules saved to %s. Run "python transfer_trigger.py '
+        '--project_id=%s" to start the workflows when the transfers finish.',
+        _TRIGGER_RULES_FILE, args.project_id)
+  job_stats = cloud_bigquery.get_job_stats()
+  logging.info('BigQuery jobs (also appended to %s):\n%s', _JOB_STATS_FILE,
+               cloud_bigquery.format_job_stats(job_stats))
+  if args.job_stats_table:
+    cloud_bigquery.write_job_stats_table(
+        args.project_id, args.dataset_id, job_stats, client=bigquery_client)
   logging.info('MarkUp installation is complete!')
 
 
+def main():
+  args = parse_arguments()
+  ads_customer_id = args.ads_customer_id.replace('-', '')
+  if args.dry_run:
+    estimates = cloud_bigquery.estimate_queries(args.project_id,
+                                                args.dataset_id,
+                                                args.merchant_id,
+                                                ads_customer_id,
+                                                args.market_insights)
+    logging.info('Estimated bytes processed:\n%s',
+                 cloud_bigquery.format_estimates(estimates))
+    return
+  cloud_bigquery.set_job_stats_file(_JOB_STATS_FILE)
+  logging.info('Enabling APIs.')
+  enable_apis(args.project_id, args.trigger_mode)
+  logging.info('Enabled APIs.')
+  install(args)
+
+
 if __name__ == '__main__':
   main()
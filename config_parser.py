@@ -19,9 +19,18 @@
 This module retrieves config values.
 """
 
+import collections
 import functools
+from typing import Optional
+
 import yaml
 
+# Settings of the BigQuery jobs of a stage, see JOB_POLICY in config.yaml.
+JobPolicy = collections.namedtuple('JobPolicy', [
+    'priority', 'labels', 'reservation', 'timeout_seconds',
+    'maximum_bytes_billed'
+])
+
 
 @functools.lru_cache()
 def _get_config(config_key: str) -> str:
@@ -46,3 +55,34 @@ def _get_config(config_key: str) -> str:
 def get_dataset_location() -> str:
   """Returns the dataset location."""
   return _get_config('LOCATION')
+
+
+def get_maximum_bytes_billed() -> Optional[int]:
+  """Returns the maximum bytes billed by a query, None if not limited."""
+  maximum_bytes_billed = _get_config('MAXIMUM_BYTES_BILLED')
+  return int(maximum_bytes_billed) if maximum_bytes_billed else None
+
+
+def get_job_policy(stage: str) -> JobPolicy:
+  """Returns the settings of the BigQuery jobs of a stage.
+
+  Args:
+    stage: Name of the installation script, workflow or workflow stage.
+
+  Returns:
+    The default policy overridden by the policy of the stage.
+  """
+  job_policies = _get_config('JOB_POLICY')
+  policy = dict(job_policies.get('default') or {})
+  stage_policy = (job_policies.get('stages') or {}).get(stage) or {}
+  labels = dict(policy.get('labels') or {})
+  labels.update(stage_policy.get('labels') or {})
+  policy.update(stage_policy)
+  maximum_bytes_billed = policy.get('maximum_bytes_billed')
+  return JobPolicy(
+      priority=policy.get('priority', 'INTERACTIVE').upper(),
+      labels=labels,
+      reservation=policy.get('reservation'),
+      timeout_seconds=policy.get('timeout_seconds'),
+      maximum_bytes_billed=(int(maximum_bytes_billed) if maximum_bytes_billed
+                            else get_maximum_bytes_billed()))
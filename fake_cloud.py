@@ -0,0 +1,625 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""In-memory fakes of the BigQuery and Data Transfer clients.
+
+The fakes keep the datasets, tables, jobs, transfer configs and transfer runs
+of a project in memory, so that the installer can be run and timed without a
+GCP project. Each API call, job and transfer run takes a duration drawn from
+a log-normal distribution around the median durations of a `ServiceProfile`,
+and fails with the probability of the profile.
+
+The durations are simulated by a `FakeClock`. By default its time is virtual:
+sleeping threads wake in the order of their simulated wake up times without
+sleeping for real, so concurrent calls overlap as they would in the cloud and
+local processing, e.g. rendering the scripts, takes no simulated time. With a
+time scale, simulated seconds are instead slept as real seconds multiplied by
+the time scale, and local processing is scaled up by its inverse.
+
+The queries are not run: the tables and views they create, recognized by
+their "CREATE OR REPLACE" statements, are added to the dataset.
+
+Typical usage example:
+  >>> clock = FakeClock()
+  >>> bigquery_client = FakeBigQueryClient('project_id', clock, seed=1)
+  >>> data_transfer_client = FakeDataTransferServiceClient(clock, seed=1)
+  >>> cloud_env_setup.install(args, bigquery_client, data_transfer_client,
+  ...                         sleep=clock.sleep)
+"""
+
+import collections
+import datetime
+import heapq
+import io
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+from google.api_core import exceptions
+from google.cloud import bigquery
+from google.cloud import bigquery_datatransfer
+from pyarrow import parquet
+
+_PENDING_STATE = 2
+_RUNNING_STATE = 3
+_SUCCESS_STATE = 4
+_FAILED_STATE = 5
+_INTERNAL_ERROR_CODE = 13
+# Real seconds a virtual sleep waits for other running threads to sleep.
+_VIRTUAL_GRACE_SECONDS = 0.005
+# Data sources whose runs are transfers, the others being scheduled queries.
+_TRANSFER_DATA_SOURCES = ('merchant_center', 'adwords')
+_CREATED_OBJECT_REGEX = re.compile(
+    r'CREATE\s+OR\s+REPLACE\s+(TABLE|VIEW)\s+`?([\w.-]+)`?', re.IGNORECASE)
+
+# Median durations in seconds and failure probabilities of the fake services.
+# The durations are drawn from log-normal distributions of shape `sigma`.
+ServiceProfile = collections.namedtuple(
+    'ServiceProfile', [
+        'call_seconds', 'job_seconds', 'transfer_seconds', 'sigma',
+        'call_failure_rate', 'job_failure_rate', 'transfer_failure_rate'
+    ],
+    defaults=[0.3, 8.0, 900.0, 0.5, 0.0, 0.0, 0.0])
+
+
+class Error(Exception):
+  """Base error for this module."""
+
+
+class FakeClock(object):
+  """Simulated clock, virtual or sleeping a fraction of the simulated durations.
+
+  The virtual time is shared by the threads. A sleeping thread wakes once it
+  is the next one to wake and the other threads are sleeping too, or have not
+  slept for `_VIRTUAL_GRACE_SECONDS`, e.g. as they wait for futures.
+
+  Typical usage example:
+    >>> clock = FakeClock()
+    >>> clock.sleep(60)  # Returns at once.
+    >>> clock.now()
+    60.0
+    >>> clock = FakeClock(time_scale=0.01)
+    >>> clock.sleep(60)  # Sleeps 0.6 seconds.
+  """
+
+  def __init__(self,
+               time_scale: Optional[float] = None,
+               start: Optional[datetime.datetime] = None) -> None:
+    """Initialise new instance of FakeClock.
+
+    Args:
+      time_scale: Optional. Real seconds slept per simulated second. The time
+        is virtual and sleeping returns at once if not set.
+      start: Optional. Simulated date and time at creation, now if not set.
+    """
+    self.time_scale = time_scale
+    self._start = start or datetime.datetime.now(tz=datetime.timezone.utc)
+    self._monotonic_start = time.monotonic()
+    self._virtual_seconds = 0.0
+    # Wake up seconds and numbers of the sleeping threads.
+    self._sleepers = []
+    self._sleeper_numbers = itertools.count()
+    self._last_change = time.monotonic()
+    self._condition = threading.Condition()
+
+  def now(self) -> float:
+    """Returns the simulated seconds since the creation of the clock."""
+    if self.time_scale is None:
+      with self._condition:
+        return self._virtual_seconds
+    return (time.monotonic() - self._monotonic_start) / self.time_scale
+
+  def datetime(self, seconds: Optional[float] = None) -> datetime.datetime:
+    """Returns the simulated date and time of simulated seconds, now if None."""
+    if seconds is None:
+      seconds = self.now()
+    return self._start + datetime.timedelta(seconds=seconds)
+
+  def _sleep_virtual(self, seconds: float) -> None:
+    """Waits until the thread is the next one to wake, then advances to it."""
+    with self._condition:
+      sleeper = (self._virtual_seconds + seconds, next(self._sleeper_numbers))
+      heapq.heappush(self._sleepers, sleeper)
+      self._last_change = time.monotonic()
+      self._condition.notify_all()
+      while True:
+        if self._sleepers[0] == sleeper:
+          idle_seconds = time.monotonic() - self._last_change
+          # Other threads may still be running and about to sleep.
+          if (len(self._sleepers) >= threading.active_count() or
+              idle_seconds >= _VIRTUAL_GRACE_SECONDS):
+            break
+          self._condition.wait(_VIRTUAL_GRACE_SECONDS - idle_seconds)
+        else:
+          self._condition.wait()
+      heapq.heappop(self._sleepers)
+      self._virtual_seconds = max(self._virtual_seconds, sleeper[0])
+      self._last_change = time.monotonic()
+      self._condition.notify_all()
+
+  def sleep(self, seconds: float) -> None:
+    """Sleeps simulated seconds."""
+    if seconds <= 0:
+      return
+    if self.time_scale is None:
+      self._sleep_virtual(seconds)
+    else:
+      time.sleep(seconds * self.time_scale)
+
+  def sleep_until(self, seconds: float) -> None:
+    """Sleeps until the simulated seconds since the creation of the clock."""
+    self.sleep(seconds - self.now())
+
+
+class _FakeService(object):
+  """Latency and failures shared by the fake clients."""
+
+  def __init__(self, clock: FakeClock, profile: ServiceProfile,
+               seed: Optional[int]) -> None:
+    self.clock = clock
+    self.profile = profile
+    # Number of calls of each method.
+    self.calls = collections.Counter()
+    self._lock = threading.RLock()
+    self._random = random.Random(seed)
+
+  def _sample_seconds(self, median_seconds: float) -> float:
+    with self._lock:
+      return self._random.lognormvariate(
+          math.log(median_seconds), self.profile.sigma)
+
+  def _sample_failure(self, failure_rate: float) -> bool:
+    with self._lock:
+      return self._random.random() < failure_rate
+
+  def _call(self, method: str) -> None:
+    """Counts a call, waits for its latency and fails it at the call rate.
+
+    Raises:
+      exceptions.ServiceUnavailable: If the call fails.
+    """
+    with self._lock:
+      self.calls[method] += 1
+    self.clock.sleep(self._sample_seconds(self.profile.call_seconds))
+    if self._sample_failure(self.profile.call_failure_rate):
+      raise exceptions.ServiceUnavailable(f'Fake {method} call failed.')
+
+
+class FakeJob(object):
+  """Query or load job of FakeBigQueryClient.
+
+  It has the attributes of the jobs read by the job statistics of
+  cloud_bigquery, set when the job ends.
+  """
+
+  def __init__(self,
+               clock: FakeClock,
+               job_id: str,
+               job_type: str,
+               location: Optional[str],
+               seconds: float,
+               failed: bool,
+               total_bytes_processed: int = 0,
+               output_rows: Optional[int] = None) -> None:
+    self.job_id = job_id
+    self.job_type = job_type
+    self.location = location
+    self.total_bytes_processed = total_bytes_processed
+    self.total_bytes_billed = total_bytes_processed
+    self.slot_millis = int(seconds * 1000)
+    self.cache_hit = False
+    self.output_rows = output_rows
+    self.num_dml_affected_rows = output_rows
+    self.error_result = None
+    self.started = None
+    self.ended = None
+    self._clock = clock
+    self._started_seconds = clock.now()
+    self._ended_seconds = self._started_seconds + seconds
+    self._failed = failed
+
+  def done(self) -> bool:
+    return self._clock.now() >= self._ended_seconds
+
+  def result(self) -> 'FakeJob':
+    """Waits for the job to end.
+
+    Raises:
+      exceptions.InternalServerError: If the job failed.
+    """
+    self._clock.sleep_until(self._ended_seconds)
+    self.started = self._clock.datetime(self._started_seconds)
+    self.ended = self._clock.datetime(self._ended_seconds)
+    if self._failed:
+      self.error_result = {
+          'reason': 'internalError',
+          'message': f'Fake job {self.job_id} failed.'
+      }
+      raise exceptions.InternalServerError(self.error_result['message'])
+    return self
+
+
+class FakeBigQueryClient(_FakeService):
+  """In-memory BigQuery client of a project.
+
+  Only the methods used by MarkUp are implemented. The dry run jobs return at
+  once, other jobs end after their simulated duration.
+
+  Typical usage example:
+    >>> client = FakeBigQueryClient('project_id', FakeClock())
+    >>> cloud_bigquery.create_dataset_if_not_exists('project_id', 'markup',
+    ...                                             client=client)
+  """
+
+  def __init__(self,
+               project: str,
+               clock: FakeClock,
+               profile: ServiceProfile = ServiceProfile(),
+               seed: Optional[int] = None) -> None:
+    """Initialise new instance of FakeBigQueryClient.
+
+    Args:
+      project: GCP project id.
+      clock: Simulated clock of the durations.
+      profile: Optional. Durations and failure rates of the calls and jobs.
+      seed: Optional. Seed of the durations and failures.
+    """
+    super().__init__(clock, profile, seed)
+    self.project = project
+    self.datasets = {}
+    self.tables = {}
+    self.jobs = []
+    self._job_ids = itertools.count(1)
+
+  def _get_dataset_id(self, dataset: Union[str, bigquery.Dataset,
+                                           bigquery.DatasetReference]) -> str:
+    if isinstance(dataset, str):
+      return dataset if '.' in dataset else f'{self.project}.{dataset}'
+    return f'{dataset.project}.{dataset.dataset_id}'
+
+  def _get_table_id(self, table: Union[str, bigquery.Table,
+                                       bigquery.TableReference]) -> str:
+    if isinstance(table, str):
+      return table if table.count('.') == 2 else f'{self.project}.{table}'
+    return f'{table.project}.{table.dataset_id}.{table.table_id}'
+
+  def _check_dataset(self, table_id: str) -> None:
+    dataset_id = table_id.rsplit('.', 1)[0]
+    if dataset_id not in self.datasets:
+      raise exceptions.NotFound(f'Not found: Dataset {dataset_id}')
+
+  def get_dataset(
+      self, dataset_ref: Union[str, bigquery.Dataset, bigquery.DatasetReference]
+  ) -> bigquery.Dataset:
+    self._call('get_dataset')
+    dataset_id = self._get_dataset_id(dataset_ref)
+    with self._lock:
+      if dataset_id not in self.datasets:
+        raise exceptions.NotFound(f'Not found: Dataset {dataset_id}')
+      return self.datasets[dataset_id]
+
+  def create_dataset(
+      self, dataset: Union[str, bigquery.Dataset]) -> bigquery.Dataset:
+    self._call('create_dataset')
+    dataset_id = self._get_dataset_id(dataset)
+    with self._lock:
+      if dataset_id in self.datasets:
+        raise exceptions.Conflict(f'Already Exists: Dataset {dataset_id}')
+      if isinstance(dataset, str):
+        dataset = bigquery.Dataset(dataset_id)
+      self.datasets[dataset_id] = dataset
+      return dataset
+
+  def get_table(
+      self, table: Union[str, bigquery.Table, bigquery.TableReference]
+  ) -> bigquery.Table:
+    self._call('get_table')
+    table_id = self._get_table_id(table)
+    with self._lock:
+      if table_id not in self.tables:
+        raise exceptions.NotFound(f'Not found: Table {table_id}')
+      return self.tables[table_id]
+
+  def update_table(self, table: bigquery.Table,
+                   fields: List[str]) -> bigquery.Table:
+    self._call('update_table')
+    table_id = self._get_table_id(table)
+    with self._lock:
+      if table_id not in self.tables:
+        raise exceptions.NotFound(f'Not found: Table {table_id}')
+      stored_table = self.tables[table_id]
+      for field in fields:
+        setattr(stored_table, field, getattr(table, field))
+      return stored_table
+
+  def delete_table(self,
+                   table: Union[str, bigquery.Table, bigquery.TableReference],
+                   not_found_ok: bool = False) -> None:
+    self._call('delete_table')
+    table_id = self._get_table_id(table)
+    with self._lock:
+      if table_id not in self.tables and not not_found_ok:
+        raise exceptions.NotFound(f'Not found: Table {table_id}')
+      self.tables.pop(table_id, None)
+
+  def _put_table(self, table_id: str, schema: Optional[List[Any]] = None,
+                 table_type: str = 'TABLE') -> None:
+    """Creates or replaces a table, keeping the labels of a replaced one."""
+    with self._lock:
+      table = bigquery.Table(table_id, schema=schema)
+      table._properties['type'] = table_type
+      if table_id in self.tables:
+        table.labels = self.tables[table_id].labels
+      self.tables[table_id] = table
+
+  def _start_job(self,
+                 job_type: str,
+                 location: Optional[str],
+                 job_config: Any,
+                 total_bytes_processed: int = 0,
+                 output_rows: Optional[int] = None) -> FakeJob:
+    seconds = self._sample_seconds(self.profile.job_seconds)
+    failed = self._sample_failure(self.profile.job_failure_rate)
+    timeout_ms = getattr(job_config, 'job_timeout_ms', None)
+    if timeout_ms and seconds * 1000 > int(timeout_ms):
+      seconds = int(timeout_ms) / 1000
+      failed = True
+    job = FakeJob(self.clock, f'fake_{job_type}_{next(self._job_ids)}',
+                  job_type, location, seconds, failed, total_bytes_processed,
+                  output_rows)
+    with self._lock:
+      self.jobs.append(job)
+    return job
+
+  def query(self,
+            query: str,
+            job_config: Optional[bigquery.QueryJobConfig] = None,
+            location: Optional[str] = None) -> FakeJob:
+    """Starts a query job, adding the tables and views it creates."""
+    self._call('query')
+    total_bytes_processed = len(query.encode('utf-8'))
+    if job_config and job_config.dry_run:
+      job = FakeJob(self.clock, 'fake_dry_run', 'query', location, 0, False,
+                    total_bytes_processed)
+      return job.result()
+    for object_type, object_id in _CREATED_OBJECT_REGEX.findall(query):
+      table_id = self._get_table_id(object_id)
+      if table_id.count('.') == 2:
+        self._check_dataset(table_id)
+        self._put_table(table_id, table_type=object_type.upper())
+    return self._start_job('query', location, job_config,
+                           total_bytes_processed)
+
+  def load_table_from_file(self,
+                           file_obj: io.IOBase,
+                           destination: Union[str, bigquery.Table,
+                                              bigquery.TableReference],
+                           job_config: Optional[
+                               bigquery.LoadJobConfig] = None,
+                           location: Optional[str] = None) -> FakeJob:
+    """Starts a load job of a Parquet file."""
+    self._call('load_table_from_file')
+    table_id = self._get_table_id(destination)
+    self._check_dataset(table_id)
+    num_rows = parquet.read_metadata(file_obj).num_rows
+    self._put_table(table_id, job_config.schema if job_config else None)
+    return self._start_job('load', location, job_config, output_rows=num_rows)
+
+  def load_table_from_json(self,
+                           json_rows: Iterable[Dict[str, Any]],
+                           destination: Union[str, bigquery.Table,
+                                              bigquery.TableReference],
+                           job_config: Optional[
+                               bigquery.LoadJobConfig] = None,
+                           location: Optional[str] = None) -> FakeJob:
+    """Starts a load job of rows, which must be JSON serializable."""
+    self._call('load_table_from_json')
+    table_id = self._get_table_id(destination)
+    self._check_dataset(table_id)
+    json_rows = list(json_rows)
+    json.dumps(json_rows)
+    with self._lock:
+      if table_id not in self.tables:
+        self._put_table(table_id, job_config.schema if job_config else None)
+    return self._start_job(
+        'load', location, job_config, output_rows=len(json_rows))
+
+
+def _get_request_field(request: Any, field: str) -> Any:
+  """Returns a field of a request given as a dict or a proto-plus message."""
+  if isinstance(request, dict):
+    return request.get(field)
+  return getattr(request, field)
+
+
+class FakeDataTransferServiceClient(_FakeService):
+  """In-memory Data Transfer client.
+
+  Creating a transfer config starts a run, unless its automatic scheduling is
+  disabled, and so do manual and backfill runs. A run is running until the end
+  of its simulated duration, then succeeded or failed. The state of a config
+  is the one of its latest run, and the runs are listed latest run time first.
+
+  Typical usage example:
+    >>> client = FakeDataTransferServiceClient(FakeClock())
+    >>> data_transfer = cloud_data_transfer.CloudDataTransferUtils(
+    ...     'project_id', client=client, sleep=client.clock.sleep)
+  """
+
+  def __init__(self,
+               clock: FakeClock,
+               profile: ServiceProfile = ServiceProfile(),
+               seed: Optional[int] = None,
+               has_valid_creds: bool = True) -> None:
+    """Initialise new instance of FakeDataTransferServiceClient.
+
+    Args:
+      clock: Simulated clock of the durations.
+      profile: Optional. Durations and failure rates of the calls and runs.
+      seed: Optional. Seed of the durations and failures.
+      has_valid_creds: Optional. Whether the credentials of the data sources
+        are valid, otherwise an authorization code is asked when a transfer
+        is created.
+    """
+    super().__init__(clock, profile, seed)
+    self.has_valid_creds = has_valid_creds
+    self.transfer_configs = collections.OrderedDict()
+    # Runs of each transfer config, with their simulated end and outcome.
+    self.transfer_runs = collections.defaultdict(list)
+    self._ids = itertools.count(1)
+
+  def _update_states(self, config_name: str) -> None:
+    """Ends the runs of a config whose duration elapsed."""
+    now = self.clock.now()
+    runs = self.transfer_runs[config_name]
+    for run, ended_seconds, failed in runs:
+      if run.state == _RUNNING_STATE and now >= ended_seconds:
+        run.end_time = self.clock.datetime(ended_seconds)
+        if failed:
+          run.state = _FAILED_STATE
+          run.error_status = {
+              'code': _INTERNAL_ERROR_CODE,
+              'message': f'Fake run {run.name} failed.'
+          }
+        else:
+          run.state = _SUCCESS_STATE
+    if runs:
+      latest_run = max(runs, key=lambda item: item[0].run_time)[0]
+      self.transfer_configs[config_name].state = latest_run.state
+
+  def _start_run(self, config_name: str,
+                 run_time: Optional[datetime.datetime] = None) -> None:
+    config = self.transfer_configs[config_name]
+    if config.data_source_id in _TRANSFER_DATA_SOURCES:
+      median_seconds = self.profile.transfer_seconds
+      failure_rate = self.profile.transfer_failure_rate
+    else:
+      median_seconds = self.profile.job_seconds
+      failure_rate = self.profile.job_failure_rate
+    now = self.clock.now()
+    run = bigquery_datatransfer.TransferRun(
+        name=f'{config_name}/runs/{next(self._ids)}',
+        data_source_id=config.data_source_id,
+        destination_dataset_id=config.destination_dataset_id,
+        schedule_time=self.clock.datetime(now),
+        run_time=run_time or self.clock.datetime(now),
+        start_time=self.clock.datetime(now),
+        state=_RUNNING_STATE)
+    self.transfer_runs[config_name].append(
+        (run, now + self._sample_seconds(median_seconds),
+         self._sample_failure(failure_rate)))
+    self._update_states(config_name)
+
+  def _get_config(self,
+                  config_name: str) -> bigquery_datatransfer.TransferConfig:
+    if config_name not in self.transfer_configs:
+      raise exceptions.NotFound(f'Not found: Transfer config {config_name}')
+    self._update_states(config_name)
+    return self.transfer_configs[config_name]
+
+  def list_transfer_configs(
+      self,
+      request: Any = None) -> List[bigquery_datatransfer.TransferConfig]:
+    self._call('list_transfer_configs')
+    parent = _get_request_field(request, 'parent')
+    with self._lock:
+      return [
+          bigquery_datatransfer.TransferConfig(self._get_config(name))
+          for name in self.transfer_configs
+          if name.startswith(parent + '/')
+      ]
+
+  def create_transfer_config(
+      self, request: Any = None) -> bigquery_datatransfer.TransferConfig:
+    self._call('create_transfer_config')
+    parent = _get_request_field(request, 'parent')
+    config = bigquery_datatransfer.TransferConfig(
+        _get_request_field(request, 'transfer_config'))
+    with self._lock:
+      config.name = f'{parent}/transferConfigs/{next(self._ids)}'
+      config.state = _PENDING_STATE
+      self.transfer_configs[config.name] = config
+      if not config.schedule_options.disable_auto_scheduling:
+        self._start_run(config.name)
+      return bigquery_datatransfer.TransferConfig(config)
+
+  def update_transfer_config(
+      self,
+      transfer_config: bigquery_datatransfer.TransferConfig,
+      update_mask: Dict[str, List[str]]
+  ) -> bigquery_datatransfer.TransferConfig:
+    self._call('update_transfer_config')
+    with self._lock:
+      config = self._get_config(transfer_config.name)
+      for path in update_mask['paths']:
+        setattr(config, path, getattr(transfer_config, path))
+      return bigquery_datatransfer.TransferConfig(config)
+
+  def list_transfer_runs(
+      self, request: Any = None) -> List[bigquery_datatransfer.TransferRun]:
+    self._call('list_transfer_runs')
+    parent = _get_request_field(request, 'parent')
+    with self._lock:
+      self._get_config(parent)
+      runs = sorted((run for run, _, _ in self.transfer_runs[parent]),
+                    key=lambda run: run.run_time,
+                    reverse=True)
+      return [bigquery_datatransfer.TransferRun(run) for run in runs]
+
+  def schedule_transfer_runs(
+      self, parent: str, start_time: Any,
+      end_time: Any) -> bigquery_datatransfer.ScheduleTransferRunsResponse:
+    """Starts a backfill run for each day from the start to the end time."""
+    self._call('schedule_transfer_runs')
+    start_date = start_time.ToDatetime(tzinfo=datetime.timezone.utc)
+    end_date = end_time.ToDatetime(tzinfo=datetime.timezone.utc)
+    with self._lock:
+      self._get_config(parent)
+      run_time = start_date
+      while run_time < end_date:
+        self._start_run(parent, run_time)
+        run_time += datetime.timedelta(days=1)
+    return bigquery_datatransfer.ScheduleTransferRunsResponse()
+
+  def start_manual_transfer_runs(
+      self, parent: str, requested_run_time: Any
+  ) -> bigquery_datatransfer.StartManualTransferRunsResponse:
+    self._call('start_manual_transfer_runs')
+    with self._lock:
+      self._get_config(parent)
+      self._start_run(
+          parent, requested_run_time.ToDatetime(tzinfo=datetime.timezone.utc))
+    return bigquery_datatransfer.StartManualTransferRunsResponse()
+
+  def check_valid_creds(
+      self,
+      request: Any = None) -> bigquery_datatransfer.CheckValidCredsResponse:
+    self._call('check_valid_creds')
+    return bigquery_datatransfer.CheckValidCredsResponse(
+        has_valid_creds=self.has_valid_creds)
+
+  def get_data_source(self,
+                      request: Any = None) -> bigquery_datatransfer.DataSource:
+    self._call('get_data_source')
+    return bigquery_datatransfer.DataSource(
+        name=_get_request_field(request, 'name'),
+        client_id='fake_client_id',
+        scopes=['https://www.googleapis.com/auth/bigquery'])
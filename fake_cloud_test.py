@@ -0,0 +1,80 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Tests for fake_cloud."""
+
+import concurrent.futures
+import time
+import unittest
+
+import fake_cloud
+
+
+class FakeClockTest(unittest.TestCase):
+
+  def test_virtual_sleep_returns_at_once(self):
+    clock = fake_cloud.FakeClock()
+    start = time.monotonic()
+
+    clock.sleep(3600)
+    clock.sleep_until(7200)
+
+    self.assertLess(time.monotonic() - start, 1)
+    self.assertEqual(clock.now(), 7200)
+
+  def test_virtual_threads_overlap(self):
+    clock = fake_cloud.FakeClock()
+    clock.sleep(10)
+
+    def sleep_and_get_time(seconds):
+      clock.sleep(seconds)
+      return clock.now()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+      thread_seconds = list(executor.map(sleep_and_get_time, [30, 60]))
+
+    self.assertEqual(thread_seconds, [40, 70])
+    self.assertEqual(clock.now(), 70)
+
+  def test_scaled_sleep(self):
+    clock = fake_cloud.FakeClock(time_scale=0.001)
+    start = time.monotonic()
+
+    clock.sleep(100)
+
+    self.assertGreaterEqual(time.monotonic() - start, 0.1)
+    self.assertGreaterEqual(clock.now(), 100)
+
+
+class FakeBigQueryClientTest(unittest.TestCase):
+
+  def test_query_job_ends_after_its_duration(self):
+    clock = fake_cloud.FakeClock()
+    client = fake_cloud.FakeBigQueryClient('project', clock, seed=1)
+    client.create_dataset('project.markup')
+
+    job = client.query('CREATE OR REPLACE VIEW `project.markup.view` AS '
+                       'SELECT 1')
+    self.assertFalse(job.done())
+    job.result()
+
+    self.assertTrue(job.done())
+    self.assertGreater(clock.now(), 0)
+    self.assertIsNotNone(client.get_table('project.markup.view'))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,1861 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Runs the MarkUp SQL scripts locally on DuckDB over fixture tables.
+
+The scripts are rendered with cloud_bigquery.configure_sql, then translated
+from BigQuery to DuckDB statement by statement:
+  * Table ids are mapped to the table names, i.e. the dataset is the DuckDB
+    database. INFORMATION_SCHEMA.TABLES, COLUMNS, PARTITIONS and __TABLES__
+    are emulated from the DuckDB catalog.
+  * Implicit and explicit UNNEST joins, STRUCT and ARRAY types and values,
+    array subscripts and the BigQuery functions used by the scripts are
+    rewritten to their DuckDB equivalent.
+  * Scripting statements (DECLARE, SET, IF, LOOP, WHILE, BEGIN...END, CALL and
+    EXECUTE IMMEDIATE) and procedures are interpreted by the harness, with the
+    script variables held in DuckDB variables.
+  * The constructParsedCriteria JavaScript UDF is replaced by a Python UDF
+    returning the same SQL.
+
+The translation covers the constructs used by the MarkUp scripts, not
+BigQuery SQL in general.
+
+Fixture tables are Parquet or CSV files named after the table, e.g.
+"Products_1234.parquet". Partitioned tables have their partition pseudo
+column, "_PARTITIONDATE" for the Merchant Center tables and "_DATA_DATE" for
+the Google Ads tables. Google Ads tables are named "p_<table>" as in the
+transfer, and a "<table>" view adding "_LATEST_DATE" is created for them.
+
+Each statement run on DuckDB is timed and, when profiling, the rows it
+scanned and an estimate of the bytes BigQuery would scan are recorded too.
+
+Typical usage example:
+  >>> harness = LocalHarness('1234', '5678')
+  >>> harness.load_fixtures('fixtures')
+  >>> harness.run_installer()
+  >>> harness.run_main_workflow()
+  >>> print(format_timings(harness.timings))
+"""
+
+import argparse
+import collections
+import datetime
+import glob
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cloud_bigquery
+import duckdb
+import reference_data
+
+_SCRIPTS_DIR = 'scripts'
+_FIXTURE_EXTENSIONS = ('.parquet', '.csv.gz', '.csv')
+_DEFAULT_TOP_STATEMENTS = 20
+# Tables emulating the BigQuery metadata views.
+_TABLES_TABLE = '__information_schema_tables'
+_COLUMNS_TABLE = '__information_schema_columns'
+_PARTITIONS_TABLE = '__information_schema_partitions'
+_LEGACY_TABLES_TABLE = '__tables__'
+_METADATA_TABLES = (_TABLES_TABLE, _COLUMNS_TABLE, _PARTITIONS_TABLE,
+                    _LEGACY_TABLES_TABLE)
+_METADATA_SCHEMAS = (
+    f'CREATE OR REPLACE TABLE {_TABLES_TABLE} (table_name VARCHAR, '
+    'table_type VARCHAR)',
+    f'CREATE OR REPLACE TABLE {_COLUMNS_TABLE} (table_name VARCHAR, '
+    'column_name VARCHAR, ordinal_position BIGINT, data_type VARCHAR, '
+    'is_partitioning_column VARCHAR)',
+    f'CREATE OR REPLACE TABLE {_PARTITIONS_TABLE} (table_name VARCHAR, '
+    'partition_id VARCHAR, total_rows BIGINT, '
+    'last_modified_time TIMESTAMPTZ)',
+    f'CREATE OR REPLACE TABLE {_LEGACY_TABLES_TABLE} (table_id VARCHAR, '
+    'row_count BIGINT, size_bytes BIGINT, last_modified_time BIGINT)',
+)
+# Pseudo columns of the partitioned fixture tables.
+_PARTITION_PSEUDO_COLUMNS = ('_PARTITIONDATE', '_DATA_DATE')
+_TRANSFER_TABLE_PREFIX = 'p_'
+# BigQuery functions without a DuckDB equivalent.
+_MACROS = (
+    'CREATE OR REPLACE MACRO bq_safe_divide(a, b) AS '
+    'CASE WHEN b = 0 THEN NULL ELSE a / b END',
+    'CREATE OR REPLACE MACRO bq_date_add(d, i) AS CAST(d + i AS DATE)',
+    'CREATE OR REPLACE MACRO bq_date_sub(d, i) AS CAST(d - i AS DATE)',
+    'CREATE OR REPLACE MACRO bq_timestamp_add(t, i) AS t + i',
+    'CREATE OR REPLACE MACRO bq_timestamp_sub(t, i) AS t - i',
+)
+_RENAMED_FUNCTIONS = {
+    'ARRAY_CONCAT': 'list_concat',
+    'ARRAY_LENGTH': 'len',
+    'COUNTIF': 'count_if',
+    'DATE_ADD': 'bq_date_add',
+    'DATE_SUB': 'bq_date_sub',
+    'LOGICAL_AND': 'bool_and',
+    'LOGICAL_OR': 'bool_or',
+    'REGEXP_CONTAINS': 'regexp_matches',
+    'SAFE_CAST': 'try_cast',
+    'SAFE_DIVIDE': 'bq_safe_divide',
+    'TIMESTAMP_ADD': 'bq_timestamp_add',
+    'TIMESTAMP_SUB': 'bq_timestamp_sub',
+}
+_SIMPLE_TYPES = {
+    'BOOL': 'BOOLEAN',
+    'BYTES': 'BLOB',
+    'DATETIME': 'TIMESTAMP',
+    'FLOAT64': 'DOUBLE',
+    'INT64': 'BIGINT',
+    'NUMERIC': 'DECIMAL(38, 9)',
+    'STRING': 'VARCHAR',
+    'TIMESTAMP': 'TIMESTAMPTZ',
+}
+_JOIN_KEYWORDS = ('LEFT', 'RIGHT', 'FULL', 'INNER', 'CROSS', 'OUTER', 'JOIN')
+_FROM_CLAUSE_END_KEYWORDS = ('WHERE', 'GROUP', 'HAVING', 'QUALIFY', 'WINDOW',
+                             'ORDER', 'LIMIT', 'UNION', 'INTERSECT', 'EXCEPT')
+_GROUP_BY_END_KEYWORDS = ('HAVING', 'QUALIFY', 'WINDOW', 'ORDER', 'LIMIT',
+                          'UNION', 'INTERSECT', 'EXCEPT')
+_ALIAS_STOP_KEYWORDS = ('ON', 'USING', 'WITH') + _JOIN_KEYWORDS
+_WRITE_STATEMENTS = ('INSERT', 'DELETE', 'UPDATE', 'MERGE', 'CREATE', 'DROP',
+                     'TRUNCATE')
+_DML_STATEMENTS = ('INSERT', 'DELETE', 'UPDATE', 'MERGE')
+# Size in bytes of the values of the fixed size DuckDB types in BigQuery,
+# other types are sized by their text representation.
+_FIXED_TYPE_BYTES = {
+    'BOOLEAN': 1,
+    'BIGINT': 8,
+    'INTEGER': 8,
+    'DOUBLE': 8,
+    'DATE': 8,
+    'TIMESTAMP': 8,
+    'TIMESTAMP WITH TIME ZONE': 8,
+}
+_DECIMAL_BYTES = 16
+# Marks the beginning of a stage of a workflow script, see cloud_bigquery.
+_STAGE_MARKER_PATTERN = re.compile(r'^-- STAGE: (\w+)\s*$')
+_TOKEN_PATTERN = re.compile(
+    r'(?P<space>\s+)'
+    r'|(?P<comment>--[^\n]*|#[^\n]*|/\*.*?\*/)'
+    r'|(?P<string>[rR]?(?:"""(?:\\.|[^\\])*?"""|\'\'\'(?:\\.|[^\\])*?\'\'\''
+    r'|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'))'
+    r'|(?P<quoted>`[^`]*`)'
+    r'|(?P<sysvar>@@[\w.]+)'
+    r'|(?P<param>@\w+)'
+    r'|(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)'
+    r'|(?P<word>[A-Za-z_]\w*)'
+    r'|(?P<op><>|!=|>=|<=|\|\||:=|.)', re.DOTALL)
+_STRING_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '0': '\0'}
+_FORMAT_SPECIFIER_PATTERN = re.compile(
+    r'%%|%[-+ #0]*\d*(?:\.\d+)?[a-zA-Z]|[{}]')
+# Product partition criteria, see construct_parsed_criteria.sql.
+_SUB_CRITERION_SEPARATOR = '&+'
+_VALUE_SEPARATOR = '=='
+_ANY_VALUE = '*'
+_INDEXED_ATTRIBUTES = (
+    ('custom', re.compile(r'custom(\d+)'), 'custom_label'),
+    ('product_type_', re.compile(r'product_type_l(\d+)'), 'product_type_l'),
+    ('category_', re.compile(r'category_l(\d+)'), 'google_product_category_l'),
+)
+_ATTRIBUTES = (('brand==', 'brand', False), ('id==', 'offer_id', False),
+               ('channel==', 'channel', True),
+               ('channel_exclusivity==', 'channel_exclusivity', True),
+               ('c_condition==', 'condition', True))
+PARSED_CRITERIA_COLUMNS = (
+    'criteria', 'custom_label0', 'custom_label1', 'custom_label2',
+    'custom_label3', 'custom_label4', 'product_type_l1', 'product_type_l2',
+    'product_type_l3', 'product_type_l4', 'product_type_l5',
+    'google_product_category_l1', 'google_product_category_l2',
+    'google_product_category_l3', 'google_product_category_l4',
+    'google_product_category_l5', 'brand', 'offer_id', 'channel',
+    'channel_exclusivity', 'condition')
+_PARSED_CRITERIA_INSERT_PATTERN = re.compile(r'INSERT INTO `([^`]+)`')
+
+# Set logging level.
+logging.getLogger().setLevel(logging.INFO)
+
+# A statement run on DuckDB: the script run by the harness, the file and line
+# of the statement, the workflow stage, a short description of the statement,
+# its duration, the number of rows it returned, changed or created and, when
+# profiling, the number of rows it scanned and the estimated bytes scanned.
+StatementTiming = collections.namedtuple(
+    'StatementTiming', [
+        'script', 'source', 'stage', 'statement', 'seconds', 'row_count',
+        'rows_scanned', 'bytes_scanned'
+    ],
+    defaults=[None, None])
+
+# Lexical token, with its line in the script.
+_Token = collections.namedtuple('_Token', ['kind', 'text', 'line'])
+# Parenthesized or bracketed tokens.
+_Group = collections.namedtuple('_Group', ['open', 'items', 'close'])
+# Location of a statement: script, line and workflow stage.
+_Source = collections.namedtuple('_Source', ['script', 'line', 'stage'])
+# Statement or block header of a script, before the blocks are nested.
+_Item = collections.namedtuple('_Item',
+                               ['kind', 'tokens', 'source', 'end_kind'])
+# Nodes of a parsed script.
+_Statement = collections.namedtuple('_Statement', ['tokens', 'source'])
+_If = collections.namedtuple('_If', ['branches', 'else_nodes', 'source'])
+_Loop = collections.namedtuple('_Loop', ['nodes', 'source'])
+_While = collections.namedtuple('_While', ['condition', 'nodes', 'source'])
+_Block = collections.namedtuple('_Block', ['nodes', 'source'])
+_Procedure = collections.namedtuple('_Procedure',
+                                    ['name', 'parameters', 'nodes', 'source'])
+# A translated statement with the table it writes to, if any.
+_Translation = collections.namedtuple(
+    '_Translation',
+    ['sql', 'kind', 'target', 'is_temporary', 'partition_column'])
+# A script variable held in a DuckDB variable.
+_Variable = collections.namedtuple('_Variable', ['duckdb_name', 'type'])
+
+
+class Error(Exception):
+  """Base error for this module."""
+
+
+class ScriptSyntaxError(Error):
+  """Raised when a script can't be split in statements and blocks."""
+
+
+class UnsupportedStatementError(Error):
+  """Raised when a statement can't be translated to DuckDB."""
+
+
+class ExecutionError(Error):
+  """Raised when DuckDB fails to run a translated statement."""
+
+
+class _Break(Exception):
+  """Exits the innermost loop."""
+
+
+class _Continue(Exception):
+  """Starts the next iteration of the innermost loop."""
+
+
+class _Return(Exception):
+  """Exits the current procedure or script."""
+
+
+def parse_criterion(criterion: str) -> Dict[str, str]:
+  """Parses a product partition criterion like constructParsedCriteria.
+
+  A criterion is a list of "<attribute>==<value>" conditions separated by
+  "&+", e.g. "custom0==sale&+brand==acme&+product_type_l1==*". "*" matches
+  any value and sets no condition.
+
+  Args:
+    criterion: The criterion.
+
+  Returns:
+    The values of the attributes set by the criterion, keyed by the column
+    names of the ParsedCriteria table.
+  """
+  parsed_criterion = {'criteria': criterion}
+  for sub_criterion in criterion.split(_SUB_CRITERION_SEPARATOR):
+    parts = sub_criterion.split(_VALUE_SEPARATOR)
+    value = parts[1] if len(parts) > 1 else None
+    if value == _ANY_VALUE:
+      continue
+    for prefix, index_pattern, column_prefix in _INDEXED_ATTRIBUTES:
+      if sub_criterion.startswith(prefix):
+        index_match = index_pattern.search(parts[0])
+        if index_match:
+          parsed_criterion[column_prefix + index_match.group(1)] = value
+    for prefix, column, is_typed in _ATTRIBUTES:
+      if sub_criterion.startswith(prefix):
+        # Typed values are "<type>:<value>", e.g. "channel==channel:online".
+        if is_typed and value is not None:
+          typed_value = value.split(':')
+          value = typed_value[1] if len(typed_value) > 1 else None
+        parsed_criterion[column] = value
+  return parsed_criterion
+
+
+def construct_parsed_criteria_sql(criterions: Sequence[str],
+                                  table_id: str) -> str:
+  """Returns the INSERT statement returned by constructParsedCriteria.
+
+  Args:
+    criterions: Product partition criteria.
+    table_id: Id of the ParsedCriteria table.
+  """
+  rows = []
+  for criterion in criterions or []:
+    criterion = criterion.replace('"', '\\"')
+    parsed_criterion = parse_criterion(criterion)
+    values = [f'"{criterion}"'] + [
+        f'"{parsed_criterion[column]}"'
+        if parsed_criterion.get(column) else 'NULL'
+        for column in PARSED_CRITERIA_COLUMNS[1:]
+    ]
+    rows.append('(' + ','.join(values) + ')')
+  return f'INSERT INTO `{table_id}` VALUES ' + ','.join(rows)
+
+
+def _tokenize(sql: str) -> List[_Token]:
+  """Splits BigQuery SQL in tokens."""
+  tokens = []
+  line = 1
+  for match in _TOKEN_PATTERN.finditer(sql):
+    tokens.append(_Token(match.lastgroup, match.group(), line))
+    line += match.group().count('\n')
+  return tokens
+
+
+def _is_word(item: Any, *words: str) -> bool:
+  return (isinstance(item, _Token) and item.kind == 'word' and
+          (not words or item.text.upper() in words))
+
+
+def _is_op(item: Any, *ops: str) -> bool:
+  return isinstance(item, _Token) and item.kind == 'op' and item.text in ops
+
+
+def _is_group(item: Any, open_text: str = '(') -> bool:
+  return isinstance(item, _Group) and item.open.text == open_text
+
+
+def _raw(text: str) -> _Token:
+  return _Token('raw', text, 0)
+
+
+def _significant(items: Sequence[Any]) -> List[int]:
+  """Returns the indexes of the items which are not blanks."""
+  return [
+      index for index, item in enumerate(items)
+      if not (isinstance(item, _Token) and item.kind in ('space', 'comment'))
+  ]
+
+
+def _group(tokens: Sequence[_Token]) -> List[Any]:
+  """Nests the parenthesized and bracketed tokens in groups."""
+  root = []
+  stack = [(None, root)]
+  for token in tokens:
+    if _is_op(token, '(', '['):
+      stack.append((token, []))
+    elif _is_op(token, ')', ']') and len(stack) > 1:
+      open_token, items = stack.pop()
+      stack[-1][1].append(_Group(open_token, items, token))
+    else:
+      stack[-1][1].append(token)
+  if len(stack) > 1:
+    raise ScriptSyntaxError(
+        f'Unbalanced "{stack[-1][0].text}" at line {stack[-1][0].line}.')
+  return root
+
+
+def _to_sql(items: Sequence[Any]) -> str:
+  parts = []
+  for item in items:
+    if isinstance(item, _Group):
+      parts.append(item.open.text + _to_sql(item.items) + item.close.text)
+    else:
+      parts.append(item.text)
+  return ''.join(parts)
+
+
+def _flatten(items: Sequence[Any]) -> List[_Token]:
+  """Returns the tokens of grouped items."""
+  tokens = []
+  for item in items:
+    if isinstance(item, _Group):
+      tokens.append(item.open)
+      tokens.extend(_flatten(item.items))
+      tokens.append(item.close)
+    else:
+      tokens.append(item)
+  return tokens
+
+
+def _split_items(items: Sequence[Any]) -> List[List[Any]]:
+  """Splits items on their commas."""
+  parts = [[]]
+  for item in items:
+    if _is_op(item, ','):
+      parts.append([])
+    else:
+      parts[-1].append(item)
+  return parts if any(_significant(part) for part in parts) else []
+
+
+def _join_items(parts: Sequence[Sequence[Any]]) -> List[Any]:
+  items = []
+  for index, part in enumerate(parts):
+    if index:
+      items.extend((_Token('op', ',', 0), _Token('space', ' ', 0)))
+    items.extend(part)
+  return items
+
+
+def _get_output_name(items: Sequence[Any]) -> Optional[str]:
+  """Returns the column name of a select list item or a struct field."""
+  indexes = _significant(items)
+  if not indexes:
+    return None
+  last = items[indexes[-1]]
+  if len(indexes) >= 2 and _is_word(last):
+    before_last = items[indexes[-2]]
+    if _is_word(before_last, 'AS'):
+      return last.text
+    # Implicit alias, e.g. "IF(x IS NULL, 0, 1) is_approved".
+    if isinstance(before_last, _Group) or (
+        isinstance(before_last, _Token) and
+        before_last.kind in ('word', 'quoted', 'string', 'number') and
+        not _is_word(before_last, 'DISTINCT')):
+      return last.text
+  if _is_word(last) and all(
+      _is_word(items[index]) or _is_op(items[index], '.')
+      for index in indexes):
+    return last.text
+  return None
+
+
+def _decode_string(text: str) -> str:
+  """Returns the value of a BigQuery string literal."""
+  is_raw = text[0] in 'rR'
+  if is_raw:
+    text = text[1:]
+  quote_length = 3 if text[:3] in ('"""', "'''") else 1
+  body = text[quote_length:-quote_length]
+  if is_raw:
+    return body
+  return re.sub(r'\\(.)', lambda match: _STRING_ESCAPES.get(
+      match.group(1), match.group(1)), body, flags=re.DOTALL)
+
+
+def _encode_string(value: str) -> str:
+  """Returns a DuckDB string literal."""
+  return "'" + value.replace("'", "''") + "'"
+
+
+def _map_table_id(table_id: str) -> str:
+  """Returns the DuckDB table of a BigQuery table id."""
+  parts = table_id.strip('`"').split('.')
+  if len(parts) >= 2 and parts[-2].upper() == 'INFORMATION_SCHEMA':
+    return f'__information_schema_{parts[-1].lower()}'
+  if parts[-1].upper() == '__TABLES__':
+    return _LEGACY_TABLES_TABLE
+  return parts[-1]
+
+
+def _parse_type(tokens: Sequence[_Token], position: int) -> Tuple[str, int]:
+  """Parses a BigQuery type.
+
+  Args:
+    tokens: The significant tokens of the type.
+    position: Position of the first token of the type.
+
+  Returns:
+    The DuckDB type and the position of the first token after the type.
+  """
+  name = tokens[position].text.upper()
+  if (name in ('ARRAY', 'STRUCT') and position + 1 < len(tokens) and
+      _is_op(tokens[position + 1], '<')):
+    position += 2
+    if name == 'ARRAY':
+      element_type, position = _parse_type(tokens, position)
+      return f'{element_type}[]', position + 1
+    fields = []
+    while not _is_op(tokens[position], '>'):
+      field_type, next_position = _parse_type(tokens, position + 1)
+      fields.append(f'"{tokens[position].text}" {field_type}')
+      position = next_position
+      if _is_op(tokens[position], ','):
+        position += 1
+    return f'STRUCT({", ".join(fields)})', position + 1
+  return _SIMPLE_TYPES.get(name, tokens[position].text), position + 1
+
+
+def _convert_format(format_string: str) -> str:
+  """Converts a FORMAT format string to a DuckDB format string."""
+
+  def convert(match):
+    specifier = match.group()
+    if specifier == '%%':
+      return '%'
+    if specifier in '{}':
+      return specifier * 2
+    return '{}'
+
+  return _FORMAT_SPECIFIER_PATTERN.sub(convert, format_string)
+
+
+class _Translator(object):
+  """Translates BigQuery statements to DuckDB."""
+
+  def __init__(self, current_date: datetime.date) -> None:
+    self._current_date_sql = f"DATE '{current_date.isoformat()}'"
+
+  def translate(self, tokens: Sequence[_Token]) -> _Translation:
+    """Translates a statement whose variables are already substituted."""
+    items = _group(tokens)
+    indexes = _significant(items)
+    words = [
+        items[index].text.upper() if _is_word(items[index]) else None
+        for index in indexes[:8]
+    ]
+    kind = words[0] if words else None
+    target = None
+    is_temporary = False
+    partition_column = None
+    if kind == 'CREATE':
+      is_temporary = 'TEMP' in words or 'TEMPORARY' in words
+      if 'TABLE' in words or 'VIEW' in words:
+        object_type = 'TABLE' if 'TABLE' in words else 'VIEW'
+        position = words.index(object_type) + 1
+        if words[position:position + 3] == ['IF', 'NOT', 'EXISTS']:
+          position += 3
+        target = _map_table_id(items[indexes[position]].text)
+        if object_type == 'TABLE':
+          items, partition_column = self._strip_table_options(items)
+    elif kind in ('INSERT', 'MERGE'):
+      position = 2 if words[1:2] == ['INTO'] else 1
+      target = _map_table_id(items[indexes[position]].text)
+      if position == 1:
+        items.insert(indexes[0] + 1, _raw(' INTO'))
+    elif kind in ('DELETE', 'TRUNCATE'):
+      target = _map_table_id(items[indexes[2]].text)
+    elif kind == 'UPDATE':
+      target = _map_table_id(items[indexes[1]].text)
+    elif kind == 'DROP':
+      position = 4 if words[2:4] == ['IF', 'EXISTS'] else 2
+      target = _map_table_id(items[indexes[position]].text)
+    sql = _to_sql(self._rewrite(items))
+    return _Translation(sql, kind, target, is_temporary, partition_column)
+
+  def translate_expression(self, tokens: Sequence[_Token]) -> str:
+    """Translates an expression whose variables are already substituted."""
+    return _to_sql(self._rewrite(_group(tokens)))
+
+  def _strip_table_options(self,
+                           items: List[Any]) -> Tuple[List[Any], Optional[str]]:
+    """Removes PARTITION BY, CLUSTER BY and OPTIONS from a CREATE TABLE."""
+    stripped_items = []
+    partition_column = None
+    skipping = None
+    for item in items:
+      if _is_word(item, 'PARTITION', 'CLUSTER', 'OPTIONS'):
+        skipping = item.text.upper()
+        continue
+      if _is_word(item, 'AS'):
+        skipping = None
+      if skipping == 'OPTIONS' and _is_group(item):
+        skipping = None
+        continue
+      if skipping:
+        if skipping == 'PARTITION' and not _is_word(item, 'BY'):
+          # PARTITION BY column or PARTITION BY DATE(column).
+          if _is_word(item) and not partition_column:
+            partition_column = item.text
+          elif _is_group(item) and _significant(item.items):
+            partition_column = item.items[_significant(item.items)[0]].text
+        continue
+      stripped_items.append(item)
+    return stripped_items, partition_column
+
+  def _rewrite(self, items: List[Any]) -> List[Any]:
+    """Rewrites a sequence of items, then the items of its groups."""
+    items = self._rewrite_select_as_struct(items)
+    items = self._rewrite_types(items)
+    items = self._rewrite_brackets(items)
+    items = self._rewrite_functions(items)
+    items = self._rewrite_from_clauses(items)
+    items = self._rewrite_group_by(items)
+    return [
+        _Group(item.open, self._rewrite(item.items), item.close)
+        if isinstance(item, _Group) else item for item in items
+    ]
+
+  def _rewrite_select_as_struct(self, items: List[Any]) -> List[Any]:
+    """SELECT AS STRUCT ... returns the selected row as a struct."""
+    indexes = _significant(items)
+    if (len(indexes) < 3 or not _is_word(items[indexes[0]], 'SELECT') or
+        not _is_word(items[indexes[1]], 'AS') or
+        not _is_word(items[indexes[2]], 'STRUCT')):
+      return items
+    subquery = [_raw('SELECT ')] + items[indexes[2] + 1:]
+    return [
+        _raw('SELECT __row FROM '),
+        _Group(_raw('('), subquery, _raw(')')),
+        _raw(' AS __row')
+    ]
+
+  def _rewrite_types(self, items: List[Any]) -> List[Any]:
+    """Maps the BigQuery types to DuckDB types."""
+    rewritten_items = []
+    index = 0
+    while index < len(items):
+      item = items[index]
+      previous = rewritten_items[_significant(rewritten_items)[-1]] if (
+          _significant(rewritten_items)) else None
+      if not _is_word(item) or _is_op(previous, '.'):
+        rewritten_items.append(item)
+        index += 1
+        continue
+      name = item.text.upper()
+      following = [
+          index + 1 + offset for offset in _significant(items[index + 1:])
+      ]
+      next_item = items[following[0]] if following else None
+      if name in ('ARRAY', 'STRUCT') and _is_op(next_item, '<'):
+        type_indexes = [index] + following
+        type_tokens = [items[position] for position in type_indexes]
+        # The type ends before the first group, e.g. an empty array literal.
+        for position, token in enumerate(type_tokens):
+          if isinstance(token, _Group):
+            type_tokens = type_tokens[:position]
+            break
+        type_sql, end = _parse_type(type_tokens, 0)
+        rewritten_items.append(_raw(type_sql))
+        index = type_indexes[end - 1] + 1
+        continue
+      if name in _SIMPLE_TYPES and not _is_group(next_item) and not (
+          isinstance(next_item, _Token) and next_item.kind == 'string'):
+        rewritten_items.append(_raw(_SIMPLE_TYPES[name]))
+      else:
+        rewritten_items.append(item)
+      index += 1
+    return rewritten_items
+
+  def _rewrite_brackets(self, items: List[Any]) -> List[Any]:
+    """Rewrites array subscripts and the tuples of struct array literals."""
+    rewritten_items = []
+    for item in items:
+      if not _is_group(item, '['):
+        rewritten_items.append(item)
+        continue
+      indexes = _significant(item.items)
+      if (len(indexes) == 2 and _is_word(item.items[indexes[0]], 'OFFSET',
+                                         'SAFE_OFFSET', 'ORDINAL',
+                                         'SAFE_ORDINAL') and
+          _is_group(item.items[indexes[1]])):
+        # DuckDB lists are indexed from 1 and out of range indexes are NULL.
+        position = item.items[indexes[1]]
+        if item.items[indexes[0]].text.upper().endswith('OFFSET'):
+          subscript = [position, _raw(' + 1')]
+        else:
+          subscript = [position]
+        rewritten_items.append(_Group(item.open, subscript, item.close))
+        continue
+      rewritten_items.append(
+          _Group(item.open, self._rewrite_struct_tuples(item.items),
+                 item.close))
+    return rewritten_items
+
+  def _rewrite_struct_tuples(self, items: List[Any]) -> List[Any]:
+    """[STRUCT(1 AS a, 2 AS b), (3, 4)]: the tuples take the field names."""
+    elements = _split_items(items)
+    if not elements:
+      return items
+    first = [elements[0][index] for index in _significant(elements[0])]
+    if (len(first) != 2 or not _is_word(first[0], 'STRUCT') or
+        not _is_group(first[1])):
+      return items
+    field_names = [
+        _get_output_name(field) for field in _split_items(first[1].items)
+    ]
+    rewritten_elements = [elements[0]]
+    for element in elements[1:]:
+      indexes = _significant(element)
+      if len(indexes) != 1 or not _is_group(element[indexes[0]]):
+        rewritten_elements.append(element)
+        continue
+      values = _split_items(element[indexes[0]].items)
+      fields = [
+          value + [
+              _Token('space', ' ', 0),
+              _Token('word', 'AS', 0),
+              _Token('space', ' ', 0),
+              _Token('word', name, 0)
+          ] if name else value
+          for value, name in zip(values, field_names)
+      ]
+      rewritten_elements.append([
+          _Token('word', 'STRUCT', 0),
+          _Group(_raw('('), _join_items(fields), _raw(')'))
+      ])
+    return _join_items(rewritten_elements)
+
+  def _rewrite_functions(self, items: List[Any]) -> List[Any]:
+    """Rewrites the function calls."""
+    rewritten_items = []
+    indexes = _significant(items)
+    skipped = set()
+    for position, index in enumerate(indexes):
+      item = items[index]
+      next_item = (
+          items[indexes[position + 1]] if position + 1 < len(indexes) else None)
+      previous = items[indexes[position - 1]] if position else None
+      if not _is_word(item) or _is_op(previous, '.'):
+        continue
+      name = item.text.upper()
+      if name == 'CURRENT_DATE':
+        items[index] = _raw(self._current_date_sql)
+        if _is_group(next_item) and not _significant(next_item.items):
+          skipped.add(indexes[position + 1])
+      elif not _is_group(next_item):
+        continue
+      elif name in _RENAMED_FUNCTIONS:
+        items[index] = _raw(_RENAMED_FUNCTIONS[name])
+      elif name == 'CURRENT_TIMESTAMP':
+        items[index] = _raw('current_timestamp')
+        skipped.add(indexes[position + 1])
+      elif name == 'STRUCT':
+        items[index] = _raw('struct_pack')
+        fields = []
+        for number, field in enumerate(_split_items(next_item.items), 1):
+          field_name = _get_output_name(field) or f'_field_{number}'
+          field_indexes = _significant(field)
+          if (len(field_indexes) >= 2 and
+              _is_word(field[field_indexes[-2]], 'AS')):
+            field = field[:field_indexes[-2]]
+          fields.append([_raw(f'"{field_name}" := ')] + field)
+        items[indexes[position + 1]] = _Group(next_item.open,
+                                              _join_items(fields),
+                                              next_item.close)
+      elif name == 'TO_HEX':
+        # DuckDB md5 returns the hexadecimal digest.
+        arguments = _significant(next_item.items)
+        if arguments and _is_word(next_item.items[arguments[0]], 'MD5'):
+          items[index] = _raw('')
+      elif name == 'FORMAT':
+        arguments = _split_items(next_item.items)
+        format_indexes = _significant(arguments[0]) if arguments else []
+        format_item = (
+            arguments[0][format_indexes[0]] if format_indexes else None)
+        if len(format_indexes) == 1 and format_item.kind == 'string':
+          format_string = format_item.text[1:-1].replace("''", "'")
+          arguments[0] = [_raw(_encode_string(_convert_format(format_string)))]
+          items[index] = _raw('format')
+          items[indexes[position + 1]] = _Group(next_item.open,
+                                                _join_items(arguments),
+                                                next_item.close)
+    for index, item in enumerate(items):
+      if index not in skipped:
+        rewritten_items.append(item)
+    return rewritten_items
+
+  def _rewrite_from_clauses(self, items: List[Any]) -> List[Any]:
+    """Rewrites the FROM clauses of a sequence."""
+    rewritten_items = []
+    index = 0
+    while index < len(items):
+      item = items[index]
+      rewritten_items.append(item)
+      index += 1
+      indexes = _significant(rewritten_items)
+      previous = rewritten_items[indexes[-2]] if len(indexes) > 1 else None
+      if not _is_word(item, 'FROM') or _is_word(previous, 'DISTINCT'):
+        continue
+      end = index
+      while end < len(items) and not (
+          _is_word(items[end], *_FROM_CLAUSE_END_KEYWORDS) or
+          _is_op(items[end], ';')):
+        end += 1
+      rewritten_items.extend(self._rewrite_from_clause(items[index:end]))
+      index = end
+    return rewritten_items
+
+  def _rewrite_from_clause(self, items: List[Any]) -> List[Any]:
+    """Rewrites the joins of a FROM clause.
+
+    Comma joins become CROSS JOIN, as DuckDB binds explicit joins before comma
+    joins. Array paths, e.g. "Products.destinations", and UNNEST are joined
+    laterally; the fields of struct arrays become columns of the alias, e.g.
+    "destinations.approved_countries".
+
+    Args:
+      items: The items of the clause, after FROM.
+
+    Returns:
+      The rewritten items.
+    """
+    segments = [[None, []]]
+    index = 0
+    while index < len(items):
+      item = items[index]
+      if _is_op(item, ','):
+        segments.append([[_raw(' CROSS JOIN ')], []])
+      elif _is_word(item, *_JOIN_KEYWORDS):
+        if segments[-1][0] is not None and not _significant(segments[-1][1]):
+          segments[-1][0].append(item)
+        else:
+          segments.append([[item], []])
+      elif (isinstance(item, _Token) and item.kind == 'space' and
+            segments[-1][0] is not None and not segments[-1][1]):
+        segments[-1][0].append(item)
+      else:
+        segments[-1][1].append(item)
+      index += 1
+    rewritten_items = []
+    for number, (join, body) in enumerate(segments):
+      # CROSS JOIN has no join condition.
+      is_join = bool(join) and not any(
+          _is_word(item, 'CROSS') or item.text == ' CROSS JOIN '
+          for item in join)
+      if join:
+        rewritten_items.extend(join)
+      rewritten_items.extend(
+          self._rewrite_from_item(body, not number, is_join))
+    return rewritten_items
+
+  def _rewrite_from_item(self, items: List[Any], is_first: bool,
+                         is_join: bool) -> List[Any]:
+    """Rewrites an UNNEST or an array path of a FROM clause."""
+    indexes = _significant(items)
+    if not indexes:
+      return items
+    first = items[indexes[0]]
+    if (_is_word(first, 'UNNEST') and len(indexes) > 1 and
+        _is_group(items[indexes[1]])):
+      array_items = items[indexes[1]].items
+      alias_position = 2
+      alias = '__unnest'
+    elif (_is_word(first) and len(indexes) > 2 and
+          _is_op(items[indexes[1]], '.') and _is_word(items[indexes[2]])):
+      alias_position = 1
+      while (alias_position + 1 < len(indexes) and
+             _is_op(items[indexes[alias_position]], '.') and
+             _is_word(items[indexes[alias_position + 1]])):
+        alias_position += 2
+      if (alias_position < len(indexes) and
+          _is_group(items[indexes[alias_position]])):
+        return items
+      array_items = items[indexes[0]:indexes[alias_position - 1] + 1]
+      alias = items[indexes[alias_position - 1]].text
+    else:
+      return items
+    rest_position = alias_position
+    if (rest_position < len(indexes) and
+        _is_word(items[indexes[rest_position]], 'AS')):
+      rest_position += 1
+    if (rest_position < len(indexes) and
+        _is_word(items[indexes[rest_position]]) and
+        not _is_word(items[indexes[rest_position]], *_ALIAS_STOP_KEYWORDS)):
+      alias = items[indexes[rest_position]].text
+      rest_position += 1
+    elif rest_position != alias_position:
+      raise UnsupportedStatementError('Invalid alias in the FROM clause.')
+    rest = items[indexes[rest_position]:] if rest_position < len(
+        indexes) else items[indexes[-1] + 1:]
+    unnest = _Group(
+        _raw('('), [
+            _raw('SELECT UNNEST'),
+            _Group(
+                _raw('('),
+                list(array_items) +
+                [_raw(', recursive := true, max_depth := 2')], _raw(')')),
+            _raw(f' AS {alias}')
+        ], _raw(')'))
+    rewritten_items = [_raw(' ' if is_first else ' LATERAL ')]
+    rewritten_items += [unnest, _raw(f' AS {alias} ')] + list(rest)
+    if is_join and not any(
+        _is_word(item, 'ON', 'USING') for item in rest):
+      rewritten_items.append(_raw(' ON TRUE '))
+    return rewritten_items
+
+  def _rewrite_group_by(self, items: List[Any]) -> List[Any]:
+    """Replaces the select list aliases of GROUP BY by their position.
+
+    BigQuery resolves the names of GROUP BY to the select list first, DuckDB
+    to the columns of the FROM clause first.
+
+    Args:
+      items: The items of a sequence.
+
+    Returns:
+      The rewritten items.
+    """
+    indexes = _significant(items)
+    select_positions = [
+        position for position, index in enumerate(indexes)
+        if _is_word(items[index], 'SELECT')
+    ]
+    for position, index in enumerate(indexes):
+      if not (_is_word(items[index], 'GROUP') and position + 1 < len(indexes)
+              and _is_word(items[indexes[position + 1]], 'BY')):
+        continue
+      select_position = max(
+          [start for start in select_positions if start < position],
+          default=None)
+      if select_position is None:
+        continue
+      from_position = select_position + 1
+      while from_position < position and not _is_word(
+          items[indexes[from_position]], 'FROM'):
+        from_position += 1
+      select_start = indexes[select_position] + 1
+      if _is_word(items[indexes[select_position + 1]], 'DISTINCT'):
+        select_start = indexes[select_position + 1] + 1
+      select_list = _split_items(items[select_start:indexes[from_position]])
+      if any(
+          _is_op(part[index_], '*') for part in select_list
+          for index_ in _significant(part)):
+        continue
+      output_names = [(_get_output_name(part) or '').lower()
+                      for part in select_list]
+      end = position + 2
+      while end < len(indexes) and not (
+          _is_word(items[indexes[end]], *_GROUP_BY_END_KEYWORDS) or
+          _is_op(items[indexes[end]], ';')):
+        end += 1
+      for group_index in indexes[position + 2:end]:
+        item = items[group_index]
+        if (_is_word(item) and item.text.lower() in output_names and
+            not _is_op(items[group_index - 1], '.') and
+            not _is_op(items[min(group_index + 1, len(items) - 1)], '.')):
+          items[group_index] = _raw(
+              str(output_names.index(item.text.lower()) + 1))
+    return items
+
+
+def _is_view_definition(translation: _Translation) -> bool:
+  return translation.kind == 'CREATE' and bool(translation.target) and bool(
+      re.search(r'\bVIEW\b',
+                translation.sql[:translation.sql.find(translation.target)],
+                re.IGNORECASE))
+
+
+def _find_word(tokens: Sequence[_Token], position: int, *words: str) -> int:
+  """Returns the position of the first of words outside of parentheses."""
+  depth = 0
+  for index in range(position, len(tokens)):
+    token = tokens[index]
+    if _is_op(token, '(', '['):
+      depth += 1
+    elif _is_op(token, ')', ']'):
+      depth -= 1
+    elif not depth and _is_word(token, *words):
+      return index
+  raise ScriptSyntaxError(
+      f'Missing {" or ".join(words)} after line {tokens[position - 1].line}.')
+
+
+def _find_statement_end(tokens: Sequence[_Token], position: int) -> int:
+  """Returns the position of the semicolon ending a statement."""
+  depth = 0
+  for index in range(position, len(tokens)):
+    token = tokens[index]
+    if _is_op(token, '(', '['):
+      depth += 1
+    elif _is_op(token, ')', ']'):
+      depth -= 1
+    elif not depth and _is_op(token, ';'):
+      return index
+  return len(tokens)
+
+
+def _split_script(sql: str, script: str) -> List[_Item]:
+  """Splits a script in statements and block headers."""
+  tokens = _tokenize(sql)
+  items = []
+  stage = None
+  position = 0
+  while position < len(tokens):
+    token = tokens[position]
+    if token.kind in ('space', 'comment') or _is_op(token, ';'):
+      stage_match = _STAGE_MARKER_PATTERN.match(token.text)
+      if token.kind == 'comment' and stage_match:
+        stage = stage_match.group(1)
+      position += 1
+      continue
+    source = _Source(script, token.line, stage)
+    word = token.text.upper() if _is_word(token) else None
+    following = [
+        tokens[index] for index in range(position + 1, len(tokens))
+        if tokens[index].kind not in ('space', 'comment')
+    ][:3]
+    following_words = [
+        item.text.upper() if _is_word(item) else None for item in following
+    ]
+    if word in ('IF', 'ELSEIF'):
+      end = _find_word(tokens, position + 1, 'THEN')
+      items.append(_Item(word, tokens[position + 1:end], source, None))
+      position = end + 1
+    elif word == 'WHILE':
+      end = _find_word(tokens, position + 1, 'DO')
+      items.append(_Item(word, tokens[position + 1:end], source, None))
+      position = end + 1
+    elif word in ('ELSE', 'LOOP') or (
+        word == 'BEGIN' and following_words[:1] != ['TRANSACTION'] and
+        not (following and _is_op(following[0], ';'))):
+      items.append(_Item(word, [], source, None))
+      position += 1
+    elif word == 'END':
+      end = _find_statement_end(tokens, position + 1)
+      end_kind = following_words[0] if following_words[0] in (
+          'IF', 'LOOP', 'WHILE') else None
+      items.append(_Item(word, [], source, end_kind))
+      position = end + 1
+    elif word == 'CREATE' and 'PROCEDURE' in following_words:
+      end = _find_word(tokens, position + 1, 'BEGIN')
+      items.append(_Item('PROCEDURE', tokens[position:end], source, None))
+      position = end + 1
+    else:
+      end = _find_statement_end(tokens, position)
+      items.append(_Item('STATEMENT', tokens[position:end], source, None))
+      position = end + 1
+  return items
+
+
+def _parse_parameters(tokens: Sequence[_Token]) -> List[Tuple[str, str]]:
+  """Parses the parameters of a procedure, e.g. "(run_date DATE)"."""
+  group = next(item for item in _group(tokens) if _is_group(item))
+  parameter_tokens = [group.items[index] for index in _significant(group.items)]
+  parameters = []
+  position = 0
+  while position < len(parameter_tokens):
+    if _is_word(parameter_tokens[position], 'IN', 'OUT', 'INOUT'):
+      position += 1
+    name = parameter_tokens[position].text
+    parameter_type, position = _parse_type(parameter_tokens, position + 1)
+    parameters.append((name, parameter_type))
+    position += 1
+  return parameters
+
+
+def _build_nodes(items: Sequence[_Item],
+                 position: int) -> Tuple[List[Any], int]:
+  """Nests the statements of blocks, up to the end of the current block."""
+  nodes = []
+  while position < len(items) and items[position].kind not in ('ELSEIF',
+                                                               'ELSE', 'END'):
+    item = items[position]
+    position += 1
+    if item.kind == 'STATEMENT':
+      nodes.append(_Statement(item.tokens, item.source))
+      continue
+    if item.kind == 'IF':
+      branches = []
+      condition = item.tokens
+      while True:
+        branch_nodes, position = _build_nodes(items, position)
+        branches.append((condition, branch_nodes))
+        if position < len(items) and items[position].kind == 'ELSEIF':
+          condition = items[position].tokens
+          position += 1
+        else:
+          break
+      else_nodes = []
+      if position < len(items) and items[position].kind == 'ELSE':
+        else_nodes, position = _build_nodes(items, position + 1)
+      node = _If(branches, else_nodes, item.source)
+    else:
+      body, position = _build_nodes(items, position)
+      if item.kind == 'LOOP':
+        node = _Loop(body, item.source)
+      elif item.kind == 'WHILE':
+        node = _While(item.tokens, body, item.source)
+      elif item.kind == 'BEGIN':
+        node = _Block(body, item.source)
+      else:
+        name = next(token.text for token in item.tokens
+                    if token.kind == 'quoted' or
+                    (_is_word(token) and not _is_word(
+                        token, 'CREATE', 'OR', 'REPLACE', 'PROCEDURE', 'IF',
+                        'NOT', 'EXISTS')))
+        node = _Procedure(
+            _map_table_id(name), _parse_parameters(item.tokens), body,
+            item.source)
+    expected_end = {'IF': 'IF', 'LOOP': 'LOOP', 'WHILE': 'WHILE'}.get(item.kind)
+    if (position >= len(items) or items[position].kind != 'END' or
+        items[position].end_kind != expected_end):
+      raise ScriptSyntaxError(
+          f'{item.source.script}:{item.source.line}: {item.kind} is not '
+          f'closed by END {expected_end or ""}.')
+    position += 1
+    nodes.append(node)
+  return nodes, position
+
+
+def _parse_script(sql: str, script: str) -> List[Any]:
+  """Parses a script in statements and nested blocks."""
+  items = _split_script(sql, script)
+  nodes, position = _build_nodes(items, 0)
+  if position < len(items):
+    item = items[position]
+    raise ScriptSyntaxError(
+        f'{item.source.script}:{item.source.line}: Unexpected {item.kind}.')
+  return nodes
+
+
+class _Scope(object):
+  """Variables declared in a script, a block or a procedure."""
+
+  def __init__(self, prefix: str, parent: Optional['_Scope'] = None) -> None:
+    self._prefix = prefix
+    self._parent = parent
+    self._variables = {}
+
+  def declare(self, name: str, variable_type: Optional[str]) -> _Variable:
+    variable = _Variable(f'{self._prefix}_{name.lower()}', variable_type)
+    self._variables[name.lower()] = variable
+    return variable
+
+  def lookup(self, name: str) -> Optional[_Variable]:
+    variable = self._variables.get(name.lower())
+    if variable is None and self._parent:
+      return self._parent.lookup(name)
+    return variable
+
+
+class LocalHarness(object):
+  """Runs the MarkUp scripts of a tenant on a DuckDB database."""
+
+  def __init__(self,
+               merchant_id: str,
+               customer_id: str,
+               project_id: str = 'local',
+               dataset_id: str = 'markup',
+               run_date: Optional[datetime.date] = None,
+               current_date: Optional[datetime.date] = None,
+               database: str = ':memory:',
+               profile: bool = False) -> None:
+    """Initializes the harness.
+
+    Args:
+      merchant_id: Merchant center id.
+      customer_id: Google Ads customer id.
+      project_id: Cloud project id of the rendered scripts.
+      dataset_id: BigQuery dataset id of the rendered scripts.
+      run_date: Value of the @run_date parameter of the main workflow,
+        current_date if not set.
+      current_date: Value of CURRENT_DATE(), today if not set. Fixtures with a
+        fixed date range set it to their last date.
+      database: DuckDB database file, in memory by default.
+      profile: Whether to record the rows and bytes scanned by each
+        statement, which takes an extra query per column read.
+    """
+    self.merchant_id = merchant_id
+    self.customer_id = customer_id
+    self.project_id = project_id
+    self.dataset_id = dataset_id
+    self._current_date = current_date or datetime.date.today()
+    self.run_date = run_date or self._current_date
+    self._connection = duckdb.connect(database)
+    self._translator = _Translator(self._current_date)
+    self._procedures = {}
+    self._scope_count = 0
+    self._modified_times = {}
+    self._partition_columns = {}
+    self._metadata_views = set()
+    self._is_metadata_changed = True
+    self._temporary_tables = set()
+    self._row_count = None
+    self._script = None
+    self._stage = None
+    self._job_count = 0
+    self._job_id = None
+    self.timings = []
+    for macro in _MACROS:
+      self._connection.execute(macro)
+    for schema in _METADATA_SCHEMAS:
+      self._connection.execute(schema)
+    self._profile_path = None
+    self._column_bytes = {}
+    if profile:
+      profile_file, self._profile_path = tempfile.mkstemp(suffix='.json')
+      os.close(profile_file)
+      self._connection.execute("PRAGMA enable_profiling = 'json'")
+      self._connection.execute("PRAGMA profiling_coverage = 'ALL'")
+      self._connection.execute(
+          f'PRAGMA profiling_output = {_encode_string(self._profile_path)}')
+
+  @property
+  def current_date(self) -> datetime.date:
+    return self._current_date
+
+  @current_date.setter
+  def current_date(self, current_date: datetime.date) -> None:
+    """Moves CURRENT_DATE(), e.g. to run the workflow of the next day."""
+    self._current_date = current_date
+    self._translator = _Translator(current_date)
+
+  def close(self) -> None:
+    self._connection.close()
+    if self._profile_path:
+      os.remove(self._profile_path)
+
+  def load_table(self, table_name: str, data: Any) -> int:
+    """Replaces a table by fixture data.
+
+    A "p_<table>" table with a "_DATA_DATE" column gets a "<table>" view adding
+    "_LATEST_DATE", as the views created by the Google Ads transfer.
+
+    Args:
+      table_name: The table name, e.g. "Products_1234".
+      data: A pyarrow Table, a pandas DataFrame or the path of a Parquet or
+        CSV file.
+
+    Returns:
+      The number of rows loaded.
+    """
+    if isinstance(data, str):
+      reader = 'read_parquet' if data.endswith('.parquet') else 'read_csv'
+      source = f'{reader}({_encode_string(data)})'
+    else:
+      self._connection.register('__fixture', data)
+      source = '__fixture'
+    try:
+      self._connection.execute(
+          f'CREATE OR REPLACE TABLE "{table_name}" AS SELECT * FROM {source}')
+    finally:
+      if source == '__fixture':
+        self._connection.unregister('__fixture')
+    columns = [
+        row[0] for row in self._connection.execute(
+            'SELECT column_name FROM duckdb_columns() WHERE table_name = ? '
+            'AND NOT internal', [table_name]).fetchall()
+    ]
+    self._set_modified(table_name)
+    for column in _PARTITION_PSEUDO_COLUMNS:
+      if column in columns:
+        self._partition_columns[table_name] = column
+    if (table_name.startswith(_TRANSFER_TABLE_PREFIX) and
+        '_DATA_DATE' in columns):
+      self._connection.execute(
+          f'CREATE OR REPLACE VIEW "{table_name[len(_TRANSFER_TABLE_PREFIX):]}"'
+          f' AS SELECT *, MAX(_DATA_DATE) OVER () AS _LATEST_DATE '
+          f'FROM "{table_name}"')
+    row_count = self._connection.execute(
+        f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+    logging.info('Loaded %d rows to %s.', row_count, table_name)
+    return row_count
+
+  def load_fixtures(self, fixture_dir: str) -> Dict[str, int]:
+    """Loads the fixture files of a directory.
+
+    The reference tables are read with their declared schemas, from the data
+    directory if they have no fixture file.
+
+    Args:
+      fixture_dir: Directory of Parquet and CSV files named after their table.
+
+    Returns:
+      The number of rows loaded, keyed by table name.
+    """
+    row_counts = {}
+    for file_path in sorted(glob.glob(os.path.join(fixture_dir, '*'))):
+      extension = next((extension for extension in _FIXTURE_EXTENSIONS
+                        if file_path.endswith(extension)), None)
+      if not extension:
+        continue
+      table_name = os.path.basename(file_path)[:-len(extension)]
+      reference_table = next(
+          (table for table in reference_data.REFERENCE_TABLES
+           if table.table_name == table_name), None)
+      if reference_table:
+        data = reference_data.read_reference_file(file_path, reference_table)
+      else:
+        data = file_path
+      row_counts[table_name] = self.load_table(table_name, data)
+    for table in reference_data.REFERENCE_TABLES:
+      if table.table_name in row_counts:
+        continue
+      try:
+        file_path = reference_data.find_reference_file(table)
+      except FileNotFoundError as error:
+        logging.warning('%s', error)
+        continue
+      row_counts[table.table_name] = self.load_table(
+          table.table_name,
+          reference_data.read_reference_file(file_path, table))
+    return row_counts
+
+  def run_sql(self, sql: str, script: str = '<sql>') -> None:
+    """Runs a BigQuery script.
+
+    Args:
+      sql: The script, rendered.
+      script: Name of the script, for the timings and the errors.
+    """
+    self._script = script
+    self._job_count += 1
+    self._job_id = f'local_{self._job_count}'
+    self._stage = None
+    scope = self._new_scope()
+    try:
+      for node in _parse_script(sql, script):
+        self._stage = node.source.stage
+        self._execute_node(node, scope)
+    except _Return:
+      pass
+    finally:
+      for table_name in sorted(self._temporary_tables):
+        self._connection.execute(f'DROP TABLE IF EXISTS temp."{table_name}"')
+      self._temporary_tables.clear()
+      self._column_bytes = {
+          key: size
+          for key, size in self._column_bytes.items()
+          if not key[0].startswith('temp.')
+      }
+
+  def run_file(self, sql_path: str) -> None:
+    """Renders and runs a script of the scripts directory."""
+    query_params = {
+        'project_id': self.project_id,
+        'dataset': self.dataset_id,
+        'merchant_id': self.merchant_id,
+        'external_customer_id': self.customer_id
+    }
+    self.run_sql(
+        cloud_bigquery.configure_sql(sql_path, query_params),
+        os.path.relpath(sql_path, _SCRIPTS_DIR))
+
+  def run_installer(self, enable_market_insights: bool = False) -> None:
+    """Runs the scripts of the installation, in order."""
+    for sql_file in cloud_bigquery.get_sql_files(enable_market_insights):
+      self.run_file(os.path.join(_SCRIPTS_DIR, sql_file))
+
+  def run_main_workflow(self) -> None:
+    """Runs the main workflow, i.e. the scheduled query."""
+    self.run_sql(
+        cloud_bigquery.get_main_workflow_sql(self.project_id, self.dataset_id,
+                                             self.merchant_id,
+                                             self.customer_id),
+        'main_workflow.sql')
+
+  def run_best_sellers_workflow(self) -> None:
+    """Runs the best sellers workflow of market insights."""
+    self.run_sql(
+        cloud_bigquery.get_best_sellers_workflow_sql(self.project_id,
+                                                     self.dataset_id,
+                                                     self.merchant_id),
+        'market_insights/best_sellers_workflow.sql')
+
+  def query(self, sql: str) -> List[Dict[str, Any]]:
+    """Runs a BigQuery query, e.g. on the tables of the dashboard.
+
+    Args:
+      sql: A query, whose table ids are mapped to the local tables.
+
+    Returns:
+      The rows returned by the query.
+    """
+    translation = self._translator.translate(
+        self._substitute(_tokenize(sql), None))
+    self._refresh_metadata(translation.sql)
+    result = self._connection.execute(translation.sql)
+    column_names = [column[0] for column in result.description]
+    return [dict(zip(column_names, row)) for row in result.fetchall()]
+
+  def _new_scope(self, parent: Optional[_Scope] = None) -> _Scope:
+    self._scope_count += 1
+    return _Scope(f'v{self._scope_count}', parent)
+
+  def _set_modified(self, table_name: str) -> None:
+    self._modified_times[table_name] = datetime.datetime.now(
+        datetime.timezone.utc)
+    self._is_metadata_changed = True
+
+  def _execute_nodes(self, nodes: Sequence[Any], scope: _Scope) -> None:
+    for node in nodes:
+      self._execute_node(node, scope)
+
+  def _execute_node(self, node: Any, scope: _Scope) -> None:
+    """Runs a statement or a block."""
+    if isinstance(node, _Statement):
+      self._execute_statement(node, scope)
+    elif isinstance(node, _If):
+      for condition, nodes in node.branches:
+        if self._evaluate_condition(condition, scope, node.source):
+          self._execute_nodes(nodes, scope)
+          return
+      self._execute_nodes(node.else_nodes, scope)
+    elif isinstance(node, (_Loop, _While)):
+      while isinstance(node, _Loop) or self._evaluate_condition(
+          node.condition, scope, node.source):
+        try:
+          self._execute_nodes(node.nodes, scope)
+        except _Break:
+          break
+        except _Continue:
+          continue
+    elif isinstance(node, _Block):
+      self._execute_nodes(node.nodes, self._new_scope(scope))
+    elif isinstance(node, _Procedure):
+      self._procedures[node.name.lower()] = node
+
+  def _execute_statement(self, node: _Statement, scope: _Scope) -> None:
+    """Runs a statement, interpreting the scripting statements."""
+    tokens = [node.tokens[index] for index in _significant(node.tokens)]
+    words = [token.text.upper() if _is_word(token) else None
+             for token in tokens]
+    if words[0] == 'DECLARE':
+      self._declare(node, scope)
+    elif words[0] == 'SET':
+      if tokens[1].kind != 'sysvar':
+        self._set(node, scope)
+    elif words[0] in ('BREAK', 'LEAVE'):
+      raise _Break()
+    elif words[0] in ('CONTINUE', 'ITERATE'):
+      raise _Continue()
+    elif words[0] == 'RETURN':
+      raise _Return()
+    elif words[0] == 'CALL':
+      self._call(node, scope)
+    elif words[0] == 'EXECUTE' and words[1:2] == ['IMMEDIATE']:
+      self._execute_immediate(node, scope)
+    elif words[0] in ('BEGIN', 'COMMIT', 'ROLLBACK'):
+      self._connection.execute(f'{words[0]} TRANSACTION')
+    elif words[0] == 'CREATE' and 'FUNCTION' in words[:6]:
+      self._create_function(node)
+    else:
+      translation = self._translator.translate(
+          self._substitute(node.tokens, scope))
+      self._execute(translation, node.source)
+
+  def _declare(self, node: _Statement, scope: _Scope) -> None:
+    """DECLARE name[, ...] [type] [DEFAULT expression]."""
+    indexes = _significant(node.tokens)
+    tokens = [node.tokens[index] for index in indexes]
+    names = [tokens[1].text]
+    position = 2
+    while _is_op(tokens[position], ','):
+      names.append(tokens[position + 1].text)
+      position += 2
+    variable_type = None
+    if not _is_word(tokens[position], 'DEFAULT'):
+      variable_type, position = _parse_type(tokens, position)
+    value_sql = 'NULL'
+    if position < len(tokens) and _is_word(tokens[position], 'DEFAULT'):
+      value_sql = self._translator.translate_expression(
+          self._substitute(node.tokens[indexes[position] + 1:], scope))
+    for name in names:
+      self._set_variable(scope.declare(name, variable_type), value_sql,
+                         node.source)
+
+  def _set(self, node: _Statement, scope: _Scope) -> None:
+    """SET name = expression or SET (name, ...) = (expression, ...)."""
+    items = _group(node.tokens)
+    indexes = _significant(items)
+    target = items[indexes[1]]
+    value = items[indexes[3]:indexes[-1] + 1]
+    if _is_group(target):
+      names = [_to_sql(name).strip() for name in _split_items(target.items)]
+      value_group = value[0]
+      values = _split_items(value_group.items) if len(value) == 1 and (
+          _is_group(value_group)) else None
+      if values is None or len(values) != len(names):
+        raise UnsupportedStatementError(
+            f'{node.source.script}:{node.source.line}: SET of several '
+            'variables needs as many values.')
+    else:
+      names = [target.text]
+      values = [value]
+    for name, value_items in zip(names, values):
+      variable = scope.lookup(name)
+      if variable is None:
+        raise UnsupportedStatementError(
+            f'{node.source.script}:{node.source.line}: Undeclared variable '
+            f'{name}.')
+      value_sql = self._translator.translate_expression(
+          self._substitute(_flatten(value_items), scope))
+      self._set_variable(variable, value_sql, node.source)
+
+  def _set_variable(self, variable: _Variable, value_sql: str,
+                    source: _Source) -> None:
+    if variable.type:
+      value_sql = f'CAST(({value_sql}) AS {variable.type})'
+    else:
+      value_sql = f'({value_sql})'
+    self._execute(
+        _Translation(f'SET VARIABLE {variable.duckdb_name} = {value_sql}',
+                     'SET', None, False, None), source)
+
+  def _evaluate(self, tokens: Sequence[_Token], scope: _Scope,
+                source: _Source) -> Any:
+    """Returns the value of an expression."""
+    expression_sql = self._translator.translate_expression(
+        self._substitute(tokens, scope))
+    return self._execute(
+        _Translation(f'SELECT ({expression_sql})', 'SELECT', None, False,
+                     None), source)[0][0]
+
+  def _evaluate_condition(self, tokens: Sequence[_Token], scope: _Scope,
+                          source: _Source) -> bool:
+    return self._evaluate(tokens, scope, source) is True
+
+  def _call(self, node: _Statement, scope: _Scope) -> None:
+    """CALL procedure(argument, ...)."""
+    items = _group(node.tokens)
+    indexes = _significant(items)
+    name = _map_table_id(items[indexes[1]].text)
+    procedure = self._procedures.get(name.lower())
+    if procedure is None:
+      raise UnsupportedStatementError(
+          f'{node.source.script}:{node.source.line}: Unknown procedure '
+          f'{name}.')
+    arguments = _split_items(items[indexes[2]].items)
+    procedure_scope = self._new_scope()
+    for (parameter, parameter_type), argument in zip(procedure.parameters,
+                                                     arguments):
+      value_sql = self._translator.translate_expression(
+          self._substitute(_flatten(argument), scope))
+      self._set_variable(
+          procedure_scope.declare(parameter, parameter_type), value_sql,
+          node.source)
+    try:
+      self._execute_nodes(procedure.nodes, procedure_scope)
+    except _Return:
+      pass
+
+  def _execute_immediate(self, node: _Statement, scope: _Scope) -> None:
+    """EXECUTE IMMEDIATE expression, without USING or INTO."""
+    indexes = _significant(node.tokens)
+    sql = self._evaluate(node.tokens[indexes[1] + 1:], scope, node.source)
+    if sql is None:
+      raise ExecutionError(f'{node.source.script}:{node.source.line}: '
+                           'EXECUTE IMMEDIATE of NULL.')
+    for dynamic_node in _parse_script(
+        sql, f'{node.source.script}:{node.source.line}'):
+      self._execute_node(dynamic_node, self._new_scope())
+
+  def _create_function(self, node: _Statement) -> None:
+    """Replaces the constructParsedCriteria JavaScript UDF by a Python one."""
+    tokens = [node.tokens[index] for index in _significant(node.tokens)]
+    name = _map_table_id(next(
+        token.text for token in tokens if token.kind == 'quoted'))
+    body = _decode_string(
+        next(token.text for token in reversed(tokens)
+             if token.kind == 'string'))
+    table_match = _PARSED_CRITERIA_INSERT_PATTERN.search(body)
+    if 'getParsedCriteria' not in body or not table_match:
+      raise UnsupportedStatementError(
+          f'{node.source.script}:{node.source.line}: Only the '
+          'constructParsedCriteria function is supported.')
+    table_id = table_match.group(1)
+
+    def construct_parsed_criteria(criterions: List[str]) -> str:
+      return construct_parsed_criteria_sql(criterions, table_id)
+
+    try:
+      self._connection.remove_function(name)
+    except duckdb.InvalidInputException:
+      pass
+    self._connection.create_function(name, construct_parsed_criteria,
+                                     [duckdb.list_type('VARCHAR')], 'VARCHAR')
+
+  def _substitute(self, tokens: Sequence[_Token],
+                  scope: Optional[_Scope]) -> List[_Token]:
+    """Maps the literals, names and variables of a statement to DuckDB."""
+    substituted_tokens = []
+    indexes = _significant(tokens)
+    for position, index in enumerate(indexes):
+      if position:
+        substituted_tokens.extend(
+            _Token('space', ' ', token.line)
+            for token in tokens[indexes[position - 1] + 1:index][:1])
+      token = tokens[index]
+      previous = tokens[indexes[position - 1]] if position else None
+      following = (
+          tokens[indexes[position + 1]]
+          if position + 1 < len(indexes) else None)
+      if token.kind == 'string':
+        token = _Token('string', _encode_string(_decode_string(token.text)),
+                       token.line)
+      elif token.kind == 'quoted':
+        token = _Token('quoted', f'"{_map_table_id(token.text)}"', token.line)
+      elif token.kind == 'param':
+        if token.text.lower() != '@run_date':
+          raise UnsupportedStatementError(
+              f'Unknown query parameter {token.text} at line {token.line}.')
+        token = _raw(f"DATE '{self.run_date.isoformat()}'")
+      elif token.kind == 'sysvar':
+        name = token.text.lower()
+        if name == '@@row_count':
+          token = _raw('NULL' if self._row_count is None else str(
+              self._row_count))
+        elif name == '@@script.job_id':
+          token = _raw(_encode_string(self._job_id))
+        else:
+          raise UnsupportedStatementError(
+              f'Unknown system variable {token.text} at line {token.line}.')
+      elif _is_word(token) and scope:
+        variable = scope.lookup(token.text)
+        if (variable and not _is_op(previous, '.') and
+            not _is_word(previous, 'AS') and not _is_group(following) and
+            not _is_op(following, '(')):
+          token = _raw(f"getvariable('{variable.duckdb_name}')")
+      substituted_tokens.append(token)
+    return substituted_tokens
+
+  def _execute(self, translation: _Translation,
+               source: _Source) -> Optional[List[Tuple[Any, ...]]]:
+    """Runs a translated statement and records its timing."""
+    self._refresh_metadata(translation.sql)
+    started_at = time.perf_counter()
+    try:
+      result = self._connection.execute(translation.sql)
+      rows = result.fetchall() if result.description else None
+    except duckdb.Error as error:
+      raise ExecutionError(
+          f'{source.script}:{source.line}: {error}\n{translation.sql}'
+      ) from error
+    seconds = time.perf_counter() - started_at
+    rows_scanned, bytes_scanned = (
+        self._get_scan_stats() if self._profile_path else (None, None))
+    row_count = None
+    if translation.kind in _DML_STATEMENTS and rows:
+      row_count = rows[0][0]
+      self._row_count = row_count
+    elif translation.kind in ('SELECT', 'WITH') and rows is not None:
+      row_count = len(rows)
+    elif (translation.kind == 'CREATE' and rows and
+          not _is_view_definition(translation)):
+      row_count = rows[0][0]
+    if translation.target and translation.kind in _WRITE_STATEMENTS:
+      self._record_write(translation)
+    description = ' '.join(
+        part for part in (translation.kind, translation.target) if part)
+    self.timings.append(
+        StatementTiming(self._script, f'{source.script}:{source.line}',
+                        self._stage, description, seconds, row_count,
+                        rows_scanned, bytes_scanned))
+    return rows
+
+  def _get_scan_stats(self) -> Tuple[int, int]:
+    """Returns the rows scanned by the last statement and the bytes estimate.
+
+    The bytes are estimated as BigQuery bills them, by the columns read: the
+    rows scanned by each table scan times the average size of the columns it
+    reads. Filters pushed down to the scans reduce the rows scanned, as
+    partition pruning reduces the bytes billed.
+    """
+    with open(self._profile_path) as profile_file:
+      profile = json.load(profile_file)
+    rows_scanned = 0
+    bytes_scanned = 0
+    operators = [profile]
+    while operators:
+      operator = operators.pop()
+      operators.extend(operator.get('children', []))
+      if operator.get('operator_type') != 'TABLE_SCAN':
+        continue
+      extra_info = operator.get('extra_info') or {}
+      row_count = operator.get('operator_rows_scanned') or 0
+      columns = extra_info.get('Projections') or []
+      if isinstance(columns, str):
+        columns = [columns]
+      rows_scanned += row_count
+      bytes_scanned += row_count * sum(
+          self._get_column_bytes(extra_info['Table'], column)
+          for column in columns)
+    return rows_scanned, round(bytes_scanned)
+
+  def _get_column_bytes(self, table: str, column: str) -> float:
+    """Returns the average size of a column of a table in BigQuery.
+
+    Args:
+      table: The table, with its catalog and schema, e.g.
+        "memory.main.Products_1234".
+      column: The column, or the path of a field of a struct column.
+
+    Returns:
+      The average size in bytes of the column, cached until the table is
+      changed.
+    """
+    table_name = table.split('.')[-1]
+    key = (table, column, self._modified_times.get(table_name))
+    if key in self._column_bytes:
+      return self._column_bytes[key]
+    table_sql = '.'.join(f'"{part}"' for part in table.split('.'))
+    column_sql = '.'.join(f'"{part}"' for part in column.split('.'))
+    try:
+      column_type = self._connection.execute(
+          f'SELECT typeof({column_sql}) FROM {table_sql} LIMIT 1').fetchone()
+      if not column_type:
+        size = 0
+      elif column_type[0] in _FIXED_TYPE_BYTES:
+        size = _FIXED_TYPE_BYTES[column_type[0]]
+      elif column_type[0].startswith('DECIMAL'):
+        size = _DECIMAL_BYTES
+      else:
+        size = self._connection.execute(
+            f'SELECT COALESCE(AVG(octet_length(CAST({column_sql} AS VARCHAR))),'
+            f' 0) FROM {table_sql}').fetchone()[0]
+    except duckdb.Error:
+      size = 0
+    self._column_bytes[key] = size
+    return size
+
+  def _record_write(self, translation: _Translation) -> None:
+    """Tracks the tables written to, for the metadata tables."""
+    target = translation.target
+    if translation.kind == 'DROP':
+      self._modified_times.pop(target, None)
+      self._partition_columns.pop(target, None)
+      self._metadata_views.discard(target)
+      self._is_metadata_changed = True
+      return
+    if translation.is_temporary:
+      self._temporary_tables.add(target)
+      return
+    if _is_view_definition(translation):
+      if self._references_metadata(translation.sql):
+        self._metadata_views.add(target)
+    if translation.partition_column:
+      self._partition_columns[target] = translation.partition_column
+    self._set_modified(target)
+
+  def _references_metadata(self, sql: str) -> bool:
+    return any(f'"{name}"' in sql
+               for name in _METADATA_TABLES + tuple(self._metadata_views))
+
+  def _refresh_metadata(self, sql: str) -> None:
+    """Rebuilds the metadata tables read by a statement if they are stale."""
+    if not self._is_metadata_changed or not self._references_metadata(sql):
+      return
+    for schema in _METADATA_SCHEMAS:
+      self._connection.execute(schema)
+    tables = self._connection.execute(
+        'SELECT table_name, estimated_size FROM duckdb_tables() '
+        'WHERE NOT temporary AND NOT internal').fetchall()
+    views = self._connection.execute(
+        'SELECT view_name FROM duckdb_views() '
+        'WHERE NOT temporary AND NOT internal').fetchall()
+    tables = [(name, size) for name, size in tables
+              if name not in _METADATA_TABLES]
+    self._connection.executemany(
+        f'INSERT INTO {_TABLES_TABLE} VALUES (?, ?)',
+        [[name, 'BASE TABLE'] for name, _ in tables] +
+        [[name, 'VIEW'] for name, in views])
+    columns = self._connection.execute(
+        'SELECT table_name, column_name, column_index, data_type '
+        "FROM duckdb_columns() WHERE database_name <> 'temp' AND NOT internal "
+        'ORDER BY table_name, column_index').fetchall()
+    self._connection.executemany(
+        f'INSERT INTO {_COLUMNS_TABLE} VALUES (?, ?, ?, ?, ?)', [[
+            table_name, column_name, column_index, data_type,
+            'YES' if self._partition_columns.get(table_name) == column_name
+            else 'NO'
+        ] for table_name, column_name, column_index, data_type in columns
+                                                 if table_name not in
+                                                 _METADATA_TABLES])
+    default_time = min(self._modified_times.values(),
+                       default=datetime.datetime.now(datetime.timezone.utc))
+    for table_name, size in tables:
+      modified_time = self._modified_times.get(table_name, default_time)
+      partition_column = self._partition_columns.get(table_name)
+      partition_id = (f"strftime({partition_column}, '%Y%m%d')"
+                      if partition_column else 'NULL')
+      self._connection.execute(
+          f'INSERT INTO {_PARTITIONS_TABLE} SELECT ?, {partition_id}, '
+          f'COUNT(*), ? FROM "{table_name}" GROUP BY ALL',
+          [table_name, modified_time])
+      self._connection.execute(
+          f'INSERT INTO {_LEGACY_TABLES_TABLE} SELECT ?, COUNT(*), ?, ? '
+          f'FROM "{table_name}"',
+          [table_name, size, int(modified_time.timestamp() * 1000)])
+    self._is_metadata_changed = False
+
+
+def format_timings(timings: Sequence[StatementTiming],
+                   top: int = _DEFAULT_TOP_STATEMENTS) -> str:
+  """Formats the slowest statements and the total time per script and stage.
+
+  Args:
+    timings: Statement timings, e.g. LocalHarness.timings.
+    top: Number of slowest statements listed.
+
+  Returns:
+    The tables of the totals and of the slowest statements.
+  """
+  totals = collections.OrderedDict()
+  for timing in timings:
+    key = (timing.script, timing.stage or '-')
+    totals[key] = totals.get(key, 0) + timing.seconds
+  lines = [f'{"script":<44} {"stage":<20} {"seconds":>9}']
+  for (script, stage), seconds in totals.items():
+    lines.append(f'{script:<44} {stage:<20} {seconds:>9.3f}')
+  lines.append(f'{"total":<65} {sum(totals.values()):>9.3f}')
+  lines.append('')
+  lines.append(f'{"source":<44} {"statement":<32} {"rows":>10} {"seconds":>9}')
+  for timing in sorted(timings, key=lambda timing: -timing.seconds)[:top]:
+    row_count = '-' if timing.row_count is None else timing.row_count
+    lines.append(f'{timing.source[:44]:<44} {timing.statement[:32]:<32} '
+                 f'{row_count:>10} {timing.seconds:>9.3f}')
+  return '\n'.join(lines)
+
+
+def parse_arguments() -> argparse.Namespace:
+  """Initialize command line parser using argparse.
+
+  Returns:
+    An argparse.ArgumentParser.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--fixture_dir',
+      help='Directory of the Parquet and CSV fixture tables.',
+      required=True)
+  parser.add_argument(
+      '--merchant_id', help='Google Merchant Center Account Id.',
+      required=True)
+  parser.add_argument(
+      '--ads_customer_id',
+      help='Google Ads External Customer Id.',
+      required=True)
+  parser.add_argument(
+      '--run_date',
+      help='Run date of the main workflow, YYYY-MM-DD.',
+      type=datetime.date.fromisoformat,
+      default=None)
+  parser.add_argument(
+      '--current_date',
+      help='Date returned by CURRENT_DATE(), YYYY-MM-DD.',
+      type=datetime.date.fromisoformat,
+      default=None)
+  parser.add_argument(
+      '--market_insights',
+      help='Run the market insights scripts and workflow.',
+      action='store_true')
+  parser.add_argument(
+      '--database',
+      help='DuckDB database file, in memory if not set.',
+      default=':memory:')
+  parser.add_argument(
+      '--top',
+      help='Number of slowest statements reported.',
+      type=int,
+      default=_DEFAULT_TOP_STATEMENTS)
+  return parser.parse_args()
+
+
+def main():
+  args = parse_arguments()
+  merchant_id = args.merchant_id
+  ads_customer_id = args.ads_customer_id.replace('-', '')
+  harness = LocalHarness(
+      merchant_id,
+      ads_customer_id,
+      run_date=args.run_date,
+      current_date=args.current_date,
+      database=args.database)
+  harness.load_fixtures(args.fixture_dir)
+  harness.run_installer(args.market_insights)
+  harness.run_main_workflow()
+  if args.market_insights:
+    harness.run_best_sellers_workflow()
+  print(format_timings(harness.timings, args.top))
+  harness.close()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,284 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Tests for the BigQuery to DuckDB translation of local_harness."""
+
+import datetime
+import tempfile
+import unittest
+
+import local_harness
+import pyarrow
+import synthetic_data
+
+_CURRENT_DATE = datetime.date(2021, 10, 1)
+_STAGES = ('parse_criteria', 'targeting', 'product_detailed',
+           'product_historical', 'dashboard_cubes')
+
+
+def _translate(sql: str) -> local_harness._Translation:
+  translator = local_harness._Translator(_CURRENT_DATE)
+  return translator.translate(local_harness._tokenize(sql))
+
+
+class TranslatorTest(unittest.TestCase):
+
+  def test_types(self):
+    self.assertEqual(
+        _translate('SELECT CAST(a AS INT64), SAFE_CAST(b AS STRING), '
+                   'ARRAY<STRUCT<c FLOAT64, d BOOL>>[]').sql,
+        'SELECT CAST(a AS BIGINT), try_cast(b AS VARCHAR), '
+        'STRUCT("c" DOUBLE, "d" BOOLEAN)[][]')
+
+  def test_array_subscripts(self):
+    self.assertEqual(
+        _translate('SELECT a[OFFSET(0)], a[SAFE_ORDINAL(2)]').sql,
+        'SELECT a[(0) + 1], a[(2)]')
+
+  def test_current_date_and_renamed_functions(self):
+    self.assertEqual(
+        _translate('SELECT DATE_SUB(CURRENT_DATE(), INTERVAL 1 DAY), '
+                   'COUNTIF(a), TO_HEX(MD5(b))').sql,
+        "SELECT bq_date_sub(DATE '2021-10-01', INTERVAL 1 DAY), "
+        'count_if(a), (MD5(b))')
+
+  def test_group_by_select_list_alias(self):
+    self.assertEqual(
+        _translate('SELECT LOWER(brand) AS brand, COUNT(*) FROM t '
+                   'GROUP BY brand').sql,
+        'SELECT LOWER(brand) AS brand, COUNT(*) FROM t GROUP BY 1')
+
+  def test_comma_join_of_array_path(self):
+    sql = _translate('SELECT d.status FROM t, t.destinations AS d').sql
+
+    self.assertIn(' CROSS JOIN ', sql)
+    self.assertIn(
+        'LATERAL (SELECT UNNEST(t.destinations, recursive := true, '
+        'max_depth := 2) AS d) AS d', sql)
+
+  def test_create_table_options_are_stripped(self):
+    translation = _translate(
+        'CREATE OR REPLACE TABLE `project.markup.Result` '
+        'PARTITION BY DATE(created) CLUSTER BY a '
+        "OPTIONS(description='x') AS SELECT 1 AS a")
+
+    self.assertEqual(translation.kind, 'CREATE')
+    self.assertEqual(translation.target, 'Result')
+    self.assertEqual(translation.partition_column, 'created')
+    self.assertNotIn('PARTITION', translation.sql)
+    self.assertNotIn('OPTIONS', translation.sql)
+
+  def test_insert_target(self):
+    translation = _translate('INSERT `project.markup.Result` (a) VALUES (1)')
+
+    self.assertEqual(translation.target, 'Result')
+    self.assertTrue(translation.sql.startswith('INSERT INTO `'))
+
+  def test_information_schema_table_ids(self):
+    self.assertEqual(
+        local_harness._map_table_id('`project.markup.INFORMATION_SCHEMA.'
+                                    'PARTITIONS`'),
+        '__information_schema_partitions')
+    self.assertEqual(
+        local_harness._map_table_id('project.markup.__TABLES__'), '__tables__')
+
+  def test_unbalanced_parenthesis(self):
+    with self.assertRaises(local_harness.ScriptSyntaxError):
+      _translate('SELECT (1')
+
+
+class LocalHarnessTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.harness = local_harness.LocalHarness(
+        '1234', '5678', current_date=_CURRENT_DATE)
+    self.addCleanup(self.harness.close)
+    self.harness.load_table(
+        'Products_1234',
+        pyarrow.table({
+            'offer_id': ['a', 'b', 'c'],
+            'brand': ['X', 'x', 'y'],
+            '_PARTITIONDATE': [_CURRENT_DATE] * 3,
+            'destinations': [[{
+                'name': 'Shopping',
+                'approved_countries': ['US', 'FR']
+            }], [{
+                'name': 'Shopping',
+                'approved_countries': []
+            }], []],
+        }))
+
+  def test_unnest_joins(self):
+    inner_rows = self.harness.query(
+        'SELECT offer_id, country FROM `local.markup.Products_1234` AS p, '
+        'p.destinations AS d, d.approved_countries AS country ORDER BY 1, 2')
+    outer_rows = self.harness.query(
+        'SELECT offer_id, country FROM `local.markup.Products_1234` AS p '
+        'LEFT JOIN UNNEST(p.destinations) AS d '
+        'LEFT JOIN d.approved_countries AS country ORDER BY 1, 2')
+
+    self.assertEqual(inner_rows, [{
+        'offer_id': 'a',
+        'country': 'FR'
+    }, {
+        'offer_id': 'a',
+        'country': 'US'
+    }])
+    self.assertEqual([row['offer_id'] for row in outer_rows],
+                     ['a', 'a', 'b', 'c'])
+
+  def test_group_by_alias_shadowing_a_column(self):
+    rows = self.harness.query(
+        'SELECT LOWER(brand) AS brand, COUNT(*) AS product_count '
+        'FROM `local.markup.Products_1234` GROUP BY brand ORDER BY brand')
+
+    self.assertEqual(rows, [{
+        'brand': 'x',
+        'product_count': 2
+    }, {
+        'brand': 'y',
+        'product_count': 1
+    }])
+
+  def test_functions_and_values(self):
+    rows = self.harness.query(
+        'SELECT SAFE_DIVIDE(1, 0) AS a, SAFE_DIVIDE(6, 3) AS b, '
+        '[1, 2, 3][OFFSET(0)] AS c, [1, 2, 3][SAFE_OFFSET(5)] AS d, '
+        "FORMAT('%s-%d%%', 'e', 1) AS e, "
+        'DATE_SUB(CURRENT_DATE(), INTERVAL 1 DAY) AS f, '
+        "STRUCT(1 AS x, 'y' AS y) AS g, "
+        "ARRAY_LENGTH([STRUCT(1 AS x, 'y' AS y), (2, 'z')]) AS h")
+
+    self.assertEqual(rows, [{
+        'a': None,
+        'b': 2,
+        'c': 1,
+        'd': None,
+        'e': 'e-1%',
+        'f': datetime.date(2021, 9, 30),
+        'g': {
+            'x': 1,
+            'y': 'y'
+        },
+        'h': 2
+    }])
+
+  def test_information_schema(self):
+    tables = self.harness.query(
+        'SELECT table_name FROM `local.markup.INFORMATION_SCHEMA.TABLES`')
+    partitions = self.harness.query(
+        'SELECT partition_id '
+        'FROM `local.markup.INFORMATION_SCHEMA.PARTITIONS` '
+        "WHERE table_name = 'Products_1234'")
+
+    self.assertEqual(tables, [{'table_name': 'Products_1234'}])
+    self.assertEqual(partitions, [{'partition_id': '20211001'}])
+
+  def test_scripting_statements(self):
+    self.harness.run_sql("""DECLARE i INT64 DEFAULT 0;
+CREATE TEMP TABLE Numbers (n INT64);
+WHILE i < 3 DO
+  SET i = i + 1;
+  IF MOD(i, 2) = 1 THEN
+    INSERT Numbers VALUES (i);
+  END IF;
+END WHILE;
+CREATE OR REPLACE TABLE `local.markup.Result` PARTITION BY data_date AS
+SELECT SUM(n) AS total, CURRENT_DATE() AS data_date FROM Numbers;
+""")
+
+    self.assertEqual(
+        self.harness.query('SELECT * FROM `local.markup.Result`'), [{
+            'total': 4,
+            'data_date': _CURRENT_DATE
+        }])
+    # The temporary table is dropped at the end of the script.
+    self.assertEqual(
+        self.harness.query(
+            'SELECT table_name FROM `local.markup.INFORMATION_SCHEMA.TABLES` '
+            'ORDER BY table_name'), [{
+                'table_name': 'Products_1234'
+            }, {
+                'table_name': 'Result'
+            }])
+
+
+class MainWorkflowRunStateTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.tables = synthetic_data.generate_tables(
+        '1234', '5678',
+        synthetic_data.Scale(
+            products=10, days=2, criteria=3, seed=1, end_date=_CURRENT_DATE))
+    self.harness = local_harness.LocalHarness(
+        '1234', '5678', current_date=_CURRENT_DATE)
+    self.addCleanup(self.harness.close)
+    with tempfile.TemporaryDirectory() as fixture_dir:
+      synthetic_data.write_tables(self.tables, fixture_dir)
+      self.harness.load_fixtures(fixture_dir)
+    self.harness.run_installer()
+
+  def _run_main_workflow(self, run_date=None):
+    """Runs the main workflow and returns the stages it skipped."""
+    self.harness.run_date = run_date or self.harness.current_date
+    self.harness.run_main_workflow()
+    return [
+        row['stage'] for row in self.harness.query(
+            'SELECT stage FROM `local.markup.workflow_run_log` '
+            'WHERE script_job_id = (SELECT MAX(script_job_id) '
+            'FROM `local.markup.workflow_run_log`) AND skipped '
+            'ORDER BY started_at')
+    ]
+
+  def test_rerun_skips_all_stages(self):
+    self.assertEqual(self._run_main_workflow(), [])
+
+    self.assertEqual(self._run_main_workflow(), list(_STAGES))
+
+  def test_run_after_backfill_parses_criteria_again(self):
+    self._run_main_workflow()
+    self._run_main_workflow(_CURRENT_DATE - datetime.timedelta(days=1))
+    # New products, the criteria didn't change since the backfill.
+    self.harness.load_table('Products_1234', self.tables['Products_1234'])
+
+    self.assertEqual(self._run_main_workflow(), [])
+
+  def test_new_day_without_new_partitions_runs_all_stages(self):
+    self._run_main_workflow()
+    self.harness.current_date = _CURRENT_DATE + datetime.timedelta(days=1)
+
+    self.assertEqual(self._run_main_workflow(), [])
+
+
+class ParseCriterionTest(unittest.TestCase):
+
+  def test_parse_criterion(self):
+    criterion = ('custom0==sale&+brand==acme&+product_type_l1==*'
+                 '&+channel==channel:online')
+
+    self.assertEqual(
+        local_harness.parse_criterion(criterion), {
+            'criteria': criterion,
+            'custom_label0': 'sale',
+            'brand': 'acme',
+            'channel': 'online'
+        })
+
+
+if __name__ == '__main__':
+  unittest.main()
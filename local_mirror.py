@@ -0,0 +1,437 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Module for keeping a local mirror of the MarkUp output tables.
+
+The first sync copies the tables. The following syncs read the partition
+metadata of each table from INFORMATION_SCHEMA.PARTITIONS and only fetch the
+`data_date` partitions whose row count or last modified time changed. Local
+partitions that no longer exist in BigQuery are removed.
+
+The mirror is stored either as one Parquet file per partition or in a DuckDB
+database, and is queried locally with DuckDB.
+
+Typical usage example:
+  >>> mirror = LocalMirror('project_id', 'markup', '/tmp/markup_mirror')
+  >>> mirror.sync()
+  >>> mirror.read_table('product_historical_materialized',
+  ...                   columns=['data_date', 'total_products'],
+  ...                   row_filter="target_country = 'US'")
+"""
+
+import argparse
+import base64
+import datetime
+import glob
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import cloud_bigquery_storage
+import config_parser
+import duckdb
+from google.cloud import bigquery
+from google.cloud import exceptions
+import pyarrow
+from pyarrow import ipc
+from pyarrow import parquet
+
+MIRRORED_TABLES = (
+    'product_detailed_materialized',
+    'product_historical_materialized',
+    'market_insights_best_sellers_materialized',
+)
+PARQUET_FORMAT = 'parquet'
+DUCKDB_FORMAT = 'duckdb'
+_STORAGE_FORMATS = (PARQUET_FORMAT, DUCKDB_FORMAT)
+_PARTITION_COLUMN = 'data_date'
+_MANIFEST_FILE = 'manifest.json'
+_MANIFEST_PARTITIONS_KEY = 'partitions'
+_MANIFEST_SCHEMAS_KEY = 'schemas'
+_DUCKDB_FILE = 'markup.duckdb'
+# Partition id used for the tables which are not partitioned.
+_TABLE_PARTITION_ID = '__TABLE__'
+_NULL_PARTITION_ID = '__NULL__'
+# Rows in the streaming buffer of a partitioned table.
+_STREAMING_PARTITION_ID = '__UNPARTITIONED__'
+
+# Set logging level.
+logging.getLogger().setLevel(logging.INFO)
+
+
+class Error(Exception):
+  """Base error for this module."""
+
+
+class LocalMirror(object):
+  """Keeps a local copy of MarkUp output tables in sync with BigQuery.
+
+  The partition metadata last seen for each mirrored partition and the Arrow
+  schema of each mirrored table are stored in a manifest file in the mirror
+  directory.
+  """
+
+  def __init__(
+      self,
+      project_id: str,
+      dataset_id: str,
+      mirror_dir: str,
+      storage_format: str = PARQUET_FORMAT,
+      client: Optional[bigquery.Client] = None,
+      read_backend: Optional[cloud_bigquery_storage.ReadSessionBackend] = None
+  ):
+    """Initialise new instance of LocalMirror.
+
+    Args:
+      project_id: A cloud project id.
+      dataset_id: BigQuery dataset id.
+      mirror_dir: Local directory of the mirror.
+      storage_format: Either 'parquet' or 'duckdb'.
+      client: Optional. BigQuery client used to read partition metadata.
+      read_backend: Optional. Backend used to read the partitions. The
+        BigQuery Storage Read API is used if not set.
+
+    Raises:
+      Error: If the storage format is not supported.
+    """
+    if storage_format not in _STORAGE_FORMATS:
+      raise Error(f'Unsupported storage format "{storage_format}". Allowed '
+                  f'values - {", ".join(_STORAGE_FORMATS)}.')
+    self.project_id = project_id
+    self.dataset_id = dataset_id
+    self.mirror_dir = mirror_dir
+    self.storage_format = storage_format
+    self.client = client or bigquery.Client(project=project_id)
+    self.read_backend = read_backend
+    os.makedirs(mirror_dir, exist_ok=True)
+    self._manifest_path = os.path.join(mirror_dir, _MANIFEST_FILE)
+    self._manifest, self._schemas = self._load_manifest()
+
+  def _load_manifest(self) -> Tuple[Dict[str, Dict[str, str]], Dict[str, str]]:
+    """Returns partition signatures and schemas of the mirrored tables."""
+    if not os.path.isfile(self._manifest_path):
+      return {}, {}
+    with open(self._manifest_path, 'r') as manifest_file:
+      manifest = json.load(manifest_file)
+    if _MANIFEST_PARTITIONS_KEY not in manifest:
+      # Manifests of earlier versions only hold the partition signatures.
+      return manifest, {}
+    return manifest[_MANIFEST_PARTITIONS_KEY], manifest[_MANIFEST_SCHEMAS_KEY]
+
+  def _save_manifest(self) -> None:
+    """Writes the partition signatures and schemas atomically."""
+    temp_path = self._manifest_path + '.tmp'
+    with open(temp_path, 'w') as manifest_file:
+      json.dump(
+          {
+              _MANIFEST_PARTITIONS_KEY: self._manifest,
+              _MANIFEST_SCHEMAS_KEY: self._schemas,
+          },
+          manifest_file,
+          indent=2,
+          sort_keys=True)
+    os.replace(temp_path, self._manifest_path)
+
+  def _get_schema(self, table_name: str) -> Optional[pyarrow.Schema]:
+    """Returns the Arrow schema of a mirrored table, None if unknown."""
+    if table_name not in self._schemas:
+      return None
+    return ipc.read_schema(
+        pyarrow.py_buffer(base64.b64decode(self._schemas[table_name])))
+
+  def _set_schema(self, table_name: str, schema: pyarrow.Schema) -> None:
+    """Records the Arrow schema of a mirrored table."""
+    self._schemas[table_name] = base64.b64encode(
+        schema.serialize().to_pybytes()).decode('ascii')
+
+  def _table_exists(self, table_name: str) -> bool:
+    """Returns whether a table exists in the dataset."""
+    try:
+      self.client.get_table(
+          f'{self.project_id}.{self.dataset_id}.{table_name}')
+    except exceptions.NotFound:
+      return False
+    return True
+
+  def _get_remote_partitions(self, table_name: str) -> Dict[str, str]:
+    """Returns signatures of the partitions of a BigQuery table.
+
+    The signature of a partition is its last modified time and row count.
+
+    Args:
+      table_name: Name of the table in the dataset.
+
+    Returns:
+      Partition signatures keyed by partition id. Empty if the table doesn't
+      exist.
+    """
+    query = f"""
+      SELECT
+        IFNULL(partition_id, '{_TABLE_PARTITION_ID}') AS partition_id,
+        total_rows,
+        last_modified_time
+      FROM
+        `{self.project_id}.{self.dataset_id}.INFORMATION_SCHEMA.PARTITIONS`
+      WHERE
+        table_name = @table_name
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter('table_name', 'STRING', table_name)
+    ])
+    rows = self.client.query(
+        query,
+        job_config=job_config,
+        location=config_parser.get_dataset_location()).result()
+    partitions = {}
+    for row in rows:
+      if row.partition_id == _STREAMING_PARTITION_ID:
+        logging.warning('Skipping the streaming buffer of %s.', table_name)
+        continue
+      partitions[row.partition_id] = (
+          f'{row.last_modified_time.isoformat()}|{row.total_rows}')
+    return partitions
+
+  def _get_partition_filter(self, partition_id: str) -> Optional[str]:
+    """Returns the row filter selecting the rows of a partition."""
+    if partition_id == _TABLE_PARTITION_ID:
+      return None
+    if partition_id == _NULL_PARTITION_ID:
+      return f'{_PARTITION_COLUMN} IS NULL'
+    partition_date = datetime.datetime.strptime(partition_id, '%Y%m%d').date()
+    return f"{_PARTITION_COLUMN} = '{partition_date.isoformat()}'"
+
+  def _get_partition_path(self, table_name: str, partition_id: str) -> str:
+    """Returns the Parquet file path of a mirrored partition."""
+    return os.path.join(self.mirror_dir, table_name, f'{partition_id}.parquet')
+
+  def _connect(self) -> duckdb.DuckDBPyConnection:
+    """Returns a DuckDB connection exposing the mirrored tables."""
+    if self.storage_format == DUCKDB_FORMAT:
+      return duckdb.connect(os.path.join(self.mirror_dir, _DUCKDB_FILE))
+    connection = duckdb.connect()
+    for table_name in self._manifest:
+      table_glob = os.path.join(self.mirror_dir, table_name, '*.parquet')
+      if glob.glob(table_glob):
+        connection.execute(
+            f'CREATE VIEW "{table_name}" AS SELECT * FROM '
+            f'read_parquet(\'{table_glob}\', union_by_name = true)')
+        continue
+      schema = self._get_schema(table_name)
+      if schema is not None:
+        # A table without partitions is an empty view with its schema.
+        connection.register(table_name, schema.empty_table())
+    return connection
+
+  def _create_empty_table(self, connection: duckdb.DuckDBPyConnection,
+                          table_name: str) -> None:
+    """Creates the DuckDB table of a table without partitions."""
+    schema = self._get_schema(table_name)
+    if schema is None:
+      return
+    connection.register('empty_table', schema.empty_table())
+    try:
+      connection.execute(f'CREATE TABLE IF NOT EXISTS "{table_name}" AS '
+                         'SELECT * FROM empty_table')
+    finally:
+      connection.unregister('empty_table')
+
+  def _store_partition(self, connection: duckdb.DuckDBPyConnection,
+                       table_name: str, partition_id: str,
+                       parquet_path: str) -> None:
+    """Replaces a partition of the DuckDB table by a fetched Parquet file."""
+    connection.execute(
+        f'CREATE TABLE IF NOT EXISTS "{table_name}" AS SELECT * FROM '
+        f'read_parquet(\'{parquet_path}\') LIMIT 0')
+    self._delete_partition(connection, table_name, partition_id)
+    # The columns are listed, as they may be in another order in the table.
+    column_list = ', '.join(
+        f'"{column}"' for column in parquet.read_schema(parquet_path).names)
+    connection.execute(
+        f'INSERT INTO "{table_name}" ({column_list}) SELECT {column_list} '
+        f'FROM read_parquet(\'{parquet_path}\')')
+    os.remove(parquet_path)
+
+  def _delete_partition(self, connection: Optional[duckdb.DuckDBPyConnection],
+                        table_name: str, partition_id: str) -> None:
+    """Deletes a mirrored partition."""
+    if self.storage_format == PARQUET_FORMAT:
+      partition_path = self._get_partition_path(table_name, partition_id)
+      if os.path.isfile(partition_path):
+        os.remove(partition_path)
+      return
+    partition_filter = self._get_partition_filter(partition_id)
+    where_clause = f'WHERE {partition_filter}' if partition_filter else ''
+    connection.execute(f'DELETE FROM "{table_name}" {where_clause}')
+
+  def sync_table(self, table_name: str) -> Dict[str, int]:
+    """Fetches the new or changed partitions of a table.
+
+    The schema of the table is recorded from its fetched partitions, or read
+    from BigQuery if it has none, so that a table without partitions is
+    mirrored as an empty table.
+
+    Args:
+      table_name: Name of the table in the dataset.
+
+    Returns:
+      Number of partitions fetched, unchanged and deleted.
+    """
+    remote_partitions = self._get_remote_partitions(table_name)
+    local_partitions = self._manifest.get(table_name, {})
+    table_id = f'{self.project_id}.{self.dataset_id}.{table_name}'
+    os.makedirs(os.path.join(self.mirror_dir, table_name), exist_ok=True)
+    connection = None
+    if self.storage_format == DUCKDB_FORMAT:
+      connection = self._connect()
+    stats = {'fetched': 0, 'unchanged': 0, 'deleted': 0}
+    try:
+      for partition_id in sorted(set(local_partitions) - set(remote_partitions)):
+        logging.info('Deleting partition %s of %s.', partition_id, table_name)
+        self._delete_partition(connection, table_name, partition_id)
+        del local_partitions[partition_id]
+        stats['deleted'] += 1
+      for partition_id, signature in sorted(remote_partitions.items()):
+        if local_partitions.get(partition_id) == signature:
+          stats['unchanged'] += 1
+          continue
+        logging.info('Fetching partition %s of %s.', partition_id, table_name)
+        partition_path = self._get_partition_path(table_name, partition_id)
+        temp_path = partition_path + '.tmp'
+        cloud_bigquery_storage.export_table(
+            table_id,
+            temp_path,
+            row_filter=self._get_partition_filter(partition_id),
+            backend=self.read_backend)
+        self._set_schema(table_name, parquet.read_schema(temp_path))
+        if connection is not None:
+          self._store_partition(connection, table_name, partition_id,
+                                temp_path)
+        else:
+          os.replace(temp_path, partition_path)
+        local_partitions[partition_id] = signature
+        stats['fetched'] += 1
+      if (not remote_partitions and table_name not in self._schemas and
+          self._table_exists(table_name)):
+        # The table has no rows, hence reading it only returns its schema.
+        self._set_schema(
+            table_name,
+            cloud_bigquery_storage.read_table(
+                table_id, backend=self.read_backend).schema)
+      if connection is not None:
+        self._create_empty_table(connection, table_name)
+      self._manifest[table_name] = local_partitions
+      self._save_manifest()
+    finally:
+      if connection is not None:
+        connection.close()
+    logging.info(
+        'Synced %s: %d partitions fetched, %d unchanged, %d deleted.',
+        table_name, stats['fetched'], stats['unchanged'], stats['deleted'])
+    return stats
+
+  def sync(self,
+           table_names: Optional[List[str]] = None) -> Dict[str, Dict[str, int]]:
+    """Syncs the mirrored tables.
+
+    Args:
+      table_names: Optional. Tables to sync. All MarkUp output tables are
+        synced if not set. Tables without partitions are mirrored as empty
+        tables. Tables missing in the dataset (e.g. best sellers without
+        Market Insights) have no schema and are not mirrored.
+
+    Returns:
+      Sync statistics keyed by table name.
+    """
+    return {
+        table_name: self.sync_table(table_name)
+        for table_name in (table_names or MIRRORED_TABLES)
+    }
+
+  def query(self, sql: str) -> pyarrow.Table:
+    """Runs a DuckDB query over the mirrored tables.
+
+    The mirrored tables are exposed under their BigQuery table names, e.g.
+    `SELECT COUNT(1) FROM product_detailed_materialized`.
+
+    Args:
+      sql: The DuckDB query.
+
+    Returns:
+      Result of the query.
+    """
+    connection = self._connect()
+    try:
+      return connection.execute(sql).fetch_arrow_table()
+    finally:
+      connection.close()
+
+  def read_table(self,
+                 table_name: str,
+                 columns: Optional[List[str]] = None,
+                 row_filter: Optional[str] = None) -> pyarrow.Table:
+    """Reads a mirrored table.
+
+    The arguments mirror `cloud_bigquery_storage.read_table`, so analysis code
+    can switch between BigQuery and the local mirror.
+
+    Args:
+      table_name: Name of the table in the dataset.
+      columns: Optional. Columns to read. All columns are read if not set.
+      row_filter: Optional. SQL predicate that the returned rows satisfy.
+
+    Returns:
+      The Arrow table.
+    """
+    select_list = ', '.join(f'"{column}"' for column in columns or []) or '*'
+    where_clause = f'WHERE {row_filter}' if row_filter else ''
+    return self.query(
+        f'SELECT {select_list} FROM "{table_name}" {where_clause}')
+
+
+def parse_arguments() -> argparse.Namespace:
+  """Initialize command line parser using argparse.
+
+  Returns:
+    An argparse.ArgumentParser.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--project_id', help='GCP project id.', required=True)
+  parser.add_argument(
+      '--dataset_id', help='BigQuery dataset id.', default='markup')
+  parser.add_argument(
+      '--mirror_dir', help='Local directory of the mirror.', required=True)
+  parser.add_argument(
+      '--format',
+      help='Storage format of the mirror.',
+      choices=_STORAGE_FORMATS,
+      default=PARQUET_FORMAT)
+  parser.add_argument(
+      '--tables',
+      help='Comma separated list of tables to sync.',
+      default=','.join(MIRRORED_TABLES))
+  return parser.parse_args()
+
+
+def main():
+  args = parse_arguments()
+  mirror = LocalMirror(args.project_id, args.dataset_id, args.mirror_dir,
+                       args.format)
+  mirror.sync(args.tables.split(','))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,159 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Tests for local_mirror."""
+
+import collections
+import datetime
+import tempfile
+import unittest
+
+import cloud_bigquery_storage
+import duckdb
+from google.cloud import exceptions
+import local_mirror
+import pyarrow
+
+_PROJECT_ID = 'project'
+_DATASET_ID = 'markup'
+_HISTORICAL_TABLE = 'product_historical_materialized'
+_BEST_SELLERS_TABLE = 'market_insights_best_sellers_materialized'
+
+_PartitionRow = collections.namedtuple(
+    '_PartitionRow', ['partition_id', 'total_rows', 'last_modified_time'])
+
+
+class _QueryJob(object):
+
+  def __init__(self, rows):
+    self._rows = rows
+
+  def result(self):
+    return self._rows
+
+
+class _MetadataClient(object):
+  """Serves the partition metadata of in-memory tables."""
+
+  def __init__(self, tables):
+    self.tables = tables
+    self.modified_time = datetime.datetime(2021, 10, 1)
+
+  def get_table(self, table_id):
+    if table_id.split('.')[-1] not in self.tables:
+      raise exceptions.NotFound(f'Not found: Table {table_id}')
+
+  def query(self, query, job_config, location):
+    del query, location  # Unused.
+    table_name = job_config.query_parameters[0].value
+    table = self.tables.get(table_name)
+    if table is None:
+      return _QueryJob([])
+    row_counts = collections.Counter(
+        day.strftime('%Y%m%d') for day in table['data_date'].to_pylist())
+    return _QueryJob([
+        _PartitionRow(partition_id, row_count, self.modified_time)
+        for partition_id, row_count in row_counts.items()
+    ])
+
+
+def _new_historical_table(days):
+  return pyarrow.table({
+      'data_date': [datetime.date(2021, 9, day) for day in days],
+      'target_country': ['US'] * len(days),
+      'total_products': [day * 10 for day in days],
+  })
+
+
+class LocalMirrorTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.mirror_dir = self._new_mirror_dir()
+    self.tables = {
+        _HISTORICAL_TABLE: _new_historical_table([1, 2]),
+        _BEST_SELLERS_TABLE: pyarrow.table({
+            'data_date': pyarrow.array([], pyarrow.date32()),
+            'rank': pyarrow.array([], pyarrow.int64()),
+        }),
+    }
+    self.client = _MetadataClient(self.tables)
+
+  def _new_mirror_dir(self):
+    mirror_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(mirror_dir.cleanup)
+    return mirror_dir.name
+
+  def _new_mirror(self, storage_format):
+    backend = cloud_bigquery_storage.FakeReadSessionBackend({
+        f'{_PROJECT_ID}.{_DATASET_ID}.{table_name}': table
+        for table_name, table in self.tables.items()
+    })
+    return local_mirror.LocalMirror(
+        _PROJECT_ID,
+        _DATASET_ID,
+        self.mirror_dir,
+        storage_format,
+        client=self.client,
+        read_backend=backend)
+
+  def test_sync_fetches_only_changed_partitions(self):
+    for storage_format in (local_mirror.PARQUET_FORMAT,
+                           local_mirror.DUCKDB_FORMAT):
+      with self.subTest(storage_format=storage_format):
+        self.mirror_dir = self._new_mirror_dir()
+        self.tables[_HISTORICAL_TABLE] = _new_historical_table([1, 2])
+        self._new_mirror(storage_format).sync([_HISTORICAL_TABLE])
+        self.tables[_HISTORICAL_TABLE] = _new_historical_table([2, 3, 3])
+        mirror = self._new_mirror(storage_format)
+
+        stats = mirror.sync([_HISTORICAL_TABLE])
+
+        self.assertEqual(stats[_HISTORICAL_TABLE], {
+            'fetched': 1,
+            'unchanged': 1,
+            'deleted': 1
+        })
+        table = mirror.read_table(
+            _HISTORICAL_TABLE, columns=['total_products'])
+        self.assertCountEqual(table['total_products'].to_pylist(),
+                              [20, 30, 30])
+
+  def test_table_without_partitions_is_mirrored_as_empty(self):
+    for storage_format in (local_mirror.PARQUET_FORMAT,
+                           local_mirror.DUCKDB_FORMAT):
+      with self.subTest(storage_format=storage_format):
+        self.mirror_dir = self._new_mirror_dir()
+        self._new_mirror(storage_format).sync([_BEST_SELLERS_TABLE])
+
+        table = self._new_mirror(storage_format).read_table(
+            _BEST_SELLERS_TABLE)
+
+        self.assertEqual(table.num_rows, 0)
+        self.assertEqual(table.column_names, ['data_date', 'rank'])
+
+  def test_missing_table_is_not_mirrored(self):
+    mirror = self._new_mirror(local_mirror.PARQUET_FORMAT)
+
+    stats = mirror.sync(['product_detailed_materialized'])
+
+    self.assertEqual(stats['product_detailed_materialized']['fetched'], 0)
+    with self.assertRaises(duckdb.CatalogException):
+      mirror.read_table('product_detailed_materialized')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -43,6 +43,10 @@ from plugins.cloud_utils import cloud_auth
 from plugins.cloud_utils import utils
 
 _SERVICE_URL = 'https://serviceusage.googleapis.com/v1/projects'
+# Maximum number of services per services.batchGet request.
+_BATCH_GET_MAX_SERVICES = 30
+# Maximum number of services per services.batchEnable request.
+_BATCH_ENABLE_MAX_SERVICES = 20
 
 
 class Error(Exception):
@@ -79,22 +83,68 @@ class CloudApiUtils(object):
                                                   service_account_key_file)
     self.project_id = project_id
 
+  def get_disabled_apis(self, apis: List[str]) -> List[str]:
+    """Returns the APIs which are not enabled for the GCP project.
+
+    The state of the services is fetched with `services.batchGet`, so a single
+    request checks up to 30 APIs.
+
+    Args:
+      apis: The list of APIs to be checked.
+
+    Returns:
+      The APIs which are not enabled, in the order of `apis`.
+
+    Raises:
+        Error: If the request was not processed successfully.
+    """
+    parent = f'projects/{self.project_id}'
+    enabled_apis = set()
+    try:
+      for start in range(0, len(apis), _BATCH_GET_MAX_SERVICES):
+        names = [
+            f'{parent}/services/{api}'
+            for api in apis[start:start + _BATCH_GET_MAX_SERVICES]
+        ]
+        request = self.client.services().batchGet(parent=parent, names=names)
+        response = utils.execute_request(request)
+        for service in response.get('services', []):
+          if service.get('state') == 'ENABLED':
+            enabled_apis.add(service['name'].rsplit('/', 1)[-1])
+    except errors.HttpError:
+      logging.exception('Error occurred while checking Cloud APIs.')
+      raise Error('Error occurred while checking Cloud APIs.')
+    return [api for api in apis if api not in enabled_apis]
+
   def enable_apis(self, apis: List[str]) -> None:
     """Enables multiple Cloud APIs for a GCP project.
 
+    The APIs which are already enabled are skipped, hence nothing is enabled
+    and no operation is waited for when the project is already configured.
+    The operations of the batchEnable requests are waited for together.
+
     Args:
       apis: The list of APIs to be enabled.
 
     Raises:
         Error: If the request was not processed successfully.
     """
+    disabled_apis = self.get_disabled_apis(apis)
+    if not disabled_apis:
+      logging.info('All the %d Cloud APIs are already enabled.', len(apis))
+      return
+    logging.info('Enabling following Cloud APIs: %s', ', '.join(disabled_apis))
     parent = f'projects/{self.project_id}'
-    request_body = {'serviceIds': apis}
     try:
-      request = self.client.services().batchEnable(
-          parent=parent, body=request_body)
-      operation = utils.execute_request(request)
-      utils.wait_for_operation(self.client.operations(), operation)
+      operations = []
+      for start in range(0, len(disabled_apis), _BATCH_ENABLE_MAX_SERVICES):
+        request_body = {
+            'serviceIds': disabled_apis[start:start + _BATCH_ENABLE_MAX_SERVICES]
+        }
+        request = self.client.services().batchEnable(
+            parent=parent, body=request_body)
+        operations.append(utils.execute_request(request))
+      utils.wait_for_operations(self.client.operations(), operations)
     except errors.HttpError:
       logging.exception('Error occurred while enabling Cloud APIs.')
       raise Error('Error occurred while enabling Cloud APIs.')
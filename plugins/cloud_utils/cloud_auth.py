@@ -34,17 +34,21 @@ import base64
 import json
 import os
 import textwrap
-from typing import Any, Dict
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
 import logging
 
 import apiclient
 from googleapiclient import discovery
+from googleapiclient import discovery_cache
 from googleapiclient import errors
 import google.auth
 from google.auth import credentials
 from google.auth.transport import requests
 from google.oauth2 import service_account
 from plugins.cloud_utils import utils
+import requests as http_requests
 
 # HTTP status code
 _NOT_FOUND_ERROR_CODE = 404
@@ -52,15 +56,51 @@ _NOT_FOUND_ERROR_CODE = 404
 # Scope to manage service accounts
 _SCOPE = 'https://www.googleapis.com/auth/cloud-platform'
 
+# Directory where fetched discovery documents are cached. Most discovery
+# documents are bundled with googleapiclient and never fetched.
+_DISCOVERY_CACHE_DIR = os.path.join(
+    os.path.expanduser('~'), '.cache', 'cloud_utils', 'discovery')
+_DISCOVERY_TIMEOUT_SECONDS = 30
+# Key of the default credentials in the credentials registry.
+_DEFAULT_CREDENTIALS_KEY = 'default'
+
+# Process-wide registries. The credentials are shared by all the clients built
+# with the same service account key file, hence the access token is refreshed
+# once and reused by every client.
+_registry_lock = threading.RLock()
+_credentials_registry: Dict[str, credentials.Credentials] = {}
+_client_registry: Dict[Tuple[str, str, str], apiclient.discovery.Resource] = {}
+_session_registry: Dict[str, requests.AuthorizedSession] = {}
+_discovery_documents: Dict[Tuple[str, str], str] = {}
+_client_metrics = {
+    'clients_built': 0,
+    'client_cache_hits': 0,
+    'client_build_seconds': 0.0,
+    'discovery_documents_fetched': 0,
+    'discovery_fetch_seconds': 0.0,
+    'credentials_loaded': 0,
+}
+
 
 class Error(Exception):
   """A generic error thrown for any exceptions in cloud_auth module."""
   pass
 
 
-def get_credentials(
+def _get_credentials_key(service_account_key_file: Optional[str]) -> str:
+  """Returns the registry key identifying credentials.
+
+  Args:
+    service_account_key_file: Optional. File containing service account key.
+  """
+  if service_account_key_file is None:
+    return _DEFAULT_CREDENTIALS_KEY
+  return os.path.abspath(service_account_key_file)
+
+
+def _load_credentials(
     service_account_key_file: str = None) -> credentials.Credentials:
-  """Get credentials to authenticate while calling GCP APIs.
+  """Loads credentials to authenticate while calling GCP APIs.
 
   Args:
     service_account_key_file: Optional. File containing service account key. If
@@ -92,22 +132,141 @@ def get_credentials(
       service_account_key_file, scopes=[_SCOPE])
 
 
+def get_credentials(
+    service_account_key_file: str = None) -> credentials.Credentials:
+  """Get credentials to authenticate while calling GCP APIs.
+
+  The credentials are loaded once per process and service account key file, and
+  shared by all the callers.
+
+  Args:
+    service_account_key_file: Optional. File containing service account key. If
+      not passed the default credential will be used.
+
+  Returns:
+    credential: Credential object to authenticate while calling GCP APIs.
+
+  Raises:
+    FileNotFoundError: If the provided file is not found.
+    Error: If no default credentials are found and service account key file is
+      not given.
+  """
+  credentials_key = _get_credentials_key(service_account_key_file)
+  with _registry_lock:
+    if credentials_key not in _credentials_registry:
+      _credentials_registry[credentials_key] = _load_credentials(
+          service_account_key_file)
+      _client_metrics['credentials_loaded'] += 1
+    return _credentials_registry[credentials_key]
+
+
+def _get_discovery_document(service_name: str, version: str) -> str:
+  """Returns the discovery document of a service API.
+
+  The document is looked up in memory, then in the documents bundled with
+  googleapiclient, then in the on-disk cache. It is only fetched over the
+  network when none of them has it, and the fetched document is written to the
+  on-disk cache.
+
+  Args:
+    service_name: Name of the service.
+    version: Version of the service API.
+
+  Returns:
+    The discovery document.
+
+  Raises:
+    Error: If the discovery document could not be retrieved.
+  """
+  document_key = (service_name, version)
+  if document_key in _discovery_documents:
+    return _discovery_documents[document_key]
+  document = discovery_cache.get_static_doc(service_name, version)
+  cache_path = os.path.join(_DISCOVERY_CACHE_DIR,
+                            f'{service_name}.{version}.json')
+  if document is None and os.path.isfile(cache_path):
+    with open(cache_path, 'r') as cache_file:
+      document = cache_file.read()
+  if document is None:
+    start_time = time.monotonic()
+    for discovery_uri in (discovery.DISCOVERY_URI, discovery.V2_DISCOVERY_URI):
+      response = http_requests.get(
+          discovery_uri.format(api=service_name, apiVersion=version),
+          timeout=_DISCOVERY_TIMEOUT_SECONDS)
+      if response.ok:
+        document = response.text
+        break
+    _client_metrics['discovery_fetch_seconds'] += (
+        time.monotonic() - start_time)
+    if document is None:
+      raise Error(f'Discovery document for {service_name} {version} could not '
+                  'be retrieved.')
+    _client_metrics['discovery_documents_fetched'] += 1
+    os.makedirs(_DISCOVERY_CACHE_DIR, exist_ok=True)
+    with open(cache_path, 'w') as cache_file:
+      cache_file.write(document)
+  _discovery_documents[document_key] = document
+  return document
+
+
 def build_service_client(
     service_name: str,
-    service_account_key_file: str = None) -> apiclient.discovery.Resource:
+    service_account_key_file: str = None,
+    version: str = 'v1') -> apiclient.discovery.Resource:
   """Construct a Resource for interacting with GCP service APIs.
 
+  The clients are kept in a process-wide registry keyed by service, version and
+  credentials, hence the discovery document is parsed once per service. The
+  returned client is shared and, like every googleapiclient client, should not
+  be used from several threads at the same time.
+
   Args:
     service_name: Name of the service for which the client is created.
     service_account_key_file: Optional. File containing service account key. If
       not passed the default credential will be used.
+    version: Optional. Version of the service API. It defaults to 'v1'.
 
   Returns:
     client: A client with methods for interacting with the service APIs.
   """
-  credentials_info = get_credentials(service_account_key_file)
-  return discovery.build(
-      service_name, 'v1', credentials=credentials_info, cache_discovery=False)
+  client_key = (service_name, version,
+                _get_credentials_key(service_account_key_file))
+  with _registry_lock:
+    if client_key in _client_registry:
+      _client_metrics['client_cache_hits'] += 1
+      return _client_registry[client_key]
+    start_time = time.monotonic()
+    credentials_info = get_credentials(service_account_key_file)
+    document = _get_discovery_document(service_name, version)
+    client = discovery.build_from_document(
+        document, credentials=credentials_info)
+    build_seconds = time.monotonic() - start_time
+    _client_metrics['clients_built'] += 1
+    _client_metrics['client_build_seconds'] += build_seconds
+    logging.debug('Built %s %s client in %.3f seconds.', service_name, version,
+                  build_seconds)
+    _client_registry[client_key] = client
+    return client
+
+
+def get_client_metrics() -> Dict[str, Any]:
+  """Returns counters and timings of the client and credentials registry.
+
+  Returns:
+    metrics: Number of clients built, registry hits, credentials loaded and
+      discovery documents fetched, and the seconds spent building clients and
+      fetching discovery documents.
+  """
+  with _registry_lock:
+    return dict(_client_metrics)
+
+
+def clear_client_registry() -> None:
+  """Drops the pooled credentials, clients and sessions."""
+  with _registry_lock:
+    _credentials_registry.clear()
+    _client_registry.clear()
+    _session_registry.clear()
 
 
 def _get_resource_manager_client() -> apiclient.discovery.Resource:
@@ -314,7 +473,10 @@ def set_service_account_role(project_id, service_account_name,
 
 def get_auth_session(
     service_account_key_file: str) -> requests.AuthorizedSession:
-  """Creates AuthorizedSession for given service account.
+  """Returns the pooled AuthorizedSession for given service account.
+
+  The session is created once per service account key file and reused, so its
+  connection pool and access token are shared by the callers.
 
   Args:
       service_account_key_file: File which contains service account private key.
@@ -325,5 +487,10 @@ def get_auth_session(
   Raises:
     FileNotFoundError: If the provided file is not found.
   """
-  credentials_info = get_credentials(service_account_key_file)
-  return requests.AuthorizedSession(credentials_info)
+  credentials_key = _get_credentials_key(service_account_key_file)
+  with _registry_lock:
+    if credentials_key not in _session_registry:
+      credentials_info = get_credentials(service_account_key_file)
+      _session_registry[credentials_key] = requests.AuthorizedSession(
+          credentials_info)
+    return _session_registry[credentials_key]
@@ -30,7 +30,7 @@
 
 """Manage operations on Cloud Composer."""
 
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 import logging
 
 from googleapiclient import errors
@@ -43,6 +43,8 @@ _DISC_SIZE = 20  # In GBs.
 _MACHINE_TYPE = 'n1-standard-1'
 _PYTHON_VERSION = '3'
 _HTTP_CONFLICT_CODE = 409
+_HTTP_BAD_REQUEST_CODE = 400
+_SOFTWARE_CONFIG_MASK = 'config.softwareConfig'
 
 
 class Error(Exception):
@@ -50,6 +52,137 @@ class Error(Exception):
   pass
 
 
+class EnvironmentUpdate(object):
+  """Collects the software configuration changes of a Composer environment.
+
+  The changes are applied with `CloudComposerUtils.update_environment`, which
+  drops the changes already in place and submits the rest as a single patch.
+
+  Typical usage example:
+       >>> update = EnvironmentUpdate()
+       >>> update.install_python_packages({'pandas': '==1.5.3'}, replace=False)
+       >>> update.set_environment_variables({'GCP_PROJECT': 'project_id'})
+       >>> composer.update_environment('environment_name', update)
+  """
+
+  def __init__(self) -> None:
+    """Initialise new instance of EnvironmentUpdate."""
+    self.pypi_packages = {}
+    self.environment_variables = {}
+    self.airflow_config_overrides = {}
+    self.replace_pypi_packages = False
+    self.replace_environment_variables = False
+    self.replace_airflow_config_overrides = False
+
+  def install_python_packages(self,
+                              packages: Dict[str, str],
+                              replace: bool = True) -> 'EnvironmentUpdate':
+    """Adds Python packages to be installed.
+
+    Args:
+      packages: Dictionary of Python packages with dependency name as the key
+        and version as the value. e.g - {'apache-beam': '==2.12.0'}
+      replace: Optional. Whether the packages of the update replace all the
+        packages of the environment, removing the others. If False, the other
+        packages of the environment are kept. It defaults to True.
+
+    Returns:
+      The update itself, so that the calls can be chained.
+    """
+    self.pypi_packages.update(packages)
+    self.replace_pypi_packages = replace
+    return self
+
+  def set_environment_variables(self,
+                                environment_variables: Dict[str, str],
+                                replace: bool = True) -> 'EnvironmentUpdate':
+    """Adds environment variables to be set.
+
+    Args:
+      environment_variables: Environment variables to be added.
+      replace: Optional. Whether the variables of the update replace all the
+        environment variables, removing the others. If False, they are merged
+        into the current variables. It defaults to True.
+
+    Returns:
+      The update itself, so that the calls can be chained.
+    """
+    self.environment_variables.update(environment_variables)
+    self.replace_environment_variables = replace
+    return self
+
+  def override_airflow_configs(self,
+                               airflow_config_overrides: Dict[str, str],
+                               replace: bool = True) -> 'EnvironmentUpdate':
+    """Adds Airflow configurations to be overridden.
+
+    Args:
+      airflow_config_overrides: Airflow configurations keyed by
+        'section-name', e.g. {'core-dags_are_paused_at_creation': 'True'}.
+      replace: Optional. Whether the overrides of the update replace all the
+        overrides of the environment, removing the others. If False, the
+        other overrides of the environment are kept. It defaults to True.
+
+    Returns:
+      The update itself, so that the calls can be chained.
+    """
+    self.airflow_config_overrides.update(airflow_config_overrides)
+    self.replace_airflow_config_overrides = replace
+    return self
+
+  def get_patches(self, software_config: Dict[str, Any]
+                 ) -> List[Tuple[List[str], Dict[str, Any]]]:
+    """Computes the patches needed to apply the update.
+
+    Replaced packages and Airflow configurations are patched as a whole.
+    Otherwise they are patched key by key, so the other packages and
+    configurations of the environment are kept. Environment variables can
+    only be patched as a whole, hence kept variables are merged into the new
+    ones.
+
+    Args:
+      software_config: Current software configuration of the environment.
+
+    Returns:
+      One (update masks, software configuration) pair per type of change, for
+      the changes which are not already in place.
+    """
+    patches = []
+    for field, values, replace in (
+        ('pypiPackages', self.pypi_packages, self.replace_pypi_packages),
+        ('airflowConfigOverrides', self.airflow_config_overrides,
+         self.replace_airflow_config_overrides)):
+      current_values = software_config.get(field, {})
+      if replace:
+        if values != current_values:
+          patches.append(([f'{_SOFTWARE_CONFIG_MASK}.{field}'], {
+              field: values
+          }))
+        continue
+      changed_values = {
+          key: value
+          for key, value in values.items()
+          if current_values.get(key) != value
+      }
+      if changed_values:
+        patches.append(([
+            f'{_SOFTWARE_CONFIG_MASK}.{field}.{key}' for key in changed_values
+        ], {
+            field: changed_values
+        }))
+    current_variables = software_config.get('envVariables', {})
+    if self.replace_environment_variables:
+      variables = dict(self.environment_variables)
+    else:
+      variables = dict(current_variables)
+      variables.update(self.environment_variables)
+    if variables != current_variables:
+      patches.append(([f'{_SOFTWARE_CONFIG_MASK}.envVariables'], {
+          'envVariables': variables
+      }))
+    return patches
+
+
 class CloudComposerUtils(object):
   """CloudComposerUtils class provides methods to manage Composer environment.
 
@@ -173,10 +306,100 @@ class CloudComposerUtils(object):
       logging.exception('Error occurred while creating Composer environment.')
       raise Error('Error occurred while creating Composer environment.')
 
-  def install_python_packages(self, environment_name: str,
-                              packages: Dict[str, str]) -> None:
+  def _patch_environment(self, fully_qualified_name: str,
+                         update_masks: List[str],
+                         software_config: Dict[str, Any]) -> None:
+    """Patches the software configuration of a Composer environment.
+
+    Args:
+      fully_qualified_name: Fully qualified environment name.
+      update_masks: Fields of the environment to be updated.
+      software_config: Software configuration holding the new values.
+
+    Raises:
+      errors.HttpError: If the request was not processed successfully.
+    """
+    request_body = {
+        'name': fully_qualified_name,
+        'config': {
+            'softwareConfig': software_config
+        }
+    }
+    request = (
+        self.client.projects().locations().environments().patch(
+            name=fully_qualified_name,
+            body=request_body,
+            updateMask=','.join(update_masks)))
+    operation = utils.execute_request(request)
+    operation_client = self.client.projects().locations().operations()
+    utils.wait_for_operation(operation_client, operation)
+
+  def update_environment(self, environment_name: str,
+                         update: EnvironmentUpdate) -> bool:
+    """Applies software configuration changes to a Composer environment.
+
+    The changes already in place are dropped and the remaining ones are
+    submitted as a single patch, since every patch is a long running update of
+    the environment. If the API rejects updating several types of changes in
+    one request, they are patched one type after the other.
+
+    Args:
+      environment_name: Name of the existing Composer environment. The fully
+        qualified environment name will be constructed as follows -
+        'projects/{project_id}/locations/{location}/environments/
+        {environment_name}'.
+      update: Changes to be applied.
+
+    Returns:
+      True if the environment was patched, False if it was already up to date.
+
+    Raises:
+      Error: If the request was not processed successfully.
+    """
+    fully_qualified_name = self._get_fully_qualified_env_name(environment_name)
+    environment = self.get_environment(environment_name)
+    software_config = environment.get(self._CONFIG_KEY,
+                                      {}).get('softwareConfig', {})
+    patches = update.get_patches(software_config)
+    if not patches:
+      logging.info('The "%s" Composer environment is already up to date.',
+                   fully_qualified_name)
+      return False
+    update_masks = []
+    combined_software_config = {}
+    for patch_update_masks, patch_software_config in patches:
+      update_masks.extend(patch_update_masks)
+      combined_software_config.update(patch_software_config)
+    logging.info('Updating "%s" in "%s" Composer environment.',
+                 ', '.join(update_masks), fully_qualified_name)
+    try:
+      try:
+        self._patch_environment(fully_qualified_name, update_masks,
+                                combined_software_config)
+      except errors.HttpError as error:
+        if (len(patches) == 1 or
+            error.__dict__['resp'].status != _HTTP_BAD_REQUEST_CODE):
+          raise
+        logging.info('Combined update was rejected, updating "%s" Composer '
+                     'environment one type of change at a time.',
+                     fully_qualified_name)
+        for patch_update_masks, patch_software_config in patches:
+          self._patch_environment(fully_qualified_name, patch_update_masks,
+                                  patch_software_config)
+      logging.info('Updated "%s" Composer environment.', fully_qualified_name)
+      return True
+    except errors.HttpError:
+      logging.exception('Error occurred while updating Composer environment.')
+      raise Error('Error occurred while updating Composer environment.')
+
+  def install_python_packages(self,
+                              environment_name: str,
+                              packages: Dict[str, str],
+                              replace: bool = True) -> None:
     """Install Python packages on the existing Composer environment.
 
+    Nothing is patched if the packages are already installed.
+
     Args:
       environment_name: Name of the existing Composer environment. The fully
         qualified environment name will be constructed as follows -
@@ -186,40 +409,23 @@ class CloudComposerUtils(object):
         environment. Each entry in the dictionary has dependency name as the key
         and version as the value. e.g -
         {'tensorflow' : "<=1.0.1", 'apache-beam': '==2.12.0', 'flask': '>1.0.3'}
+      replace: Optional. Whether the packages replace all the packages of the
+        environment, uninstalling the others. If False, the other packages of
+        the environment are kept. It defaults to True.
 
     Raises:
       Error: If the list of packages is empty.
     """
     if not packages:
       raise Error('Package list cannot be empty.')
-    fully_qualified_name = self._get_fully_qualified_env_name(environment_name)
-    logging.info('Installing "%s" packages in "%s" Composer environment.',
-                 packages, fully_qualified_name)
-    try:
-      request_body = {
-          'name': fully_qualified_name,
-          'config': {
-              'softwareConfig': {
-                  'pypiPackages': packages
-              }
-          }
-      }
-      request = (
-          self.client.projects().locations().environments().patch(
-              name=fully_qualified_name,
-              body=request_body,
-              updateMask='config.softwareConfig.pypiPackages'))
-      operation = utils.execute_request(request)
-      operation_client = self.client.projects().locations().operations()
-      utils.wait_for_operation(operation_client, operation)
-      logging.info('Installed "%s" packages in "%s" Composer environment.',
-                   packages, fully_qualified_name)
-    except errors.HttpError:
-      logging.exception('Error occurred while installing packages.')
-      raise Error('Error occurred while installing python packages.')
-
-  def set_environment_variables(self, environment_name: str,
-                                environment_variables: Dict[str, str]) -> None:
+    self.update_environment(
+        environment_name,
+        EnvironmentUpdate().install_python_packages(packages, replace))
+
+  def set_environment_variables(self,
+                                environment_name: str,
+                                environment_variables: Dict[str, str],
+                                replace: bool = True) -> None:
     """Sets environment variables on the existing Composer environment.
 
     Args:
@@ -229,41 +435,22 @@ class CloudComposerUtils(object):
         {environment_name}'.
       environment_variables: Environment variables to be added to the Composer
         environment.
+      replace: Optional. Whether the variables replace all the environment
+        variables, removing the others. If False, they are merged into the
+        existing environment variables. It defaults to True.
 
     Raises:
       Error: If the request was not processed successfully.
     """
-    fully_qualified_name = self._get_fully_qualified_env_name(environment_name)
-    logging.info(
-        'Setting "%s" environment variables in "%s" Composer '
-        'environment.', environment_variables, fully_qualified_name)
-    try:
-      request_body = {
-          'name': fully_qualified_name,
-          'config': {
-              'softwareConfig': {
-                  'envVariables': environment_variables
-              }
-          }
-      }
-      request = (
-          self.client.projects().locations().environments().patch(
-              name=fully_qualified_name,
-              body=request_body,
-              updateMask='config.softwareConfig.envVariables'))
-      operation = utils.execute_request(request)
-      operation_client = self.client.projects().locations().operations()
-      utils.wait_for_operation(operation_client, operation)
-      logging.info(
-          'Updated "%s" environment variables in "%s" Composer '
-          'environment.', environment_variables, fully_qualified_name)
-    except errors.HttpError:
-      logging.exception('Error occurred while setting environment variables.')
-      raise Error('Error occurred while setting environment variables.')
-
-  def override_airflow_configs(
-      self, environment_name: str, airflow_config_overrides: Dict[str,
-                                                                  str]) -> None:
+    self.update_environment(
+        environment_name,
+        EnvironmentUpdate().set_environment_variables(environment_variables,
+                                                      replace))
+
+  def override_airflow_configs(self,
+                               environment_name: str,
+                               airflow_config_overrides: Dict[str, str],
+                               replace: bool = True) -> None:
     """Overrides Airflow configurations on the existing Composer environment.
 
     Args:
@@ -273,38 +460,17 @@ class CloudComposerUtils(object):
         {environment_name}'.
       airflow_config_overrides: Airflow configurations to be overridden in the
         Composer environment.
+      replace: Optional. Whether the overrides replace all the Airflow
+        configuration overrides of the environment, removing the others. If
+        False, the other overrides are kept. It defaults to True.
 
     Raises:
       Error: If the request was not processed successfully.
     """
-    fully_qualified_name = self._get_fully_qualified_env_name(environment_name)
-    logging.info(
-        'Overriding "%s" Airflow configurations in "%s" Composer '
-        'environment.', airflow_config_overrides, fully_qualified_name)
-    try:
-      request_body = {
-          'name': fully_qualified_name,
-          'config': {
-              'softwareConfig': {
-                  'airflowConfigOverrides': airflow_config_overrides
-              }
-          }
-      }
-      request = (
-          self.client.projects().locations().environments().patch(
-              name=fully_qualified_name,
-              body=request_body,
-              updateMask='config.softwareConfig.airflowConfigOverrides'))
-      operation = utils.execute_request(request)
-      operation_client = self.client.projects().locations().operations()
-      utils.wait_for_operation(operation_client, operation)
-      logging.info(
-          'Airflow configurations "%s" has been overridden in "%s" Composer '
-          'environment.', airflow_config_overrides, fully_qualified_name)
-    except errors.HttpError:
-      logging.exception(
-          'Error occurred while overriding Airflow configurations.')
-      raise Error('Error occurred while overriding Airflow configurations.')
+    self.update_environment(
+        environment_name,
+        EnvironmentUpdate().override_airflow_configs(airflow_config_overrides,
+                                                     replace))
 
   def get_environment(self, environment_name: str) -> Dict[str, Any]:
     """Retrieves details of a Composer environment.
@@ -0,0 +1,154 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Tests for cloud_composer."""
+
+import unittest
+from unittest import mock
+
+from plugins.cloud_utils import cloud_composer
+
+_MASK = 'config.softwareConfig'
+_SOFTWARE_CONFIG = {
+    'pypiPackages': {
+        'pandas': '==1.5.3',
+        'flask': '>1.0.3'
+    },
+    'envVariables': {
+        'GCP_PROJECT': 'project_id'
+    },
+    'airflowConfigOverrides': {
+        'core-dags_are_paused_at_creation': 'True'
+    },
+}
+
+
+class EnvironmentUpdateTest(unittest.TestCase):
+
+  def test_packages_replace_the_installed_packages_by_default(self):
+    update = cloud_composer.EnvironmentUpdate().install_python_packages(
+        {'pandas': '==1.5.3'})
+
+    self.assertEqual(
+        update.get_patches(_SOFTWARE_CONFIG),
+        [([f'{_MASK}.pypiPackages'], {
+            'pypiPackages': {
+                'pandas': '==1.5.3'
+            }
+        })])
+
+  def test_packages_are_merged_without_replace(self):
+    update = cloud_composer.EnvironmentUpdate().install_python_packages(
+        {
+            'pandas': '==1.5.3',
+            'numpy': '==1.24.0'
+        }, replace=False)
+
+    self.assertEqual(
+        update.get_patches(_SOFTWARE_CONFIG),
+        [([f'{_MASK}.pypiPackages.numpy'], {
+            'pypiPackages': {
+                'numpy': '==1.24.0'
+            }
+        })])
+
+  def test_environment_variables_replace_the_variables_by_default(self):
+    update = cloud_composer.EnvironmentUpdate().set_environment_variables(
+        {'DATASET': 'markup'})
+
+    self.assertEqual(
+        update.get_patches(_SOFTWARE_CONFIG),
+        [([f'{_MASK}.envVariables'], {
+            'envVariables': {
+                'DATASET': 'markup'
+            }
+        })])
+
+  def test_environment_variables_are_merged_without_replace(self):
+    update = cloud_composer.EnvironmentUpdate().set_environment_variables(
+        {'DATASET': 'markup'}, replace=False)
+
+    self.assertEqual(
+        update.get_patches(_SOFTWARE_CONFIG),
+        [([f'{_MASK}.envVariables'], {
+            'envVariables': {
+                'GCP_PROJECT': 'project_id',
+                'DATASET': 'markup'
+            }
+        })])
+
+  def test_changes_in_place_are_not_patched(self):
+    update = (
+        cloud_composer.EnvironmentUpdate().install_python_packages(
+            _SOFTWARE_CONFIG['pypiPackages']).set_environment_variables(
+                {
+                    'GCP_PROJECT': 'project_id'
+                }, replace=False).override_airflow_configs(
+                    _SOFTWARE_CONFIG['airflowConfigOverrides'], replace=False))
+
+    self.assertEqual(update.get_patches(_SOFTWARE_CONFIG), [])
+
+
+class CloudComposerUtilsTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    build_service_client = mock.patch.object(cloud_composer.cloud_auth,
+                                             'build_service_client')
+    self.client = build_service_client.start().return_value
+    self.addCleanup(build_service_client.stop)
+    # The environment is returned by the get request, the patch requests
+    # return an operation which is not used by the mocked wait_for_operation.
+    execute_request = mock.patch.object(
+        cloud_composer.utils,
+        'execute_request',
+        return_value={'config': {
+            'softwareConfig': _SOFTWARE_CONFIG
+        }})
+    execute_request.start()
+    self.addCleanup(execute_request.stop)
+    wait_for_operation = mock.patch.object(cloud_composer.utils,
+                                           'wait_for_operation')
+    wait_for_operation.start()
+    self.addCleanup(wait_for_operation.stop)
+    self.environments = self.client.projects().locations().environments()
+    self.composer = cloud_composer.CloudComposerUtils('project_id')
+
+  def test_install_python_packages_replaces_the_packages(self):
+    self.composer.install_python_packages('environment', {'numpy': '==1.24.0'})
+
+    patch_kwargs = self.environments.patch.call_args.kwargs
+    self.assertEqual(patch_kwargs['updateMask'], f'{_MASK}.pypiPackages')
+    self.assertEqual(patch_kwargs['body']['config']['softwareConfig'],
+                     {'pypiPackages': {
+                         'numpy': '==1.24.0'
+                     }})
+
+  def test_set_environment_variables_merges_without_replace(self):
+    self.composer.set_environment_variables(
+        'environment', {'DATASET': 'markup'}, replace=False)
+
+    patch_kwargs = self.environments.patch.call_args.kwargs
+    self.assertEqual(patch_kwargs['updateMask'], f'{_MASK}.envVariables')
+    self.assertEqual(
+        patch_kwargs['body']['config']['softwareConfig']['envVariables'], {
+            'GCP_PROJECT': 'project_id',
+            'DATASET': 'markup'
+        })
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -30,8 +30,14 @@
 
 """Manage operations on Cloud Storage."""
 
+import base64
+import collections
+import concurrent.futures
+import gzip
+import hashlib
+import io
 import os
-from typing import Optional, Tuple
+from typing import BinaryIO, Dict, Iterable, Optional, Tuple, Union
 from urllib import parse
 
 import logging
@@ -39,8 +45,27 @@ import logging
 from google.api_core import exceptions
 from google.api_core import retry
 from google.cloud import storage
+from google.cloud.storage import retry as storage_retry
+import google_crc32c
 from plugins.cloud_utils import cloud_auth
 
+# Default number of files uploaded in parallel by upload_directory.
+_DEFAULT_UPLOAD_WORKERS = 8
+# Size of the chunks read when computing checksums of local files.
+_CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+# Default size of the chunks sent by resumable uploads. It has to be a multiple
+# of 256 KiB. Peak memory of streaming uploads is bounded by this size.
+_DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+# Maximum number of source objects of a single compose request.
+_MAX_COMPOSE_PARTS = 32
+
+# Summary of an upload_directory call.
+SyncReport = collections.namedtuple('SyncReport', [
+    'uploaded_files', 'uploaded_bytes', 'skipped_files', 'skipped_bytes',
+    'deleted_files'
+])
+
 
 class Error(Exception):
   """A generic error thrown for exceptions in cloud_storage module."""
@@ -133,11 +158,19 @@ class CloudStorageUtils(object):
     bucket_name, path = self._parse_blob_url(destination_file_url)
     self.upload_file(source_file_path, bucket_name, path)
 
-  def upload_file(self, source_file_path: str, bucket_name: str,
-                  destination_file_path: str) -> None:
+  def upload_file(
+      self,
+      source_file_path: str,
+      bucket_name: str,
+      destination_file_path: str,
+      parallel_composite_threshold: Optional[int] = None,
+      max_workers: int = _DEFAULT_UPLOAD_WORKERS) -> None:
     """Uploads file from source file system to Cloud Storage.
 
-    If the bucket doesn't exist in the Cloud Storage, it will be created.
+    If the bucket doesn't exist in the Cloud Storage, it will be created. If
+    parallel_composite_threshold is set, files larger than it are split in
+    parts which are uploaded in parallel and composed into the destination
+    object.
 
     Args:
       source_file_path: Path to the file to be uploaded. e.g - /tmp/file.txt
@@ -148,6 +181,13 @@ class CloudStorageUtils(object):
         Cloud Storage bucket. If the Cloud Storage URL is
         'gs://bucket1/dir1/file1.txt', then the destination_file_path would be
         'dir1/file1.txt'.
+      parallel_composite_threshold: Optional. Size in bytes from which the file
+        is uploaded as a parallel composite upload, e.g. 150 MiB. Composite
+        objects have no MD5 hash, and their parts are written as temporary
+        objects next to the destination, which costs extra operations and
+        early deletion charges on cold storage classes. Composite uploads are
+        disabled by default.
+      max_workers: Optional. Number of parts uploaded in parallel.
     Raises:
       FileNotFoundError: If the provided file is not found.
       Error: If the upload was not successful.
@@ -160,7 +200,12 @@ class CloudStorageUtils(object):
       logging.info('Uploading "%s" file to "gs://%s/%s"', source_file_path,
                    bucket_name, destination_file_path)
       bucket = self._get_or_create_bucket(bucket_name)
-      self._upload_file(source_file_path, bucket, destination_file_path)
+      if (parallel_composite_threshold is not None and
+          os.path.getsize(source_file_path) >= parallel_composite_threshold):
+        self._upload_file_composite(source_file_path, bucket,
+                                    destination_file_path, max_workers)
+      else:
+        self._upload_file(source_file_path, bucket, destination_file_path)
       logging.info('Uploaded "%s" file to "gs://%s/%s"', source_file_path,
                    bucket_name, destination_file_path)
     except exceptions.RetryError:
@@ -191,8 +236,86 @@ class CloudStorageUtils(object):
     destination_blob = bucket.blob(destination_file_path)
     destination_blob.upload_from_filename(source_file_path)
 
-  def upload_directory_to_url(self, source_directory_path: str,
-                              destination_dir_url: str):
+  @retry.Retry()
+  def _upload_file_part(self, source_file_path: str,
+                        bucket: storage.bucket.Bucket, part_path: str,
+                        offset: int, size: int) -> storage.blob.Blob:
+    """Uploads a byte range of a file to Cloud Storage with Retry logic.
+
+    Args:
+      source_file_path: Path to the file to be uploaded.
+      bucket: Cloud Storage bucket to which the part should be uploaded.
+      part_path: Path of the part object within the bucket.
+      offset: Offset of the first byte of the part.
+      size: Number of bytes of the part.
+
+    Returns:
+      The uploaded part object.
+    """
+    part_blob = bucket.blob(part_path, chunk_size=_DEFAULT_CHUNK_SIZE)
+    with open(source_file_path, 'rb') as source_file:
+      source_file.seek(offset)
+      part_blob.upload_from_file(source_file, size=size)
+    return part_blob
+
+  def _upload_file_composite(self, source_file_path: str,
+                             bucket: storage.bucket.Bucket,
+                             destination_file_path: str,
+                             max_workers: int) -> None:
+    """Uploads a large file as a parallel composite upload.
+
+    The file is split in at most 32 parts which are uploaded in parallel as
+    temporary objects and composed into the destination object. The temporary
+    objects are deleted afterwards, even if the upload failed. Composite
+    objects have a CRC32C checksum but no MD5 hash.
+
+    Args:
+      source_file_path: Path to the file to be uploaded.
+      bucket: Cloud Storage bucket to which the file should be uploaded.
+      destination_file_path: Path of the destination blob/object within the
+        Cloud Storage bucket.
+      max_workers: Number of parts uploaded in parallel.
+    """
+    file_size = os.path.getsize(source_file_path)
+    part_size = max(-(-file_size // _MAX_COMPOSE_PARTS), _DEFAULT_CHUNK_SIZE)
+    parts = [(offset, min(part_size, file_size - offset))
+             for offset in range(0, file_size, part_size)]
+    parts_prefix = f'{destination_file_path}.parts-{os.urandom(8).hex()}'
+    logging.info('Uploading "%s" file as %d parallel parts.', source_file_path,
+                 len(parts))
+    part_blobs = [
+        bucket.blob(f'{parts_prefix}/{index:02d}')
+        for index in range(len(parts))
+    ]
+    try:
+      with concurrent.futures.ThreadPoolExecutor(
+          max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(self._upload_file_part, source_file_path, bucket,
+                            part_blob.name, offset, size)
+            for part_blob, (offset, size) in zip(part_blobs, parts)
+        ]
+        for future in futures:
+          future.result()
+      # The compose is retried only if the destination is still the object
+      # it replaces, so a retry can't overwrite a newer object.
+      current_blob = bucket.get_blob(destination_file_path)
+      destination_blob = bucket.blob(destination_file_path)
+      destination_blob.compose(
+          part_blobs,
+          if_generation_match=current_blob.generation if current_blob else 0,
+          retry=storage_retry.DEFAULT_RETRY)
+    finally:
+      for part_blob in part_blobs:
+        self._delete_blob(part_blob)
+
+  def upload_directory_to_url(
+      self,
+      source_directory_path: str,
+      destination_dir_url: str,
+      sync: bool = False,
+      max_workers: int = _DEFAULT_UPLOAD_WORKERS,
+      delete_orphans: bool = False) -> SyncReport:
     """Uploads an entire directory to Cloud Storage.
 
     This is a convenience method that parses bucket name and path, and calls
@@ -203,18 +326,84 @@ class CloudStorageUtils(object):
         /tmp/dir1/dir2
       destination_dir_url: The full URL to destination directory, in the form of
         'gs://bucket_name/path/to/dir'.
+      sync: Optional. Whether to skip the files which are identical to the
+        objects already in Cloud Storage. See `upload_directory`.
+      max_workers: Optional. Number of files uploaded in parallel.
+      delete_orphans: Optional. Whether to delete the objects which don't have
+        a matching local file. Only applied when `sync` is True.
+
+    Returns:
+      Summary of the transferred, skipped and deleted files.
     """
     bucket_name, path = self._parse_blob_url(destination_dir_url)
-    self.upload_directory(source_directory_path, bucket_name, path)
+    return self.upload_directory(source_directory_path, bucket_name, path,
+                                 sync, max_workers, delete_orphans)
+
+  def _is_blob_up_to_date(self, source_file_path: str,
+                          blob: storage.blob.Blob) -> bool:
+    """Checks if a Cloud Storage object has the content of a local file.
+
+    The CRC32C checksum is compared since it is set on all the objects,
+    including composite objects. The MD5 hash is used otherwise.
 
-  def upload_directory(self, source_directory_path: str, bucket_name: str,
-                       destination_dir_path: str) -> None:
+    Args:
+      source_file_path: Path to the local file.
+      blob: The Cloud Storage object.
+
+    Returns:
+      True if the object has the same size and checksum as the file.
+    """
+    if blob.size != os.path.getsize(source_file_path):
+      return False
+    if blob.crc32c:
+      local_hash = google_crc32c.Checksum()
+      remote_hash = blob.crc32c
+    elif blob.md5_hash:
+      local_hash = hashlib.md5()
+      remote_hash = blob.md5_hash
+    else:
+      return False
+    with open(source_file_path, 'rb') as source_file:
+      for chunk in iter(lambda: source_file.read(_CHECKSUM_CHUNK_SIZE), b''):
+        local_hash.update(chunk)
+    return base64.b64encode(local_hash.digest()).decode('utf-8') == remote_hash
+
+  def _list_blobs(self, bucket: storage.bucket.Bucket,
+                  prefix: str) -> Dict[str, storage.blob.Blob]:
+    """Lists the objects under a prefix with a single listing.
+
+    Args:
+      bucket: Cloud Storage bucket.
+      prefix: Path of the directory within the bucket.
+
+    Returns:
+      The objects keyed by object name.
+    """
+    if prefix and not prefix.endswith('/'):
+      prefix += '/'
+    return {
+        blob.name: blob
+        for blob in self.client.list_blobs(bucket, prefix=prefix or None)
+    }
+
+  def upload_directory(
+      self,
+      source_directory_path: str,
+      bucket_name: str,
+      destination_dir_path: str,
+      sync: bool = False,
+      max_workers: int = _DEFAULT_UPLOAD_WORKERS,
+      delete_orphans: bool = False) -> SyncReport:
     """Uploads an entire directory to Cloud Storage.
 
     All the files in the source directory are identified recursively and
-    uploaded to Cloud Storage bucket. The symlinks in the source directory is
-    ignored to avoid infinite recursion. If the bucket doesn't exist in the
-    Cloud Storage it will be created.
+    uploaded to Cloud Storage bucket in parallel. The symlinks in the source
+    directory is ignored to avoid infinite recursion. If the bucket doesn't
+    exist in the Cloud Storage it will be created.
+
+    In sync mode the destination directory is listed once and the files whose
+    size and CRC32C (or MD5) checksum match the existing object are skipped.
+    This makes re-deploying DAGs and SQL bundles proportional to what changed.
 
     Args:
       source_directory_path: Path to the directory to be uploaded: e.g -
@@ -226,6 +415,15 @@ class CloudStorageUtils(object):
         Cloud Storage bucket. If the Cloud Storage URL is
         'gs://bucket/dir1/dir2', then the destination_dir_path would be
         'dir1/dir2'.
+      sync: Optional. Whether to skip the files which are identical to the
+        objects already in Cloud Storage.
+      max_workers: Optional. Number of files uploaded in parallel.
+      delete_orphans: Optional. Whether to delete the objects under
+        destination_dir_path which don't have a matching local file. Only
+        applied when `sync` is True.
+
+    Returns:
+      Summary of the transferred, skipped and deleted files.
 
     Raises:
       FileNotFoundError: If the provided directory is not found.
@@ -237,24 +435,111 @@ class CloudStorageUtils(object):
           f'The directory "{source_directory_path}" could not be found.')
     logging.info('Uploading "%s" directory to "gs://%s/%s"',
                  source_directory_path, bucket_name, destination_dir_path)
-    files_to_upload = []
+    files_to_upload = {}
     for (root, _, files) in os.walk(source_directory_path):
       if not files:
         continue
       for file in files:
         full_path = os.path.join(root, file)
-        files_to_upload.append(full_path)
+        # Construct destination path by replacing source directory path:
+        # If the source directory is `/tmp/dir1` and destination_dir_path is
+        # `obj1/obj2` then file `/tmp/dir1/dir2/file.txt` will have a
+        # destination file path `obj1/obj2/dir2/file.txt`
+        relative_path = os.path.relpath(full_path, source_directory_path)
+        destination_file_path = '/'.join(
+            part for part in [destination_dir_path.strip('/')] +
+            relative_path.split(os.sep) if part)
+        files_to_upload[destination_file_path] = full_path
     bucket = self._get_or_create_bucket(bucket_name)
-    for file in files_to_upload:
-      # Construct destination path by replacing source directory path:
-      # If the source directory is `/tmp/dir1` and destination_dir_path is
-      # `obj1/obj2` then file `/tmp/dir1/dir2/file.txt` will have a destination
-      # file path `obj1/obj2/dir2/file.txt`
-      destination_file_path = file.replace(source_directory_path,
-                                           destination_dir_path)
-      self._upload_file(file, bucket, destination_file_path)
-    logging.info('Uploaded "%s" directory to "gs://%s/%s"',
-                 source_directory_path, bucket_name, destination_dir_path)
+    existing_blobs = {}
+    if sync:
+      existing_blobs = self._list_blobs(bucket, destination_dir_path.strip('/'))
+    skipped_files = 0
+    skipped_bytes = 0
+    uploaded_bytes = 0
+    changed_files = {}
+    for destination_file_path, file in files_to_upload.items():
+      blob = existing_blobs.get(destination_file_path)
+      if blob is not None and self._is_blob_up_to_date(file, blob):
+        skipped_files += 1
+        skipped_bytes += blob.size
+        continue
+      changed_files[destination_file_path] = file
+    orphan_blobs = []
+    if sync and delete_orphans:
+      orphan_blobs = [
+          blob for name, blob in existing_blobs.items()
+          if name not in files_to_upload
+      ]
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers) as executor:
+      futures = [
+          executor.submit(self._upload_file, file, bucket,
+                          destination_file_path)
+          for destination_file_path, file in changed_files.items()
+      ]
+      futures.extend(
+          executor.submit(self._delete_blob, blob) for blob in orphan_blobs)
+      for future in concurrent.futures.as_completed(futures):
+        future.result()
+    for file in changed_files.values():
+      uploaded_bytes += os.path.getsize(file)
+    report = SyncReport(
+        uploaded_files=len(changed_files),
+        uploaded_bytes=uploaded_bytes,
+        skipped_files=skipped_files,
+        skipped_bytes=skipped_bytes,
+        deleted_files=len(orphan_blobs))
+    logging.info(
+        'Uploaded "%s" directory to "gs://%s/%s": %d files (%d bytes) '
+        'uploaded, %d files (%d bytes) unchanged, %d orphan objects deleted.',
+        source_directory_path, bucket_name, destination_dir_path,
+        report.uploaded_files, report.uploaded_bytes, report.skipped_files,
+        report.skipped_bytes, report.deleted_files)
+    return report
+
+  @retry.Retry()
+  def _delete_blob(self, blob: storage.blob.Blob) -> None:
+    """Deletes a Cloud Storage object with Retry logic.
+
+    Args:
+      blob: The Cloud Storage object to be deleted.
+    """
+    logging.info('Deleting object "gs://%s/%s"', blob.bucket.name, blob.name)
+    try:
+      blob.delete()
+    except exceptions.NotFound:
+      pass
+
+  def _abort_upload(self, blob_writer: storage.fileio.BlobWriter,
+                    blob: storage.blob.Blob,
+                    previous_generation: Optional[int]) -> None:
+    """Cancels a resumable upload and deletes the object it may have created.
+
+    Args:
+      blob_writer: The writer of the upload, which is not closed so that the
+        upload isn't finalized.
+      blob: The destination object of the upload.
+      previous_generation: Generation of the object before the upload, None if
+        there was no object. This object is kept.
+    """
+    # The cleanup is best effort, its errors mustn't hide the upload error.
+    try:
+      blob_writer.terminate()
+    except Exception:  # pylint: disable=broad-except
+      logging.exception('Error occurred while cancelling the upload to '
+                        '"gs://%s/%s".', blob.bucket.name, blob.name)
+    logging.info('Deleting partial object "gs://%s/%s"', blob.bucket.name,
+                 blob.name)
+    try:
+      blob.delete(
+          if_generation_not_match=previous_generation,
+          retry=storage_retry.DEFAULT_RETRY)
+    except (exceptions.NotFound, exceptions.PreconditionFailed):
+      pass
+    except exceptions.GoogleAPICallError:
+      logging.exception('Error occurred while deleting partial object '
+                        '"gs://%s/%s".', blob.bucket.name, blob.name)
 
   def write_to_path(self, file_content: str, destination_file_path: str):
     """Writes file content to Cloud Storage file.
@@ -297,3 +582,107 @@ class CloudStorageUtils(object):
     destination_blob.upload_from_string(file_content)
     logging.info('Successfully wrote data to "gs://%s/%s"', bucket_name,
                  destination_file_path)
+
+  def write_stream_to_path(self,
+                           stream: Union[BinaryIO, Iterable[bytes]],
+                           destination_file_path: str,
+                           chunk_size: int = _DEFAULT_CHUNK_SIZE,
+                           gzip_content: bool = False,
+                           content_type: Optional[str] = None) -> int:
+    """Streams content to Cloud Storage file.
+
+    This is a convenience method that parses bucket name and path, and calls
+    write_stream_to_file, so that the client can pass the full path as a whole.
+
+    Args:
+      stream: Binary file-like object or iterable of bytes to be written.
+      destination_file_path: The full path to destination file, in the form of
+        'gs://bucket_name/path/to/file'.
+      chunk_size: Optional. Size in bytes of the resumable upload chunks.
+      gzip_content: Optional. Whether to compress the content on the fly and
+        store it with 'gzip' content encoding.
+      content_type: Optional. Content type of the destination object.
+
+    Returns:
+      Number of uncompressed bytes written.
+    """
+    bucket_name, path = self._parse_blob_url(destination_file_path)
+    return self.write_stream_to_file(stream, bucket_name, path, chunk_size,
+                                     gzip_content, content_type)
+
+  def write_stream_to_file(self,
+                           stream: Union[BinaryIO, Iterable[bytes]],
+                           bucket_name: str,
+                           destination_file_path: str,
+                           chunk_size: int = _DEFAULT_CHUNK_SIZE,
+                           gzip_content: bool = False,
+                           content_type: Optional[str] = None) -> int:
+    """Streams content to Cloud Storage file with a resumable upload.
+
+    Unlike write_to_file, the content doesn't need to be held in memory: it is
+    read from the stream and sent in chunks of chunk_size bytes, so the peak
+    memory is bounded by the chunk size. Each chunk is retried for transient
+    errors; the upload as a whole isn't retried since the stream can't be
+    rewound. If reading the stream fails, the upload is cancelled instead of
+    being finalized with the content read so far and the error is raised. If
+    the bucket doesn't exist in the Cloud Storage, it will be created.
+
+    Args:
+      stream: Binary file-like object or iterable of bytes to be written.
+      bucket_name: Cloud Storage bucket to which the content should be written.
+        If the Cloud Storage URL is 'gs://bucket1/file1.txt', then the
+        bucket_name would be 'bucket1'.
+      destination_file_path: Path of the destination blob/object within the
+        Cloud Storage bucket. If the Cloud Storage URL is
+        'gs://bucket1/dir1/file1.txt', then the destination_file_path would be
+        'dir1/file1.txt'.
+      chunk_size: Optional. Size in bytes of the resumable upload chunks. It
+        has to be a multiple of 256 KiB.
+      gzip_content: Optional. Whether to compress the content on the fly and
+        store it with 'gzip' content encoding.
+      content_type: Optional. Content type of the destination object.
+
+    Returns:
+      Number of uncompressed bytes written.
+    """
+    logging.info('Streaming data to "gs://%s/%s"', bucket_name,
+                 destination_file_path)
+    if isinstance(stream, io.IOBase) or hasattr(stream, 'read'):
+      chunks = iter(lambda: stream.read(chunk_size), b'')
+    else:
+      chunks = stream
+    bucket = self._get_or_create_bucket(bucket_name)
+    destination_blob = bucket.blob(destination_file_path)
+    if content_type:
+      destination_blob.content_type = content_type
+    if gzip_content:
+      destination_blob.content_encoding = 'gzip'
+    # A failed upload deletes the object it may have finalized, but not the
+    # object it was replacing.
+    previous_blob = bucket.get_blob(destination_file_path)
+    previous_generation = previous_blob.generation if previous_blob else None
+    bytes_written = 0
+    blob_writer = destination_blob.open(
+        'wb',
+        chunk_size=chunk_size,
+        ignore_flush=True,
+        retry=storage_retry.DEFAULT_RETRY)
+    writer = blob_writer
+    if gzip_content:
+      writer = gzip.GzipFile(fileobj=blob_writer, mode='wb')
+    try:
+      for chunk in chunks:
+        writer.write(chunk)
+        bytes_written += len(chunk)
+      if gzip_content:
+        writer.close()
+    except Exception:
+      logging.exception('Error occurred while streaming data to "gs://%s/%s".',
+                        bucket_name, destination_file_path)
+      self._abort_upload(blob_writer, destination_blob, previous_generation)
+      raise
+    # Closing the writer uploads the last chunk and finalizes the object.
+    blob_writer.close()
+    logging.info('Successfully streamed %d bytes to "gs://%s/%s"',
+                 bytes_written, bucket_name, destination_file_path)
+    return bytes_written
@@ -0,0 +1,171 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Tests for cloud_storage."""
+
+import gzip
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from plugins.cloud_utils import cloud_storage
+
+
+class _BlobWriter(io.RawIOBase):
+  """Stand-in of a BlobWriter, finalizing the object when closed."""
+
+  def __init__(self):
+    super().__init__()
+    self.content = b''
+    self.is_finalized = False
+    self.is_terminated = False
+
+  def writable(self):
+    return True
+
+  def write(self, data):
+    self.content += bytes(data)
+    return len(data)
+
+  def close(self):
+    if not self.is_terminated:
+      self.is_finalized = True
+    super().close()
+
+  def terminate(self):
+    self.is_terminated = True
+    super().close()
+
+
+def _read_chunks(chunks):
+  for chunk in chunks:
+    if isinstance(chunk, Exception):
+      raise chunk
+    yield chunk
+
+
+class _CloudStorageTestCase(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    get_credentials = mock.patch.object(cloud_storage.cloud_auth,
+                                        'get_credentials')
+    get_credentials.start()
+    self.addCleanup(get_credentials.stop)
+    client_patcher = mock.patch.object(cloud_storage.storage, 'Client')
+    client = client_patcher.start().return_value
+    self.addCleanup(client_patcher.stop)
+    self.bucket = client.get_bucket.return_value
+    self.bucket.get_blob.return_value = None
+    self.blob = self.bucket.blob.return_value
+    self.cloud_storage = cloud_storage.CloudStorageUtils('project_id')
+
+
+class UploadFileTest(_CloudStorageTestCase):
+
+  def setUp(self):
+    super().setUp()
+    source_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(source_dir.cleanup)
+    self.source_file_path = os.path.join(source_dir.name, 'file.csv')
+    with open(self.source_file_path, 'wb') as source_file:
+      source_file.write(b'a,b\n' * 1024)
+
+  def test_composite_upload_is_opt_in(self):
+    self.cloud_storage.upload_file(self.source_file_path, 'bucket',
+                                   'dir/file.csv')
+
+    self.bucket.blob.assert_called_once_with('dir/file.csv')
+    self.blob.upload_from_filename.assert_called_once_with(
+        self.source_file_path)
+    self.blob.compose.assert_not_called()
+
+  def test_composite_upload_composes_with_generation_precondition(self):
+    self.bucket.get_blob.return_value = mock.Mock(generation=1234)
+
+    self.cloud_storage.upload_file(
+        self.source_file_path,
+        'bucket',
+        'dir/file.csv',
+        parallel_composite_threshold=1024)
+
+    self.blob.compose.assert_called_once_with(
+        mock.ANY, if_generation_match=1234, retry=mock.ANY)
+    self.blob.delete.assert_called()
+
+  def test_composite_upload_of_new_object(self):
+    self.cloud_storage.upload_file(
+        self.source_file_path,
+        'bucket',
+        'dir/file.csv',
+        parallel_composite_threshold=1024)
+
+    self.blob.compose.assert_called_once_with(
+        mock.ANY, if_generation_match=0, retry=mock.ANY)
+
+
+class WriteStreamToFileTest(_CloudStorageTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.blob_writer = _BlobWriter()
+    self.blob.open.return_value = self.blob_writer
+
+  def test_write_stream(self):
+    bytes_written = self.cloud_storage.write_stream_to_file(
+        _read_chunks([b'a,b\n', b'1,2\n']), 'bucket', 'dir/file.csv')
+
+    self.assertEqual(bytes_written, 8)
+    self.assertEqual(self.blob_writer.content, b'a,b\n1,2\n')
+    self.assertTrue(self.blob_writer.is_finalized)
+    self.blob.delete.assert_not_called()
+
+  def test_write_gzip_stream(self):
+    self.cloud_storage.write_stream_to_file(
+        io.BytesIO(b'a,b\n1,2\n'), 'bucket', 'dir/file.csv.gz',
+        gzip_content=True)
+
+    self.assertEqual(gzip.decompress(self.blob_writer.content), b'a,b\n1,2\n')
+    self.assertEqual(self.blob.content_encoding, 'gzip')
+    self.assertTrue(self.blob_writer.is_finalized)
+
+  def test_failed_stream_is_not_finalized(self):
+    with self.assertRaises(ValueError):
+      self.cloud_storage.write_stream_to_file(
+          _read_chunks([b'a,b\n', ValueError('Broken stream.')]), 'bucket',
+          'dir/file.csv', gzip_content=True)
+
+    self.assertTrue(self.blob_writer.is_terminated)
+    self.assertFalse(self.blob_writer.is_finalized)
+    self.blob.delete.assert_called_once_with(
+        if_generation_not_match=None, retry=mock.ANY)
+
+  def test_failed_stream_keeps_the_replaced_object(self):
+    self.bucket.get_blob.return_value = mock.Mock(generation=1234)
+
+    with self.assertRaises(ValueError):
+      self.cloud_storage.write_stream_to_file(
+          _read_chunks([ValueError('Broken stream.')]), 'bucket',
+          'dir/file.csv')
+
+    self.blob.delete.assert_called_once_with(
+        if_generation_not_match=1234, retry=mock.ANY)
+
+
+if __name__ == '__main__':
+  unittest.main()
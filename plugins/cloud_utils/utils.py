@@ -32,25 +32,73 @@
 
   This module implements the common methods required for different modules under
   cloud_utils package.
+
+  Every request sent with `execute_request` is rate limited client-side, by
+  default to 10 requests per second with bursts of 20 per API. Requests
+  failing with a retriable status code are retried up to 5 times with jittered
+  exponential backoff, honoring the Retry-After header, within a process-wide
+  retry budget. Use `set_rate_limit` and `set_retry_policy` to change these
+  defaults, e.g. to raise the limit of an API with a higher quota.
 """
 
+from concurrent import futures
+import email.utils
+import random
+import threading
 import time
-from typing import Any, Dict, Text
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple
+from urllib import parse
 
 import logging
 import apiclient
 from googleapiclient import errors
 from googleapiclient import http
 
-from google.api_core import retry
-
 
-# Number of seconds to wait before re-checking for operation status.
-_WAIT_FOR_OPERATION_SLEEP_SECONDS = 10
+# Number of seconds to wait before the first re-check of operation status.
+_WAIT_FOR_OPERATION_SLEEP_SECONDS = 2
+# Factor applied to the wait interval after each poll.
+_WAIT_FOR_OPERATION_BACKOFF = 1.5
+# Maximum number of seconds to wait between two checks of operation status.
+_WAIT_FOR_OPERATION_MAX_SLEEP_SECONDS = 30
+# Maximum number of requests in a single batch request.
+_MAX_BATCH_SIZE = 100
 _RETRIABLE_STATUS_CODES = (
     429,  # Too Many Requests
     500,  # Internal Server Error
     503)  # Service Unavailable
+# Default sustained rate (requests per second) and burst size of the token
+# bucket of each API. Override with `set_rate_limit`.
+_DEFAULT_RATE_LIMIT = 10.0
+_DEFAULT_BURST = 20
+# Default retry policy. Override with `set_retry_policy`.
+_DEFAULT_MAX_RETRIES = 5
+_DEFAULT_INITIAL_BACKOFF_SECONDS = 1.0
+_DEFAULT_MAX_BACKOFF_SECONDS = 60.0
+# The retry budget earns `ratio` retries per call up to `max_tokens` retries,
+# so a burst of failures can't turn into a retry storm.
+_DEFAULT_RETRY_BUDGET_RATIO = 0.2
+_DEFAULT_RETRY_BUDGET_MAX_TOKENS = 10.0
+
+_limiter_lock = threading.RLock()
+_rate_limits: Dict[str, Tuple[float, float]] = {}
+_token_buckets: Dict[str, '_TokenBucket'] = {}
+_retry_policy = {
+    'max_retries': _DEFAULT_MAX_RETRIES,
+    'initial_backoff_seconds': _DEFAULT_INITIAL_BACKOFF_SECONDS,
+    'max_backoff_seconds': _DEFAULT_MAX_BACKOFF_SECONDS,
+    'budget_ratio': _DEFAULT_RETRY_BUDGET_RATIO,
+    'budget_max_tokens': _DEFAULT_RETRY_BUDGET_MAX_TOKENS,
+}
+_retry_budget_tokens = _DEFAULT_RETRY_BUDGET_MAX_TOKENS
+_request_metrics = {
+    'calls': 0,
+    'retries': 0,
+    'retry_budget_exhausted': 0,
+    'throttled_seconds': 0.0,
+    'backoff_seconds': 0.0,
+}
+_endpoint_metrics: Dict[str, Dict[str, Any]] = {}
 
 
 class Error(Exception):
@@ -74,54 +122,451 @@ def _is_retriable_http_error(error: errors.HttpError) -> bool:
   return False
 
 
-@retry.Retry(predicate=_is_retriable_http_error)
+class _TokenBucket(object):
+  """Token bucket limiting the rate of requests sent to an API."""
+
+  def __init__(self, rate: float, burst: float) -> None:
+    """Initialise new instance of _TokenBucket.
+
+    Args:
+      rate: Number of tokens added per second.
+      burst: Maximum number of tokens in the bucket.
+    """
+    self.rate = rate
+    self.burst = burst
+    self._tokens = burst
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  def acquire(self) -> float:
+    """Takes a token, waiting until one is available.
+
+    Returns:
+      Number of seconds spent waiting for the token.
+    """
+    waited = 0.0
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+          self._tokens -= 1
+          return waited
+        wait_seconds = (1 - self._tokens) / self.rate
+      time.sleep(wait_seconds)
+      waited += wait_seconds
+
+
+def set_rate_limit(endpoint: str, rate: float, burst: float = None) -> None:
+  """Sets the client-side rate limit of an API or an API method.
+
+  Args:
+    endpoint: API name, e.g. 'composer', or method id, e.g.
+      'composer.projects.locations.environments.patch'. Method limits take
+      precedence over API limits.
+    rate: Sustained number of requests per second.
+    burst: Optional. Maximum number of requests sent at once. Defaults to the
+      rate.
+  """
+  with _limiter_lock:
+    _rate_limits[endpoint] = (rate, burst if burst is not None else rate)
+    _token_buckets.pop(endpoint, None)
+
+
+def set_retry_policy(**policy: float) -> None:
+  """Overrides the retry policy of execute_request.
+
+  Args:
+    **policy: Any of 'max_retries', 'initial_backoff_seconds',
+      'max_backoff_seconds', 'budget_ratio' and 'budget_max_tokens'.
+
+  Raises:
+    Error: If an unknown setting is passed.
+  """
+  global _retry_budget_tokens
+  with _limiter_lock:
+    unknown_settings = set(policy) - set(_retry_policy)
+    if unknown_settings:
+      raise Error(f'Unknown retry policy settings: {sorted(unknown_settings)}')
+    _retry_policy.update(policy)
+    _retry_budget_tokens = min(_retry_budget_tokens,
+                               _retry_policy['budget_max_tokens'])
+
+
+def get_request_metrics() -> Dict[str, Any]:
+  """Returns counters of the requests sent by execute_request.
+
+  Returns:
+    metrics: Number of requests sent (retries included) and retries, retries
+      denied by the retry budget, seconds spent waiting for the rate limiter
+      and backing off, in total and per endpoint under the 'endpoints' key.
+  """
+  with _limiter_lock:
+    metrics = dict(_request_metrics)
+    metrics['endpoints'] = {
+        endpoint: dict(endpoint_metrics)
+        for endpoint, endpoint_metrics in _endpoint_metrics.items()
+    }
+    return metrics
+
+
+def reset_request_metrics() -> None:
+  """Resets the counters returned by get_request_metrics."""
+  with _limiter_lock:
+    for key in _request_metrics:
+      _request_metrics[key] = 0
+    _endpoint_metrics.clear()
+
+
+def _get_request_endpoint(request: http.HttpRequest) -> str:
+  """Returns the method id of a request, or the host for batch requests."""
+  method_id = getattr(request, 'methodId', None)
+  if method_id:
+    return method_id
+  uri = getattr(request, 'uri', None) or getattr(request, '_batch_uri', '')
+  return parse.urlparse(uri).netloc or 'unknown'
+
+
+def _get_token_bucket(endpoint: str) -> Tuple[str, _TokenBucket]:
+  """Returns the token bucket limiting an endpoint.
+
+  The method id is looked up first, then the API name, i.e. the first
+  component of the method id. APIs without a configured limit get the
+  default limit.
+
+  Args:
+    endpoint: Method id of the request.
+
+  Returns:
+    The key of the bucket and the bucket.
+  """
+  api = endpoint.split('.', 1)[0]
+  with _limiter_lock:
+    key = endpoint if endpoint in _rate_limits else api
+    if key not in _token_buckets:
+      rate, burst = _rate_limits.get(key, (_DEFAULT_RATE_LIMIT, _DEFAULT_BURST))
+      _token_buckets[key] = _TokenBucket(rate, burst)
+    return key, _token_buckets[key]
+
+
+def _record(endpoint: str, metric: str, value: float = 1) -> None:
+  """Adds a value to the total and endpoint counters."""
+  with _limiter_lock:
+    _request_metrics[metric] += value
+    endpoint_metrics = _endpoint_metrics.setdefault(
+        endpoint, {key: 0 for key in _request_metrics})
+    endpoint_metrics[metric] += value
+
+
+def _get_retry_after_seconds(error: errors.HttpError) -> Optional[float]:
+  """Returns the delay requested by the Retry-After header of an error.
+
+  Args:
+    error: The http error.
+
+  Returns:
+    Number of seconds to wait, or None if the header is missing or invalid.
+  """
+  retry_after = error.resp.get('retry-after')
+  if not retry_after:
+    return None
+  try:
+    return max(float(retry_after), 0.0)
+  except ValueError:
+    pass
+  try:
+    retry_date = email.utils.parsedate_to_datetime(retry_after)
+  except (TypeError, ValueError):
+    return None
+  return max(retry_date.timestamp() - time.time(), 0.0)
+
+
+def _take_retry_token() -> bool:
+  """Takes a retry from the retry budget if any is left."""
+  global _retry_budget_tokens
+  with _limiter_lock:
+    if _retry_budget_tokens < 1:
+      return False
+    _retry_budget_tokens -= 1
+    return True
+
+
+def _earn_retry_tokens() -> None:
+  """Adds the retries earned by a call to the retry budget."""
+  global _retry_budget_tokens
+  with _limiter_lock:
+    _retry_budget_tokens = min(
+        _retry_budget_tokens + _retry_policy['budget_ratio'],
+        _retry_policy['budget_max_tokens'])
+
+
 def execute_request(request: http.HttpRequest) -> Any:
   """Executes an HTTP request and return its response.
 
-  This method executes an HTTP request and retries if the response error code is
-  capable of being retried. Refer to `retry_utils.py` module to see the list of
-  error codes for which the retry will be attempted.
+  Requests are limited by a token bucket per API (or per method when one is
+  configured with `set_rate_limit`), so bursts are smoothed client-side
+  instead of hitting per-minute quotas. Requests failing with a retriable
+  status code (see `_RETRIABLE_STATUS_CODES`) are retried with jittered
+  exponential backoff, honoring the Retry-After header, as long as the
+  process-wide retry budget allows it.
 
   Args:
     request: HTTP request to be executed.
 
   Returns:
     response: Response from the HTTP request.
+
+  Raises:
+    errors.HttpError: If the request failed and could not be retried.
+  """
+  endpoint = _get_request_endpoint(request)
+  _, token_bucket = _get_token_bucket(endpoint)
+  _earn_retry_tokens()
+  attempt = 0
+  while True:
+    _record(endpoint, 'calls')
+    throttled_seconds = token_bucket.acquire()
+    if throttled_seconds:
+      _record(endpoint, 'throttled_seconds', throttled_seconds)
+    try:
+      return request.execute()
+    except errors.HttpError as error:
+      if not _is_retriable_http_error(error):
+        raise
+      if attempt >= _retry_policy['max_retries']:
+        logging.info('Giving up on %s after %d retries.', endpoint, attempt)
+        raise
+      if not _take_retry_token():
+        _record(endpoint, 'retry_budget_exhausted')
+        logging.info('Retry budget exhausted, not retrying %s.', endpoint)
+        raise
+      backoff_seconds = random.uniform(
+          0,
+          min(_retry_policy['max_backoff_seconds'],
+              _retry_policy['initial_backoff_seconds'] * 2**attempt))
+      retry_after_seconds = _get_retry_after_seconds(error)
+      if retry_after_seconds is not None:
+        backoff_seconds = max(backoff_seconds, retry_after_seconds)
+      attempt += 1
+      _record(endpoint, 'retries')
+      _record(endpoint, 'backoff_seconds', backoff_seconds)
+      logging.info('Retriable error %s on %s. Retrying in %.1f seconds.',
+                   error.resp.status, endpoint, backoff_seconds)
+      time.sleep(backoff_seconds)
+
+
+class OperationTracker(object):
+  """Tracks long running operations and polls their status in batches.
+
+  All the pending operations are fetched with a single batch request on every
+  poll, so waiting for several operations takes as long as the slowest one
+  instead of the sum of all of them. The interval between two polls starts at
+  `initial_interval` seconds and grows by `backoff` up to `max_interval`
+  seconds, so short operations complete quickly while long ones don't issue
+  many requests.
+
+  Typical usage example:
+       >>> tracker = OperationTracker(client.projects().locations().operations())
+       >>> future = tracker.add(operation, timeout=1800)
+       >>> tracker.wait()
+       >>> future.result()
   """
-  response = request.execute()
-  return response
+
+  def __init__(
+      self,
+      operation_client: apiclient.discovery.Resource,
+      initial_interval: float = _WAIT_FOR_OPERATION_SLEEP_SECONDS,
+      max_interval: float = _WAIT_FOR_OPERATION_MAX_SLEEP_SECONDS,
+      backoff: float = _WAIT_FOR_OPERATION_BACKOFF,
+      batch_uri: Optional[str] = None) -> None:
+    """Initialise new instance of OperationTracker.
+
+    Args:
+      operation_client: Client with methods for interacting with the operation
+        APIs. The `build_service_client` method from `cloud_auth` module can be
+        used to build the client.
+      initial_interval: Optional. Seconds to wait before the first re-check.
+      max_interval: Optional. Maximum number of seconds between two checks.
+      backoff: Optional. Factor applied to the interval after each poll.
+      batch_uri: Optional. URI of the batch endpoint. By default it's the
+        batch path of the discovery document of the operation API.
+    """
+    self._operation_client = operation_client
+    self._initial_interval = initial_interval
+    self._max_interval = max_interval
+    self._backoff = backoff
+    self._batch_uri = batch_uri
+    # Pending operations keyed by name: (future, deadline).
+    self._pending = {}
+
+  def add(self,
+          operation: Dict[Text, Any],
+          timeout: Optional[float] = None,
+          callback: Optional[Callable[[futures.Future], None]] = None
+         ) -> futures.Future:
+    """Adds an operation to be tracked.
+
+    Args:
+      operation: Resource representing long running operation.
+      timeout: Optional. Maximum number of seconds to wait for the operation.
+        The operation isn't cancelled when the deadline is exceeded, but its
+        future fails with Error.
+      callback: Optional. Function called with the future once the operation
+        is completed.
+
+    Returns:
+      Future resolved with the completed operation resource, or failed with
+      Error if the operation failed or exceeded its deadline.
+    """
+    future = futures.Future()
+    future.set_running_or_notify_cancel()
+    if callback:
+      future.add_done_callback(callback)
+    if operation.get('done'):
+      self._complete(operation, future)
+      return future
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    self._pending[operation['name']] = (future, deadline)
+    return future
+
+  def _complete(self, operation: Dict[Text, Any],
+                future: futures.Future) -> None:
+    """Resolves the future of a completed operation.
+
+    Args:
+      operation: Resource representing the completed operation.
+      future: Future of the operation.
+    """
+    if operation.get('error'):
+      logging.info(
+          f'Operation {operation["name"]} failed to complete successfully.')
+      future.set_exception(
+          Error(f'Operation {operation["name"]} not completed. Error Details - '
+                f'{operation["error"]}'))
+    else:
+      logging.info(f'Operation {operation["name"]} successfully completed.')
+      future.set_result(operation)
+
+  def _get_batch_uri(self) -> str:
+    """Returns the URI of the batch endpoint of the operation API.
+
+    The URI is built from the root URL and the batch path of the discovery
+    document of the client, as `new_batch_http_request` does on the root
+    resource of the client.
+
+    Raises:
+      Error: If the client has no discovery document and no batch URI was set.
+    """
+    if self._batch_uri:
+      return self._batch_uri
+    # Nested resources keep the discovery document of their service.
+    root_description = getattr(self._operation_client, '_rootDesc', None)
+    if not root_description:
+      raise Error('The batch URI of the operation API is unknown.')
+    return (root_description['rootUrl'] +
+            root_description.get('batchPath', 'batch'))
+
+  def poll(self) -> None:
+    """Fetches the status of all the pending operations once."""
+    names = list(self._pending)
+    for start in range(0, len(names), _MAX_BATCH_SIZE):
+      batch = None
+      for name in names[start:start + _MAX_BATCH_SIZE]:
+        request = self._operation_client.get(name=name)
+        if batch is None:
+          batch = http.BatchHttpRequest(
+              callback=self._handle_response, batch_uri=self._get_batch_uri())
+        batch.add(request, request_id=name)
+      execute_request(batch)
+    now = time.monotonic()
+    for name, (future, deadline) in list(self._pending.items()):
+      if deadline is not None and now >= deadline:
+        del self._pending[name]
+        logging.info(f'Operation {name} exceeded its deadline.')
+        future.set_exception(
+            Error(f'Operation {name} not completed before its deadline.'))
+
+  def _handle_response(self, request_id: str, operation: Dict[Text, Any],
+                       exception: Optional[errors.HttpError]) -> None:
+    """Handles the response of a single operation of a batch request.
+
+    Args:
+      request_id: Name of the operation.
+      operation: Resource representing the operation.
+      exception: Error of the request, if any.
+    """
+    if request_id not in self._pending:
+      return
+    future, _ = self._pending[request_id]
+    if exception is not None:
+      if isinstance(exception, errors.HttpError) and _is_retriable_http_error(
+          exception):
+        logging.info(f'Retriable error while checking operation {request_id}.')
+        return
+      del self._pending[request_id]
+      future.set_exception(exception)
+      return
+    if operation.get('done'):
+      del self._pending[request_id]
+      self._complete(operation, future)
+
+  def wait(self) -> None:
+    """Waits until all the tracked operations are completed or timed out."""
+    interval = self._initial_interval
+    while self._pending:
+      logging.info(
+          f'{len(self._pending)} operations still in progress. Sleeping for '
+          f'{interval:.1f} seconds before retrying.')
+      time.sleep(interval)
+      self.poll()
+      interval = min(interval * self._backoff, self._max_interval)
+
+
+def wait_for_operations(operation_client: apiclient.discovery.Resource,
+                        operations: List[Dict[Text, Any]],
+                        timeout: Optional[float] = None
+                       ) -> List[Dict[Text, Any]]:
+  """Waits for the completion of several operations.
+
+  Args:
+    operation_client: Client with methods for interacting with the operation
+      APIs.
+    operations: Resources representing long running operations.
+    timeout: Optional. Maximum number of seconds to wait for each operation.
+
+  Returns:
+    The completed operation resources, in the order of `operations`.
+
+  Raises:
+    Error: If any of the operations is not successfully completed.
+  """
+  tracker = OperationTracker(operation_client)
+  operation_futures = [
+      tracker.add(operation, timeout=timeout) for operation in operations
+  ]
+  tracker.wait()
+  return [future.result() for future in operation_futures]
 
 
 def wait_for_operation(operation_client: apiclient.discovery.Resource,
-                       operation: Dict[Text, Any]) -> None:
+                       operation: Dict[Text, Any],
+                       timeout: Optional[float] = None) -> None:
   """Waits for the completion of operation.
 
   This method retrieves operation resource and checks for its status. If the
-  operation is not completed, then the operation is re-checked after
-  `_WAIT_FOR_OPERATION_SLEEP_SECONDS` seconds.
+  operation is not completed, then the operation is re-checked with an interval
+  growing from `_WAIT_FOR_OPERATION_SLEEP_SECONDS` seconds.
 
   Args:
     operation_client: Client with methods for interacting with the operation
       APIs. The `build_service_client` method from `cloud_auth` module can be
       used to build the client.
     operation: Resource representing long running operation.
+    timeout: Optional. Maximum number of seconds to wait for the operation.
 
   Raises:
     Error: If the operation is not successfully completed.
   """
-  while True:
-    request = operation_client.get(name=operation['name'])
-    updated_operation = execute_request(request)
-    if updated_operation.get('done'):
-      logging.info(f'Operation {operation["name"]} successfully completed.')
-      return
-    if updated_operation.get('error'):
-      logging.info(
-          f'Operation {operation["name"]} failed to complete successfully.')
-      raise Error(
-          f'Operation {operation["name"]} not completed. Error Details - '
-          f'{updated_operation["error"]}')
-    logging.info(
-        f'Operation {operation["name"]} still in progress. Sleeping for '
-        f'{_WAIT_FOR_OPERATION_SLEEP_SECONDS} seconds before retrying.')
-    time.sleep(_WAIT_FOR_OPERATION_SLEEP_SECONDS)
+  wait_for_operations(operation_client, [operation], timeout)
@@ -0,0 +1,413 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Tests for cloud_utils.utils."""
+
+import email.utils
+import json
+import unittest
+from unittest import mock
+from urllib import parse
+
+from googleapiclient import discovery
+from googleapiclient import errors
+from googleapiclient import http
+import httplib2
+from plugins.cloud_utils import utils
+
+_METHOD_ID = 'fake.things.get'
+_EPOCH_SECONDS = 1600000000
+_BATCH_URI = 'https://fake.googleapis.com/batch/fake/v1'
+_BATCH_BOUNDARY = 'batch_boundary'
+# Discovery document of a service with an operations resource.
+_DISCOVERY_DOCUMENT = {
+    'kind': 'discovery#restDescription',
+    'discoveryVersion': 'v1',
+    'id': 'fake:v1',
+    'name': 'fake',
+    'version': 'v1',
+    'protocol': 'rest',
+    'rootUrl': 'https://fake.googleapis.com/',
+    'servicePath': '',
+    'batchPath': 'batch/fake/v1',
+    'resources': {
+        'operations': {
+            'methods': {
+                'get': {
+                    'id': 'fake.operations.get',
+                    'path': 'v1/{+name}',
+                    'httpMethod': 'GET',
+                    'parameters': {
+                        'name': {
+                            'type': 'string',
+                            'required': True,
+                            'location': 'path'
+                        }
+                    },
+                    'parameterOrder': ['name'],
+                    'response': {
+                        '$ref': 'Operation'
+                    }
+                }
+            }
+        }
+    },
+    'schemas': {
+        'Operation': {
+            'id': 'Operation',
+            'type': 'object',
+            'properties': {
+                'name': {
+                    'type': 'string'
+                },
+                'done': {
+                    'type': 'boolean'
+                }
+            }
+        }
+    }
+}
+
+
+class _FakeTime(object):
+  """Stand-in of the time module whose sleep advances the clock."""
+
+  def __init__(self) -> None:
+    self.now = 0.0
+    self.sleeps = []
+
+  def monotonic(self) -> float:
+    return self.now
+
+  def time(self) -> float:
+    return _EPOCH_SECONDS + self.now
+
+  def sleep(self, seconds: float) -> None:
+    self.sleeps.append(seconds)
+    self.now += seconds
+
+
+class _Request(object):
+  """Request returning or raising its responses in order."""
+
+  def __init__(self, *responses) -> None:
+    self.methodId = _METHOD_ID  # pylint: disable=invalid-name
+    self.call_count = 0
+    self._responses = list(responses)
+
+  def execute(self):
+    self.call_count += 1
+    response = self._responses.pop(0) if len(
+        self._responses) > 1 else self._responses[0]
+    if isinstance(response, Exception):
+      raise response
+    return response
+
+
+def _http_error(status: int, retry_after: str = None) -> errors.HttpError:
+  headers = {'status': status}
+  if retry_after is not None:
+    headers['retry-after'] = retry_after
+  return errors.HttpError(httplib2.Response(headers), b'')
+
+
+class _UtilsTestCase(unittest.TestCase):
+  """Runs the tests on a fake clock with the default limits and policy."""
+
+  def setUp(self):
+    super().setUp()
+    self.time = _FakeTime()
+    for patcher in (
+        mock.patch.object(utils, 'time', self.time),
+        # The backoff is the maximum of its jittered range.
+        mock.patch.object(utils.random, 'uniform', lambda low, high: high),
+        mock.patch.dict(utils._rate_limits, clear=True),
+        mock.patch.dict(utils._token_buckets, clear=True),
+        mock.patch.dict(utils._retry_policy),
+        mock.patch.object(utils, '_retry_budget_tokens',
+                          utils._DEFAULT_RETRY_BUDGET_MAX_TOKENS),
+    ):
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    utils.reset_request_metrics()
+
+
+class ExecuteRequestTest(_UtilsTestCase):
+
+  def test_default_rate_limit_applies_to_every_api(self):
+    request = _Request({})
+
+    for _ in range(utils._DEFAULT_BURST + 1):
+      utils.execute_request(request)
+
+    self.assertEqual(self.time.sleeps, [1 / utils._DEFAULT_RATE_LIMIT])
+
+  def test_token_bucket_burst_and_refill(self):
+    utils.set_rate_limit('fake', rate=2, burst=3)
+    request = _Request({})
+
+    for _ in range(5):
+      utils.execute_request(request)
+    self.assertEqual(self.time.sleeps, [0.5, 0.5])
+    # The bucket refills up to its burst size.
+    self.time.sleep(60)
+    for _ in range(3):
+      utils.execute_request(request)
+
+    self.assertEqual(self.time.sleeps, [0.5, 0.5, 60])
+    self.assertEqual(utils.get_request_metrics()['throttled_seconds'], 1.0)
+
+  def test_method_rate_limit_takes_precedence(self):
+    utils.set_rate_limit('fake', rate=100)
+    utils.set_rate_limit(_METHOD_ID, rate=1)
+    request = _Request({})
+
+    for _ in range(2):
+      utils.execute_request(request)
+
+    self.assertEqual(self.time.sleeps, [1.0])
+
+  def test_retriable_error_is_retried_with_backoff(self):
+    request = _Request(_http_error(503), _http_error(500), {'name': 'thing'})
+
+    self.assertEqual(utils.execute_request(request), {'name': 'thing'})
+
+    self.assertEqual(request.call_count, 3)
+    self.assertEqual(self.time.sleeps, [1.0, 2.0])
+    metrics = utils.get_request_metrics()
+    self.assertEqual(metrics['retries'], 2)
+    self.assertEqual(metrics['endpoints'][_METHOD_ID]['calls'], 3)
+
+  def test_retry_after_seconds_takes_precedence_over_backoff(self):
+    request = _Request(_http_error(429, retry_after='7'), {})
+
+    utils.execute_request(request)
+
+    self.assertEqual(self.time.sleeps, [7.0])
+
+  def test_retry_after_date(self):
+    retry_after = email.utils.formatdate(self.time.time() + 30, usegmt=True)
+    request = _Request(_http_error(429, retry_after=retry_after), {})
+
+    utils.execute_request(request)
+
+    self.assertEqual(self.time.sleeps, [30.0])
+
+  def test_shorter_retry_after_keeps_the_backoff(self):
+    utils.set_retry_policy(initial_backoff_seconds=5)
+    request = _Request(_http_error(503, retry_after='1'), {})
+
+    utils.execute_request(request)
+
+    self.assertEqual(self.time.sleeps, [5.0])
+
+  def test_non_retriable_error_is_raised_at_once(self):
+    request = _Request(_http_error(404), {})
+
+    with self.assertRaises(errors.HttpError):
+      utils.execute_request(request)
+
+    self.assertEqual(request.call_count, 1)
+    self.assertEqual(self.time.sleeps, [])
+    self.assertEqual(utils.get_request_metrics()['retries'], 0)
+
+  def test_gives_up_after_max_retries(self):
+    utils.set_retry_policy(max_retries=2)
+    request = _Request(_http_error(503))
+
+    with self.assertRaises(errors.HttpError):
+      utils.execute_request(request)
+
+    self.assertEqual(request.call_count, 3)
+
+  def test_retry_budget_exhaustion(self):
+    utils.set_retry_policy(budget_ratio=0, budget_max_tokens=2)
+    request = _Request(_http_error(503))
+
+    with self.assertRaises(errors.HttpError):
+      utils.execute_request(request)
+    with self.assertRaises(errors.HttpError):
+      utils.execute_request(request)
+
+    # The two retries of the budget are spent by the first call.
+    self.assertEqual(request.call_count, 4)
+    metrics = utils.get_request_metrics()
+    self.assertEqual(metrics['retries'], 2)
+    self.assertEqual(metrics['retry_budget_exhausted'], 2)
+
+  def test_calls_earn_retries(self):
+    utils.set_retry_policy(budget_ratio=0.5, budget_max_tokens=1)
+    utils._retry_budget_tokens = 0
+
+    with self.assertRaises(errors.HttpError):
+      utils.execute_request(_Request(_http_error(503)))
+    utils.execute_request(_Request(_http_error(503), {}))
+
+    self.assertEqual(utils.get_request_metrics()['retries'], 1)
+
+  def test_unknown_retry_policy_setting(self):
+    with self.assertRaises(utils.Error):
+      utils.set_retry_policy(max_attempts=3)
+
+
+def _batch_response(*responses):
+  """Returns the response of a batch request of operations.get requests.
+
+  Args:
+    *responses: (operation name, HTTP status, response body) tuples.
+
+  Returns:
+    The (headers, content) pair of the batch response.
+  """
+  parts = []
+  for name, status, body in responses:
+    parts.append(f'--{_BATCH_BOUNDARY}\r\n'
+                 'Content-Type: application/http\r\n'
+                 f'Content-ID: <response + {parse.quote(name)}>\r\n\r\n'
+                 f'HTTP/1.1 {status} Status\r\n'
+                 'Content-Type: application/json\r\n\r\n'
+                 f'{json.dumps(body)}\r\n')
+  return ({
+      'status': '200',
+      'content-type': f'multipart/mixed; boundary="{_BATCH_BOUNDARY}"'
+  }, ''.join(parts) + f'--{_BATCH_BOUNDARY}--')
+
+
+class OperationTrackerTest(_UtilsTestCase):
+
+  def _new_tracker(self, *responses):
+    self.http = http.HttpMockSequence(list(responses))
+    service = discovery.build_from_document(
+        _DISCOVERY_DOCUMENT, http=self.http)
+    return utils.OperationTracker(service.operations())
+
+  def test_one_batch_polls_all_the_operations(self):
+    tracker = self._new_tracker(
+        _batch_response(('operations/1', 200, {
+            'name': 'operations/1',
+            'done': True
+        }), ('operations/2', 200, {
+            'name': 'operations/2'
+        })),
+        _batch_response(('operations/2', 200, {
+            'name': 'operations/2',
+            'done': True
+        })))
+    completed = []
+    futures = [
+        tracker.add({'name': f'operations/{number}'},
+                    callback=lambda future: completed.append(future.result()))
+        for number in (1, 2)
+    ]
+
+    tracker.wait()
+
+    self.assertEqual([future.result()['name'] for future in futures],
+                     ['operations/1', 'operations/2'])
+    self.assertEqual([operation['name'] for operation in completed],
+                     ['operations/1', 'operations/2'])
+    self.assertEqual([request[0] for request in self.http.request_sequence],
+                     [_BATCH_URI, _BATCH_URI])
+    self.assertEqual(self.time.sleeps, [2, 3])
+
+  def test_completed_operation_is_not_polled(self):
+    tracker = self._new_tracker()
+
+    future = tracker.add({'name': 'operations/1', 'done': True})
+    tracker.wait()
+
+    self.assertEqual(future.result()['name'], 'operations/1')
+    self.assertEqual(self.http.request_sequence, [])
+
+  def test_failed_operations(self):
+    tracker = self._new_tracker(
+        _batch_response(('operations/1', 200, {
+            'name': 'operations/1',
+            'done': True,
+            'error': {
+                'code': 3
+            }
+        }), ('operations/2', 404, {
+            'error': {
+                'code': 404
+            }
+        })))
+    failed_future = tracker.add({'name': 'operations/1'})
+    missing_future = tracker.add({'name': 'operations/2'})
+
+    tracker.wait()
+
+    with self.assertRaises(utils.Error):
+      failed_future.result()
+    with self.assertRaises(errors.HttpError):
+      missing_future.result()
+
+  def test_retriable_error_is_polled_again(self):
+    tracker = self._new_tracker(
+        _batch_response(('operations/1', 503, {
+            'error': {
+                'code': 503
+            }
+        })),
+        _batch_response(('operations/1', 200, {
+            'name': 'operations/1',
+            'done': True
+        })))
+
+    future = tracker.add({'name': 'operations/1'})
+    tracker.wait()
+
+    self.assertEqual(future.result()['name'], 'operations/1')
+
+  def test_deadline_exceeded(self):
+    pending_operation = ('operations/1', 200, {'name': 'operations/1'})
+    tracker = self._new_tracker(
+        _batch_response(pending_operation), _batch_response(pending_operation))
+
+    future = tracker.add({'name': 'operations/1'}, timeout=5)
+    tracker.wait()
+
+    with self.assertRaises(utils.Error):
+      future.result()
+    self.assertEqual(self.time.now, 5)
+
+  def test_wait_for_operations(self):
+    self.http = http.HttpMockSequence([
+        _batch_response(('operations/1', 200, {
+            'name': 'operations/1',
+            'done': True
+        }))
+    ])
+    service = discovery.build_from_document(
+        _DISCOVERY_DOCUMENT, http=self.http)
+
+    operations = utils.wait_for_operations(
+        service.operations(), [{
+            'name': 'operations/1'
+        }])
+
+    self.assertEqual(operations, [{'name': 'operations/1', 'done': True}])
+
+  def test_batch_uri_is_required_without_discovery_document(self):
+    tracker = utils.OperationTracker(mock.Mock(spec=['get']))
+    tracker.add({'name': 'operations/1'})
+
+    with self.assertRaises(utils.Error):
+      tracker.poll()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,355 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Loads the reference tables of MarkUp, i.e. language codes and geo targets.
+
+Each reference table has a declared schema and is replaced as a whole by each
+load. The source file of a table is looked for in the data directory as
+"<table>.parquet", "<table>.csv.gz" or "<table>.csv". The checksum of the file
+is stored as a label of the table, and a load is skipped when the file didn't
+change since the last one.
+
+The geo targets file published by Google Ads lists every region and city of
+every country, while MarkUp only maps country criterion ids to country codes.
+It is pre-filtered locally to the countries and one child of each country
+before being loaded.
+
+Typical usage example:
+  >>> load_reference_data('project_id', 'markup')
+  >>> prepare_reference_file('geotargets-2021-10-01.csv', GEO_TARGETS,
+  ...                        'data/geo_targets.parquet')
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import hashlib
+import io
+import logging
+import os
+import re
+from typing import Dict, Optional, Sequence
+
+import cloud_bigquery
+from google.cloud import bigquery
+from google.cloud import exceptions
+import pyarrow
+from pyarrow import compute
+from pyarrow import csv
+from pyarrow import parquet
+
+_DATA_DIR = 'data'
+_FILE_EXTENSIONS = ('.parquet', '.csv.gz', '.csv')
+_DEFAULT_MAX_WORKERS = 4
+_CHECKSUM_LABEL = 'markup_checksum'
+# Label values are limited to 63 characters.
+_CHECKSUM_LENGTH = 32
+_READ_CHUNK_SIZE = 1024 * 1024
+_ARROW_TYPES = {
+    'STRING': pyarrow.string(),
+    'INTEGER': pyarrow.int64(),
+    'FLOAT': pyarrow.float64(),
+    'BOOLEAN': pyarrow.bool_(),
+}
+# Geo targets download page, for the error raised when the file is missing.
+_GEO_TARGETS_URL = (
+    'https://developers.google.com/google-ads/api/reference/data/geotargets')
+
+# Set logging level.
+logging.getLogger().setLevel(logging.INFO)
+
+# A reference table: its schema, with the columns of the source file in their
+# normalized form (e.g. "Criteria ID" is criteria_id), and an optional
+# function filtering the rows of the source file.
+ReferenceTable = collections.namedtuple(
+    'ReferenceTable', ['table_name', 'schema', 'row_filter'])
+
+
+class Error(Exception):
+  """Base error for this module."""
+
+
+def filter_country_rows(geo_targets: pyarrow.Table) -> pyarrow.Table:
+  """Keeps the countries and one of the direct children of each country.
+
+  product_metrics_view and the main workflow map the country criterion id of
+  the Google Ads stats to a country code through the parent_id and
+  country_code of the geo targets, hence only need one child per country.
+  Filtering filtered geo targets returns them unchanged.
+
+  Args:
+    geo_targets: The geo targets.
+
+  Returns:
+    The countries and, for each country, its direct child with the smallest
+    criteria id.
+  """
+  is_country = compute.equal(geo_targets['target_type'], 'Country')
+  country_ids = compute.filter(geo_targets['criteria_id'], is_country)
+  children = geo_targets.filter(
+      compute.is_in(geo_targets['parent_id'], value_set=country_ids))
+  first_children = children.group_by(['parent_id', 'country_code']).aggregate(
+      [('criteria_id', 'min')])
+  is_kept = compute.or_(
+      is_country,
+      compute.is_in(
+          geo_targets['criteria_id'],
+          value_set=first_children['criteria_id_min']))
+  return geo_targets.filter(is_kept).sort_by('criteria_id')
+
+
+LANGUAGE_CODES = ReferenceTable(
+    table_name='language_codes',
+    schema=[
+        bigquery.SchemaField('language_name', 'STRING'),
+        bigquery.SchemaField('language_code', 'STRING'),
+        bigquery.SchemaField('criterion_id', 'INTEGER'),
+    ],
+    row_filter=None)
+GEO_TARGETS = ReferenceTable(
+    table_name='geo_targets',
+    schema=[
+        bigquery.SchemaField('criteria_id', 'INTEGER'),
+        bigquery.SchemaField('name', 'STRING'),
+        bigquery.SchemaField('canonical_name', 'STRING'),
+        bigquery.SchemaField('parent_id', 'INTEGER'),
+        bigquery.SchemaField('country_code', 'STRING'),
+        bigquery.SchemaField('target_type', 'STRING'),
+        bigquery.SchemaField('status', 'STRING'),
+    ],
+    row_filter=filter_country_rows)
+REFERENCE_TABLES = (LANGUAGE_CODES, GEO_TARGETS)
+
+
+def _normalize_column_name(column_name: str) -> str:
+  return re.sub(r'\W+', '_', column_name.strip().lower()).strip('_')
+
+
+def find_reference_file(table: ReferenceTable,
+                        data_dir: str = _DATA_DIR) -> str:
+  """Returns the path of the source file of a reference table.
+
+  Args:
+    table: The reference table.
+    data_dir: Directory of the source files.
+
+  Raises:
+    FileNotFoundError: If there is no source file for the table.
+  """
+  for extension in _FILE_EXTENSIONS:
+    file_path = os.path.join(data_dir, table.table_name + extension)
+    if os.path.exists(file_path):
+      return file_path
+  message = (f'No {", ".join(_FILE_EXTENSIONS)} file found for '
+             f'"{table.table_name}" in "{data_dir}".')
+  if table is GEO_TARGETS:
+    message += f' Download the geo targets file from {_GEO_TARGETS_URL}.'
+  raise FileNotFoundError(message)
+
+
+def read_reference_file(file_path: str,
+                        table: ReferenceTable) -> pyarrow.Table:
+  """Reads and filters the source file of a reference table.
+
+  Args:
+    file_path: Path of a Parquet or CSV file, gzipped if its name ends with
+      ".gz". The columns are matched to the schema by their normalized names.
+    table: The reference table.
+
+  Returns:
+    The rows of the table, with the columns and types of its schema.
+
+  Raises:
+    Error: If a column of the schema is missing from the file.
+  """
+  if file_path.endswith('.parquet'):
+    data = parquet.read_table(file_path)
+  else:
+    data = csv.read_csv(file_path)
+  data = data.rename_columns(
+      [_normalize_column_name(name) for name in data.column_names])
+  missing_columns = [
+      field.name for field in table.schema
+      if field.name not in data.column_names
+  ]
+  if missing_columns:
+    raise Error(f'Columns {", ".join(missing_columns)} of '
+                f'"{table.table_name}" are missing from "{file_path}".')
+  data = pyarrow.Table.from_arrays(
+      [
+          data[field.name].cast(_ARROW_TYPES[field.field_type])
+          for field in table.schema
+      ],
+      names=[field.name for field in table.schema])
+  if table.row_filter:
+    data = table.row_filter(data)
+  return data
+
+
+def prepare_reference_file(source_path: str, table: ReferenceTable,
+                           output_path: str) -> int:
+  """Writes the filtered rows of a source file to a Parquet file.
+
+  Args:
+    source_path: Path of the source file, e.g. the geo targets downloaded from
+      Google Ads.
+    table: The reference table.
+    output_path: Path of the Parquet file.
+
+  Returns:
+    The number of rows written.
+  """
+  data = read_reference_file(source_path, table)
+  parquet.write_table(data, output_path)
+  logging.info('Wrote %d %s rows to %s.', data.num_rows, table.table_name,
+               output_path)
+  return data.num_rows
+
+
+def get_checksum(file_path: str, table: ReferenceTable) -> str:
+  """Returns the checksum of a source file and the declaration of its table."""
+  checksum = hashlib.sha256()
+  checksum.update(repr([(field.name, field.field_type)
+                        for field in table.schema]).encode('utf-8'))
+  if table.row_filter:
+    checksum.update(table.row_filter.__name__.encode('utf-8'))
+  with open(file_path, 'rb') as source_file:
+    for chunk in iter(lambda: source_file.read(_READ_CHUNK_SIZE), b''):
+      checksum.update(chunk)
+  return checksum.hexdigest()[:_CHECKSUM_LENGTH]
+
+
+def load_reference_table(client: bigquery.Client,
+                         dataset_id: str,
+                         table: ReferenceTable,
+                         data_dir: str = _DATA_DIR,
+                         force: bool = False) -> bool:
+  """Replaces a reference table by the rows of its source file.
+
+  Args:
+    client: BigQuery client of the project.
+    dataset_id: BigQuery dataset id.
+    table: The reference table.
+    data_dir: Directory of the source files.
+    force: Whether the table is loaded even if its source file didn't change.
+
+  Returns:
+    Whether the table was loaded, i.e. False if the load was skipped.
+  """
+  file_path = find_reference_file(table, data_dir)
+  checksum = get_checksum(file_path, table)
+  table_id = f'{client.project}.{dataset_id}.{table.table_name}'
+  if not force:
+    try:
+      labels = client.get_table(table_id).labels
+    except exceptions.NotFound:
+      labels = {}
+    if labels.get(_CHECKSUM_LABEL) == checksum:
+      logging.info('%s is unchanged since the last load of %s, skipping.',
+                   file_path, table_id)
+      return False
+  data = read_reference_file(file_path, table)
+  buffer = io.BytesIO()
+  parquet.write_table(data, buffer)
+  buffer.seek(0)
+  job_config = bigquery.LoadJobConfig(
+      source_format=bigquery.SourceFormat.PARQUET,
+      schema=table.schema,
+      write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+      labels=cloud_bigquery.get_job_labels(table.table_name))
+  job = client.load_table_from_file(buffer, table_id, job_config=job_config)
+  cloud_bigquery.wait_for_job(job, file_path)
+  bigquery_table = client.get_table(table_id)
+  bigquery_table.labels = {
+      **bigquery_table.labels, _CHECKSUM_LABEL: checksum
+  }
+  client.update_table(bigquery_table, ['labels'])
+  logging.info('Loaded %d rows from %s to %s.', data.num_rows, file_path,
+               table_id)
+  return True
+
+
+def load_reference_data(
+    project_id: str,
+    dataset_id: str,
+    data_dir: str = _DATA_DIR,
+    tables: Sequence[ReferenceTable] = REFERENCE_TABLES,
+    force: bool = False,
+    max_workers: int = _DEFAULT_MAX_WORKERS,
+    client: Optional[bigquery.Client] = None) -> Dict[str, bool]:
+  """Loads the reference tables concurrently.
+
+  Args:
+    project_id: A cloud project id.
+    dataset_id: BigQuery dataset id.
+    data_dir: Directory of the source files.
+    tables: The reference tables to load.
+    force: Whether the tables are loaded even if their source files didn't
+      change.
+    max_workers: Maximum number of concurrent loads.
+    client: BigQuery client, one for the project is created if not set.
+
+  Returns:
+    Whether each table was loaded, keyed by table name.
+  """
+  client = client or bigquery.Client(project=project_id)
+  with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+    futures = {
+        table.table_name:
+        executor.submit(load_reference_table, client, dataset_id, table,
+                        data_dir, force) for table in tables
+    }
+    return {
+        table_name: future.result() for table_name, future in futures.items()
+    }
+
+
+def parse_arguments() -> argparse.Namespace:
+  """Initialize command line parser using argparse.
+
+  Returns:
+    An argparse.ArgumentParser.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--project_id', help='GCP project id.', required=True)
+  parser.add_argument(
+      '--dataset_id', help='BigQuery dataset id.', default='markup')
+  parser.add_argument(
+      '--data_dir', help='Directory of the source files.', default=_DATA_DIR)
+  parser.add_argument(
+      '--geo_targets_source',
+      help=('Geo targets CSV file downloaded from Google Ads, pre-filtered to '
+            '<data_dir>/geo_targets.parquet before the load.'),
+      default=None)
+  parser.add_argument(
+      '--force',
+      help='Load the tables even if their source files did not change.',
+      action='store_true')
+  return parser.parse_args()
+
+
+def main():
+  args = parse_arguments()
+  if args.geo_targets_source:
+    prepare_reference_file(
+        args.geo_targets_source, GEO_TARGETS,
+        os.path.join(args.data_dir, f'{GEO_TARGETS.table_name}.parquet'))
+  load_reference_data(
+      args.project_id, args.dataset_id, args.data_dir, force=args.force)
+
+
+if __name__ == '__main__':
+  main()
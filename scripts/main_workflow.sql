@@ -19,258 +19,479 @@
 -- uses @run_date parameter and hence can be backfilled on a specific date. This
 -- is useful when a Google Ads or GMC data transfer has failed on a specific
 -- day.
+--
+-- The script is split in stages by the "-- STAGE: <name>" markers. The
+-- statements before the first marker are declarations shared by all the
+-- stages. The scheduled query runs the script as a whole, while the generated
+-- Airflow DAG (see airflow_dag.py) runs each stage as a separate task.
+--
+-- A stage is skipped when the partitions it reads didn't change since its
+-- last successful run for the same run date (see workflow_run_state.sql), so
+-- reruns and duplicate triggers cost almost nothing.
+--
+-- Each stage appends a row to "workflow_run_log" with its start and end time
+-- and its row count: the rows inserted in TargetedProduct for the targeting
+-- stage, the rows of the output tables for the other stages. See
+-- workflow_run_log.sql and workflow_report.py.
 
 DECLARE to_be_processed ARRAY<STRING> DEFAULT [];
 DECLARE where_clause STRING;
 DECLARE i INT64 DEFAULT 0;
 DECLARE BATCH_SIZE INT64 DEFAULT 500;
 DECLARE total_criterions DEFAULT 0;
+-- Each run date writes its own partitions of the output tables.
+DECLARE workflow_run_key STRING DEFAULT CAST(@run_date AS STRING);
+DECLARE stage_started_at TIMESTAMP;
+DECLARE stage_row_count INT64;
+DECLARE stage_input STRUCT<stage STRING, input_fingerprint STRING, input_versions ARRAY<STRUCT<table_name STRING, partition_id STRING, last_modified_time TIMESTAMP, total_rows INT64>>, is_changed BOOL>;
 
--- Clean-up existing tables.
-DELETE FROM
-  `{project_id}.{dataset}.ParsedCriteria_{external_customer_id}`
-WHERE 1=1;
-
-DELETE FROM
-  `{project_id}.{dataset}.TargetedProduct_{external_customer_id}`
-WHERE
-  -- Delete data older than 90 days.
-  data_date < DATE_SUB(@run_date, INTERVAL 90 DAY)
-  OR data_date = @run_date;
-
-CREATE TEMPORARY TABLE IF NOT EXISTS DistinctCriterion AS (
-  WITH DistinctCriterion AS (
-    SELECT DISTINCT
-      Criteria
-    FROM
-      `{project_id}.{dataset}.Criteria_{external_customer_id}` AS CriteriaTable
-    WHERE
-      CriteriaType = 'PRODUCT_PARTITION'
-      -- If the run_date is not a backfill then use the latest available data.
-      AND (
-        (
-          @run_date = CURRENT_DATE()
-          AND CriteriaTable._DATA_DATE = CriteriaTable._LATEST_DATE)
-        OR (
-          @run_date <> CURRENT_DATE()
-          AND CriteriaTable._DATA_DATE = @run_date))
-  )
+-- Snapshot of the input partitions, recorded as consumed by the stages.
+CREATE TEMP TABLE StageInput
+AS (
+  WITH
+    StageState AS (
+      SELECT
+        InputVersion.stage,
+        InputVersion.input_fingerprint,
+        InputVersion.input_versions,
+        RunState.input_fingerprint IS DISTINCT FROM InputVersion.input_fingerprint AS is_changed
+      FROM
+        `{project_id}.{dataset}.workflow_input_versions_{external_customer_id}` AS InputVersion
+      LEFT JOIN
+        `{project_id}.{dataset}.workflow_run_state` AS RunState
+        ON
+          RunState.tenant = '{external_customer_id}'
+          AND RunState.stage = InputVersion.stage
+          AND RunState.run_key = workflow_run_key
+    ),
+    -- ParsedCriteria is shared by all the run dates and holds the criteria of
+    -- the last run of parse_criteria, whatever its run key.
+    LastParse AS (
+      SELECT
+        run_key
+      FROM
+        `{project_id}.{dataset}.workflow_run_state`
+      WHERE
+        tenant = '{external_customer_id}'
+        AND stage = 'parse_criteria'
+      ORDER BY updated_at DESC
+      LIMIT 1
+    )
   SELECT
-    Criteria,
-    ROW_NUMBER() OVER (ORDER BY Criteria asc) as RowNum
+    StageState.stage,
+    StageState.input_fingerprint,
+    StageState.input_versions,
+    -- The criteria are parsed again for targeting when the last parse was for
+    -- another run date.
+    StageState.is_changed
+    OR (
+      StageState.stage = 'parse_criteria'
+      AND TargetingState.is_changed
+      AND LastParse.run_key IS DISTINCT FROM workflow_run_key) AS is_changed
   FROM
-    DistinctCriterion
+    StageState
+  INNER JOIN
+    StageState AS TargetingState
+    ON TargetingState.stage = 'targeting'
+  LEFT JOIN
+    LastParse
+    ON TRUE
 );
 
-SET total_criterions = (SELECT COUNT(1) FROM DistinctCriterion);
+-- STAGE: parse_criteria
+SET (stage_started_at, stage_row_count) = (CURRENT_TIMESTAMP(), NULL);
+SET stage_input = (
+  SELECT AS STRUCT * FROM StageInput WHERE stage = 'parse_criteria'
+);
+IF stage_input.is_changed IS NOT FALSE THEN
+  -- Clean-up existing tables.
+  DELETE FROM
+    `{project_id}.{dataset}.ParsedCriteria_{external_customer_id}`
+  WHERE 1=1;
 
-LOOP
-  IF i >= total_criterions THEN
-    BREAK;
-  END IF;
-  SET to_be_processed = (
+  CREATE TEMPORARY TABLE IF NOT EXISTS DistinctCriterion AS (
+    WITH DistinctCriterion AS (
+      SELECT DISTINCT
+        Criteria
+      FROM
+        `{project_id}.{dataset}.Criteria_{external_customer_id}` AS CriteriaTable
+      WHERE
+        CriteriaType = 'PRODUCT_PARTITION'
+        -- If the run_date is not a backfill then use the latest available data.
+        AND (
+          (
+            @run_date = CURRENT_DATE()
+            AND CriteriaTable._DATA_DATE = CriteriaTable._LATEST_DATE)
+          OR (
+            @run_date <> CURRENT_DATE()
+            AND CriteriaTable._DATA_DATE = @run_date))
+    )
     SELECT
-      ARRAY_AGG(Criteria)
+      Criteria,
+      ROW_NUMBER() OVER (ORDER BY Criteria asc) as RowNum
     FROM
       DistinctCriterion
+  );
+
+  SET total_criterions = (SELECT COUNT(1) FROM DistinctCriterion);
+
+  LOOP
+    IF i >= total_criterions THEN
+      BREAK;
+    END IF;
+    SET to_be_processed = (
+      SELECT
+        ARRAY_AGG(Criteria)
+      FROM
+        DistinctCriterion
+      WHERE
+        RowNum BETWEEN i AND i+BATCH_SIZE
+    );
+    SET i = i + BATCH_SIZE + 1;
+    EXECUTE IMMEDIATE `{project_id}.{dataset}.constructParsedCriteria_{external_customer_id}`(to_be_processed);
+  END LOOP;
+
+  SET stage_row_count = (
+    SELECT
+      row_count
+    FROM
+      `{project_id}.{dataset}.__TABLES__`
     WHERE
-      RowNum BETWEEN i AND i+BATCH_SIZE
+      table_id = 'ParsedCriteria_{external_customer_id}'
   );
-  SET i = i + BATCH_SIZE + 1;
-  EXECUTE IMMEDIATE `{project_id}.{dataset}.constructParsedCriteria_{external_customer_id}`(to_be_processed);
-END LOOP;
 
+  CALL `{project_id}.{dataset}.record_workflow_stage`(
+    '{external_customer_id}', workflow_run_key, @run_date, stage_input);
+ELSE
+  SELECT 'Skipping parse_criteria: the inputs did not change since the last run.' AS message;
+END IF;
+INSERT `{project_id}.{dataset}.workflow_run_log`
+VALUES (
+  @@script.job_id,
+  '{external_customer_id}',
+  @run_date,
+  'parse_criteria',
+  stage_started_at,
+  CURRENT_TIMESTAMP(),
+  stage_row_count,
+  stage_input.is_changed IS FALSE);
 
-CREATE TEMP TABLE CriteriaInfo
-AS (
-  WITH TargetedMerchantInfo AS (
+-- STAGE: targeting
+SET (stage_started_at, stage_row_count) = (CURRENT_TIMESTAMP(), NULL);
+SET stage_input = (
+  SELECT AS STRUCT * FROM StageInput WHERE stage = 'targeting'
+);
+IF stage_input.is_changed IS NOT FALSE THEN
+  DELETE FROM
+    `{project_id}.{dataset}.TargetedProduct_{external_customer_id}`
+  WHERE
+    -- Delete data older than 90 days.
+    data_date < DATE_SUB(@run_date, INTERVAL 90 DAY)
+    OR data_date = @run_date;
+
+  CREATE TEMP TABLE CriteriaInfo
+  AS (
+    WITH TargetedMerchantInfo AS (
+      SELECT DISTINCT
+        MerchantId AS merchant_id,
+        AdGroupId AS ad_group_id,
+        UPPER(GeoTargets.Country_Code) AS target_country
+      FROM
+        `{project_id}.{dataset}.ShoppingProductStats_{external_customer_id}` AS ShoppingProductStats
+      INNER JOIN `{project_id}.{dataset}.geo_targets` GeoTargets
+        ON GeoTargets.parent_id = ShoppingProductStats.CountryCriteriaId
+      WHERE
+        -- If the run_date is not a backfill then use the latest available data.
+        (
+          (
+            @run_date = CURRENT_DATE()
+            AND ShoppingProductStats._DATA_DATE = ShoppingProductStats._LATEST_DATE)
+          OR (
+            @run_date <> CURRENT_DATE()
+            AND ShoppingProductStats._DATA_DATE = @run_date))
+    )
+    SELECT
+      TargetedMerchantInfo.merchant_id,
+      TargetedMerchantInfo.target_country,
+      CriteriaTable.criteria
+    FROM
+      TargetedMerchantInfo
+    INNER JOIN
+      `{project_id}.{dataset}.Criteria_{external_customer_id}` AS CriteriaTable
+      ON
+        CriteriaTable.AdGroupId = TargetedMerchantInfo.ad_group_id
+        -- If the run_date is not a backfill then use the latest available data.
+        AND (
+          (
+            @run_date = CURRENT_DATE()
+            AND CriteriaTable._DATA_DATE = CriteriaTable._LATEST_DATE)
+          OR (
+            @run_date <> CURRENT_DATE()
+            AND CriteriaTable._DATA_DATE = @run_date))
+  );
+
+  CREATE TEMP TABLE IdTargetedOffer
+  AS (
     SELECT DISTINCT
-      MerchantId AS merchant_id,
-      AdGroupId AS ad_group_id,
-      UPPER(GeoTargets.Country_Code) AS target_country
+      CriteriaInfo.merchant_id,
+      CriteriaInfo.target_country,
+      ParsedCriteria.offer_id
+    FROM
+      `{project_id}.{dataset}.ParsedCriteria_{external_customer_id}` ParsedCriteria
+    INNER JOIN CriteriaInfo
+      ON ParsedCriteria.criteria = CriteriaInfo.criteria
+    WHERE
+      ParsedCriteria.offer_id IS NOT NULL
+  );
+
+
+  CREATE TEMP TABLE IdTargeted
+  AS (
+    SELECT
+      ProductView.data_date,
+      ProductView.product_id,
+      ProductView.merchant_id,
+      ProductView.target_country
     FROM
-      `{project_id}.{dataset}.ShoppingProductStats_{external_customer_id}` AS ShoppingProductStats
-    INNER JOIN `{project_id}.{dataset}.geo_targets` GeoTargets
-      ON GeoTargets.parent_id = ShoppingProductStats.CountryCriteriaId
+      `{project_id}.{dataset}.product_view_{merchant_id}` AS ProductView
+    INNER JOIN IdTargetedOffer
+      ON
+        IdTargetedOffer.merchant_id = ProductView.merchant_id
+        AND IdTargetedOffer.target_country = ProductView.target_country
+        AND IdTargetedOffer.offer_id = ProductView.offer_id
     WHERE
       -- If the run_date is not a backfill then use the latest available data.
-      (
         (
-          @run_date = CURRENT_DATE()
-          AND ShoppingProductStats._DATA_DATE = ShoppingProductStats._LATEST_DATE)
-        OR (
-          @run_date <> CURRENT_DATE()
-          AND ShoppingProductStats._DATA_DATE = @run_date))
-  )
-  SELECT
-    TargetedMerchantInfo.merchant_id,
-    TargetedMerchantInfo.target_country,
-    CriteriaTable.criteria
-  FROM
-    TargetedMerchantInfo
-  INNER JOIN
-    `{project_id}.{dataset}.Criteria_{external_customer_id}` AS CriteriaTable
-    ON
-      CriteriaTable.AdGroupId = TargetedMerchantInfo.ad_group_id
+          (
+            @run_date = CURRENT_DATE()
+            AND ProductView.data_date = ProductView.latest_date)
+          OR (
+            @run_date <> CURRENT_DATE()
+            AND ProductView.data_date = @run_date))
+  );
+
+  CREATE TEMP TABLE NonIdTargeted
+  AS (
+    SELECT
+      ProductView.data_date,
+      ProductView.product_id,
+      ProductView.merchant_id,
+      ProductView.target_country
+    FROM
+      `{project_id}.{dataset}.product_view_{merchant_id}` AS ProductView
+    INNER JOIN CriteriaInfo
+      ON
+        CriteriaInfo.merchant_id = ProductView.merchant_id
+        AND CriteriaInfo.target_country = ProductView.target_country
+    INNER JOIN `{project_id}.{dataset}.ParsedCriteria_{external_customer_id}` AS ParsedCriteria
+      ON
+        ParsedCriteria.criteria = CriteriaInfo.criteria
+        AND (
+          ParsedCriteria.custom_label0 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.custom_label0)) = TRIM(LOWER(ProductView.custom_labels.label_0)))
+        AND (
+          ParsedCriteria.custom_label1 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.custom_label1)) = TRIM(LOWER(ProductView.custom_labels.label_1)))
+        AND (
+          ParsedCriteria.custom_label2 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.custom_label2)) = TRIM(LOWER(ProductView.custom_labels.label_2)))
+        AND (
+          ParsedCriteria.custom_label3 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.custom_label3)) = TRIM(LOWER(ProductView.custom_labels.label_3)))
+        AND (
+          ParsedCriteria.custom_label4 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.custom_label4)) = TRIM(LOWER(ProductView.custom_labels.label_4)))
+        AND (
+          ParsedCriteria.product_type_l1 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.product_type_l1)) = TRIM(LOWER(ProductView.product_type_l1)))
+        AND (
+          ParsedCriteria.product_type_l2 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.product_type_l2)) = TRIM(LOWER(ProductView.product_type_l2)))
+        AND (
+          ParsedCriteria.product_type_l3 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.product_type_l3)) = TRIM(LOWER(ProductView.product_type_l3)))
+        AND (
+          ParsedCriteria.product_type_l4 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.product_type_l4)) = TRIM(LOWER(ProductView.product_type_l4)))
+        AND (
+          ParsedCriteria.product_type_l5 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.product_type_l5)) = TRIM(LOWER(ProductView.product_type_l5)))
+        AND (
+          ParsedCriteria.google_product_category_l1 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.google_product_category_l1)) = TRIM(LOWER(ProductView.google_product_category_l1)))
+        AND (
+          ParsedCriteria.google_product_category_l2 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.google_product_category_l2)) = TRIM(LOWER(ProductView.google_product_category_l2)))
+        AND (
+          ParsedCriteria.google_product_category_l3 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.google_product_category_l3)) = TRIM(LOWER(ProductView.google_product_category_l3)))
+        AND (
+          ParsedCriteria.google_product_category_l4 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.google_product_category_l4)) = TRIM(LOWER(ProductView.google_product_category_l4)))
+        AND (
+          ParsedCriteria.google_product_category_l5 IS NULL
+          OR TRIM(LOWER(ParsedCriteria.google_product_category_l5)) = TRIM(LOWER(ProductView.google_product_category_l5)))
+        AND (
+          ParsedCriteria.brand IS NULL
+          OR TRIM(LOWER(ParsedCriteria.brand)) = TRIM(LOWER(ProductView.brand)))
+        AND (
+          ParsedCriteria.channel IS NULL
+          OR TRIM(LOWER(ParsedCriteria.channel)) = TRIM(LOWER(ProductView.channel)))
+        AND (
+          ParsedCriteria.channel_exclusivity IS NULL
+          OR TRIM(LOWER(ParsedCriteria.channel_exclusivity)) = TRIM(LOWER(ProductView.channel_exclusivity)))
+        AND (
+          ParsedCriteria.condition IS NULL
+          OR TRIM(LOWER(ParsedCriteria.condition)) = TRIM(LOWER(ProductView.condition)))
+    WHERE
+      ParsedCriteria.offer_id IS NULL
       -- If the run_date is not a backfill then use the latest available data.
       AND (
         (
           @run_date = CURRENT_DATE()
-          AND CriteriaTable._DATA_DATE = CriteriaTable._LATEST_DATE)
+          AND ProductView.data_date = ProductView.latest_date)
         OR (
           @run_date <> CURRENT_DATE()
-          AND CriteriaTable._DATA_DATE = @run_date))
-);
+          AND ProductView.data_date = @run_date))
+  );
 
-CREATE TEMP TABLE IdTargetedOffer
-AS (
-  SELECT DISTINCT
-    CriteriaInfo.merchant_id,
-    CriteriaInfo.target_country,
-    ParsedCriteria.offer_id
+  INSERT `{project_id}.{dataset}.TargetedProduct_{external_customer_id}`
+  (
+    data_date,
+    product_id,
+    merchant_id,
+    target_country
+  )
+  SELECT
+    data_date,
+    product_id,
+    merchant_id,
+    target_country
   FROM
-    `{project_id}.{dataset}.ParsedCriteria_{external_customer_id}` ParsedCriteria
-  INNER JOIN CriteriaInfo
-    ON ParsedCriteria.criteria = CriteriaInfo.criteria
-  WHERE
-    ParsedCriteria.offer_id IS NOT NULL
-);
-
-
-CREATE TEMP TABLE IdTargeted
-AS (
+    IdTargeted
+  UNION ALL
   SELECT
-    ProductView.data_date,
-    ProductView.product_id,
-    ProductView.merchant_id,
-    ProductView.target_country
+    data_date,
+    product_id,
+    merchant_id,
+    target_country
   FROM
-    `{project_id}.{dataset}.product_view_{merchant_id}` AS ProductView
-  INNER JOIN IdTargetedOffer
-    ON
-      IdTargetedOffer.merchant_id = ProductView.merchant_id
-      AND IdTargetedOffer.target_country = ProductView.target_country
-      AND IdTargetedOffer.offer_id = ProductView.offer_id
-  WHERE
-    -- If the run_date is not a backfill then use the latest available data.
-      (
-        (
-          @run_date = CURRENT_DATE()
-          AND ProductView.data_date = ProductView.latest_date)
-        OR (
-          @run_date <> CURRENT_DATE()
-          AND ProductView.data_date = @run_date))
+    NonIdTargeted;
+  SET stage_row_count = @@row_count;
+
+  CALL `{project_id}.{dataset}.record_workflow_stage`(
+    '{external_customer_id}', workflow_run_key, @run_date, stage_input);
+ELSE
+  SELECT 'Skipping targeting: the inputs did not change since the last run.' AS message;
+END IF;
+INSERT `{project_id}.{dataset}.workflow_run_log`
+VALUES (
+  @@script.job_id,
+  '{external_customer_id}',
+  @run_date,
+  'targeting',
+  stage_started_at,
+  CURRENT_TIMESTAMP(),
+  stage_row_count,
+  stage_input.is_changed IS FALSE);
+
+-- STAGE: product_detailed
+SET (stage_started_at, stage_row_count) = (CURRENT_TIMESTAMP(), NULL);
+SET stage_input = (
+  SELECT AS STRUCT * FROM StageInput WHERE stage = 'product_detailed'
 );
+IF stage_input.is_changed IS NOT FALSE THEN
+  -- Update product detailed and product historical materialized tables.
+  CALL `{project_id}.{dataset}.product_detailed_proc`();
 
-CREATE TEMP TABLE NonIdTargeted
-AS (
-  SELECT
-    ProductView.data_date,
-    ProductView.product_id,
-    ProductView.merchant_id,
-    ProductView.target_country
-  FROM
-    `{project_id}.{dataset}.product_view_{merchant_id}` AS ProductView
-  INNER JOIN CriteriaInfo
-    ON
-      CriteriaInfo.merchant_id = ProductView.merchant_id
-      AND CriteriaInfo.target_country = ProductView.target_country
-  INNER JOIN `{project_id}.{dataset}.ParsedCriteria_{external_customer_id}` AS ParsedCriteria
-    ON
-      ParsedCriteria.criteria = CriteriaInfo.criteria
-      AND (
-        ParsedCriteria.custom_label0 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.custom_label0)) = TRIM(LOWER(ProductView.custom_labels.label_0)))
-      AND (
-        ParsedCriteria.custom_label1 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.custom_label1)) = TRIM(LOWER(ProductView.custom_labels.label_1)))
-      AND (
-        ParsedCriteria.custom_label2 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.custom_label2)) = TRIM(LOWER(ProductView.custom_labels.label_2)))
-      AND (
-        ParsedCriteria.custom_label3 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.custom_label3)) = TRIM(LOWER(ProductView.custom_labels.label_3)))
-      AND (
-        ParsedCriteria.custom_label4 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.custom_label4)) = TRIM(LOWER(ProductView.custom_labels.label_4)))
-      AND (
-        ParsedCriteria.product_type_l1 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.product_type_l1)) = TRIM(LOWER(ProductView.product_type_l1)))
-      AND (
-        ParsedCriteria.product_type_l2 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.product_type_l2)) = TRIM(LOWER(ProductView.product_type_l2)))
-      AND (
-        ParsedCriteria.product_type_l3 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.product_type_l3)) = TRIM(LOWER(ProductView.product_type_l3)))
-      AND (
-        ParsedCriteria.product_type_l4 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.product_type_l4)) = TRIM(LOWER(ProductView.product_type_l4)))
-      AND (
-        ParsedCriteria.product_type_l5 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.product_type_l5)) = TRIM(LOWER(ProductView.product_type_l5)))
-      AND (
-        ParsedCriteria.google_product_category_l1 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.google_product_category_l1)) = TRIM(LOWER(ProductView.google_product_category_l1)))
-      AND (
-        ParsedCriteria.google_product_category_l2 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.google_product_category_l2)) = TRIM(LOWER(ProductView.google_product_category_l2)))
-      AND (
-        ParsedCriteria.google_product_category_l3 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.google_product_category_l3)) = TRIM(LOWER(ProductView.google_product_category_l3)))
-      AND (
-        ParsedCriteria.google_product_category_l4 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.google_product_category_l4)) = TRIM(LOWER(ProductView.google_product_category_l4)))
-      AND (
-        ParsedCriteria.google_product_category_l5 IS NULL
-        OR TRIM(LOWER(ParsedCriteria.google_product_category_l5)) = TRIM(LOWER(ProductView.google_product_category_l5)))
-      AND (
-        ParsedCriteria.brand IS NULL
-        OR TRIM(LOWER(ParsedCriteria.brand)) = TRIM(LOWER(ProductView.brand)))
-      AND (
-        ParsedCriteria.channel IS NULL
-        OR TRIM(LOWER(ParsedCriteria.channel)) = TRIM(LOWER(ProductView.channel)))
-      AND (
-        ParsedCriteria.channel_exclusivity IS NULL
-        OR TRIM(LOWER(ParsedCriteria.channel_exclusivity)) = TRIM(LOWER(ProductView.channel_exclusivity)))
-      AND (
-        ParsedCriteria.condition IS NULL
-        OR TRIM(LOWER(ParsedCriteria.condition)) = TRIM(LOWER(ProductView.condition)))
-  WHERE
-    ParsedCriteria.offer_id IS NULL
-    -- If the run_date is not a backfill then use the latest available data.
-    AND (
-      (
-        @run_date = CURRENT_DATE()
-        AND ProductView.data_date = ProductView.latest_date)
-      OR (
-        @run_date <> CURRENT_DATE()
-        AND ProductView.data_date = @run_date))
+  SET stage_row_count = (
+    SELECT
+      row_count
+    FROM
+      `{project_id}.{dataset}.__TABLES__`
+    WHERE
+      table_id = 'product_detailed_materialized'
+  );
+
+  CALL `{project_id}.{dataset}.record_workflow_stage`(
+    '{external_customer_id}', workflow_run_key, @run_date, stage_input);
+ELSE
+  SELECT 'Skipping product_detailed: the inputs did not change since the last run.' AS message;
+END IF;
+INSERT `{project_id}.{dataset}.workflow_run_log`
+VALUES (
+  @@script.job_id,
+  '{external_customer_id}',
+  @run_date,
+  'product_detailed',
+  stage_started_at,
+  CURRENT_TIMESTAMP(),
+  stage_row_count,
+  stage_input.is_changed IS FALSE);
+
+-- STAGE: product_historical
+SET (stage_started_at, stage_row_count) = (CURRENT_TIMESTAMP(), NULL);
+SET stage_input = (
+  SELECT AS STRUCT * FROM StageInput WHERE stage = 'product_historical'
 );
+IF stage_input.is_changed IS NOT FALSE THEN
+  CALL `{project_id}.{dataset}.product_historical_proc`(@run_date);
+
+  SET stage_row_count = (
+    SELECT
+      row_count
+    FROM
+      `{project_id}.{dataset}.__TABLES__`
+    WHERE
+      table_id = 'product_historical_materialized'
+  );
+
+  CALL `{project_id}.{dataset}.record_workflow_stage`(
+    '{external_customer_id}', workflow_run_key, @run_date, stage_input);
+ELSE
+  SELECT 'Skipping product_historical: the inputs did not change since the last run.' AS message;
+END IF;
+INSERT `{project_id}.{dataset}.workflow_run_log`
+VALUES (
+  @@script.job_id,
+  '{external_customer_id}',
+  @run_date,
+  'product_historical',
+  stage_started_at,
+  CURRENT_TIMESTAMP(),
+  stage_row_count,
+  stage_input.is_changed IS FALSE);
 
-INSERT `{project_id}.{dataset}.TargetedProduct_{external_customer_id}`
-(
-  data_date,
-  product_id,
-  merchant_id,
-  target_country
-)
-SELECT
-  data_date,
-  product_id,
-  merchant_id,
-  target_country
-FROM
-  IdTargeted
-UNION ALL
-SELECT
-  data_date,
-  product_id,
-  merchant_id,
-  target_country
-FROM
-  NonIdTargeted;
+-- STAGE: dashboard_cubes
+SET (stage_started_at, stage_row_count) = (CURRENT_TIMESTAMP(), NULL);
+SET stage_input = (
+  SELECT AS STRUCT * FROM StageInput WHERE stage = 'dashboard_cubes'
+);
+IF stage_input.is_changed IS NOT FALSE THEN
+  -- Update the pre-aggregated dashboard tables from the materialized tables.
+  CALL `{project_id}.{dataset}.dashboard_cubes_proc`();
 
+  SET stage_row_count = (
+    SELECT
+      SUM(row_count)
+    FROM
+      `{project_id}.{dataset}.__TABLES__`
+    WHERE
+      table_id IN ('dashboard_funnel_cube', 'dashboard_issue_cube')
+  );
 
--- Update product detailed and product historical materialized tables.
-CALL `{project_id}.{dataset}.product_detailed_proc`();
-CALL `{project_id}.{dataset}.product_historical_proc`();
+  CALL `{project_id}.{dataset}.record_workflow_stage`(
+    '{external_customer_id}', workflow_run_key, @run_date, stage_input);
+ELSE
+  SELECT 'Skipping dashboard_cubes: the inputs did not change since the last run.' AS message;
+END IF;
+INSERT `{project_id}.{dataset}.workflow_run_log`
+VALUES (
+  @@script.job_id,
+  '{external_customer_id}',
+  @run_date,
+  'dashboard_cubes',
+  stage_started_at,
+  CURRENT_TIMESTAMP(),
+  stage_row_count,
+  stage_input.is_changed IS FALSE);
@@ -75,3 +75,6 @@ CREATE OR REPLACE TABLE `{project_id}.{dataset}.market_insights_best_sellers_mat
     inventory
   USING (rank_id)
 );
+
+-- Append the latest Products and PriceBenchmarks partitions to price history.
+CALL `{project_id}.{dataset}.price_history_proc`();
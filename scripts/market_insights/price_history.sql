@@ -0,0 +1,180 @@
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+-- Incrementally maintained price history for Market Insights.
+--
+-- "price_history" stores one row per product, country and day with only the
+-- price, sale price and price benchmark columns. It is partitioned by
+-- data_date so that the date filter of the historical dashboard prunes
+-- partitions instead of scanning every partition of Products_<Merchant Id>.
+--
+-- The procedure only reads the Products and PriceBenchmarks partitions that
+-- are newer than the latest stored day. The last two stored days are rebuilt
+-- on every run since the price benchmarks can land later than the products.
+-- "price_changed" is TRUE on the days where the price, the sale price or the
+-- benchmark differs from the previous stored day of the same product, so
+-- change-only reports can filter on it instead of diffing the whole history.
+
+CREATE TABLE IF NOT EXISTS `{project_id}.{dataset}.price_history`
+(
+  data_date DATE,
+  unique_product_id STRING,
+  target_country STRING,
+  price FLOAT64,
+  price_currency STRING,
+  sale_price FLOAT64,
+  sale_price_currency STRING,
+  price_benchmark_value FLOAT64,
+  price_benchmark_currency STRING,
+  price_benchmark_timestamp TIMESTAMP,
+  price_changed BOOL
+)
+PARTITION BY data_date
+CLUSTER BY unique_product_id, target_country;
+
+CREATE OR REPLACE PROCEDURE `{project_id}.{dataset}.price_history_proc`()
+BEGIN
+  DECLARE start_date DATE DEFAULT (
+    SELECT
+      IFNULL(DATE_SUB(MAX(data_date), INTERVAL 2 DAY), DATE '1970-01-01')
+    FROM
+      `{project_id}.{dataset}.price_history`
+  );
+
+  DELETE FROM
+    `{project_id}.{dataset}.price_history`
+  WHERE
+    data_date >= start_date;
+
+  INSERT `{project_id}.{dataset}.price_history`
+  (
+    data_date,
+    unique_product_id,
+    target_country,
+    price,
+    price_currency,
+    sale_price,
+    sale_price_currency,
+    price_benchmark_value,
+    price_benchmark_currency,
+    price_benchmark_timestamp,
+    price_changed
+  )
+  WITH
+    ProductPrice AS (
+      SELECT DISTINCT
+        _PARTITIONDATE AS data_date,
+        CONCAT(CAST(merchant_id AS STRING), '|', product_id) AS unique_product_id,
+        target_country,
+        price.value AS price,
+        price.currency AS price_currency,
+        sale_price.value AS sale_price,
+        sale_price.currency AS sale_price_currency
+      FROM
+        `{project_id}.{dataset}.Products_{merchant_id}` AS Products,
+        Products.destinations,
+        UNNEST(
+          ARRAY_CONCAT(
+            destinations.approved_countries,
+            destinations.pending_countries,
+            destinations.disapproved_countries)) AS target_country
+      WHERE
+        _PARTITIONDATE >= start_date
+    ),
+    PriceBenchmark AS (
+      SELECT
+        _PARTITIONDATE AS data_date,
+        CONCAT(CAST(merchant_id AS STRING), '|', product_id) AS unique_product_id,
+        country_of_sale AS target_country,
+        price_benchmark_value,
+        price_benchmark_currency,
+        price_benchmark_timestamp
+      FROM
+        `{project_id}.{dataset}.Products_PriceBenchmarks_{merchant_id}`
+      WHERE
+        _PARTITIONDATE >= start_date
+    ),
+    NewPrice AS (
+      SELECT
+        *
+      FROM
+        ProductPrice
+      LEFT JOIN
+        PriceBenchmark
+        USING (data_date, unique_product_id, target_country)
+    ),
+    -- The latest day kept in the table is needed to flag the first new day.
+    PreviousPrice AS (
+      SELECT
+        data_date,
+        unique_product_id,
+        target_country,
+        price,
+        price_currency,
+        sale_price,
+        sale_price_currency,
+        price_benchmark_value,
+        price_benchmark_currency,
+        price_benchmark_timestamp
+      FROM
+        `{project_id}.{dataset}.price_history`
+      WHERE
+        data_date = DATE_SUB(start_date, INTERVAL 1 DAY)
+    ),
+    PriceWithPrevious AS (
+      SELECT
+        *,
+        FALSE AS is_new,
+      FROM
+        PreviousPrice
+      UNION ALL
+      SELECT
+        *,
+        TRUE AS is_new,
+      FROM
+        NewPrice
+    ),
+    FlaggedPrice AS (
+      SELECT
+        *,
+        LAG(STRUCT(price, sale_price, price_benchmark_value)) OVER (
+          PARTITION BY unique_product_id, target_country
+          ORDER BY data_date
+        ) AS previous
+      FROM
+        PriceWithPrevious
+    )
+  SELECT
+    data_date,
+    unique_product_id,
+    target_country,
+    price,
+    price_currency,
+    sale_price,
+    sale_price_currency,
+    price_benchmark_value,
+    price_benchmark_currency,
+    price_benchmark_timestamp,
+    previous IS NULL
+      OR price IS DISTINCT FROM previous.price
+      OR sale_price IS DISTINCT FROM previous.sale_price
+      OR price_benchmark_value IS DISTINCT FROM previous.price_benchmark_value
+      AS price_changed
+  FROM
+    FlaggedPrice
+  WHERE
+    is_new;
+END;
+
+CALL `{project_id}.{dataset}.price_history_proc`();
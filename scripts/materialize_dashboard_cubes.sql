@@ -0,0 +1,178 @@
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+-- Stored procedure for materializing pre-aggregated dashboard tables.
+--
+-- The MarkUp DataStudio dashboard filters on account, country, channel and
+-- product category and then shows funnel counts and top issues. Running those
+-- filters on "product_detailed_materialized" scans every product row. The
+-- cube tables below hold the same numbers at the grain of the dashboard
+-- charts, hence they are a few thousand rows per account.
+--
+-- dashboard_funnel_cube
+--   Grain: data_date x account_id x target_country x channel x category_level
+--     x product_type_l1 x product_type_l2 x product_type_l3 x funnel_stage.
+--   category_level 0 aggregates all product types (product_type_l1..l3 are
+--   NULL), level N keeps product_type_l1..lN and sets the deeper levels to
+--   NULL.
+-- dashboard_issue_cube
+--   Grain: data_date x account_id x target_country x channel x issue_type
+--     x issue, limited to the top 50 issues by affected products for each
+--     account, country, channel and issue type.
+
+CREATE OR REPLACE PROCEDURE `{project_id}.{dataset}.dashboard_cubes_proc`()
+BEGIN
+  CREATE OR REPLACE TABLE `{project_id}.{dataset}.dashboard_funnel_cube`
+  CLUSTER BY account_id, target_country
+  OPTIONS (
+    description = 'Grain: data_date x account_id x target_country x channel x category_level x product_type_l1 x product_type_l2 x product_type_l3 x funnel_stage.'
+  )
+  AS (
+    WITH
+      ProductCategory AS (
+        SELECT
+          ProductDetailed.*,
+          category_level,
+          IF(category_level >= 1, ProductDetailed.product_type_l1, NULL) AS category_l1,
+          IF(category_level >= 2, ProductDetailed.product_type_l2, NULL) AS category_l2,
+          IF(category_level >= 3, ProductDetailed.product_type_l3, NULL) AS category_l3
+        FROM
+          `{project_id}.{dataset}.product_detailed_materialized` AS ProductDetailed,
+          UNNEST([0, 1, 2, 3]) AS category_level
+      ),
+      FunnelMetrics AS (
+        SELECT
+          data_date,
+          account_id,
+          ANY_VALUE(account_display_name) AS account_display_name,
+          target_country,
+          channel,
+          category_level,
+          category_l1,
+          category_l2,
+          category_l3,
+          COUNT(1) AS total_products,
+          COUNTIF(is_approved = 1) AS total_approved,
+          COUNTIF(funnel_in_stock = 1) AS total_in_stock,
+          COUNTIF(funnel_targeted = 1) AS total_targeted,
+          COUNTIF(funnel_has_impression = 1) AS total_has_impression,
+          COUNTIF(funnel_has_clicks = 1) AS total_has_clicks,
+          IFNULL(SUM(impressions_30_days), 0) AS impressions_30_days,
+          IFNULL(SUM(clicks_30_days), 0) AS clicks_30_days,
+          IFNULL(SUM(cost_30_days), 0) AS cost_30_days,
+          IFNULL(SUM(conversions_30_days), 0) AS conversions_30_days,
+          IFNULL(SUM(conversions_value_30_days), 0) AS conversions_value_30_days
+        FROM
+          ProductCategory
+        GROUP BY
+          data_date,
+          account_id,
+          target_country,
+          channel,
+          category_level,
+          category_l1,
+          category_l2,
+          category_l3
+      )
+    SELECT
+      data_date,
+      account_id,
+      account_display_name,
+      target_country,
+      channel,
+      category_level,
+      category_l1 AS product_type_l1,
+      category_l2 AS product_type_l2,
+      category_l3 AS product_type_l3,
+      FunnelStage.funnel_stage,
+      FunnelStage.product_count,
+      impressions_30_days,
+      clicks_30_days,
+      cost_30_days,
+      conversions_30_days,
+      conversions_value_30_days
+    FROM
+      FunnelMetrics,
+      UNNEST([
+        STRUCT('1_total' AS funnel_stage, total_products AS product_count),
+        ('2_approved', total_approved),
+        ('3_in_stock', total_in_stock),
+        ('4_targeted', total_targeted),
+        ('5_has_impression', total_has_impression),
+        ('6_has_clicks', total_has_clicks)
+      ]) AS FunnelStage
+  );
+
+  CREATE OR REPLACE TABLE `{project_id}.{dataset}.dashboard_issue_cube`
+  CLUSTER BY account_id, target_country
+  OPTIONS (
+    description = 'Grain: data_date x account_id x target_country x channel x issue_type x issue. Top 50 issues per account_id x target_country x channel x issue_type.'
+  )
+  AS (
+    WITH
+      ProductIssue AS (
+        SELECT
+          data_date,
+          account_id,
+          target_country,
+          channel,
+          unique_product_id,
+          IssueGroup.issue_type,
+          TRIM(issue_text) AS issue
+        FROM
+          `{project_id}.{dataset}.product_detailed_materialized`,
+          UNNEST([
+            STRUCT('disapproval' AS issue_type, disapproval_issues AS issues),
+            ('demotion', demotion_issues),
+            ('warning', warning_issues)
+          ]) AS IssueGroup,
+          UNNEST(SPLIT(IssueGroup.issues, ', ')) AS issue_text
+        WHERE
+          IssueGroup.issues IS NOT NULL
+      ),
+      IssueCount AS (
+        SELECT
+          data_date,
+          account_id,
+          target_country,
+          channel,
+          issue_type,
+          issue,
+          COUNT(DISTINCT unique_product_id) AS product_count
+        FROM
+          ProductIssue
+        GROUP BY
+          data_date,
+          account_id,
+          target_country,
+          channel,
+          issue_type,
+          issue
+      )
+    SELECT
+      *,
+      ROW_NUMBER() OVER (
+        PARTITION BY data_date, account_id, target_country, channel, issue_type
+        ORDER BY product_count DESC, issue
+      ) AS issue_rank
+    FROM
+      IssueCount
+    WHERE
+      TRUE
+    QUALIFY
+      issue_rank <= 50
+  );
+END;
+
+CALL `{project_id}.{dataset}.dashboard_cubes_proc`();
@@ -13,10 +13,56 @@
 # limitations under the License.
 
 -- Stored procedure for creating historic snapshot at a product category level.
+--
+-- "product_historical_materialized" is partitioned by data_date and only the
+-- days whose inputs can still change are recomputed: the last three days
+-- (Google Ads data is refreshed for the previous day), the days missed since
+-- the last run and, for backfills, the days from run_date onwards. The other
+-- partitions are left untouched so that their last modified time tells
+-- consumers which days changed. The first run computes the last 90 days.
 
-CREATE OR REPLACE PROCEDURE `{project_id}.{dataset}.product_historical_proc`()
+-- Tables created before partitioning was introduced cannot be replaced in
+-- place by a partitioned table.
+IF EXISTS (
+  SELECT
+    1
+  FROM
+    `{project_id}.{dataset}.INFORMATION_SCHEMA.COLUMNS`
+  WHERE
+    table_name = 'product_historical_materialized'
+    AND column_name = 'data_date'
+    AND is_partitioning_column = 'NO'
+) THEN
+  DROP TABLE `{project_id}.{dataset}.product_historical_materialized`;
+END IF;
+
+CREATE OR REPLACE PROCEDURE `{project_id}.{dataset}.product_historical_proc`(run_date DATE)
 BEGIN
-  CREATE OR REPLACE TABLE `{project_id}.{dataset}.product_historical_materialized`
+  DECLARE is_first_run BOOL DEFAULT NOT EXISTS (
+    SELECT
+      1
+    FROM
+      `{project_id}.{dataset}.INFORMATION_SCHEMA.TABLES`
+    WHERE
+      table_name = 'product_historical_materialized'
+  );
+  DECLARE start_date DATE DEFAULT DATE_SUB(CURRENT_DATE(), INTERVAL 90 DAY);
+
+  IF NOT is_first_run THEN
+    SET start_date = (
+      SELECT
+        GREATEST(
+          start_date,
+          LEAST(
+            run_date,
+            DATE_SUB(CURRENT_DATE(), INTERVAL 3 DAY),
+            IFNULL(DATE_ADD(MAX(data_date), INTERVAL 1 DAY), start_date)))
+      FROM
+        `{project_id}.{dataset}.product_historical_materialized`
+    );
+  END IF;
+
+  CREATE OR REPLACE TEMP TABLE ProductHistorical
   AS (
     SELECT
       data_date,
@@ -40,7 +86,7 @@ BEGIN
     FROM
       `{project_id}.{dataset}.product_detailed_view`
     WHERE
-      data_date >= DATE_SUB(CURRENT_DATE(), INTERVAL 90 DAY)
+      data_date >= start_date
     GROUP BY
       data_date,
       account_id,
@@ -52,6 +98,24 @@ BEGIN
       target_country,
       channel
   );
+
+  IF is_first_run THEN
+    CREATE TABLE `{project_id}.{dataset}.product_historical_materialized`
+    PARTITION BY data_date
+    AS (
+      SELECT * FROM ProductHistorical
+    );
+  ELSE
+    BEGIN TRANSACTION;
+    DELETE FROM
+      `{project_id}.{dataset}.product_historical_materialized`
+    WHERE
+      data_date >= start_date
+      OR data_date < DATE_SUB(CURRENT_DATE(), INTERVAL 90 DAY);
+    INSERT `{project_id}.{dataset}.product_historical_materialized`
+    SELECT * FROM ProductHistorical;
+    COMMIT TRANSACTION;
+  END IF;
 END;
 
-CALL `{project_id}.{dataset}.product_historical_proc`();
+CALL `{project_id}.{dataset}.product_historical_proc`(CURRENT_DATE());
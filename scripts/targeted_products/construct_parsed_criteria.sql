@@ -20,90 +20,90 @@
 CREATE OR REPLACE FUNCTION `{project_id}.{dataset}.constructParsedCriteria_{external_customer_id}`(criterions ARRAY<STRING>)
 RETURNS STRING
 LANGUAGE js AS """
-  function getParsedCriteria(criterion) {{
-    let parsedCriteria = {{}}
+  function getParsedCriteria(criterion) {
+    let parsedCriteria = {}
     parsedCriteria['criteria']  = criterion;
     subCriterions = criterion.split('&+');
-    for (subCriterion of subCriterions) {{
-      if(subCriterion.startsWith('custom')) {{
+    for (subCriterion of subCriterions) {
+      if(subCriterion.startsWith('custom')) {
         const customLabelRegex = /custom(\\d+)/;
         result = subCriterion.split('==');
 
         index = result[0].match(customLabelRegex)[1];
         value = result[1]
-        if(value != '*') {{
+        if(value != '*') {
           parsedCriteria['custom_label' + index] = value;
-        }}
-      }}
-      if(subCriterion.startsWith('brand==')) {{
+        }
+      }
+      if(subCriterion.startsWith('brand==')) {
         result = subCriterion.split('==');
         value = result[1];
-        if(value != '*') {{
+        if(value != '*') {
           parsedCriteria['brand'] = value;
-        }}
-      }}
-      if(subCriterion.startsWith('product_type_')) {{
+        }
+      }
+      if(subCriterion.startsWith('product_type_')) {
         const productTypeRegex = /product_type_l(\\d+)/;
         result = subCriterion.split('==');
 
         index = result[0].match(productTypeRegex)[1];
         value = result[1]
-        if(value != '*') {{
+        if(value != '*') {
           parsedCriteria['product_type_l' + index] = value;
-        }}
-      }}
-      if(subCriterion.startsWith('category_')) {{
+        }
+      }
+      if(subCriterion.startsWith('category_')) {
         const categoryRegex = /category_l(\\d+)/;
         result = subCriterion.split('==');
 
         index = result[0].match(categoryRegex)[1];
         value = result[1]
-        if(value != '*') {{
+        if(value != '*') {
           parsedCriteria['google_product_category_l' + index] = value;
-        }}
-      }}
-      if(subCriterion.startsWith('id==')) {{
+        }
+      }
+      if(subCriterion.startsWith('id==')) {
         result = subCriterion.split('==');
         value = result[1];
-        if(value != '*') {{
+        if(value != '*') {
           parsedCriteria['offer_id'] = value;
-        }}
-      }}
-      if(subCriterion.startsWith('channel==')) {{
+        }
+      }
+      if(subCriterion.startsWith('channel==')) {
         result = subCriterion.split('==');
         value = result[1];
-        if(value != '*') {{
+        if(value != '*') {
           channel = value.split(':')[1];
           parsedCriteria['channel'] = channel;
-        }}
-      }}
-      if(subCriterion.startsWith('channel_exclusivity==')) {{
+        }
+      }
+      if(subCriterion.startsWith('channel_exclusivity==')) {
         result = subCriterion.split('==');
         value = result[1];
-        if(value != '*') {{
+        if(value != '*') {
           channel_exclusivity = value.split(':')[1];
           parsedCriteria['channel_exclusivity'] = channel_exclusivity;
-        }}
-      }}
-      if(subCriterion.startsWith('c_condition==')) {{
+        }
+      }
+      if(subCriterion.startsWith('c_condition==')) {
         result = subCriterion.split('==');
         value = result[1];
-        if(value != '*') {{
+        if(value != '*') {
           condition = value.split(':')[1];
           parsedCriteria['condition'] = condition;
-        }}
-      }}
-    }}
+        }
+      }
+    }
     return parsedCriteria;
-  }}
+  }
   sql = 'INSERT INTO `{project_id}.{dataset}.ParsedCriteria_{external_customer_id}` VALUES ';
   i = 0;
-  for (criterion of criterions) {{
+  for (criterion of criterions) {
     criterion = criterion.replace(/"/g, '\\\\"');
     parsedCriteria = getParsedCriteria(criterion)
-    if ( i!=0 ) {{
+    if ( i!=0 ) {
       sql += ',';
-    }}
+    }
     sql += '('
     sql += '"' + criterion + '",';
     sql += (parsedCriteria['custom_label0'] ? '"' + parsedCriteria['custom_label0'] + '"' : 'NULL') + ',';
@@ -128,6 +128,6 @@ LANGUAGE js AS """
     sql += (parsedCriteria['condition'] ? '"' + parsedCriteria['condition'] + '"' : 'NULL');
     sql += ')';
     i += 1;
-  }}
+  }
   return sql;
   """;
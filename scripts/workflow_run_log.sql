@@ -0,0 +1,38 @@
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+-- Per stage log of the main workflow runs.
+--
+-- The main workflow appends a row per stage with its start and end time and
+-- the number of rows it produced. "script_job_id" is the job id of the
+-- workflow script (@@script.job_id), which is the parent job id of the jobs
+-- run by the stage in INFORMATION_SCHEMA.JOBS. workflow_report.py joins both
+-- to report the duration, bytes and slot time of each stage across days.
+
+CREATE TABLE IF NOT EXISTS `{project_id}.{dataset}.workflow_run_log`
+(
+  script_job_id STRING,
+  tenant STRING,
+  run_date DATE,
+  stage STRING,
+  started_at TIMESTAMP,
+  ended_at TIMESTAMP,
+  row_count INT64,
+  skipped BOOL
+)
+PARTITION BY DATE(started_at)
+CLUSTER BY tenant, stage
+OPTIONS (
+  partition_expiration_days = 400
+);
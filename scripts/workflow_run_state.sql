@@ -0,0 +1,169 @@
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+-- Input watermarks of the main workflow stages.
+--
+-- "workflow_input_versions_<Customer Id>" lists, for each stage of the main
+-- workflow, the partitions of the transferred tables the stage reads, with
+-- their last modified time and row count, and a fingerprint of them. The
+-- inputs of a stage include the inputs of the stages before it.
+--
+-- "workflow_run_state" keeps the fingerprint of the inputs consumed by the
+-- last successful run of each stage, per Google Ads customer and run key. The
+-- run key is the run date, as each run date writes its own partitions of the
+-- output tables. The main workflow skips a stage when the fingerprint of its
+-- inputs didn't change since then.
+
+CREATE TABLE IF NOT EXISTS `{project_id}.{dataset}.workflow_run_state`
+(
+  tenant STRING,
+  stage STRING,
+  run_key STRING,
+  run_date DATE,
+  input_fingerprint STRING,
+  input_versions ARRAY<STRUCT<table_name STRING, partition_id STRING, last_modified_time TIMESTAMP, total_rows INT64>>,
+  updated_at TIMESTAMP
+)
+CLUSTER BY tenant, stage;
+
+-- The installation re-creates the output tables, hence all the stages have
+-- to run again.
+DELETE FROM
+  `{project_id}.{dataset}.workflow_run_state`
+WHERE
+  tenant = '{external_customer_id}';
+
+CREATE OR REPLACE VIEW `{project_id}.{dataset}.workflow_input_versions_{external_customer_id}`
+AS (
+  WITH
+    StageTable AS (
+      SELECT
+        stage,
+        table_name
+      FROM
+        UNNEST([
+          STRUCT(
+            'parse_criteria' AS stage,
+            ['p_Criteria_{external_customer_id}'] AS table_names),
+          (
+            'targeting',
+            [
+              'p_Criteria_{external_customer_id}',
+              'p_ShoppingProductStats_{external_customer_id}',
+              'Products_{merchant_id}',
+              'geo_targets']),
+          (
+            'product_detailed',
+            [
+              'p_Criteria_{external_customer_id}',
+              'p_ShoppingProductStats_{external_customer_id}',
+              'p_Customer_{external_customer_id}',
+              'Products_{merchant_id}',
+              'geo_targets']),
+          (
+            'product_historical',
+            [
+              'p_Criteria_{external_customer_id}',
+              'p_ShoppingProductStats_{external_customer_id}',
+              'p_Customer_{external_customer_id}',
+              'Products_{merchant_id}',
+              'geo_targets']),
+          (
+            'dashboard_cubes',
+            [
+              'p_Criteria_{external_customer_id}',
+              'p_ShoppingProductStats_{external_customer_id}',
+              'p_Customer_{external_customer_id}',
+              'Products_{merchant_id}',
+              'geo_targets'])
+        ]) AS StageTables,
+        UNNEST(StageTables.table_names) AS table_name
+    ),
+    InputVersion AS (
+      SELECT
+        StageTable.stage,
+        StageTable.table_name,
+        Partitions.partition_id,
+        Partitions.last_modified_time,
+        Partitions.total_rows
+      FROM
+        StageTable
+      LEFT JOIN
+        `{project_id}.{dataset}.INFORMATION_SCHEMA.PARTITIONS` AS Partitions
+        USING (table_name)
+    )
+  SELECT
+    stage,
+    TO_HEX(
+      MD5(
+        STRING_AGG(
+          FORMAT(
+            '%s/%s/%t/%t',
+            table_name,
+            IFNULL(partition_id, ''),
+            last_modified_time,
+            total_rows),
+          ','
+          ORDER BY table_name, partition_id))) AS input_fingerprint,
+    ARRAY_AGG(
+      STRUCT(table_name, partition_id, last_modified_time, total_rows)
+      ORDER BY table_name, partition_id) AS input_versions
+  FROM
+    InputVersion
+  GROUP BY
+    stage
+);
+
+-- Records the inputs consumed by a successful run of a stage.
+CREATE OR REPLACE PROCEDURE `{project_id}.{dataset}.record_workflow_stage`(
+  tenant_id STRING,
+  workflow_run_key STRING,
+  workflow_run_date DATE,
+  stage_input STRUCT<stage STRING, input_fingerprint STRING, input_versions ARRAY<STRUCT<table_name STRING, partition_id STRING, last_modified_time TIMESTAMP, total_rows INT64>>, is_changed BOOL>)
+BEGIN
+  MERGE `{project_id}.{dataset}.workflow_run_state` AS RunState
+  USING (
+    SELECT
+      tenant_id AS tenant,
+      stage_input.stage AS stage,
+      workflow_run_key AS run_key
+  ) AS Run
+  ON
+    RunState.tenant = Run.tenant
+    AND RunState.stage = Run.stage
+    AND RunState.run_key = Run.run_key
+  WHEN MATCHED THEN
+    UPDATE SET
+      run_date = workflow_run_date,
+      input_fingerprint = stage_input.input_fingerprint,
+      input_versions = stage_input.input_versions,
+      updated_at = CURRENT_TIMESTAMP()
+  WHEN NOT MATCHED THEN
+    INSERT (
+      tenant,
+      stage,
+      run_key,
+      run_date,
+      input_fingerprint,
+      input_versions,
+      updated_at)
+    VALUES (
+      Run.tenant,
+      Run.stage,
+      Run.run_key,
+      workflow_run_date,
+      stage_input.input_fingerprint,
+      stage_input.input_versions,
+      CURRENT_TIMESTAMP());
+END;
@@ -0,0 +1,272 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Templates of the MarkUp SQL scripts.
+
+A template replaces "{name}" placeholders by the value of the parameter "name".
+Any other brace is kept as is, so JavaScript UDFs and JSON don't need any
+escaping. Blocks between "{% if name %}", an optional "{% else %}" and
+"{% endif %}" are only rendered when the parameter "name" is true; a line
+holding only a block tag is removed. No script uses blocks yet: the Market
+Insights scripts are whole files, selected by cloud_bigquery.get_sql_files.
+
+Parameter values are typed:
+  * Identifier: project, dataset, table or account ids, rendered as is.
+  * SqlList: a list of values, rendered as a parenthesized list of literals
+    for the IN operator e.g. ('a', 'b').
+  * Scalars: bool, int, float and datetime.date, rendered as SQL literals.
+Plain strings are rendered as identifiers.
+
+Templates are compiled once per file, and rendering the same parameters always
+returns the same SQL, which can be fingerprinted.
+
+Typical usage example:
+  >>> template = load_template('scripts/1_product_view.sql')
+  >>> template.render({
+  ...     'project_id': 'project_id',
+  ...     'dataset': 'markup',
+  ...     'merchant_id': Identifier('1234')})
+"""
+
+import collections
+import datetime
+import functools
+import hashlib
+import re
+from typing import Any, Dict, FrozenSet, List, Sequence, Union
+
+# Placeholders, e.g. "{dataset}", and block tags, e.g. "{% if name %}". A block
+# tag alone on its line is matched with the line, so that it leaves no blank
+# line.
+_TOKEN_PATTERN = re.compile(
+    r'(?P<placeholder>\{(?P<name>[A-Za-z_]\w*)\})'
+    r'|(?P<tag_line>^[ \t]*(?P<line_tag>\{%[^%]*%\})[ \t]*(?:\n|\Z))'
+    r'|(?P<tag>\{%[^%]*%\})', re.MULTILINE)
+_TAG_PATTERN = re.compile(
+    r'^\{%\s*(?:(?P<keyword>if)\s+(?P<name>[A-Za-z_]\w*)|'
+    r'(?P<else>else)|(?P<endif>endif))\s*%\}$')
+# Domain-scoped project ids have a ":", e.g. "example.com:project".
+_IDENTIFIER_PATTERN = re.compile(r'^[\w\-.:]*$')
+
+
+class Error(Exception):
+  """Base error for this module."""
+
+
+class TemplateSyntaxError(Error):
+  """Raised when a template can't be compiled."""
+
+
+class MissingParameterError(Error):
+  """Raised when a parameter used by a template is not given."""
+
+
+class Identifier(str):
+  """Project, dataset, table or account id.
+
+  Raises:
+    ValueError: If the id has characters other than letters, digits, "_", "-",
+      "." and ":", as it could change the meaning of the SQL.
+  """
+
+  def __new__(cls, value: Any) -> 'Identifier':
+    value = str(value)
+    if not _IDENTIFIER_PATTERN.match(value):
+      raise ValueError(f'"{value}" is not a valid identifier.')
+    return super().__new__(cls, value)
+
+
+class SqlList(tuple):
+  """List of values rendered as a parenthesized list of SQL literals."""
+
+  def __new__(cls, values: Sequence[Any]) -> 'SqlList':
+    return super().__new__(cls, values)
+
+
+# Nodes of a compiled template.
+_Placeholder = collections.namedtuple('_Placeholder', ['name'])
+_Conditional = collections.namedtuple('_Conditional',
+                                      ['name', 'if_nodes', 'else_nodes'])
+
+
+def _quote_string(value: str) -> str:
+  escaped_value = value.replace('\\', '\\\\').replace("'", "\\'")
+  return f"'{escaped_value}'"
+
+
+def render_value(value: Any) -> str:
+  """Returns the SQL of a parameter value.
+
+  Args:
+    value: Identifier, SqlList, plain string or scalar value.
+
+  Returns:
+    The SQL of the value.
+
+  Raises:
+    TypeError: If the type of the value is not supported.
+  """
+  if isinstance(value, SqlList):
+    return '(' + ', '.join(
+        _quote_string(item) if isinstance(item, str) else render_value(item)
+        for item in value) + ')'
+  if isinstance(value, str):
+    return str(Identifier(value))
+  # bool is a subclass of int, hence is checked first.
+  if isinstance(value, bool):
+    return 'TRUE' if value else 'FALSE'
+  if isinstance(value, (int, float)):
+    return repr(value)
+  if isinstance(value, datetime.date):
+    return f"DATE '{value.isoformat()}'"
+  raise TypeError(f'Unsupported parameter type: {type(value).__name__}.')
+
+
+class Template(object):
+  """Compiled SQL template."""
+
+  def __init__(self, source: str, name: str = '<string>') -> None:
+    """Compiles a template.
+
+    Args:
+      source: Text of the template.
+      name: Name of the template used in error messages, e.g. its path.
+
+    Raises:
+      TemplateSyntaxError: If the block tags are malformed or unbalanced.
+    """
+    self.name = name
+    self._nodes = self._compile(source)
+    self.parameters = frozenset(self._get_parameters(self._nodes))
+
+  def _compile(self, source: str) -> List[Any]:
+    """Returns the nodes of a template."""
+    # Stack of the nodes of the enclosing blocks.
+    root = []
+    stack = [(None, root)]
+    position = 0
+    for match in _TOKEN_PATTERN.finditer(source):
+      nodes = stack[-1][1]
+      if match.start() > position:
+        nodes.append(source[position:match.start()])
+      position = match.end()
+      if match.group('placeholder'):
+        nodes.append(_Placeholder(match.group('name')))
+        continue
+      tag = match.group('line_tag') or match.group('tag')
+      tag_match = _TAG_PATTERN.match(tag)
+      if not tag_match:
+        raise TemplateSyntaxError(f'Invalid tag {tag} in {self.name}.')
+      if tag_match.group('keyword'):
+        conditional = _Conditional(tag_match.group('name'), [], [])
+        nodes.append(conditional)
+        stack.append((conditional, conditional.if_nodes))
+      elif tag_match.group('else'):
+        conditional, nodes = stack[-1]
+        if not conditional or nodes is conditional.else_nodes:
+          raise TemplateSyntaxError(f'Unexpected {tag} in {self.name}.')
+        stack[-1] = (conditional, conditional.else_nodes)
+      else:
+        if len(stack) == 1:
+          raise TemplateSyntaxError(f'Unexpected {tag} in {self.name}.')
+        stack.pop()
+    if len(stack) > 1:
+      raise TemplateSyntaxError(
+          f'Missing {{% endif %}} for "{stack[-1][0].name}" in {self.name}.')
+    if position < len(source):
+      root.append(source[position:])
+    return root
+
+  def _get_parameters(self, nodes: List[Any]) -> List[str]:
+    """Returns the names of the parameters used by nodes."""
+    parameters = []
+    for node in nodes:
+      if isinstance(node, _Placeholder):
+        parameters.append(node.name)
+      elif isinstance(node, _Conditional):
+        parameters.append(node.name)
+        parameters.extend(self._get_parameters(node.if_nodes))
+        parameters.extend(self._get_parameters(node.else_nodes))
+    return parameters
+
+  def _render_nodes(self, nodes: List[Any], values: Dict[str, str],
+                    params: Dict[str, Any], parts: List[str]) -> None:
+    for node in nodes:
+      if isinstance(node, str):
+        parts.append(node)
+      elif isinstance(node, _Placeholder):
+        parts.append(values[node.name])
+      elif params[node.name]:
+        self._render_nodes(node.if_nodes, values, params, parts)
+      else:
+        self._render_nodes(node.else_nodes, values, params, parts)
+
+  def render(self, params: Dict[str, Any]) -> str:
+    """Renders the template.
+
+    Args:
+      params: Values of the parameters. Parameters not used by the template
+        are ignored.
+
+    Returns:
+      The SQL.
+
+    Raises:
+      MissingParameterError: If a parameter used by the template is missing.
+    """
+    missing_parameters = self.parameters.difference(params)
+    if missing_parameters:
+      raise MissingParameterError(
+          f'Missing parameters for {self.name}: '
+          f'{", ".join(sorted(missing_parameters))}.')
+    values = {name: render_value(params[name]) for name in self.parameters}
+    parts = []
+    self._render_nodes(self._nodes, values, params, parts)
+    return ''.join(parts)
+
+  def fingerprint(self, params: Dict[str, Any]) -> str:
+    """Returns the SHA-256 hex digest of the rendered SQL."""
+    return hashlib.sha256(self.render(params).encode('utf-8')).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def load_template(file_path: str) -> Template:
+  """Returns the compiled template of a file, compiled on the first call.
+
+  Args:
+    file_path: Path of the SQL file.
+
+  Raises:
+    FileNotFoundError: If the file is not found.
+  """
+  try:
+    with open(file_path, 'r') as template_file:
+      source = template_file.read()
+  except FileNotFoundError as e:
+    raise FileNotFoundError(
+        f'The file "{file_path}" could not be found.') from e
+  return Template(source, file_path)
+
+
+def get_parameters(file_path: str) -> FrozenSet[str]:
+  """Returns the names of the parameters used by a SQL file."""
+  return load_template(file_path).parameters
+
+
+def render_file(file_path: str,
+                params: Dict[str, Union[Identifier, SqlList, Any]]) -> str:
+  """Renders a SQL file, see Template.render."""
+  return load_template(file_path).render(params)
@@ -0,0 +1,96 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Tests for sql_template."""
+
+import datetime
+import unittest
+
+import sql_template
+
+
+class IdentifierTest(unittest.TestCase):
+
+  def test_accepts_domain_scoped_project_id(self):
+    self.assertEqual(
+        sql_template.Identifier('example.com:my-project'),
+        'example.com:my-project')
+
+  def test_rejects_quotes_and_spaces(self):
+    for value in ('project`; DROP TABLE x; --', "project'", 'my project'):
+      with self.subTest(value=value):
+        with self.assertRaises(ValueError):
+          sql_template.Identifier(value)
+
+
+class TemplateTest(unittest.TestCase):
+
+  def test_render_placeholders(self):
+    template = sql_template.Template(
+        'SELECT * FROM `{project_id}.{dataset}.Products_{merchant_id}`')
+
+    self.assertEqual(
+        template.render({
+            'project_id': 'example.com:my-project',
+            'dataset': 'markup',
+            'merchant_id': 1234
+        }), 'SELECT * FROM `example.com:my-project.markup.Products_1234`')
+
+  def test_render_keeps_other_braces(self):
+    template = sql_template.Template(
+        'LANGUAGE js AS """ return {a: 1}; """ -- {dataset}')
+
+    self.assertEqual(
+        template.render({'dataset': 'markup'}),
+        'LANGUAGE js AS """ return {a: 1}; """ -- markup')
+
+  def test_render_typed_values(self):
+    template = sql_template.Template('{countries} {enabled} {day} {days}')
+
+    self.assertEqual(
+        template.render({
+            'countries': sql_template.SqlList(['US', "O'X"]),
+            'enabled': True,
+            'day': datetime.date(2021, 10, 1),
+            'days': 7
+        }), "('US', 'O\\'X') TRUE DATE '2021-10-01' 7")
+
+  def test_render_conditional_blocks(self):
+    template = sql_template.Template('SELECT 1\n'
+                                     '{% if market_insights %}\n'
+                                     'UNION ALL SELECT 2\n'
+                                     '{% else %}\n'
+                                     'UNION ALL SELECT 3\n'
+                                     '{% endif %}\n')
+
+    self.assertEqual(
+        template.render({'market_insights': True}),
+        'SELECT 1\nUNION ALL SELECT 2\n')
+    self.assertEqual(
+        template.render({'market_insights': False}),
+        'SELECT 1\nUNION ALL SELECT 3\n')
+
+  def test_render_fails_on_missing_parameter(self):
+    with self.assertRaises(sql_template.MissingParameterError):
+      sql_template.Template('{dataset}').render({})
+
+  def test_compile_fails_on_unclosed_block(self):
+    with self.assertRaises(sql_template.TemplateSyntaxError):
+      sql_template.Template('{% if market_insights %}SELECT 1')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,950 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Generates synthetic Merchant Center and Google Ads transfer tables.
+
+The tables have the columns read by the MarkUp scripts:
+  * Products_<merchant_id>, with destinations, issues, custom labels and
+    product type and Google product category paths.
+  * p_Criteria_<customer_id>, whose product partitions use the syntax parsed
+    by constructParsedCriteria, e.g. "product_type_l1==apparel&+brand==*".
+  * p_ShoppingProductStats_<customer_id> and p_Customer_<customer_id>.
+  * Products_PriceBenchmarks_<merchant_id>,
+    BestSellers_TopProducts_<merchant_id> and
+    BestSellers_TopProducts_Inventory_<merchant_id> for market insights.
+  * geo_targets, with the countries of the products and one child each.
+
+Each day of data is a partition, held in the "_PARTITIONDATE" column of the
+Merchant Center tables and the "_DATA_DATE" column of the Google Ads tables
+as expected by local_harness. When loaded to BigQuery, the tables are
+ingestion time partitioned instead and the Google Ads tables get the views
+created by the transfer.
+
+The data only depends on the scale and its seed, so a scale always generates
+the same tables.
+
+Typical usage example:
+  >>> scale = Scale(products=10000, days=30, countries=3, seed=1)
+  >>> tables = generate_tables('1234', '5678', scale)
+  >>> write_tables(tables, 'fixtures')
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import io
+import logging
+import os
+import random
+from typing import Any, Dict, List, Optional, Sequence
+
+import cloud_bigquery
+from google.api_core import exceptions
+from google.cloud import bigquery
+import pyarrow
+from pyarrow import compute
+from pyarrow import csv
+from pyarrow import parquet
+import reference_data
+
+PARQUET_FORMAT = 'parquet'
+CSV_FORMAT = 'csv'
+_DEFAULT_MAX_WORKERS = 4
+_MERCHANT_CENTER_PARTITION_COLUMN = '_PARTITIONDATE'
+_GOOGLE_ADS_PARTITION_COLUMN = '_DATA_DATE'
+_TRANSFER_TABLE_PREFIX = 'p_'
+# Countries in order of use: country code, geo target criterion id, language
+# code, language criterion id and currency.
+_COUNTRIES = (
+    ('US', 2840, 'en', 1000, 'USD'),
+    ('GB', 2826, 'en', 1000, 'GBP'),
+    ('DE', 2276, 'de', 1001, 'EUR'),
+    ('FR', 2250, 'fr', 1002, 'EUR'),
+    ('JP', 2392, 'ja', 1005, 'JPY'),
+    ('CA', 2124, 'en', 1000, 'CAD'),
+    ('AU', 2036, 'en', 1000, 'AUD'),
+    ('IT', 2380, 'it', 1004, 'EUR'),
+    ('ES', 2724, 'es', 1003, 'EUR'),
+    ('NL', 2528, 'nl', 1010, 'EUR'),
+    ('BR', 2076, 'pt', 1014, 'BRL'),
+    ('SE', 2752, 'sv', 1015, 'SEK'),
+)
+# Criteria ids of the synthetic children of the countries in geo_targets.
+_GEO_TARGET_CHILD_ID_OFFSET = 9000000
+_PRODUCT_TYPES = ('Apparel', 'Electronics', 'Home & Garden', 'Sporting Goods',
+                  'Toys & Games', 'Health & Beauty', 'Office Supplies',
+                  'Pet Supplies')
+# Product types of the product partitions, the offers of the other types are
+# not targeted.
+_TARGETED_PRODUCT_TYPES = _PRODUCT_TYPES[:6]
+_PRODUCT_SUBTYPES = ('Accessories', 'Basics', 'Essentials', 'Kids', 'Outdoor',
+                     'Premium')
+_GOOGLE_PRODUCT_CATEGORIES = (
+    (166, 'Apparel & Accessories'),
+    (222, 'Electronics'),
+    (536, 'Home & Garden'),
+    (988, 'Sporting Goods'),
+    (1239, 'Toys & Games'),
+    (469, 'Health & Beauty'),
+    (922, 'Office Supplies'),
+    (2, 'Animals & Pet Supplies'),
+)
+_CUSTOM_LABELS = (
+    ('sale', 'new', 'clearance', 'bestseller', 'regular'),
+    ('spring', 'summer', 'autumn', 'winter'),
+    ('high_margin', 'low_margin'),
+    ('tier_1', 'tier_2', 'tier_3'),
+    ('campaign_a', 'campaign_b'),
+)
+_CONDITIONS = ('new', 'refurbished', 'used')
+_ISSUES = (
+    ('image_link_broken', 'disapproved', 'Invalid image'),
+    ('landing_page_error', 'disapproved', 'Unavailable desktop landing page'),
+    ('missing_gtin', 'demoted', 'Missing value [gtin]'),
+    ('price_mismatch', 'demoted', 'Mismatched value (page crawl) [price]'),
+    ('missing_color', 'unaffected', 'Missing value [color]'),
+)
+# Share of the offers of each destination status and of each issue type.
+_APPROVED_RATE = 0.85
+_PENDING_RATE = 0.05
+_DEMOTED_RATE = 0.1
+_WARNING_RATE = 0.2
+_IN_STOCK_RATE = 0.8
+_LOCAL_CHANNEL_RATE = 0.1
+# Share of the offers with impressions on a day.
+_IMPRESSION_RATE = 0.5
+_PRICE_BENCHMARK_RATE = 0.4
+_BEST_SELLER_INVENTORY_RATE = 0.3
+_CRITERIA_PER_AD_GROUP = 20
+# Share of the product partitions below the first level which are "everything
+# else" nodes.
+_EVERYTHING_ELSE_RATE = 0.2
+# Product partition dimensions, from the root of the tree to its leaves.
+PARTITION_DIMENSIONS = ('product_type_l1', 'brand', 'custom0',
+                        'product_type_l2', 'category_l1', 'c_condition',
+                        'channel', 'id')
+
+# Set logging level.
+logging.getLogger().setLevel(logging.INFO)
+
+# Size and shape of the generated data:
+#   products: Number of offers per day, over all the countries.
+#   days: Number of daily partitions.
+#   countries: Number of target countries, at most len(_COUNTRIES).
+#   criteria: Number of product partitions per day.
+#   targeting_depth: Maximum number of conditions of a product partition, at
+#     most len(PARTITION_DIMENSIONS).
+#   churn_rate: Share of the offers replaced by new ones each day, as well as
+#     the share of the other offers whose price, availability or status change
+#     and the share of product partitions replaced.
+#   seed: Seed of the random generator.
+#   end_date: Last day of data, today if not set.
+Scale = collections.namedtuple(
+    'Scale', [
+        'products', 'days', 'countries', 'criteria', 'targeting_depth',
+        'churn_rate', 'seed', 'end_date'
+    ],
+    defaults=[1000, 7, 1, 100, 3, 0.02, 0, None])
+
+PRODUCTS_SCHEMA = pyarrow.schema([
+    ('product_id', pyarrow.string()),
+    ('merchant_id', pyarrow.int64()),
+    ('aggregator_id', pyarrow.int64()),
+    ('offer_id', pyarrow.string()),
+    ('title', pyarrow.string()),
+    ('description', pyarrow.string()),
+    ('link', pyarrow.string()),
+    ('mobile_link', pyarrow.string()),
+    ('image_link', pyarrow.string()),
+    ('additional_image_links', pyarrow.list_(pyarrow.string())),
+    ('content_language', pyarrow.string()),
+    ('channel', pyarrow.string()),
+    ('expiration_date', pyarrow.timestamp('us', tz='UTC')),
+    ('google_expiration_date', pyarrow.timestamp('us', tz='UTC')),
+    ('adult', pyarrow.bool_()),
+    ('age_group', pyarrow.string()),
+    ('availability', pyarrow.string()),
+    ('availability_date', pyarrow.timestamp('us', tz='UTC')),
+    ('brand', pyarrow.string()),
+    ('color', pyarrow.string()),
+    ('condition', pyarrow.string()),
+    ('custom_labels',
+     pyarrow.struct([(f'label_{index}', pyarrow.string())
+                     for index in range(len(_CUSTOM_LABELS))])),
+    ('gender', pyarrow.string()),
+    ('gtin', pyarrow.string()),
+    ('item_group_id', pyarrow.string()),
+    ('material', pyarrow.string()),
+    ('mpn', pyarrow.string()),
+    ('pattern', pyarrow.string()),
+    ('price',
+     pyarrow.struct([('value', pyarrow.float64()),
+                     ('currency', pyarrow.string())])),
+    ('sale_price',
+     pyarrow.struct([('value', pyarrow.float64()),
+                     ('currency', pyarrow.string())])),
+    ('sale_price_effective_start_date', pyarrow.timestamp('us', tz='UTC')),
+    ('sale_price_effective_end_date', pyarrow.timestamp('us', tz='UTC')),
+    ('google_product_category', pyarrow.int64()),
+    ('google_product_category_path', pyarrow.string()),
+    ('product_type', pyarrow.string()),
+    ('additional_product_types', pyarrow.list_(pyarrow.string())),
+    ('destinations',
+     pyarrow.list_(
+         pyarrow.struct([
+             ('name', pyarrow.string()),
+             ('approved_countries', pyarrow.list_(pyarrow.string())),
+             ('pending_countries', pyarrow.list_(pyarrow.string())),
+             ('disapproved_countries', pyarrow.list_(pyarrow.string())),
+         ]))),
+    ('issues',
+     pyarrow.list_(
+         pyarrow.struct([
+             ('code', pyarrow.string()),
+             ('servability', pyarrow.string()),
+             ('resolution', pyarrow.string()),
+             ('attribute_name', pyarrow.string()),
+             ('destination', pyarrow.string()),
+             ('short_description', pyarrow.string()),
+             ('detail', pyarrow.string()),
+             ('documentation', pyarrow.string()),
+             ('applicable_countries', pyarrow.list_(pyarrow.string())),
+         ]))),
+    (_MERCHANT_CENTER_PARTITION_COLUMN, pyarrow.date32()),
+])
+CRITERIA_SCHEMA = pyarrow.schema([
+    ('ExternalCustomerId', pyarrow.int64()),
+    ('CampaignId', pyarrow.int64()),
+    ('AdGroupId', pyarrow.int64()),
+    ('CriterionId', pyarrow.int64()),
+    ('Criteria', pyarrow.string()),
+    ('CriteriaType', pyarrow.string()),
+    ('IsNegative', pyarrow.bool_()),
+    (_GOOGLE_ADS_PARTITION_COLUMN, pyarrow.date32()),
+])
+SHOPPING_PRODUCT_STATS_SCHEMA = pyarrow.schema([
+    ('ExternalCustomerId', pyarrow.int64()),
+    ('MerchantId', pyarrow.int64()),
+    ('CampaignId', pyarrow.int64()),
+    ('AdGroupId', pyarrow.int64()),
+    ('Channel', pyarrow.string()),
+    ('CountryCriteriaId', pyarrow.int64()),
+    ('LanguageCriteriaId', pyarrow.string()),
+    ('OfferId', pyarrow.string()),
+    ('Impressions', pyarrow.int64()),
+    ('Clicks', pyarrow.int64()),
+    ('Cost', pyarrow.int64()),
+    ('Conversions', pyarrow.float64()),
+    ('ConversionValue', pyarrow.float64()),
+    (_GOOGLE_ADS_PARTITION_COLUMN, pyarrow.date32()),
+])
+CUSTOMER_SCHEMA = pyarrow.schema([
+    ('ExternalCustomerId', pyarrow.int64()),
+    ('AccountDescriptiveName', pyarrow.string()),
+    ('AccountCurrencyCode', pyarrow.string()),
+    ('AccountTimeZone', pyarrow.string()),
+    (_GOOGLE_ADS_PARTITION_COLUMN, pyarrow.date32()),
+])
+PRICE_BENCHMARKS_SCHEMA = pyarrow.schema([
+    ('product_id', pyarrow.string()),
+    ('merchant_id', pyarrow.int64()),
+    ('country_of_sale', pyarrow.string()),
+    ('price_benchmark_value', pyarrow.float64()),
+    ('price_benchmark_currency', pyarrow.string()),
+    ('price_benchmark_timestamp', pyarrow.timestamp('us', tz='UTC')),
+    (_MERCHANT_CENTER_PARTITION_COLUMN, pyarrow.date32()),
+])
+_LOCALIZED_NAMES = pyarrow.list_(
+    pyarrow.struct([('locale', pyarrow.string()),
+                    ('name', pyarrow.string())]))
+BEST_SELLERS_SCHEMA = pyarrow.schema([
+    ('rank_id', pyarrow.string()),
+    ('rank', pyarrow.int64()),
+    ('previous_rank', pyarrow.int64()),
+    ('ranking_country', pyarrow.string()),
+    ('ranking_category', pyarrow.int64()),
+    ('ranking_category_path', _LOCALIZED_NAMES),
+    ('product_title', _LOCALIZED_NAMES),
+    ('gtins', pyarrow.list_(pyarrow.string())),
+    ('brand', pyarrow.string()),
+    ('google_product_category_path', _LOCALIZED_NAMES),
+    ('google_product_category', pyarrow.int64()),
+    ('price_range',
+     pyarrow.struct([('min', pyarrow.float64()), ('max', pyarrow.float64()),
+                     ('currency', pyarrow.string())])),
+    (_MERCHANT_CENTER_PARTITION_COLUMN, pyarrow.date32()),
+])
+BEST_SELLERS_INVENTORY_SCHEMA = pyarrow.schema([
+    ('rank_id', pyarrow.string()),
+    ('product_id', pyarrow.string()),
+    ('merchant_id', pyarrow.int64()),
+    (_MERCHANT_CENTER_PARTITION_COLUMN, pyarrow.date32()),
+])
+GEO_TARGETS_SCHEMA = pyarrow.schema([
+    ('criteria_id', pyarrow.int64()),
+    ('name', pyarrow.string()),
+    ('canonical_name', pyarrow.string()),
+    ('parent_id', pyarrow.int64()),
+    ('country_code', pyarrow.string()),
+    ('target_type', pyarrow.string()),
+    ('status', pyarrow.string()),
+])
+
+
+class Error(Exception):
+  """Base error for this module."""
+
+
+def _get_days(scale: Scale) -> List[datetime.date]:
+  end_date = scale.end_date or datetime.date.today()
+  return [
+      end_date - datetime.timedelta(days=days_before)
+      for days_before in reversed(range(scale.days))
+  ]
+
+
+def _new_offer(rng: random.Random, merchant_id: int, offer_number: int,
+               country: Sequence[Any], brands: Sequence[str]) -> Dict[str, Any]:
+  """Returns the attributes of a new offer which don't change over time."""
+  country_code, _, language_code, _, currency = country
+  offer_id = f'sku{offer_number:08d}'
+  channel = 'local' if rng.random() < _LOCAL_CHANNEL_RATE else 'online'
+  product_type = rng.choice(_PRODUCT_TYPES)
+  category_id, category = _GOOGLE_PRODUCT_CATEGORIES[_PRODUCT_TYPES.index(
+      product_type)]
+  subtype = rng.choice(_PRODUCT_SUBTYPES)
+  return {
+      'product_id': f'{channel}:{language_code}:{country_code}:{offer_id}',
+      'merchant_id': merchant_id,
+      'aggregator_id': None,
+      'offer_id': offer_id,
+      'title': f'{rng.choice(brands)} {subtype} {product_type} {offer_number}',
+      'description': f'{subtype} {product_type.lower()} item.',
+      'link': f'https://shop.example.com/{offer_id}',
+      'mobile_link': f'https://m.shop.example.com/{offer_id}',
+      'image_link': f'https://shop.example.com/images/{offer_id}.jpg',
+      'additional_image_links': [
+          f'https://shop.example.com/images/{offer_id}_{index}.jpg'
+          for index in range(rng.randint(0, 3))
+      ],
+      'content_language': language_code,
+      'channel': channel,
+      'adult': False,
+      'age_group': rng.choice(('adult', 'kids', None)),
+      'brand': rng.choice(brands),
+      'color': rng.choice(('black', 'white', 'red', 'blue', None)),
+      'condition': rng.choices(_CONDITIONS, weights=(90, 7, 3))[0],
+      'custom_labels': {
+          f'label_{index}': rng.choice(labels + (None,))
+          for index, labels in enumerate(_CUSTOM_LABELS)
+      },
+      'gender': rng.choice(('female', 'male', 'unisex', None)),
+      'gtin': f'{rng.randrange(10**12, 10**13)}',
+      'item_group_id': f'group{offer_number // 4:08d}',
+      'material': rng.choice(('cotton', 'metal', 'plastic', 'wood', None)),
+      'mpn': f'MPN{offer_number:08d}',
+      'pattern': None,
+      'currency': currency,
+      'google_product_category': category_id,
+      'google_product_category_path': category,
+      'product_type': (f'{product_type} > {subtype} > '
+                       f'Line {rng.randint(1, 10)}'),
+      'additional_product_types': [],
+      'country_code': country_code,
+  }
+
+
+def _update_offer(rng: random.Random, offer: Dict[str, Any]) -> None:
+  """Draws the attributes of an offer which change over time."""
+  offer['price'] = round(rng.lognormvariate(3.5, 0.8), 2)
+  offer['is_on_sale'] = rng.random() < 0.15
+  offer['availability'] = (
+      'in stock' if rng.random() < _IN_STOCK_RATE else rng.choice(
+          ('out of stock', 'preorder')))
+  status = rng.random()
+  if status < _APPROVED_RATE:
+    offer['status'] = 'approved'
+  elif status < _APPROVED_RATE + _PENDING_RATE:
+    offer['status'] = 'pending'
+  else:
+    offer['status'] = 'disapproved'
+  issue_types = []
+  if offer['status'] == 'disapproved':
+    issue_types.append(
+        rng.choice([issue for issue in _ISSUES if issue[1] == 'disapproved']))
+  if rng.random() < _DEMOTED_RATE:
+    issue_types.append(
+        rng.choice([issue for issue in _ISSUES if issue[1] == 'demoted']))
+  if rng.random() < _WARNING_RATE:
+    issue_types.append(
+        rng.choice([issue for issue in _ISSUES if issue[1] == 'unaffected']))
+  offer['issue_types'] = issue_types
+
+
+def _get_product_row(offer: Dict[str, Any],
+                     day: datetime.date) -> Dict[str, Any]:
+  """Returns the Products row of an offer on a day."""
+  country_code = offer['country_code']
+  day_start = datetime.datetime.combine(
+      day, datetime.time(), tzinfo=datetime.timezone.utc)
+  # The attributes of the offer which aren't columns are ignored by
+  # pyarrow.Table.from_pylist.
+  row = dict(offer)
+  row.update({
+      'expiration_date': day_start + datetime.timedelta(days=30),
+      'google_expiration_date': day_start + datetime.timedelta(days=30),
+      'availability': offer['availability'],
+      'availability_date': None,
+      'price': {
+          'value': offer['price'],
+          'currency': offer['currency']
+      },
+      'sale_price': {
+          'value': round(offer['price'] * 0.8, 2),
+          'currency': offer['currency']
+      } if offer['is_on_sale'] else None,
+      'sale_price_effective_start_date':
+          day_start - datetime.timedelta(days=7)
+          if offer['is_on_sale'] else None,
+      'sale_price_effective_end_date':
+          day_start + datetime.timedelta(days=7)
+          if offer['is_on_sale'] else None,
+      'destinations': [{
+          'name': 'Shopping',
+          'approved_countries':
+              [country_code] if offer['status'] == 'approved' else [],
+          'pending_countries':
+              [country_code] if offer['status'] == 'pending' else [],
+          'disapproved_countries':
+              [country_code] if offer['status'] == 'disapproved' else [],
+      }],
+      'issues': [{
+          'code': code,
+          'servability': servability,
+          'resolution': 'merchant_action',
+          'attribute_name': None,
+          'destination': 'Shopping',
+          'short_description': short_description,
+          'detail': short_description,
+          'documentation': 'https://support.google.com/merchants',
+          'applicable_countries': [country_code],
+      } for code, servability, short_description in offer['issue_types']],
+      _MERCHANT_CENTER_PARTITION_COLUMN: day,
+  })
+  return row
+
+
+def _get_partition_values(offer: Dict[str, Any]) -> Dict[str, str]:
+  """Returns the value of each product partition dimension for an offer."""
+  product_type_levels = [
+      level.strip() for level in offer['product_type'].split('>')
+  ]
+  return {
+      'product_type_l1': product_type_levels[0].lower(),
+      'brand': offer['brand'].lower(),
+      'custom0': offer['custom_labels']['label_0'] or '*',
+      'product_type_l2': product_type_levels[1].lower(),
+      'category_l1': offer['google_product_category_path'].lower(),
+      'c_condition': f'condition:{offer["condition"]}',
+      'channel': f'channel:{offer["channel"]}',
+      'id': offer['offer_id'],
+  }
+
+
+def _get_targeted_offers(
+    offers: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+  targeted_offers = [
+      offer for offer in offers
+      if offer['product_type'].split(' > ')[0] in _TARGETED_PRODUCT_TYPES
+  ]
+  return targeted_offers or list(offers)
+
+
+def _new_criterion(rng: random.Random, offers: Sequence[Dict[str, Any]],
+                   targeting_depth: int) -> str:
+  """Returns a product partition matching a random offer.
+
+  Args:
+    rng: The random generator.
+    offers: The offers of the day of the targeted product types.
+    targeting_depth: Maximum number of conditions of the product partition.
+
+  Returns:
+    The product partition, e.g. "product_type_l1==apparel&+brand==*".
+  """
+  depth = rng.randint(1, targeting_depth)
+  values = _get_partition_values(rng.choice(offers))
+  conditions = [
+      f'{dimension}=={values[dimension]}'
+      for dimension in PARTITION_DIMENSIONS[:depth]
+  ]
+  if depth > 1 and rng.random() < _EVERYTHING_ELSE_RATE:
+    conditions[-1] = f'{PARTITION_DIMENSIONS[depth - 1]}==*'
+  return '&+'.join(conditions)
+
+
+def generate_tables(merchant_id: str, customer_id: str,
+                    scale: Scale) -> Dict[str, pyarrow.Table]:
+  """Generates the transfer tables of a MarkUp installation.
+
+  Args:
+    merchant_id: Merchant center id.
+    customer_id: Google Ads customer id, without dashes.
+    scale: Size and shape of the data.
+
+  Returns:
+    The tables keyed by table name, e.g. "Products_1234".
+
+  Raises:
+    Error: If the scale has more countries or a deeper targeting than
+      supported.
+  """
+  if not 1 <= scale.countries <= len(_COUNTRIES):
+    raise Error(f'countries must be between 1 and {len(_COUNTRIES)}.')
+  if not 1 <= scale.targeting_depth <= len(PARTITION_DIMENSIONS):
+    raise Error('targeting_depth must be between 1 and '
+                f'{len(PARTITION_DIMENSIONS)}.')
+  rng = random.Random(scale.seed)
+  merchant = int(merchant_id)
+  customer = int(customer_id)
+  countries = _COUNTRIES[:scale.countries]
+  brands = [f'Brand {index:03d}' for index in range(
+      max(10, scale.products // 200))]
+  days = _get_days(scale)
+  ad_group_count = max(1, -(-scale.criteria // _CRITERIA_PER_AD_GROUP))
+  offers = []
+  for offer_number in range(scale.products):
+    offer = _new_offer(rng, merchant, offer_number,
+                       countries[offer_number % len(countries)], brands)
+    _update_offer(rng, offer)
+    offers.append(offer)
+  next_offer_number = scale.products
+  targeted_offers = _get_targeted_offers(offers)
+  criteria = [
+      _new_criterion(rng, targeted_offers, scale.targeting_depth)
+      for _ in range(scale.criteria)
+  ]
+  rows = collections.defaultdict(list)
+  for day_number, day in enumerate(days):
+    if day_number:
+      for index in range(len(offers)):
+        if rng.random() < scale.churn_rate:
+          offers[index] = _new_offer(rng, merchant, next_offer_number,
+                                     countries[index % len(countries)], brands)
+          next_offer_number += 1
+          _update_offer(rng, offers[index])
+        elif rng.random() < scale.churn_rate:
+          _update_offer(rng, offers[index])
+      targeted_offers = _get_targeted_offers(offers)
+      for index in range(len(criteria)):
+        if rng.random() < scale.churn_rate:
+          criteria[index] = _new_criterion(rng, targeted_offers,
+                                           scale.targeting_depth)
+    day_start = datetime.datetime.combine(
+        day, datetime.time(), tzinfo=datetime.timezone.utc)
+    rows['products'].extend(_get_product_row(offer, day) for offer in offers)
+    for index, criterion in enumerate(criteria):
+      ad_group_id = index % ad_group_count + 1
+      rows['criteria'].append({
+          'ExternalCustomerId': customer,
+          'CampaignId': ad_group_id // 10 + 1,
+          'AdGroupId': ad_group_id,
+          'CriterionId': index + 1,
+          'Criteria': criterion,
+          'CriteriaType': 'PRODUCT_PARTITION',
+          'IsNegative': False,
+          _GOOGLE_ADS_PARTITION_COLUMN: day,
+      })
+    country_ids = {country[0]: country for country in countries}
+    for offer in offers:
+      if offer['status'] != 'approved' or rng.random() >= _IMPRESSION_RATE:
+        continue
+      _, country_id, _, language_id, _ = country_ids[offer['country_code']]
+      impressions = int(rng.paretovariate(1.2) * 10)
+      clicks = round(impressions * rng.uniform(0, 0.04))
+      conversions = float(round(clicks * rng.uniform(0, 0.1)))
+      ad_group_id = rng.randint(1, ad_group_count)
+      rows['stats'].append({
+          'ExternalCustomerId': customer,
+          'MerchantId': merchant,
+          'CampaignId': ad_group_id // 10 + 1,
+          'AdGroupId': ad_group_id,
+          'Channel': offer['channel'].upper(),
+          'CountryCriteriaId': country_id,
+          'LanguageCriteriaId': str(language_id),
+          'OfferId': offer['offer_id'],
+          'Impressions': impressions,
+          'Clicks': clicks,
+          'Cost': clicks * rng.randint(100000, 2000000),
+          'Conversions': conversions,
+          'ConversionValue': round(conversions * offer['price'], 2),
+          _GOOGLE_ADS_PARTITION_COLUMN: day,
+      })
+    rows['customer'].append({
+        'ExternalCustomerId': customer,
+        'AccountDescriptiveName': f'Account {customer_id}',
+        'AccountCurrencyCode': countries[0][4],
+        'AccountTimeZone': 'America/New_York',
+        _GOOGLE_ADS_PARTITION_COLUMN: day,
+    })
+    for offer in offers:
+      if rng.random() >= _PRICE_BENCHMARK_RATE:
+        continue
+      rows['price_benchmarks'].append({
+          'product_id': offer['product_id'],
+          'merchant_id': merchant,
+          'country_of_sale': offer['country_code'],
+          'price_benchmark_value': round(
+              offer['price'] * rng.uniform(0.85, 1.15), 2),
+          'price_benchmark_currency': offer['currency'],
+          'price_benchmark_timestamp': day_start,
+          _MERCHANT_CENTER_PARTITION_COLUMN: day,
+      })
+    offers_by_country = collections.defaultdict(list)
+    for offer in offers:
+      offers_by_country[offer['country_code']].append(offer)
+    for country_code, _, _, _, currency in countries:
+      for rank in range(1, max(10, scale.products // 20) + 1):
+        category_id, category = rng.choice(_GOOGLE_PRODUCT_CATEGORIES)
+        rank_id = f'{day.isoformat()}:{country_code}:{category_id}:{rank}'
+        price = round(rng.lognormvariate(3.5, 0.8), 2)
+        rows['best_sellers'].append({
+            'rank_id': rank_id,
+            'rank': rank,
+            'previous_rank': max(1, rank + rng.randint(-5, 5)),
+            'ranking_country': country_code,
+            'ranking_category': category_id,
+            'ranking_category_path': [{'locale': 'en-US', 'name': category}],
+            'product_title': [{
+                'locale': 'en-US',
+                'name': f'Best seller {category_id}-{rank}'
+            }],
+            'gtins': [f'{rng.randrange(10**12, 10**13)}'],
+            'brand': rng.choice(brands),
+            'google_product_category_path': [{
+                'locale': 'en-US',
+                'name': category
+            }],
+            'google_product_category': category_id,
+            'price_range': {
+                'min': price,
+                'max': round(price * 1.2, 2),
+                'currency': currency
+            },
+            _MERCHANT_CENTER_PARTITION_COLUMN: day,
+        })
+        if (offers_by_country[country_code] and
+            rng.random() < _BEST_SELLER_INVENTORY_RATE):
+          offer = rng.choice(offers_by_country[country_code])
+          rows['best_sellers_inventory'].append({
+              'rank_id': rank_id,
+              'product_id': offer['product_id'],
+              'merchant_id': merchant,
+              _MERCHANT_CENTER_PARTITION_COLUMN: day,
+          })
+  geo_targets = []
+  for country_code, country_id, _, _, _ in countries:
+    geo_targets.append({
+        'criteria_id': country_id,
+        'name': country_code,
+        'canonical_name': country_code,
+        'parent_id': None,
+        'country_code': country_code,
+        'target_type': 'Country',
+        'status': 'Active',
+    })
+    geo_targets.append({
+        'criteria_id': _GEO_TARGET_CHILD_ID_OFFSET + country_id,
+        'name': f'{country_code} region',
+        'canonical_name': f'{country_code} region,{country_code}',
+        'parent_id': country_id,
+        'country_code': country_code,
+        'target_type': 'Region',
+        'status': 'Active',
+    })
+  return {
+      f'Products_{merchant_id}':
+          pyarrow.Table.from_pylist(rows['products'], PRODUCTS_SCHEMA),
+      f'p_Criteria_{customer_id}':
+          pyarrow.Table.from_pylist(rows['criteria'], CRITERIA_SCHEMA),
+      f'p_ShoppingProductStats_{customer_id}':
+          pyarrow.Table.from_pylist(rows['stats'],
+                                    SHOPPING_PRODUCT_STATS_SCHEMA),
+      f'p_Customer_{customer_id}':
+          pyarrow.Table.from_pylist(rows['customer'], CUSTOMER_SCHEMA),
+      f'Products_PriceBenchmarks_{merchant_id}':
+          pyarrow.Table.from_pylist(rows['price_benchmarks'],
+                                    PRICE_BENCHMARKS_SCHEMA),
+      f'BestSellers_TopProducts_{merchant_id}':
+          pyarrow.Table.from_pylist(rows['best_sellers'],
+                                    BEST_SELLERS_SCHEMA),
+      f'BestSellers_TopProducts_Inventory_{merchant_id}':
+          pyarrow.Table.from_pylist(rows['best_sellers_inventory'],
+                                    BEST_SELLERS_INVENTORY_SCHEMA),
+      reference_data.GEO_TARGETS.table_name:
+          pyarrow.Table.from_pylist(geo_targets, GEO_TARGETS_SCHEMA),
+  }
+
+
+def _is_nested(table: pyarrow.Table) -> bool:
+  return any(pyarrow.types.is_nested(field.type) for field in table.schema)
+
+
+def write_tables(tables: Dict[str, pyarrow.Table],
+                 output_dir: str,
+                 file_format: str = PARQUET_FORMAT) -> List[str]:
+  """Writes tables as fixture files, e.g. for local_harness.
+
+  Args:
+    tables: The tables keyed by table name.
+    output_dir: Directory of the files, created if missing.
+    file_format: Either 'parquet' or 'csv'. Tables with nested columns are
+      written as Parquet in both cases, as CSV can't hold them.
+
+  Returns:
+    The paths of the files written.
+  """
+  os.makedirs(output_dir, exist_ok=True)
+  file_paths = []
+  for table_name, table in tables.items():
+    if file_format == CSV_FORMAT and not _is_nested(table):
+      file_path = os.path.join(output_dir, f'{table_name}.csv')
+      csv.write_csv(table, file_path)
+    else:
+      file_path = os.path.join(output_dir, f'{table_name}.parquet')
+      parquet.write_table(table, file_path)
+    logging.info('Wrote %d rows to %s.', table.num_rows, file_path)
+    file_paths.append(file_path)
+  return file_paths
+
+
+def _load_partition(client: bigquery.Client, table_id: str,
+                    table: pyarrow.Table, partition_column: str,
+                    day: datetime.date) -> None:
+  """Loads the rows of a day to the partition of an ingestion time table."""
+  rows = table.filter(compute.equal(table[partition_column],
+                                    day)).drop([partition_column])
+  buffer = io.BytesIO()
+  parquet.write_table(rows, buffer)
+  buffer.seek(0)
+  parquet_options = bigquery.format_options.ParquetOptions()
+  parquet_options.enable_list_inference = True
+  job_config = bigquery.LoadJobConfig(
+      source_format=bigquery.SourceFormat.PARQUET,
+      parquet_options=parquet_options,
+      time_partitioning=bigquery.TimePartitioning(
+          type_=bigquery.TimePartitioningType.DAY),
+      write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+      labels=cloud_bigquery.get_job_labels('synthetic_data'))
+  partition_id = f'{table_id}${day.strftime("%Y%m%d")}'
+  job = client.load_table_from_file(
+      buffer, partition_id, job_config=job_config)
+  cloud_bigquery.wait_for_job(job, partition_id)
+
+
+def _get_replaced_tables(client: bigquery.Client, project_id: str,
+                         dataset_id: str,
+                         table_names: Sequence[str]) -> List[str]:
+  """Returns the tables and views of a dataset that a load would replace."""
+  try:
+    existing_tables = {
+        table.table_id
+        for table in client.list_tables(f'{project_id}.{dataset_id}')
+    }
+  except exceptions.NotFound:
+    return []
+  replaced_tables = set(table_names)
+  for table_name in table_names:
+    if table_name.startswith(_TRANSFER_TABLE_PREFIX):
+      replaced_tables.add(table_name[len(_TRANSFER_TABLE_PREFIX):])
+  return sorted(existing_tables & replaced_tables)
+
+
+def load_tables(tables: Dict[str, pyarrow.Table],
+                project_id: str,
+                dataset_id: str,
+                max_workers: int = _DEFAULT_MAX_WORKERS,
+                client: Optional[bigquery.Client] = None,
+                overwrite: bool = False) -> None:
+  """Loads tables to BigQuery as the transfers would.
+
+  Each day of a table is loaded to its partition of an ingestion time
+  partitioned table. The Google Ads tables are loaded as "p_<table>" and get
+  a "<table>" view adding "_DATA_DATE" and "_LATEST_DATE". The reference
+  tables are skipped, load them with reference_data.py.
+
+  The loaded tables and views are deleted and replaced, so the dataset
+  mustn't be the one of the real transfers.
+
+  Args:
+    tables: The tables keyed by table name.
+    project_id: A cloud project id.
+    dataset_id: BigQuery dataset id.
+    max_workers: Maximum number of concurrent loads.
+    client: BigQuery client, one for the project is created if not set.
+    overwrite: Whether to replace the tables and views already in the
+      dataset. If False, nothing is loaded when any of them exists.
+
+  Raises:
+    Error: If the dataset already holds some of the tables and overwrite is
+      False.
+  """
+  client = client or bigquery.Client(project=project_id)
+  reference_tables = [
+      table.table_name for table in reference_data.REFERENCE_TABLES
+  ]
+  replaced_tables = _get_replaced_tables(
+      client, project_id, dataset_id,
+      [table_name for table_name in tables
+       if table_name not in reference_tables])
+  if replaced_tables and not overwrite:
+    raise Error(f'{project_id}.{dataset_id} already holds '
+                f'{", ".join(replaced_tables)}. Load the synthetic data to '
+                'another dataset, or set overwrite to replace them.')
+  with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+    futures = []
+    for table_name, table in tables.items():
+      if table_name in reference_tables:
+        logging.info('Skipping %s, load it with reference_data.py.',
+                     table_name)
+        continue
+      partition_column = (
+          _MERCHANT_CENTER_PARTITION_COLUMN
+          if _MERCHANT_CENTER_PARTITION_COLUMN in table.column_names else
+          _GOOGLE_ADS_PARTITION_COLUMN)
+      table_id = f'{project_id}.{dataset_id}.{table_name}'
+      client.delete_table(table_id, not_found_ok=True)
+      for day in sorted(set(table[partition_column].to_pylist())):
+        futures.append(
+            executor.submit(_load_partition, client, table_id, table,
+                            partition_column, day))
+    for future in futures:
+      future.result()
+  for table_name in tables:
+    if not table_name.startswith(_TRANSFER_TABLE_PREFIX):
+      continue
+    view_id = (f'{project_id}.{dataset_id}.'
+               f'{table_name[len(_TRANSFER_TABLE_PREFIX):]}')
+    query = f"""
+      CREATE OR REPLACE VIEW `{view_id}` AS
+      SELECT
+        *,
+        DATE(_PARTITIONTIME) AS _DATA_DATE,
+        DATE(MAX(_PARTITIONTIME) OVER ()) AS _LATEST_DATE
+      FROM
+        `{project_id}.{dataset_id}.{table_name}`"""
+    job = client.query(
+        query,
+        job_config=cloud_bigquery.get_query_job_config('synthetic_data'))
+    cloud_bigquery.wait_for_job(job, view_id)
+  logging.info('Loaded %d tables to %s.%s.', len(tables), project_id,
+               dataset_id)
+
+
+def parse_arguments() -> argparse.Namespace:
+  """Initialize command line parser using argparse.
+
+  Returns:
+    An argparse.ArgumentParser.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--merchant_id', help='Google Merchant Center Account Id.',
+      required=True)
+  parser.add_argument(
+      '--ads_customer_id',
+      help='Google Ads External Customer Id.',
+      required=True)
+  parser.add_argument(
+      '--output_dir', help='Directory of the fixture files.', default=None)
+  parser.add_argument(
+      '--format',
+      help='Format of the fixture files.',
+      choices=[PARQUET_FORMAT, CSV_FORMAT],
+      default=PARQUET_FORMAT)
+  parser.add_argument(
+      '--project_id',
+      help='GCP project id, to load the tables to BigQuery.',
+      default=None)
+  parser.add_argument(
+      '--dataset_id',
+      help=('BigQuery dataset id to load the tables to, required with '
+            '--project_id. Use a dataset of its own, not the one of the '
+            'transfers.'),
+      default=None)
+  parser.add_argument(
+      '--overwrite',
+      help='Replace the tables already in the dataset.',
+      action='store_true')
+  parser.add_argument(
+      '--products',
+      help='Number of offers per day.',
+      type=int,
+      default=Scale().products)
+  parser.add_argument(
+      '--days', help='Number of days.', type=int, default=Scale().days)
+  parser.add_argument(
+      '--countries',
+      help='Number of target countries.',
+      type=int,
+      default=Scale().countries)
+  parser.add_argument(
+      '--criteria',
+      help='Number of product partitions per day.',
+      type=int,
+      default=Scale().criteria)
+  parser.add_argument(
+      '--targeting_depth',
+      help='Maximum number of conditions of a product partition.',
+      type=int,
+      default=Scale().targeting_depth)
+  parser.add_argument(
+      '--churn_rate',
+      help='Share of the offers and product partitions changing each day.',
+      type=float,
+      default=Scale().churn_rate)
+  parser.add_argument(
+      '--seed', help='Seed of the random generator.', type=int,
+      default=Scale().seed)
+  parser.add_argument(
+      '--end_date',
+      help='Last day of data, YYYY-MM-DD, today if not set.',
+      type=datetime.date.fromisoformat,
+      default=None)
+  return parser.parse_args()
+
+
+def main():
+  args = parse_arguments()
+  if not args.output_dir and not args.project_id:
+    raise Error('Set --output_dir, --project_id or both.')
+  if args.project_id and not args.dataset_id:
+    raise Error('Set the --dataset_id to load the tables to.')
+  ads_customer_id = args.ads_customer_id.replace('-', '')
+  scale = Scale(args.products, args.days, args.countries, args.criteria,
+                args.targeting_depth, args.churn_rate, args.seed,
+                args.end_date)
+  tables = generate_tables(args.merchant_id, ads_customer_id, scale)
+  if args.output_dir:
+    write_tables(tables, args.output_dir, args.format)
+  if args.project_id:
+    load_tables(
+        tables, args.project_id, args.dataset_id, overwrite=args.overwrite)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,104 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Tests for synthetic_data."""
+
+import datetime
+import sys
+import unittest
+from unittest import mock
+
+import cloud_bigquery
+from google.api_core import exceptions
+import synthetic_data
+
+_SCALE = synthetic_data.Scale(
+    products=20,
+    days=2,
+    countries=1,
+    criteria=5,
+    seed=1,
+    end_date=datetime.date(2021, 10, 1))
+
+
+class LoadTablesTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    wait_for_job = mock.patch.object(cloud_bigquery, 'wait_for_job')
+    wait_for_job.start()
+    self.addCleanup(wait_for_job.stop)
+    self.client = mock.Mock()
+    self.client.list_tables.return_value = []
+    self.tables = synthetic_data.generate_tables('1234', '5678', _SCALE)
+
+  def _set_existing_tables(self, *table_names):
+    self.client.list_tables.return_value = [
+        mock.Mock(table_id=table_name) for table_name in table_names
+    ]
+
+  def test_load_to_new_dataset(self):
+    self.client.list_tables.side_effect = exceptions.NotFound('dataset')
+
+    synthetic_data.load_tables(
+        self.tables, 'project', 'synthetic', client=self.client)
+
+    self.client.delete_table.assert_any_call(
+        'project.synthetic.Products_1234', not_found_ok=True)
+
+  def test_load_refuses_to_replace_tables(self):
+    for table_name in ('Products_1234', 'ShoppingProductStats_5678'):
+      with self.subTest(table_name=table_name):
+        self._set_existing_tables('Other', table_name)
+
+        with self.assertRaisesRegex(synthetic_data.Error, table_name):
+          synthetic_data.load_tables(
+              self.tables, 'project', 'markup', client=self.client)
+
+        self.client.delete_table.assert_not_called()
+        self.client.load_table_from_file.assert_not_called()
+        self.client.query.assert_not_called()
+
+  def test_load_ignores_other_tables(self):
+    self._set_existing_tables('Other', 'geo_targets')
+
+    synthetic_data.load_tables(
+        self.tables, 'project', 'synthetic', client=self.client)
+
+    self.client.delete_table.assert_called()
+
+  def test_load_with_overwrite(self):
+    self._set_existing_tables('Products_1234')
+
+    synthetic_data.load_tables(
+        self.tables, 'project', 'markup', client=self.client, overwrite=True)
+
+    self.client.delete_table.assert_any_call(
+        'project.markup.Products_1234', not_found_ok=True)
+
+  def test_main_requires_dataset_id_to_load(self):
+    with mock.patch.object(sys, 'argv', [
+        'synthetic_data.py', '--merchant_id=1234',
+        '--ads_customer_id=567-890-1234', '--project_id=project'
+    ]), mock.patch.object(synthetic_data, 'load_tables') as load_tables:
+      with self.assertRaises(synthetic_data.Error):
+        synthetic_data.main()
+
+    load_tables.assert_not_called()
+
+
+if __name__ == '__main__':
+  unittest.main()
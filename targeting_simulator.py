@@ -0,0 +1,674 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Simulates the targeting stage of the main workflow on table snapshots.
+
+The targeting stage of main_workflow.sql lists the products targeted by the
+product partition criteria of the ad groups in TargetedProduct. This module
+computes the same rows from snapshots of the transfer tables, without
+BigQuery:
+  * The criteria are parsed like constructParsedCriteria, each distinct
+    criterion once.
+  * The products are the rows of product_view, derived from the Products
+    table for the columns read by the targeting.
+  * Criteria with an offer id target the products of that offer id
+    (IdTargeted), the others the products whose attributes equal, trimmed and
+    in lower case, all the attributes set by the criterion (NonIdTargeted).
+
+The matching is columnar: the criteria are grouped by the set of attributes
+they set, and each group is hash joined with the products on these
+attributes. The rows are the ones the workflow inserts, duplicates included,
+e.g. a product targeted by a criterion of two ad groups is listed twice.
+
+The snapshots are Parquet or CSV files named after their table, with their
+partition date column, as the fixtures of local_harness. With --check, the
+main workflow is also run with local_harness on the same files and its rows
+compared.
+
+Typical usage example:
+  >>> targeted_products = simulate_targeting(products, criteria,
+  ...                                        shopping_product_stats,
+  ...                                        geo_targets)
+  python targeting_simulator.py --snapshot_dir=fixtures --merchant_id=1234 \\
+      --customer_id=5678 --check
+"""
+
+import argparse
+import collections
+import datetime
+import functools
+import logging
+import os
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import local_harness
+import numpy
+import pyarrow
+from pyarrow import compute
+from pyarrow import csv
+from pyarrow import parquet
+import reference_data
+
+_SNAPSHOT_EXTENSIONS = ('.parquet', '.csv.gz', '.csv')
+_MERCHANT_CENTER_PARTITION_COLUMN = '_PARTITIONDATE'
+_GOOGLE_ADS_PARTITION_COLUMN = '_DATA_DATE'
+# Google Ads snapshots may be named after the transfer table or its view.
+_TRANSFER_TABLE_PREFIX = 'p_'
+_PRODUCT_PARTITION = 'PRODUCT_PARTITION'
+_PATH_SEPARATOR = '>'
+_PATH_LEVELS = 5
+_MISSING_LEVEL = 'N/A'
+_COUNTRY_KINDS = ('approved_countries', 'pending_countries',
+                  'disapproved_countries')
+_CRITERION_COLUMNS = local_harness.PARSED_CRITERIA_COLUMNS[1:]
+_OFFER_ID_COLUMN = 'offer_id'
+# Attributes of the products matched by the criteria without offer id.
+_ATTRIBUTE_COLUMNS = tuple(
+    column for column in _CRITERION_COLUMNS if column != _OFFER_ID_COLUMN)
+TARGETED_PRODUCT_COLUMNS = ('data_date', 'product_id', 'merchant_id',
+                            'target_country')
+_PRODUCT_COLUMNS = ('product_id', 'merchant_id', 'offer_id', 'channel',
+                    'brand', 'condition', 'custom_labels', 'product_type',
+                    'google_product_category_path',
+                    'destinations', _MERCHANT_CENTER_PARTITION_COLUMN)
+_WEIGHT_COLUMN = 'weight'
+
+# Set logging level.
+logging.getLogger().setLevel(logging.INFO)
+
+
+class Error(Exception):
+  """Base error for this module."""
+
+
+@functools.lru_cache(maxsize=None)
+def parse_criterion(criterion: str) -> Tuple[Optional[str], ...]:
+  """Parses a criterion like the ParsedCriteria rows of the workflow.
+
+  Args:
+    criterion: A product partition criterion.
+
+  Returns:
+    The values of the ParsedCriteria columns after "criteria", None for the
+    attributes the criterion doesn't set. The values of the attributes other
+    than the offer id are trimmed and in lower case, as they are matched.
+  """
+  parsed_criterion = local_harness.parse_criterion(criterion)
+  values = []
+  for column in _CRITERION_COLUMNS:
+    # Empty values are inserted as NULL by constructParsedCriteria.
+    value = parsed_criterion.get(column) or None
+    if value is not None and column != _OFFER_ID_COLUMN:
+      value = value.lower().strip()
+    values.append(value)
+  return tuple(values)
+
+
+def parse_criteria(criteria: Iterable[str]) -> pyarrow.Table:
+  """Returns the ParsedCriteria rows of criteria, one per distinct criterion.
+
+  Args:
+    criteria: Product partition criteria.
+  """
+  criteria = sorted(set(criteria))
+  parsed_criteria = [parse_criterion(criterion) for criterion in criteria]
+  arrays = [pyarrow.array(criteria, pyarrow.string())] + [
+      pyarrow.array([values[index] for values in parsed_criteria],
+                    pyarrow.string())
+      for index in range(len(_CRITERION_COLUMNS))
+  ]
+  return pyarrow.Table.from_arrays(
+      arrays, names=list(local_harness.PARSED_CRITERIA_COLUMNS))
+
+
+def _filter_date(table: pyarrow.Table, date_column: str,
+                 run_date: Optional[datetime.date]) -> pyarrow.Table:
+  """Keeps the rows of the run date, or of the latest date if not set."""
+  if run_date is None:
+    run_date = compute.max(table[date_column]).as_py()
+  return table.filter(
+      compute.equal(table[date_column], pyarrow.scalar(run_date,
+                                                       pyarrow.date32())))
+
+
+def _normalize(values: pyarrow.ChunkedArray) -> pyarrow.ChunkedArray:
+  """Returns TRIM(LOWER(values))."""
+  return compute.utf8_trim_whitespace(compute.utf8_lower(values))
+
+
+def _get_field(values: pyarrow.ChunkedArray, name: str) -> pyarrow.ChunkedArray:
+  """Returns a field of struct values, by index as pyarrow 10 requires."""
+  return compute.struct_field(values, [values.type.get_field_index(name)])
+
+
+def _get_path_levels(paths: pyarrow.ChunkedArray) -> List[pyarrow.Array]:
+  """Returns the levels of '>' separated paths, 'N/A' when missing."""
+  level_counts = compute.list_value_length(
+      compute.split_pattern(paths, _PATH_SEPARATOR))
+  # Padding the paths makes every level exist for list_element.
+  padded_levels = compute.split_pattern(
+      compute.binary_join_element_wise(
+          paths, _PATH_SEPARATOR * (_PATH_LEVELS - 1), ''), _PATH_SEPARATOR)
+  return [
+      compute.fill_null(
+          compute.if_else(
+              compute.less(pyarrow.scalar(level, pyarrow.int32()),
+                           level_counts),
+              compute.list_element(padded_levels, level),
+              pyarrow.scalar(None, pyarrow.string())),
+          _MISSING_LEVEL) for level in range(_PATH_LEVELS)
+  ]
+
+
+def _get_target_countries(products: pyarrow.Table) -> pyarrow.Table:
+  """Returns the target countries of the products and their multiplicity.
+
+  product_view joins each product with its distinct approved, pending and
+  disapproved countries, and its target country is the approved country, else
+  the pending one, else the disapproved one. A product is hence repeated for
+  each combination of its countries of the three kinds, e.g. a product
+  approved in one country and pending in two is twice in that country.
+
+  Args:
+    products: The products of a date, with their row number in a "row"
+      column.
+
+  Returns:
+    The row numbers of the products, their target countries, NULL if they
+    have none, and the number of times they are listed with each.
+  """
+  keys = ['merchant_id', 'product_id']
+  destinations = compute.list_flatten(products['destinations'])
+  destination_rows = compute.list_parent_indices(products['destinations'])
+  rows = products.select(['row'] + keys)
+  countries = {}
+  for kind in _COUNTRY_KINDS:
+    kind_countries = _get_field(destinations, kind)
+    product_rows = compute.take(destination_rows,
+                                compute.list_parent_indices(kind_countries))
+    countries[kind] = pyarrow.table({
+        key: compute.take(products[key], product_rows) for key in keys
+    }).append_column('target_country', compute.list_flatten(
+        kind_countries)).group_by(keys + ['target_country']).aggregate([])
+    counts = countries[kind].group_by(keys).aggregate([('target_country',
+                                                        'count')])
+    rows = rows.join(
+        pyarrow.table({
+            **{key: counts[key] for key in keys},
+            kind: counts['target_country_count'],
+        }),
+        keys=keys,
+        join_type='left outer')
+  approved, pending, disapproved = [
+      compute.fill_null(rows[kind], 0) for kind in _COUNTRY_KINDS
+  ]
+  one = pyarrow.scalar(1, pyarrow.int64())
+  weights = {
+      'approved_countries':
+          compute.multiply(
+              compute.max_element_wise(pending, one),
+              compute.max_element_wise(disapproved, one)),
+      'pending_countries':
+          compute.max_element_wise(disapproved, one),
+      'disapproved_countries':
+          pyarrow.array(numpy.ones(rows.num_rows, numpy.int64)),
+  }
+  # Whether the target countries of the products are of each kind.
+  is_kind = {
+      'approved_countries':
+          compute.greater(approved, 0),
+      'pending_countries':
+          compute.and_(compute.equal(approved, 0), compute.greater(pending, 0)),
+      'disapproved_countries':
+          compute.and_(
+              compute.equal(compute.add(approved, pending), 0),
+              compute.greater(disapproved, 0)),
+  }
+  parts = []
+  for kind in _COUNTRY_KINDS:
+    kind_rows = rows.select(['row'] + keys).append_column(
+        _WEIGHT_COLUMN, weights[kind]).filter(is_kind[kind])
+    parts.append(
+        kind_rows.join(countries[kind], keys=keys, join_type='inner').select(
+            ['row', 'target_country', _WEIGHT_COLUMN]))
+  without_country = rows.filter(
+      compute.equal(compute.add(compute.add(approved, pending), disapproved),
+                    0))
+  parts.append(
+      pyarrow.table({
+          'row':
+              without_country['row'],
+          'target_country':
+              pyarrow.nulls(without_country.num_rows, pyarrow.string()),
+          _WEIGHT_COLUMN:
+              pyarrow.array(numpy.ones(without_country.num_rows, numpy.int64)),
+      }))
+  return pyarrow.concat_tables(parts)
+
+
+def get_product_view(products: pyarrow.Table,
+                     run_date: Optional[datetime.date] = None) -> pyarrow.Table:
+  """Returns the product_view rows of a date with the columns of targeting.
+
+  Args:
+    products: Snapshot of the Products table, with its "_PARTITIONDATE".
+    run_date: Date of the products, the latest date if not set.
+
+  Returns:
+    The data date, product id, merchant id, offer id and target country of
+    the products, their attributes matched by the criteria, trimmed and in
+    lower case, and the number of times each row is in product_view.
+  """
+  products = _filter_date(
+      products.select(list(_PRODUCT_COLUMNS)),
+      _MERCHANT_CENTER_PARTITION_COLUMN, run_date)
+  products = products.append_column(
+      'row', pyarrow.array(numpy.arange(products.num_rows)))
+  channel_counts = products.group_by(['merchant_id', 'product_id']).aggregate([
+      ('channel', 'count_distinct')
+  ])
+  channel_exclusivity = compute.if_else(
+      compute.greater(channel_counts['channel_count_distinct'], 1),
+      'multi_channel', 'single_channel')
+  channel_exclusivities = pyarrow.table({
+      'merchant_id': channel_counts['merchant_id'],
+      'product_id': channel_counts['product_id'],
+      'channel_exclusivity': channel_exclusivity,
+  })
+  columns = {
+      'row': products['row'],
+      'data_date': products[_MERCHANT_CENTER_PARTITION_COLUMN],
+      'product_id': products['product_id'],
+      'merchant_id': products['merchant_id'],
+      'offer_id': products['offer_id'],
+  }
+  for index in range(5):
+    columns[f'custom_label{index}'] = _normalize(
+        _get_field(products['custom_labels'], f'label_{index}'))
+  for prefix, paths in (('product_type_l', products['product_type']),
+                        ('google_product_category_l',
+                         products['google_product_category_path'])):
+    for level, values in enumerate(_get_path_levels(paths)):
+      columns[f'{prefix}{level + 1}'] = _normalize(values)
+  for column in ('brand', 'channel', 'condition'):
+    columns[column] = _normalize(products[column])
+  product_view = pyarrow.table(columns).join(
+      channel_exclusivities,
+      keys=['merchant_id', 'product_id'],
+      join_type='inner')
+  product_view = product_view.set_column(
+      product_view.column_names.index('channel_exclusivity'),
+      'channel_exclusivity',
+      _normalize(product_view['channel_exclusivity']))
+  return product_view.join(
+      _get_target_countries(products), keys='row',
+      join_type='inner').drop(['row'])
+
+
+def get_criteria_info(criteria: pyarrow.Table,
+                      shopping_product_stats: pyarrow.Table,
+                      geo_targets: pyarrow.Table) -> pyarrow.Table:
+  """Returns the criteria of the ad groups of each merchant and country.
+
+  Args:
+    criteria: Criteria of the run date.
+    shopping_product_stats: Shopping product stats of the run date.
+    geo_targets: The geo targets reference table.
+
+  Returns:
+    The merchant id, target country and criteria of the CriteriaInfo rows,
+    with the number of rows of each in a "weight" column.
+  """
+  stats = shopping_product_stats.select(
+      ['MerchantId', 'AdGroupId', 'CountryCriteriaId']).cast(
+          pyarrow.schema([('MerchantId', pyarrow.int64()),
+                          ('AdGroupId', pyarrow.int64()),
+                          ('CountryCriteriaId', pyarrow.int64())]))
+  countries = pyarrow.table({
+      'CountryCriteriaId': geo_targets['parent_id'],
+      'target_country': compute.utf8_upper(geo_targets['country_code']),
+  })
+  targeted_merchant_info = stats.join(
+      countries, keys='CountryCriteriaId', join_type='inner').group_by(
+          ['MerchantId', 'AdGroupId', 'target_country']).aggregate([])
+  ad_group_criteria = pyarrow.table({
+      'AdGroupId': criteria['AdGroupId'].cast(pyarrow.int64()),
+      'criteria': criteria['Criteria'],
+      _WEIGHT_COLUMN: pyarrow.array(
+          numpy.ones(criteria.num_rows, numpy.int64)),
+  })
+  criteria_info = targeted_merchant_info.join(
+      ad_group_criteria, keys='AdGroupId', join_type='inner').group_by(
+          ['MerchantId', 'target_country', 'criteria']).aggregate([
+              (_WEIGHT_COLUMN, 'sum')
+          ])
+  return pyarrow.table({
+      'merchant_id': criteria_info['MerchantId'],
+      'target_country': criteria_info['target_country'],
+      'criteria': criteria_info['criteria'],
+      _WEIGHT_COLUMN: criteria_info[f'{_WEIGHT_COLUMN}_sum'],
+  })
+
+
+def _get_id_targeted(product_view: pyarrow.Table,
+                     targeting: pyarrow.Table) -> pyarrow.Table:
+  """Returns the products targeted by the criteria with an offer id."""
+  offers = targeting.filter(compute.is_valid(
+      targeting[_OFFER_ID_COLUMN])).group_by(
+          ['merchant_id', 'target_country', _OFFER_ID_COLUMN]).aggregate([])
+  return product_view.select(
+      list(TARGETED_PRODUCT_COLUMNS) +
+      [_OFFER_ID_COLUMN, _WEIGHT_COLUMN]).join(
+          offers,
+          keys=['merchant_id', 'target_country', _OFFER_ID_COLUMN],
+          join_type='inner').select(
+              list(TARGETED_PRODUCT_COLUMNS) + [_WEIGHT_COLUMN])
+
+
+def _get_non_id_targeted(product_view: pyarrow.Table,
+                         targeting: pyarrow.Table) -> List[pyarrow.Table]:
+  """Returns the products targeted by the criteria without offer id.
+
+  The criteria setting the same attributes are matched by a single join on
+  the merchant id, the target country and these attributes, which returns a
+  table of the list.
+  """
+  targeting = targeting.filter(compute.is_null(targeting[_OFFER_ID_COLUMN]))
+  attributes = collections.defaultdict(list)
+  for criterion in targeting['criteria'].unique().to_pylist():
+    values = dict(zip(_CRITERION_COLUMNS, parse_criterion(criterion)))
+    attributes[tuple(
+        column for column in _ATTRIBUTE_COLUMNS
+        if values[column] is not None)].append(criterion)
+  parts = []
+  for columns, criteria in attributes.items():
+    keys = ['merchant_id', 'target_country'] + list(columns)
+    matched = product_view.select(
+        list(TARGETED_PRODUCT_COLUMNS) + list(columns) + [_WEIGHT_COLUMN]).join(
+            targeting.filter(
+                compute.is_in(targeting['criteria'],
+                              pyarrow.array(criteria))).select(
+                                  keys + [_WEIGHT_COLUMN]),
+            keys=keys,
+            join_type='inner',
+            right_suffix='_criteria')
+    parts.append(
+        pyarrow.table({
+            **{column: matched[column] for column in TARGETED_PRODUCT_COLUMNS},
+            _WEIGHT_COLUMN:
+                compute.multiply(matched[_WEIGHT_COLUMN],
+                                 matched[f'{_WEIGHT_COLUMN}_criteria']),
+        }))
+  return parts
+
+
+def simulate_targeting(products: pyarrow.Table,
+                       criteria: pyarrow.Table,
+                       shopping_product_stats: pyarrow.Table,
+                       geo_targets: pyarrow.Table,
+                       run_date: Optional[datetime.date] = None,
+                       distinct: bool = False) -> pyarrow.Table:
+  """Returns the TargetedProduct rows the targeting stage inserts.
+
+  Args:
+    products: Snapshot of the Products table, with its "_PARTITIONDATE".
+    criteria: Snapshot of the Criteria table, with its "_DATA_DATE".
+    shopping_product_stats: Snapshot of the ShoppingProductStats table, with
+      its "_DATA_DATE".
+    geo_targets: The geo targets reference table.
+    run_date: The @run_date of a backfill, the latest date of each table if
+      not set, as the daily runs.
+    distinct: Whether each targeted product is listed once.
+
+  Returns:
+    The data date, product id, merchant id and target country of the
+    targeted products, sorted.
+  """
+  criteria = _filter_date(criteria, _GOOGLE_ADS_PARTITION_COLUMN, run_date)
+  shopping_product_stats = _filter_date(shopping_product_stats,
+                                        _GOOGLE_ADS_PARTITION_COLUMN, run_date)
+  parsed_criteria = parse_criteria(
+      criteria.filter(
+          compute.equal(criteria['CriteriaType'],
+                        _PRODUCT_PARTITION))['Criteria'].to_pylist())
+  targeting = get_criteria_info(criteria, shopping_product_stats,
+                                geo_targets).join(
+                                    parsed_criteria,
+                                    keys='criteria',
+                                    join_type='inner')
+  product_view = get_product_view(products, run_date)
+  targeted_products = pyarrow.concat_tables(
+      [_get_id_targeted(product_view, targeting)] +
+      _get_non_id_targeted(product_view, targeting))
+  if distinct:
+    targeted_products = targeted_products.group_by(
+        list(TARGETED_PRODUCT_COLUMNS)).aggregate([])
+  else:
+    targeted_products = targeted_products.take(
+        numpy.repeat(
+            numpy.arange(targeted_products.num_rows),
+            targeted_products[_WEIGHT_COLUMN].to_numpy()))
+  return targeted_products.select(list(TARGETED_PRODUCT_COLUMNS)).sort_by(
+      [(column, 'ascending') for column in TARGETED_PRODUCT_COLUMNS])
+
+
+def find_snapshot_file(snapshot_dir: str, table_names: Sequence[str]) -> str:
+  """Returns the path of the snapshot of a table.
+
+  Args:
+    snapshot_dir: Directory of the snapshots.
+    table_names: Names the snapshot may be named after, in order.
+
+  Raises:
+    FileNotFoundError: If there is no snapshot of the table.
+  """
+  for table_name in table_names:
+    for extension in _SNAPSHOT_EXTENSIONS:
+      file_path = os.path.join(snapshot_dir, table_name + extension)
+      if os.path.exists(file_path):
+        return file_path
+  raise FileNotFoundError(f'No snapshot of {" or ".join(table_names)} found '
+                          f'in "{snapshot_dir}".')
+
+
+def read_snapshot(file_path: str,
+                  columns: Optional[Sequence[str]] = None) -> pyarrow.Table:
+  """Reads the columns of a Parquet or CSV snapshot."""
+  if columns is not None:
+    columns = list(columns)
+  if file_path.endswith('.parquet'):
+    return parquet.read_table(file_path, columns=columns)
+  convert_options = csv.ConvertOptions(include_columns=columns)
+  return csv.read_csv(file_path, convert_options=convert_options)
+
+
+def read_snapshots(snapshot_dir: str, merchant_id: str,
+                   customer_id: str) -> Dict[str, pyarrow.Table]:
+  """Reads the snapshots of the tables read by the targeting.
+
+  The geo targets are read from the data directory if they have no snapshot.
+
+  Args:
+    snapshot_dir: Directory of the snapshots.
+    merchant_id: Merchant center id.
+    customer_id: Google Ads customer id.
+
+  Returns:
+    The arguments of simulate_targeting, keyed by name.
+  """
+  snapshots = {
+      'products':
+          read_snapshot(
+              find_snapshot_file(snapshot_dir, [f'Products_{merchant_id}']),
+              _PRODUCT_COLUMNS),
+  }
+  for argument, table_name, columns in (
+      ('criteria', f'Criteria_{customer_id}',
+       ('AdGroupId', 'Criteria', 'CriteriaType',
+        _GOOGLE_ADS_PARTITION_COLUMN)),
+      ('shopping_product_stats', f'ShoppingProductStats_{customer_id}',
+       ('MerchantId', 'AdGroupId', 'CountryCriteriaId',
+        _GOOGLE_ADS_PARTITION_COLUMN))):
+    snapshots[argument] = read_snapshot(
+        find_snapshot_file(snapshot_dir,
+                           [table_name, _TRANSFER_TABLE_PREFIX + table_name]),
+        columns)
+  geo_targets = reference_data.GEO_TARGETS
+  try:
+    geo_targets_path = reference_data.find_reference_file(
+        geo_targets, snapshot_dir)
+  except FileNotFoundError:
+    geo_targets_path = reference_data.find_reference_file(geo_targets)
+  snapshots['geo_targets'] = reference_data.read_reference_file(
+      geo_targets_path, geo_targets)
+  return snapshots
+
+
+def run_workflow_targeting(
+    snapshot_dir: str, merchant_id: str, customer_id: str,
+    run_date: Optional[datetime.date]) -> Tuple[pyarrow.Table, float]:
+  """Runs the main workflow on the snapshots with local_harness.
+
+  Args:
+    snapshot_dir: Directory of the snapshots, loaded as fixtures.
+    merchant_id: Merchant center id.
+    customer_id: Google Ads customer id.
+    run_date: The @run_date of a backfill, today if not set.
+
+  Returns:
+    The TargetedProduct rows, sorted, and the seconds of the parse_criteria
+    and targeting stages.
+  """
+  harness = local_harness.LocalHarness(
+      merchant_id, customer_id, run_date=run_date)
+  try:
+    harness.load_fixtures(snapshot_dir)
+    harness.run_installer()
+    harness.timings.clear()
+    harness.run_main_workflow()
+    rows = harness.query(
+        f'SELECT {", ".join(TARGETED_PRODUCT_COLUMNS)} FROM '
+        f'`{harness.project_id}.{harness.dataset_id}.'
+        f'TargetedProduct_{customer_id}`')
+  finally:
+    harness.close()
+  seconds = sum(timing.seconds
+                for timing in harness.timings
+                if timing.stage in ('parse_criteria', 'targeting'))
+  targeted_products = pyarrow.Table.from_pylist(
+      rows, schema=pyarrow.schema([('data_date', pyarrow.date32()),
+                                   ('product_id', pyarrow.string()),
+                                   ('merchant_id', pyarrow.int64()),
+                                   ('target_country', pyarrow.string())]))
+  return targeted_products.sort_by(
+      [(column, 'ascending') for column in TARGETED_PRODUCT_COLUMNS]), seconds
+
+
+def compare_targeted_products(simulated: pyarrow.Table,
+                              expected: pyarrow.Table) -> List[str]:
+  """Returns the differences of two lists of TargetedProduct rows.
+
+  Args:
+    simulated: Rows of simulate_targeting.
+    expected: Rows of the workflow.
+
+  Returns:
+    A line per row whose count differs, empty if the rows are the same.
+  """
+  simulated_counts = collections.Counter(
+      tuple(row.values()) for row in simulated.to_pylist())
+  expected_counts = collections.Counter(
+      tuple(row.values()) for row in expected.to_pylist())
+  return [
+      f'{row}: {simulated_counts[row]} simulated, {expected_counts[row]} '
+      f'expected' for row in sorted(
+          set(simulated_counts) | set(expected_counts), key=str)
+      if simulated_counts[row] != expected_counts[row]
+  ]
+
+
+def parse_arguments() -> argparse.Namespace:
+  """Initialize command line parser using argparse.
+
+  Returns:
+    An argparse.ArgumentParser.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--snapshot_dir',
+      help='Directory of the Parquet or CSV snapshots of the tables.',
+      required=True)
+  parser.add_argument(
+      '--merchant_id', help='Google Merchant Center Account Id.', required=True)
+  parser.add_argument(
+      '--customer_id', help='Google Ads External Customer Id.', required=True)
+  parser.add_argument(
+      '--run_date',
+      help='Run date of a backfill, YYYY-MM-DD. The latest dates if not set.',
+      type=datetime.date.fromisoformat,
+      default=None)
+  parser.add_argument(
+      '--distinct',
+      help='List each targeted product once.',
+      action='store_true')
+  parser.add_argument(
+      '--output', help='Parquet file of the targeted products.', default=None)
+  parser.add_argument(
+      '--check',
+      help='Compare the rows with the ones of the workflow on local_harness.',
+      action='store_true')
+  return parser.parse_args()
+
+
+def main():
+  args = parse_arguments()
+  snapshots = read_snapshots(args.snapshot_dir, args.merchant_id,
+                             args.customer_id)
+  start = time.perf_counter()
+  targeted_products = simulate_targeting(
+      **snapshots, run_date=args.run_date, distinct=args.distinct)
+  seconds = time.perf_counter() - start
+  logging.info('Simulated %d targeted products of %d products in %.2fs.',
+               targeted_products.num_rows, snapshots['products'].num_rows,
+               seconds)
+  if args.output:
+    parquet.write_table(targeted_products, args.output)
+    logging.info('Wrote the targeted products to %s.', args.output)
+  if not args.check:
+    return
+  expected, workflow_seconds = run_workflow_targeting(args.snapshot_dir,
+                                                      args.merchant_id,
+                                                      args.customer_id,
+                                                      args.run_date)
+  if args.distinct:
+    expected = expected.group_by(list(TARGETED_PRODUCT_COLUMNS)).aggregate(
+        []).select(list(TARGETED_PRODUCT_COLUMNS))
+  logging.info('The workflow targeted %d products in %.2fs on local_harness.',
+               expected.num_rows, workflow_seconds)
+  differences = compare_targeted_products(targeted_products, expected)
+  for difference in differences[:20]:
+    logging.warning('%s', difference)
+  if differences:
+    logging.error('%d targeted products differ from the workflow.',
+                  len(differences))
+    sys.exit(1)
+  logging.info('The targeted products are the same as the workflow ones.')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,467 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Module for starting the MarkUp workflows when their transfers finish.
+
+In trigger mode the Merchant Center and Google Ads transfers publish a message
+to a Pub/Sub topic when a run finishes, and the workflow scheduled queries
+don't run on their own. `WorkflowTrigger` consumes the messages and starts a
+workflow for a run date as soon as all its upstream transfers have succeeded
+for that date. Each workflow is started at most once per run date, even if the
+messages are delivered more than once.
+
+`FakePubSub` delivers messages in memory, so the trigger can be tested without
+Pub/Sub.
+
+Typical usage example:
+  >>> rules = [TriggerRule('main_workflow_config', ['mc_config', 'ads_config'])]
+  >>> trigger = WorkflowTrigger(rules, data_transfer.start_run)
+  >>> CloudPubSub('project_id').subscribe('markup-transfers', trigger)
+"""
+
+import argparse
+import collections
+import datetime
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import cloud_data_transfer
+from google.api_core import exceptions
+
+_SUCCEEDED_STATE = 'SUCCEEDED'
+_FAILED_STATES = ('FAILED', 'CANCELLED')
+_TOPIC_ID = 'markup-transfer-runs'
+_SUBSCRIPTION_ID = 'markup-transfer-runs-trigger'
+# Messages are acknowledged late enough for the workflow runs to be started.
+_ACK_DEADLINE_SECONDS = 60
+# Days of run dates kept in the state, before the latest run date.
+_STATE_RETENTION_DAYS = 30
+
+# Set logging level.
+logging.getLogger().setLevel(logging.INFO)
+
+# A workflow to be started once all its upstream transfers have succeeded. The
+# names are transfer config names, in the form of
+# 'projects/{project_id}/locations/{location}/transferConfigs/{id}'.
+TriggerRule = collections.namedtuple('TriggerRule', ['workflow', 'upstream'])
+
+
+class Error(Exception):
+  """Base error for this module."""
+
+
+def get_run_date(run: Dict[str, Any]) -> datetime.date:
+  """Returns the run date of a transfer run.
+
+  Args:
+    run: TransferRun resource of a notification, in JSON API format.
+  """
+  run_time = run.get('runTime') or run['scheduleTime']
+  return datetime.datetime.strptime(run_time[:10], '%Y-%m-%d').date()
+
+
+def get_transfer_config_name(run: Dict[str, Any]) -> str:
+  """Returns the transfer config name of a transfer run.
+
+  Args:
+    run: TransferRun resource of a notification, in JSON API format.
+  """
+  return run['name'].split('/runs/')[0]
+
+
+class WorkflowTrigger(object):
+  """Starts the workflows whose upstream transfers succeeded.
+
+  The trigger is called with each Pub/Sub message. The succeeded transfers and
+  the started workflows are kept per run date, and optionally saved to a JSON
+  file so that they survive restarts. The run dates older than the retention
+  before the latest run date are dropped, hence duplicate notifications of
+  runs that old may start their workflows again.
+  """
+
+  def __init__(self,
+               rules: Iterable[TriggerRule],
+               start_run: Callable[[str, datetime.datetime], None],
+               state_path: Optional[str] = None,
+               retention_days: int = _STATE_RETENTION_DAYS) -> None:
+    """Initialise new instance of WorkflowTrigger.
+
+    Args:
+      rules: The workflows and their upstream transfers.
+      start_run: Function starting a run of a transfer config for a run time,
+        e.g. `CloudDataTransferUtils.start_run`.
+      state_path: Optional. JSON file where the state is saved.
+      retention_days: Optional. Days of run dates kept in the state, before
+        the latest run date.
+    """
+    self._rules = [
+        TriggerRule(rule.workflow, frozenset(rule.upstream)) for rule in rules
+    ]
+    self._start_run = start_run
+    self._state_path = state_path
+    self._retention_days = retention_days
+    self._lock = threading.Lock()
+    # Succeeded transfer configs and started workflows, keyed by run date.
+    self._succeeded = collections.defaultdict(set)
+    self._started = collections.defaultdict(set)
+    if state_path and os.path.exists(state_path):
+      with open(state_path) as state_file:
+        state = json.load(state_file)
+      for run_date, names in state['succeeded'].items():
+        self._succeeded[run_date].update(names)
+      for run_date, names in state['started'].items():
+        self._started[run_date].update(names)
+
+  def _prune_state(self) -> None:
+    """Drops the run dates older than the retention."""
+    run_dates = set(self._succeeded) | set(self._started)
+    if not run_dates:
+      return
+    oldest_date = (datetime.date.fromisoformat(max(run_dates)) -
+                   datetime.timedelta(days=self._retention_days)).isoformat()
+    for run_date in run_dates:
+      if run_date < oldest_date:
+        self._succeeded.pop(run_date, None)
+        self._started.pop(run_date, None)
+
+  def _save_state(self) -> None:
+    """Prunes the state and saves it to the state file, if any."""
+    self._prune_state()
+    if not self._state_path:
+      return
+    state = {
+        'succeeded': {
+            run_date: sorted(names)
+            for run_date, names in self._succeeded.items()
+        },
+        'started': {
+            run_date: sorted(names)
+            for run_date, names in self._started.items()
+        },
+    }
+    temp_path = f'{self._state_path}.tmp'
+    with open(temp_path, 'w') as state_file:
+      json.dump(state, state_file, indent=2, sort_keys=True)
+    os.replace(temp_path, self._state_path)
+
+  def handle_run(self, run: Dict[str, Any]) -> List[str]:
+    """Handles a finished transfer run.
+
+    Args:
+      run: TransferRun resource of a notification, in JSON API format.
+
+    Returns:
+      The workflows started by this run.
+    """
+    config_name = get_transfer_config_name(run)
+    run_date = get_run_date(run)
+    state = run.get('state')
+    if state in _FAILED_STATES:
+      logging.warning('Transfer run %s %s, the workflows of %s are not started.',
+                      run['name'], state.lower(), run_date)
+      return []
+    if state != _SUCCEEDED_STATE:
+      return []
+    started_workflows = []
+    with self._lock:
+      date_key = run_date.isoformat()
+      self._succeeded[date_key].add(config_name)
+      try:
+        for rule in self._rules:
+          if rule.workflow in self._started[date_key]:
+            continue
+          if config_name not in rule.upstream:
+            continue
+          if not rule.upstream <= self._succeeded[date_key]:
+            continue
+          run_time = datetime.datetime.combine(
+              run_date, datetime.time(), tzinfo=datetime.timezone.utc)
+          self._start_run(rule.workflow, run_time)
+          self._started[date_key].add(rule.workflow)
+          started_workflows.append(rule.workflow)
+      finally:
+        # The workflows started before an error are not started again.
+        self._save_state()
+    return started_workflows
+
+  def __call__(self, message: Any) -> None:
+    """Handles a Pub/Sub transfer run notification.
+
+    The message is acknowledged once handled, and not acknowledged if a
+    workflow could not be started so that it is delivered again.
+
+    Args:
+      message: Pub/Sub message with `data`, `attributes`, `ack` and `nack`.
+    """
+    try:
+      run = json.loads(message.data)
+      self.handle_run(run)
+    except (ValueError, KeyError):
+      logging.exception('Ignoring invalid transfer run notification.')
+      message.ack()
+      return
+    except Exception:  # pylint: disable=broad-except
+      logging.exception('Error while handling transfer run notification.')
+      message.nack()
+      return
+    message.ack()
+
+
+class FakeMessage(object):
+  """In-memory Pub/Sub message."""
+
+  def __init__(self, fake_pubsub: 'FakePubSub', subscription: str, data: bytes,
+               attributes: Dict[str, str]) -> None:
+    self.data = data
+    self.attributes = attributes
+    self.delivery_attempt = 1
+    self._fake_pubsub = fake_pubsub
+    self._subscription = subscription
+
+  def ack(self) -> None:
+    self._fake_pubsub.acked.append(self)
+
+  def nack(self) -> None:
+    self._fake_pubsub.redeliver(self._subscription, self)
+
+
+class FakePubSub(object):
+  """In-memory Pub/Sub delivering messages synchronously.
+
+  Messages published before a subscriber is attached are kept until then, and
+  messages which are not acknowledged are delivered again, up to
+  `max_deliveries` times.
+
+  Typical usage example:
+    >>> pubsub = FakePubSub()
+    >>> pubsub.create_subscription('topic', 'subscription')
+    >>> pubsub.subscribe('subscription', trigger)
+    >>> pubsub.publish('topic', json.dumps(run).encode('utf-8'))
+  """
+
+  def __init__(self, max_deliveries: int = 5) -> None:
+    self.acked = []
+    self._max_deliveries = max_deliveries
+    self._subscriptions = collections.defaultdict(list)
+    self._callbacks = {}
+    self._pending = collections.defaultdict(collections.deque)
+
+  def create_topic(self, topic: str) -> None:
+    self._subscriptions.setdefault(topic, [])
+
+  def create_subscription(self, topic: str, subscription: str) -> None:
+    if subscription not in self._subscriptions[topic]:
+      self._subscriptions[topic].append(subscription)
+
+  def subscribe(self, subscription: str, callback: Callable[[Any],
+                                                            None]) -> None:
+    self._callbacks[subscription] = callback
+    self._deliver(subscription)
+
+  def publish(self,
+              topic: str,
+              data: bytes,
+              attributes: Optional[Dict[str, str]] = None) -> None:
+    for subscription in self._subscriptions[topic]:
+      message = FakeMessage(self, subscription, data, attributes or {})
+      self._pending[subscription].append(message)
+      self._deliver(subscription)
+
+  def redeliver(self, subscription: str, message: FakeMessage) -> None:
+    if message.delivery_attempt < self._max_deliveries:
+      message.delivery_attempt += 1
+      self._pending[subscription].append(message)
+
+  def _deliver(self, subscription: str) -> None:
+    callback = self._callbacks.get(subscription)
+    if callback is None:
+      return
+    pending = self._pending[subscription]
+    while pending:
+      callback(pending.popleft())
+
+
+class CloudPubSub(object):
+  """Pub/Sub topics and streaming pull subscriptions of a GCP project."""
+
+  def __init__(self, project_id: str) -> None:
+    """Initialise new instance of CloudPubSub.
+
+    Args:
+      project_id: GCP project id.
+    """
+    # Imported here since Pub/Sub is only required in trigger mode.
+    from google.cloud import pubsub_v1  # pylint: disable=g-import-not-at-top
+    self.project_id = project_id
+    self.publisher = pubsub_v1.PublisherClient()
+    self.subscriber = pubsub_v1.SubscriberClient()
+
+  def get_topic_path(self, topic: str) -> str:
+    return self.publisher.topic_path(self.project_id, topic)
+
+  def create_topic(self, topic: str) -> str:
+    """Creates a topic if it doesn't exist.
+
+    Args:
+      topic: Topic id.
+
+    Returns:
+      The topic path.
+    """
+    topic_path = self.get_topic_path(topic)
+    try:
+      self.publisher.create_topic(name=topic_path)
+      logging.info('Topic %s created.', topic_path)
+    except exceptions.AlreadyExists:
+      logging.info('Topic %s already exists.', topic_path)
+    return topic_path
+
+  def create_subscription(self, topic: str, subscription: str) -> None:
+    """Creates a pull subscription if it doesn't exist.
+
+    Args:
+      topic: Topic id.
+      subscription: Subscription id.
+    """
+    subscription_path = self.subscriber.subscription_path(
+        self.project_id, subscription)
+    try:
+      self.subscriber.create_subscription(
+          name=subscription_path,
+          topic=self.get_topic_path(topic),
+          ack_deadline_seconds=_ACK_DEADLINE_SECONDS)
+      logging.info('Subscription %s created.', subscription_path)
+    except exceptions.AlreadyExists:
+      logging.info('Subscription %s already exists.', subscription_path)
+
+  def subscribe(self, subscription: str, callback: Callable[[Any],
+                                                            None]) -> None:
+    """Handles the messages of a subscription until interrupted.
+
+    Args:
+      subscription: Subscription id.
+      callback: Function called with each message.
+    """
+    subscription_path = self.subscriber.subscription_path(
+        self.project_id, subscription)
+    streaming_pull = self.subscriber.subscribe(subscription_path, callback)
+    logging.info('Listening for transfer runs on %s.', subscription_path)
+    with self.subscriber:
+      try:
+        streaming_pull.result()
+      except KeyboardInterrupt:
+        streaming_pull.cancel()
+        streaming_pull.result()
+
+
+def setup_notifications(project_id: str,
+                        topic: str = _TOPIC_ID,
+                        subscription: str = _SUBSCRIPTION_ID) -> str:
+  """Creates the topic and the subscription of the transfer run notifications.
+
+  Args:
+    project_id: GCP project id.
+    topic: Optional. Topic id.
+    subscription: Optional. Subscription id.
+
+  Returns:
+    The topic path, to be set as notification_pubsub_topic of the transfers.
+  """
+  pubsub = CloudPubSub(project_id)
+  topic_path = pubsub.create_topic(topic)
+  pubsub.create_subscription(topic, subscription)
+  return topic_path
+
+
+def save_rules(rules: List[TriggerRule], rules_path: str) -> None:
+  """Adds trigger rules to a rules file, replacing the rules of workflows.
+
+  Args:
+    rules: The rules to be saved.
+    rules_path: JSON file of the rules.
+  """
+  saved_rules = {}
+  if os.path.exists(rules_path):
+    saved_rules = {rule.workflow: rule for rule in load_rules(rules_path)}
+  for rule in rules:
+    saved_rules[rule.workflow] = rule
+  with open(rules_path, 'w') as rules_file:
+    json.dump([{
+        'workflow': rule.workflow,
+        'upstream': sorted(rule.upstream)
+    } for rule in saved_rules.values()],
+              rules_file,
+              indent=2)
+
+
+def load_rules(rules_path: str) -> List[TriggerRule]:
+  """Loads the trigger rules saved by save_rules.
+
+  Args:
+    rules_path: JSON file of the rules.
+
+  Returns:
+    The trigger rules.
+  """
+  with open(rules_path) as rules_file:
+    return [
+        TriggerRule(rule['workflow'], rule['upstream'])
+        for rule in json.load(rules_file)
+    ]
+
+
+def parse_arguments() -> argparse.Namespace:
+  """Initialize command line parser using argparse.
+
+  Returns:
+    An argparse.ArgumentParser.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--project_id', help='GCP project id.', required=True)
+  parser.add_argument(
+      '--rules_file',
+      help='JSON file of the trigger rules written by cloud_env_setup.py.',
+      default='trigger_rules.json')
+  parser.add_argument(
+      '--subscription',
+      help='Pub/Sub subscription of the transfer run notifications.',
+      default=_SUBSCRIPTION_ID)
+  parser.add_argument(
+      '--state_file',
+      help='JSON file where the trigger state is kept.',
+      default='trigger_state.json')
+  parser.add_argument(
+      '--state_retention_days',
+      help='Days of run dates kept in the state, before the latest run date.',
+      type=int,
+      default=_STATE_RETENTION_DAYS)
+  return parser.parse_args()
+
+
+def main():
+  args = parse_arguments()
+  data_transfer = cloud_data_transfer.CloudDataTransferUtils(args.project_id)
+  trigger = WorkflowTrigger(
+      load_rules(args.rules_file), data_transfer.start_run, args.state_file,
+      args.state_retention_days)
+  CloudPubSub(args.project_id).subscribe(args.subscription, trigger)
+
+
+if __name__ == '__main__':
+  main()
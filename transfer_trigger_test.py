@@ -0,0 +1,196 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Tests for transfer_trigger."""
+
+import datetime
+import json
+import os
+import tempfile
+import unittest
+from typing import Optional
+
+import transfer_trigger
+
+_CONFIGS = 'projects/project/locations/us/transferConfigs/'
+_MERCHANT_CENTER_CONFIG = _CONFIGS + 'merchant_center'
+_GOOGLE_ADS_CONFIG = _CONFIGS + 'google_ads'
+_MAIN_WORKFLOW_CONFIG = _CONFIGS + 'main_workflow'
+_BEST_SELLERS_CONFIG = _CONFIGS + 'best_sellers'
+_RULES = [
+    transfer_trigger.TriggerRule(_MAIN_WORKFLOW_CONFIG,
+                                 [_MERCHANT_CENTER_CONFIG, _GOOGLE_ADS_CONFIG]),
+    transfer_trigger.TriggerRule(_BEST_SELLERS_CONFIG,
+                                 [_MERCHANT_CENTER_CONFIG]),
+]
+_TOPIC = 'topic'
+_SUBSCRIPTION = 'subscription'
+
+
+def _get_run_data(config_name: str,
+                  run_date: str = '2021-10-01',
+                  state: str = 'SUCCEEDED') -> bytes:
+  return json.dumps({
+      'name': f'{config_name}/runs/{run_date}',
+      'runTime': f'{run_date}T06:00:00Z',
+      'state': state,
+  }).encode('utf-8')
+
+
+class _StartRun(object):
+  """Records the started runs, failing the first `failures` calls."""
+
+  def __init__(self,
+               failures: int = 0,
+               failing_config: Optional[str] = None) -> None:
+    """Initialise new instance of _StartRun.
+
+    Args:
+      failures: Number of calls failing before the runs are started.
+      failing_config: Optional. Only the calls of this config fail if set.
+    """
+    self.runs = []
+    self._failures = failures
+    self._failing_config = failing_config
+
+  def __call__(self, config_name: str, run_time: datetime.datetime) -> None:
+    if self._failures and self._failing_config in (None, config_name):
+      self._failures -= 1
+      raise RuntimeError('The run could not be started.')
+    self.runs.append((config_name, run_time.date().isoformat()))
+
+
+class WorkflowTriggerTest(unittest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    state_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(state_dir.cleanup)
+    self.state_path = os.path.join(state_dir.name, 'trigger_state.json')
+
+  def _subscribe(self, start_run: _StartRun) -> transfer_trigger.FakePubSub:
+    pubsub = transfer_trigger.FakePubSub()
+    pubsub.create_subscription(_TOPIC, _SUBSCRIPTION)
+    pubsub.subscribe(
+        _SUBSCRIPTION,
+        transfer_trigger.WorkflowTrigger(_RULES, start_run, self.state_path))
+    return pubsub
+
+  def test_workflows_start_once_their_upstream_succeeded(self):
+    start_run = _StartRun()
+    pubsub = self._subscribe(start_run)
+
+    pubsub.publish(_TOPIC, _get_run_data(_MERCHANT_CENTER_CONFIG))
+    self.assertEqual(start_run.runs, [(_BEST_SELLERS_CONFIG, '2021-10-01')])
+    pubsub.publish(_TOPIC, _get_run_data(_GOOGLE_ADS_CONFIG))
+
+    self.assertEqual(start_run.runs, [(_BEST_SELLERS_CONFIG, '2021-10-01'),
+                                      (_MAIN_WORKFLOW_CONFIG, '2021-10-01')])
+
+  def test_failed_upstream_does_not_start_workflows(self):
+    start_run = _StartRun()
+    pubsub = self._subscribe(start_run)
+
+    pubsub.publish(_TOPIC, _get_run_data(_GOOGLE_ADS_CONFIG))
+    pubsub.publish(_TOPIC,
+                   _get_run_data(_MERCHANT_CENTER_CONFIG, state='FAILED'))
+
+    self.assertEqual(start_run.runs, [])
+    self.assertEqual(len(pubsub.acked), 2)
+
+  def test_duplicate_delivery_starts_workflows_once(self):
+    start_run = _StartRun()
+    pubsub = self._subscribe(start_run)
+
+    for config_name in (_MERCHANT_CENTER_CONFIG, _GOOGLE_ADS_CONFIG,
+                        _GOOGLE_ADS_CONFIG, _MERCHANT_CENTER_CONFIG):
+      pubsub.publish(_TOPIC, _get_run_data(config_name))
+
+    self.assertEqual(
+        sorted(start_run.runs), [(_BEST_SELLERS_CONFIG, '2021-10-01'),
+                                 (_MAIN_WORKFLOW_CONFIG, '2021-10-01')])
+    self.assertEqual(len(pubsub.acked), 4)
+
+  def test_failure_is_nacked_and_redelivered(self):
+    start_run = _StartRun(failures=1)
+    pubsub = self._subscribe(start_run)
+
+    pubsub.publish(_TOPIC, _get_run_data(_MERCHANT_CENTER_CONFIG))
+
+    self.assertEqual(start_run.runs, [(_BEST_SELLERS_CONFIG, '2021-10-01')])
+    self.assertEqual(len(pubsub.acked), 1)
+    self.assertEqual(pubsub.acked[0].delivery_attempt, 2)
+
+  def test_workflows_started_before_a_failure_are_not_started_again(self):
+    start_run = _StartRun(failures=1, failing_config=_MAIN_WORKFLOW_CONFIG)
+    # The best sellers workflow is started before the main workflow.
+    rules = list(reversed(_RULES))
+    trigger = transfer_trigger.WorkflowTrigger(rules, start_run,
+                                               self.state_path)
+    run = json.loads(_get_run_data(_MERCHANT_CENTER_CONFIG))
+    trigger.handle_run(json.loads(_get_run_data(_GOOGLE_ADS_CONFIG)))
+    with self.assertRaises(RuntimeError):
+      trigger.handle_run(run)
+
+    # The redelivered run is handled by a restarted trigger.
+    transfer_trigger.WorkflowTrigger(rules, start_run,
+                                     self.state_path).handle_run(run)
+
+    self.assertEqual(start_run.runs, [(_BEST_SELLERS_CONFIG, '2021-10-01'),
+                                      (_MAIN_WORKFLOW_CONFIG, '2021-10-01')])
+
+  def test_restart_from_state_file(self):
+    first_start_run = _StartRun()
+    self._subscribe(first_start_run).publish(
+        _TOPIC, _get_run_data(_MERCHANT_CENTER_CONFIG))
+    second_start_run = _StartRun()
+    pubsub = self._subscribe(second_start_run)
+
+    pubsub.publish(_TOPIC, _get_run_data(_GOOGLE_ADS_CONFIG))
+    pubsub.publish(_TOPIC, _get_run_data(_MERCHANT_CENTER_CONFIG))
+
+    self.assertEqual(first_start_run.runs,
+                     [(_BEST_SELLERS_CONFIG, '2021-10-01')])
+    self.assertEqual(second_start_run.runs,
+                     [(_MAIN_WORKFLOW_CONFIG, '2021-10-01')])
+
+  def test_old_run_dates_are_pruned(self):
+    trigger = transfer_trigger.WorkflowTrigger(
+        _RULES, _StartRun(), self.state_path, retention_days=2)
+
+    for run_date in ('2021-10-01', '2021-10-02', '2021-10-03', '2021-10-04'):
+      trigger.handle_run(
+          json.loads(_get_run_data(_MERCHANT_CENTER_CONFIG, run_date)))
+
+    with open(self.state_path) as state_file:
+      state = json.load(state_file)
+    self.assertEqual(
+        sorted(state['succeeded']), ['2021-10-02', '2021-10-03', '2021-10-04'])
+    self.assertEqual(
+        sorted(state['started']), ['2021-10-02', '2021-10-03', '2021-10-04'])
+
+  def test_invalid_message_is_acked(self):
+    start_run = _StartRun()
+    pubsub = self._subscribe(start_run)
+
+    pubsub.publish(_TOPIC, b'not json')
+
+    self.assertEqual(start_run.runs, [])
+    self.assertEqual(len(pubsub.acked), 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
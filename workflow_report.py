@@ -0,0 +1,273 @@
+# coding=utf-8
+# Copyright 2021 Google LLC..
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# python3
+"""Reports the duration and cost of the main workflow stages across days.
+
+The main workflow appends a row per stage to the "workflow_run_log" table with
+the start and end time of the stage and the job id of the workflow script. The
+jobs run by a stage are the child jobs of the script, as listed in
+INFORMATION_SCHEMA.JOBS, created between the start and the end of the stage.
+Reading INFORMATION_SCHEMA.JOBS requires the bigquery.jobs.listAll permission
+on the project.
+
+Typical usage example:
+  >>> runs = get_stage_runs('project_id', 'markup', days=14)
+  >>> print(format_report(runs))
+"""
+
+import argparse
+import collections
+import datetime
+import logging
+import statistics
+from typing import Any, Dict, List, Optional
+
+import config_parser
+from google.cloud import bigquery
+
+_DEFAULT_DAYS = 14
+# A stage is reported as slower or costlier than usual when its last run is
+# above this ratio of the median of its previous runs.
+_TREND_ALERT_RATIO = 1.5
+_BYTES_PER_GB = 1024**3
+
+_STAGE_RUNS_SQL = """
+WITH
+  RunLog AS (
+    SELECT
+      *
+    FROM
+      `{project_id}.{dataset}.workflow_run_log`
+    WHERE
+      started_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
+      AND (@tenant IS NULL OR tenant = @tenant)
+  ),
+  ChildJob AS (
+    SELECT
+      parent_job_id,
+      creation_time,
+      total_bytes_processed,
+      total_bytes_billed,
+      total_slot_ms
+    FROM
+      `{project_id}`.`region-{location}`.INFORMATION_SCHEMA.JOBS
+    WHERE
+      creation_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days + 1 DAY)
+      AND parent_job_id IS NOT NULL
+  )
+SELECT
+  RunLog.tenant,
+  RunLog.stage,
+  RunLog.run_date,
+  RunLog.script_job_id,
+  RunLog.started_at,
+  RunLog.ended_at,
+  TIMESTAMP_DIFF(RunLog.ended_at, RunLog.started_at, MILLISECOND) / 1000
+    AS duration_seconds,
+  RunLog.row_count,
+  RunLog.skipped,
+  COUNT(ChildJob.parent_job_id) AS job_count,
+  IFNULL(SUM(ChildJob.total_bytes_processed), 0) AS bytes_processed,
+  IFNULL(SUM(ChildJob.total_bytes_billed), 0) AS bytes_billed,
+  IFNULL(SUM(ChildJob.total_slot_ms), 0) AS slot_ms
+FROM
+  RunLog
+LEFT JOIN
+  ChildJob
+  ON
+    ChildJob.parent_job_id = RunLog.script_job_id
+    AND ChildJob.creation_time BETWEEN RunLog.started_at AND RunLog.ended_at
+GROUP BY
+  tenant,
+  stage,
+  run_date,
+  script_job_id,
+  started_at,
+  ended_at,
+  row_count,
+  skipped
+ORDER BY
+  tenant,
+  started_at
+"""
+
+# Set logging level.
+logging.getLogger().setLevel(logging.INFO)
+
+# Last run of a stage compared with the median of its previous runs.
+StageTrend = collections.namedtuple('StageTrend', [
+    'tenant', 'stage', 'run_count', 'skipped_count', 'duration_seconds',
+    'median_duration_seconds', 'bytes_processed', 'median_bytes_processed',
+    'slot_ms', 'median_slot_ms'
+])
+
+
+def get_stage_runs(project_id: str,
+                   dataset_id: str,
+                   days: int = _DEFAULT_DAYS,
+                   tenant: Optional[str] = None,
+                   client: Optional[bigquery.Client] = None
+                  ) -> List[Dict[str, Any]]:
+  """Returns the logged runs of the main workflow stages with their job stats.
+
+  Args:
+    project_id: A cloud project id.
+    dataset_id: BigQuery dataset id.
+    days: Number of days of runs to return.
+    tenant: Google Ads customer id of the runs to return, all if not set.
+    client: BigQuery client, one for the project is created if not set.
+
+  Returns:
+    One dict per stage run, in the order the stages started for each tenant.
+  """
+  client = client or bigquery.Client(project=project_id)
+  location = config_parser.get_dataset_location()
+  query = _STAGE_RUNS_SQL.format(
+      project_id=project_id, dataset=dataset_id, location=location.lower())
+  job_config = bigquery.QueryJobConfig(query_parameters=[
+      bigquery.ScalarQueryParameter('days', 'INT64', days),
+      bigquery.ScalarQueryParameter('tenant', 'STRING', tenant),
+  ])
+  rows = client.query(query, job_config=job_config, location=location).result()
+  return [dict(row.items()) for row in rows]
+
+
+def _median(values: List[float]) -> Optional[float]:
+  return statistics.median(values) if values else None
+
+
+def get_stage_trends(runs: List[Dict[str, Any]]) -> List[StageTrend]:
+  """Compares the last run of each stage with its previous runs.
+
+  Skipped runs are counted but not compared, as they don't do any work.
+
+  Args:
+    runs: Stage runs as returned by get_stage_runs.
+
+  Returns:
+    One trend per tenant and stage, in the order of the stages.
+  """
+  runs_by_stage = collections.OrderedDict()
+  for run in runs:
+    runs_by_stage.setdefault((run['tenant'], run['stage']), []).append(run)
+  trends = []
+  for (tenant, stage), stage_runs in runs_by_stage.items():
+    executed_runs = [run for run in stage_runs if not run['skipped']]
+    last_run = executed_runs[-1] if executed_runs else {}
+    previous_runs = executed_runs[:-1]
+    trends.append(
+        StageTrend(
+            tenant=tenant,
+            stage=stage,
+            run_count=len(stage_runs),
+            skipped_count=len(stage_runs) - len(executed_runs),
+            duration_seconds=last_run.get('duration_seconds'),
+            median_duration_seconds=_median(
+                [run['duration_seconds'] for run in previous_runs]),
+            bytes_processed=last_run.get('bytes_processed'),
+            median_bytes_processed=_median(
+                [run['bytes_processed'] for run in previous_runs]),
+            slot_ms=last_run.get('slot_ms'),
+            median_slot_ms=_median([run['slot_ms'] for run in previous_runs])))
+  return trends
+
+
+def _format_ratio(value: Optional[float], median: Optional[float]) -> str:
+  if value is None or not median:
+    return '-'
+  ratio = value / median
+  alert = ' !' if ratio >= _TREND_ALERT_RATIO else ''
+  return f'x{ratio:.2f}{alert}'
+
+
+def format_report(runs: List[Dict[str, Any]]) -> str:
+  """Formats the stage runs and their trends as a text report.
+
+  Args:
+    runs: Stage runs as returned by get_stage_runs.
+
+  Returns:
+    The report with a line per stage run, followed by the trend of each stage.
+  """
+  lines = [
+      f'{"tenant":<12} {"stage":<20} {"started at":<20} {"seconds":>9} '
+      f'{"rows":>12} {"GB processed":>13} {"slot seconds":>13}'
+  ]
+  for run in runs:
+    started_at = run['started_at']
+    if isinstance(started_at, datetime.datetime):
+      started_at = started_at.strftime('%Y-%m-%d %H:%M:%S')
+    if run['skipped']:
+      metrics = f'{"skipped":>9}'
+    else:
+      row_count = '-' if run['row_count'] is None else run['row_count']
+      metrics = (f'{run["duration_seconds"]:>9.1f} {row_count:>12} '
+                 f'{run["bytes_processed"] / _BYTES_PER_GB:>13.3f} '
+                 f'{run["slot_ms"] / 1000:>13.1f}')
+    lines.append(
+        f'{run["tenant"]:<12} {run["stage"]:<20} {started_at:<20} {metrics}')
+  lines.append('')
+  lines.append(f'{"tenant":<12} {"stage":<20} {"runs":>5} {"skipped":>8} '
+               f'{"seconds":>9} {"bytes":>9} {"slots":>9}')
+  for trend in get_stage_trends(runs):
+    duration_ratio = _format_ratio(trend.duration_seconds,
+                                   trend.median_duration_seconds)
+    bytes_ratio = _format_ratio(trend.bytes_processed,
+                                trend.median_bytes_processed)
+    slot_ratio = _format_ratio(trend.slot_ms, trend.median_slot_ms)
+    lines.append(
+        f'{trend.tenant:<12} {trend.stage:<20} {trend.run_count:>5} '
+        f'{trend.skipped_count:>8} {duration_ratio:>9} {bytes_ratio:>9} '
+        f'{slot_ratio:>9}')
+  return '\n'.join(lines)
+
+
+def parse_arguments() -> argparse.Namespace:
+  """Initialize command line parser using argparse.
+
+  Returns:
+    An argparse.ArgumentParser.
+  """
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--project_id', help='GCP project id.', required=True)
+  parser.add_argument(
+      '--dataset_id', help='BigQuery dataset id.', default='markup')
+  parser.add_argument(
+      '--days',
+      help='Number of days of runs to report.',
+      type=int,
+      default=_DEFAULT_DAYS)
+  parser.add_argument(
+      '--ads_customer_id',
+      help='Google Ads External Customer Id of the runs to report.',
+      default=None)
+  return parser.parse_args()
+
+
+def main():
+  args = parse_arguments()
+  tenant = None
+  if args.ads_customer_id:
+    tenant = args.ads_customer_id.replace('-', '')
+  runs = get_stage_runs(args.project_id, args.dataset_id, args.days, tenant)
+  if not runs:
+    logging.info('No workflow runs logged in the last %d days.', args.days)
+    return
+  print(format_report(runs))
+
+
+if __name__ == '__main__':
+  main()